@@ -1,7 +1,7 @@
 'use client';
 
 import { useState, useEffect } from 'react';
-import { supabase, MedicionHidrologica } from '@/lib/supabase';
+import { supabase, MedicionHidrologica, VENTANAS_TIEMPO, VentanaTiempo } from '@/lib/supabase';
 
 // Marcar como dinámico para evitar generación estática
 export const dynamic = 'force-dynamic';
@@ -9,6 +9,7 @@ import { ChartContainer, ChartTooltip, ChartTooltipContent } from '@/components/
 import { LineChart, Line, XAxis, YAxis, CartesianGrid, ResponsiveContainer, Legend } from 'recharts';
 import LoadingSpinner from '@/components/ui/LoadingSpinner';
 import AlertBanner from '@/components/ui/AlertBanner';
+import TabNavigation from '@/components/ui/TabNavigation';
 import { Card, CardContent, CardDescription, CardHeader, CardTitle } from '@/components/ui/card';
 import { Activity, Droplets, TrendingUp, Gauge } from 'lucide-react';
 
@@ -16,7 +17,9 @@ export default function DashboardPage() {
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState<string | null>(null);
   const [mediciones, setMediciones] = useState<MedicionHidrologica[]>([]);
-  const [ultimaMedicion, setUltimaMedicion] = useState<MedicionHidrologica | null>(null);
+  const [ventana, setVentana] = useState<VentanaTiempo>('1h');
+  const [nodo, setNodo] = useState<string | null>(null);
+  const [serie, setSerie] = useState<{ ts: string; nivel_m: number; lluvia_mm: number }[]>([]);
 
   useEffect(() => {
     cargarMediciones();
@@ -25,6 +28,45 @@ export default function DashboardPage() {
     return () => clearInterval(interval);
   }, []);
 
+  useEffect(() => {
+    if (!nodo) return;
+    cargarSerie(ventana, nodo);
+    const interval = setInterval(() => cargarSerie(ventana, nodo), 30000);
+    return () => clearInterval(interval);
+  }, [ventana, nodo]);
+
+  // Nivel y lluvia del nodo en la ventana seleccionada, leídos de los
+  // agregados por bucket en lugar de todas las mediciones crudas. Se piden
+  // las más recientes primero: si la ventana no entrara, se pierde lo más viejo
+  const cargarSerie = async (ventanaActual: VentanaTiempo, nodoActual: string) => {
+    const { horas, tabla, bucketS } = VENTANAS_TIEMPO[ventanaActual];
+    const desde = new Date(Date.now() - horas * 3600 * 1000).toISOString();
+
+    const { data, error: supabaseError } = await supabase
+      .from(tabla)
+      .select('ts,nivel_mean,lluvia_sum')
+      .eq('node_id', nodoActual)
+      .gte('ts', desde)
+      .order('ts', { ascending: false })
+      .limit(Math.ceil((horas * 3600) / bucketS) + 1);
+
+    if (supabaseError) {
+      console.error('Error cargando serie:', supabaseError);
+      return;
+    }
+
+    setSerie(
+      (data || [])
+        .slice()
+        .reverse()
+        .map((fila: any) => ({
+          ts: fila.ts,
+          nivel_m: fila.nivel_mean,
+          lluvia_mm: fila.lluvia_sum,
+        }))
+    );
+  };
+
   const cargarMediciones = async () => {
     try {
       setLoading(true);
@@ -46,7 +88,8 @@ export default function DashboardPage() {
 
       if (data && data.length > 0) {
         setMediciones(data);
-        setUltimaMedicion(data[0]);
+        // Por defecto el nodo de la lectura más reciente
+        setNodo((actual) => actual ?? data[0].node_id ?? null);
       }
     } catch (err) {
       console.error('Error cargando mediciones:', err);
@@ -56,8 +99,15 @@ export default function DashboardPage() {
     }
   };
 
+  // Las lecturas recientes mezclan nodos: tarjetas y gráficos muestran solo el seleccionado
+  const nodos = Array.from(
+    new Set(mediciones.map((m) => m.node_id).filter((id): id is string => !!id))
+  ).sort();
+  const medicionesNodo = mediciones.filter((m) => m.node_id === nodo);
+  const ultimaMedicion = medicionesNodo[0] ?? null;
+
   // Preparar datos para gráficos (solo campos no null)
-  const datosGrafico = mediciones
+  const datosGrafico = medicionesNodo
     .slice()
     .reverse()
     .map((m) => ({
@@ -75,6 +125,24 @@ export default function DashboardPage() {
       persistencia: m.persistencia,
     }));
 
+  const datosSerie = serie.map((m) => ({
+    fecha: new Date(m.ts).toLocaleString('es-ES', {
+      month: 'short',
+      day: 'numeric',
+      hour: '2-digit',
+      minute: '2-digit'
+    }),
+    nivel_m: m.nivel_m,
+    lluvia_mm: m.lluvia_mm,
+  }));
+
+  const tabsNodo = nodos.map((id) => ({ id, label: id }));
+
+  const tabsVentana = (Object.keys(VENTANAS_TIEMPO) as VentanaTiempo[]).map((id) => ({
+    id,
+    label: VENTANAS_TIEMPO[id].label,
+  }));
+
   const chartConfig = {
     nivel_m: {
       label: 'Nivel (m)',
@@ -198,6 +266,20 @@ export default function DashboardPage() {
         {/* Gráficos */}
         {mediciones.length > 0 ? (
           <div className="space-y-8">
+            {tabsNodo.length > 1 && (
+              <TabNavigation
+                tabs={tabsNodo}
+                activeTab={nodo ?? ''}
+                onChange={(id) => setNodo(id)}
+              />
+            )}
+
+            <TabNavigation
+              tabs={tabsVentana}
+              activeTab={ventana}
+              onChange={(id) => setVentana(id as VentanaTiempo)}
+            />
+
             {/* Gráfico de Nivel del Río */}
             <Card>
               <CardHeader>
@@ -206,7 +288,7 @@ export default function DashboardPage() {
               </CardHeader>
               <CardContent>
                 <ChartContainer config={chartConfig}>
-                  <LineChart data={datosGrafico}>
+                  <LineChart data={datosSerie}>
                     <CartesianGrid strokeDasharray="3 3" />
                     <XAxis dataKey="fecha" />
                     <YAxis />
@@ -232,7 +314,7 @@ export default function DashboardPage() {
               </CardHeader>
               <CardContent>
                 <ChartContainer config={chartConfig}>
-                  <LineChart data={datosGrafico}>
+                  <LineChart data={datosSerie}>
                     <CartesianGrid strokeDasharray="3 3" />
                     <XAxis dataKey="fecha" />
                     <YAxis />
@@ -69,6 +69,7 @@ function createMockSupabaseChain() {
     select: () => mockChain,
     eq: () => mockChain,
     order: () => mockChain,
+    gte: () => mockChain,
     limit: () => Promise.resolve(errorResult),
     insert: () => mockChain,
     update: () => mockChain,
@@ -106,6 +107,7 @@ export const supabase = new Proxy({} as SupabaseClient, {
 // Tipos para las mediciones hidrológicas
 export interface MedicionHidrologica {
   id: number;
+  node_id: string | null;
   ts: string;
   nivel_m: number;
   lluvia_mm: number;
@@ -120,6 +122,33 @@ export interface MedicionHidrologica {
   created_at?: string;
 }
 
+// Agregados por nodo que mantiene el ETL (mediciones_1min, mediciones_15min, mediciones_1h)
+export interface MedicionAgregada {
+  node_id: string;
+  ts: string;
+  muestras: number;
+  nivel_min: number;
+  nivel_max: number;
+  nivel_mean: number;
+  nivel_last: number;
+  lluvia_sum: number;
+  ror_max: number | null;
+}
+
+// Ventanas de tiempo de los gráficos y el agregado que se consulta para cada
+// una. `bucketS` es la resolución de la tabla: una ventana de un nodo trae
+// horas * 3600 / bucketS filas, por debajo del máximo de 1000 por consulta de
+// Supabase (las crudas llegan cada ~2 s por nodo: 1800 en una hora)
+export type VentanaTiempo = '1h' | '6h' | '24h' | '7d' | '30d';
+
+export const VENTANAS_TIEMPO: Record<VentanaTiempo, { label: string; horas: number; tabla: string; bucketS: number }> = {
+  '1h': { label: 'Última hora', horas: 1, tabla: 'mediciones_1min', bucketS: 60 },
+  '6h': { label: '6 horas', horas: 6, tabla: 'mediciones_1min', bucketS: 60 },
+  '24h': { label: '24 horas', horas: 24, tabla: 'mediciones_15min', bucketS: 900 },
+  '7d': { label: '7 días', horas: 24 * 7, tabla: 'mediciones_1h', bucketS: 3600 },
+  '30d': { label: '30 días', horas: 24 * 30, tabla: 'mediciones_1h', bucketS: 3600 },
+};
+
 // Tipos para la comunidad
 export interface Comunidad {
   comunidad_id?: number;
@@ -0,0 +1,113 @@
+"""
+Agregados por nodo en ventanas de tiempo fijas (1 min, 15 min y 1 h) para que
+el dashboard no tenga que leer las mediciones crudas en rangos largos
+"""
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, Tuple
+
+# Tabla de destino -> tamaño del bucket en segundos
+RESOLUCIONES = {
+    'mediciones_1min': 60,
+    'mediciones_15min': 900,
+    'mediciones_1h': 3600,
+}
+
+# Clave de conflicto de las tablas de agregados (upsert)
+CONFLICTO_AGREGADOS = 'node_id,ts'
+
+
+def limitar_valor(valor, max_abs=9999.9999):
+    """
+    Limita un valor numérico a precision 8, scale 4 (máximo absoluto:
+    9999.9999) para que un valor extremo no haga fallar el insert del lote
+    """
+    if valor is None:
+        return None
+    if abs(valor) > max_abs:
+        return max_abs if valor > 0 else -max_abs
+    return valor
+
+
+class AgregadorRollups:
+    """
+    Mantiene incrementalmente, por nodo y resolución, el bucket abierto con
+    min/max/media/último del nivel, la suma de lluvia y el RoR máximo.
+
+    Cuando llega una medición de un bucket posterior, el anterior se cierra y
+    se emite con `emitir(tabla, fila)`. Los buckets abiertos se reemiten cada
+    `intervalo_s` segundos con `publicar_abiertos`; como se escriben con upsert
+    sobre (node_id, ts), cada emisión reemplaza a la anterior del mismo bucket.
+    Las mediciones más antiguas que el bucket abierto se descartan del agregado.
+    """
+
+    def __init__(self, emitir: Callable[[str, Dict], None], intervalo_s: float = 60.0):
+        self.emitir = emitir
+        self.intervalo_s = intervalo_s
+        self._buckets: Dict[Tuple[str, str], Dict] = {}
+        self._ultima_publicacion = time.monotonic()
+        self.fuera_de_orden = 0
+
+    def agregar(self, resultado: Dict):
+        if resultado.get('ts_ms') is not None:
+            epoch = resultado['ts_ms'] // 1000
+        else:
+            fecha = datetime.fromisoformat(resultado['ts'].replace('Z', '+00:00'))
+            if fecha.tzinfo is None:
+                fecha = fecha.replace(tzinfo=timezone.utc)
+            epoch = int(fecha.timestamp())
+
+        node_id = resultado['node_id']
+        nivel = resultado['nivel_m']
+        lluvia = resultado['lluvia_mm']
+        ror = resultado.get('ror')
+
+        for tabla, segundos in RESOLUCIONES.items():
+            inicio = epoch - epoch % segundos
+            clave = (node_id, tabla)
+            bucket = self._buckets.get(clave)
+
+            if bucket is not None and inicio < bucket['inicio']:
+                self.fuera_de_orden += 1
+                continue
+
+            if bucket is None or inicio > bucket['inicio']:
+                if bucket is not None:
+                    self.emitir(tabla, self._fila(node_id, bucket))
+                bucket = {
+                    'inicio': inicio, 'muestras': 0, 'suma_nivel': 0.0,
+                    'nivel_min': nivel, 'nivel_max': nivel,
+                    'lluvia_sum': 0.0, 'ror_max': None
+                }
+                self._buckets[clave] = bucket
+
+            bucket['muestras'] += 1
+            bucket['suma_nivel'] += nivel
+            bucket['nivel_min'] = min(bucket['nivel_min'], nivel)
+            bucket['nivel_max'] = max(bucket['nivel_max'], nivel)
+            bucket['nivel_last'] = nivel
+            bucket['lluvia_sum'] += lluvia
+            if ror is not None and (bucket['ror_max'] is None or ror > bucket['ror_max']):
+                bucket['ror_max'] = ror
+
+    def publicar_abiertos(self, forzar: bool = False):
+        """Reemite los buckets abiertos si pasó `intervalo_s` desde la última vez"""
+        ahora = time.monotonic()
+        if not forzar and ahora - self._ultima_publicacion < self.intervalo_s:
+            return
+        self._ultima_publicacion = ahora
+        for (node_id, tabla), bucket in self._buckets.items():
+            self.emitir(tabla, self._fila(node_id, bucket))
+
+    def _fila(self, node_id: str, bucket: Dict) -> Dict:
+        return {
+            "node_id": node_id,
+            "ts": datetime.fromtimestamp(bucket['inicio'], tz=timezone.utc).isoformat().replace('+00:00', 'Z'),
+            "muestras": bucket['muestras'],
+            "nivel_min": limitar_valor(bucket['nivel_min']),
+            "nivel_max": limitar_valor(bucket['nivel_max']),
+            "nivel_mean": limitar_valor(bucket['suma_nivel'] / bucket['muestras']),
+            "nivel_last": limitar_valor(bucket['nivel_last']),
+            "lluvia_sum": bucket['lluvia_sum'],
+            "ror_max": limitar_valor(bucket['ror_max']),
+        }
@@ -1,36 +1,136 @@
+import logging
+import multiprocessing
 import os
+import queue
+import signal
+import threading
 import time
 import requests
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from collections import defaultdict, deque
+from functools import lru_cache
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from typing import Callable, Dict, List, Optional
 from supabase import create_client, Client
-import json
 from dotenv import load_dotenv
 
-load_dotenv()
+import metricas
+import reglas
+import registro
+from agregados import CONFLICTO_AGREGADOS, RESOLUCIONES, AgregadorRollups, limitar_valor
+from constantes import DATOS_RIO, NODO_DESCONOCIDO, VENTANA_PERSISTENCIA
+from despachador_alertas import DespachadorAlertas
+from escritor_supabase import EscritorSupabase
+from estado_nodos import CacheEstado
+import estado_nodos
 
-# Configuración de datos fijos del río
-DATOS_RIO = {
-    "altura_inicial_m": 2595.4,  # cota aguas arriba
-    "altura_final_m": 2589.6,    # cota aguas abajo
-    "largo_rio_m": 3200          # longitud del tramo modelado
-}
+load_dotenv()
 
 # URLs de servicios
 COLA_URL = os.getenv('COLA_URL', 'http://cola:5000')
+COLA_LOTE_MAX = int(os.getenv('COLA_LOTE_MAX', 100))  # mensajes por consumo
+COLA_ESPERA_SEGUNDOS = float(os.getenv('COLA_ESPERA_SEGUNDOS', 20))  # long-polling en /consumir
 WEBHOOK_ALERTA_URL = os.getenv('WEBHOOK_ALERTA_URL', 'https://testsh.app.n8n.cloud/webhook/webhook-alerta-esmeralda')
+ALERTA_COOLDOWN_S = float(os.getenv('ALERTA_COOLDOWN_S', 600))  # reenvío del mismo nivel por nodo
+ALERTA_TRABAJADORES = int(os.getenv('ALERTA_TRABAJADORES', 2))
 
 # Configuración Supabase
 SUPABASE_URL = os.getenv('SUPABASE_URL', '')
 SUPABASE_KEY = os.getenv('SUPABASE_KEY', '')
 TABLE_NAME = 'mediciones_hidrologicas'
 
+# Escritura por lotes en segundo plano
+SUPABASE_LOTE = int(os.getenv('SUPABASE_LOTE', 500))                # filas por insert
+SUPABASE_INTERVALO_S = float(os.getenv('SUPABASE_INTERVALO_S', 1))  # flush máximo cada N s
+SUPABASE_SPOOL_PATH = os.getenv('SUPABASE_SPOOL_PATH', 'spool_supabase.jsonl')
+# Filas que Supabase rechaza por su contenido (JSONL con el error), para revisarlas a mano
+SUPABASE_DESCARTES_PATH = os.getenv('SUPABASE_DESCARTES_PATH', 'descartes_supabase.jsonl')
+
+# Cada cuánto se reescriben en Supabase los agregados (1min/15min/1h) aún abiertos
+AGREGADOS_INTERVALO_S = float(os.getenv('AGREGADOS_INTERVALO_S', 60))
+
+# Procesos trabajadores; cada uno atiende una partición fija de node_id
+ETL_TRABAJADORES = int(os.getenv('ETL_TRABAJADORES', 1))
+ETL_REINICIO_MIN_S = float(os.getenv('ETL_REINICIO_MIN_S', 5))  # espera entre reinicios de un trabajador
+# Plazo para que los trabajadores vacíen sus buffers al detenerse; por debajo
+# del stop_grace_period del contenedor, después del cual llega SIGKILL
+ETL_PLAZO_SALIDA_S = float(os.getenv('ETL_PLAZO_SALIDA_S', 25))
+
+# Puerto de /metrics (Prometheus); el trabajador i de una partición usa puerto + i. 0 lo desactiva
+ETL_METRICAS_PUERTO = int(os.getenv('ETL_METRICAS_PUERTO', 9100))
+
+# API del último estado por nodo para el dashboard (/estado, /estado/<node_id>,
+# SSE en /estado/eventos). Con varios trabajadores la sirve el supervisor. 0 la desactiva
+ETL_ESTADO_PUERTO = int(os.getenv('ETL_ESTADO_PUERTO', 9200))
+ETL_ESTADO_VENTANA = int(os.getenv('ETL_ESTADO_VENTANA', 60))  # lecturas recientes por nodo
+ETL_ESTADO_SSE_MAX = int(os.getenv('ETL_ESTADO_SSE_MAX', 200))  # clientes SSE simultáneos
+ETL_ESTADO_CORS = os.getenv('ETL_ESTADO_CORS', '*')             # Access-Control-Allow-Origin; vacío lo omite
+ESTADO_COLA_MAX = 1000  # lotes en tránsito de los trabajadores al supervisor
+
+log = registro.obtener('etl')
+
+MEDICIONES_PROCESADAS = metricas.contador(
+    'etl_mediciones_total', 'Mediciones procesadas por nodo', ('node_id',)
+)
+MEDICIONES_INVALIDAS = metricas.contador('etl_mediciones_invalidas_total', 'Mediciones descartadas por error')
+ESTADO_DESCARTADOS = metricas.contador(
+    'etl_estado_descartados_total', 'Resultados que no llegaron a la caché de estado del supervisor por cola llena'
+)
+LATENCIA_INGESTA = metricas.histograma(
+    'etl_latencia_ingesta_segundos',
+    'Tiempo desde recibido_en en la cola hasta procesado (etapa=procesado) o persistido en Supabase (etapa=persistido)',
+    ('etapa',)
+)
+
+
+@lru_cache(maxsize=256)
+def epoch_iso(valor: Optional[str]) -> Optional[float]:
+    """
+    Epoch en segundos de un timestamp ISO 8601 (los de la cola son UTC con
+    sufijo Z). Con caché porque un lote ingresado por /mensajes/lote comparte
+    el mismo recibido_en.
+    """
+    if not valor:
+        return None
+    fecha = datetime.fromisoformat(valor.replace('Z', '+00:00'))
+    if fecha.tzinfo is None:
+        fecha = fecha.replace(tzinfo=timezone.utc)
+    return fecha.timestamp()
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_UN_MS = timedelta(milliseconds=1)
+
+
+def epoch_ms(medicion: Dict) -> int:
+    """
+    Epoch en milisegundos de una medición. Usa el `ts_ms` que ya trae desde el
+    gateway o la cola; si no lo trae, parsea `ts` una sola vez y lo guarda en
+    la misma medición para los cálculos siguientes.
+    """
+    valor = medicion.get('ts_ms')
+    if valor is None:
+        fecha = datetime.fromisoformat(medicion['ts'].replace('Z', '+00:00'))
+        if fecha.tzinfo is None:
+            fecha = fecha.replace(tzinfo=timezone.utc)
+        valor = medicion['ts_ms'] = (fecha - _EPOCH) // _UN_MS
+    return valor
+
 class HidrologiaProcessor:
     """Procesador de datos hidrológicos"""
     
-    def __init__(self, supabase: Optional[Client] = None):
+    def __init__(self, supabase: Optional[Client] = None,
+                 escritor: Optional[EscritorSupabase] = None,
+                 despachador: Optional[DespachadorAlertas] = None,
+                 motor: Optional[reglas.Motor] = None):
         self.supabase = supabase
-        self.mediciones_previas: List[Dict] = []
+        self.escritor = escritor
+        self.despachador = despachador
+        # Reglas de alerta y puntaje (conjunto "etl" de REGLAS_ALERTA)
+        self.motor = motor or reglas.motor('etl')
+        # Historial reciente por node_id (buffer circular de tamaño fijo)
+        self.mediciones_previas: Dict[str, deque] = defaultdict(
+            lambda: deque(maxlen=VENTANA_PERSISTENCIA)
+        )
     
     def base_level(self, nivel_m: float) -> float:
         return nivel_m
@@ -43,10 +143,7 @@ class HidrologiaProcessor:
             return None
         
         try:
-            ts_actual = datetime.fromisoformat(medicion_actual['ts'].replace('Z', '+00:00'))
-            ts_anterior = datetime.fromisoformat(medicion_anterior['ts'].replace('Z', '+00:00'))
-            
-            delta_tiempo = (ts_actual - ts_anterior).total_seconds() / 3600  # horas
+            delta_tiempo = (epoch_ms(medicion_actual) - epoch_ms(medicion_anterior)) / 1000 / 3600  # horas
             
             if delta_tiempo <= 0:
                 return None
@@ -56,7 +153,7 @@ class HidrologiaProcessor:
             
             return ror
         except Exception as e:
-            print(f"Error calculando RoR: {e}")
+            log.warning("Error calculando RoR", extra={"error": str(e)})
             return None
     
     def intensidad_lluvia(self, medicion_actual: Dict, medicion_anterior: Optional[Dict]) -> Optional[float]:
@@ -64,10 +161,7 @@ class HidrologiaProcessor:
             return None
         
         try:
-            ts_actual = datetime.fromisoformat(medicion_actual['ts'].replace('Z', '+00:00'))
-            ts_anterior = datetime.fromisoformat(medicion_anterior['ts'].replace('Z', '+00:00'))
-            
-            delta_tiempo = (ts_actual - ts_anterior).total_seconds() / 3600  # horas
+            delta_tiempo = (epoch_ms(medicion_actual) - epoch_ms(medicion_anterior)) / 1000 / 3600  # horas
             
             if delta_tiempo <= 0:
                 return None
@@ -77,7 +171,7 @@ class HidrologiaProcessor:
             
             return intensidad
         except Exception as e:
-            print(f"Error calculando intensidad: {e}")
+            log.warning("Error calculando intensidad", extra={"error": str(e)})
             return None
     
     def proyeccion_30min(self, nivel_m: float, ror: Optional[float]) -> Optional[float]:
@@ -102,8 +196,9 @@ class HidrologiaProcessor:
         if medicion_actual['nivel_m'] <= umbral_alerta:
             return 0
         
+        previas = self.mediciones_previas[medicion_actual.get('node_id', NODO_DESCONOCIDO)]
         persistencia = 1
-        for medicion in reversed(self.mediciones_previas[-10:]):  # Últimas 10 mediciones
+        for medicion in islice(reversed(previas), VENTANA_PERSISTENCIA):  # Últimas 10 mediciones del nodo
             if medicion.get('nivel_m', 0) > umbral_alerta:
                 persistencia += 1
             else:
@@ -113,11 +208,14 @@ class HidrologiaProcessor:
     
     def procesar_medicion(self, medicion: Dict) -> Dict:
         nivel_m = medicion['nivel_m']
+        ts_ms = epoch_ms(medicion)
+        node_id = medicion.get('node_id', NODO_DESCONOCIDO)
+        previas = self.mediciones_previas[node_id]
         
-        # Buscar medición anterior
+        # Buscar medición anterior del mismo nodo
         medicion_anterior = None
-        if self.mediciones_previas:
-            medicion_anterior = self.mediciones_previas[-1]
+        if previas:
+            medicion_anterior = previas[-1]
         
         # Calcular todos los parámetros
         base_level = self.base_level(nivel_m)
@@ -129,7 +227,9 @@ class HidrologiaProcessor:
         persistencia = self.persistencia(medicion)
         
         resultado = {
+            "node_id": node_id,
             "ts": medicion['ts'],
+            "ts_ms": ts_ms,
             "nivel_m": nivel_m,
             "lluvia_mm": medicion['lluvia_mm'],
             "base_level": base_level,
@@ -143,69 +243,41 @@ class HidrologiaProcessor:
             "procesado_en": datetime.utcnow().isoformat() + "Z"
         }
         
-        # Guardar medición anterior para próximos cálculos
-        self.mediciones_previas.append(medicion)
-        if len(self.mediciones_previas) > 100:  # Limitar historial
-            self.mediciones_previas = self.mediciones_previas[-100:]
+        # Guardar medición anterior para próximos cálculos (el deque descarta la más antigua)
+        previas.append(medicion)
         
         return resultado
     
+    def evaluar(self, resultado: Dict) -> reglas.Resultado:
+        """Reglas de alerta cumplidas, puntaje de riesgo y color (VERDE, AMARILLA o ROJA)"""
+        return self.motor.evaluar(resultado)
+    
     def evaluar_alerta(self, resultado: Dict) -> bool:
-        nivel = resultado['nivel_m']
-        proyeccion = resultado.get('proyeccion_30min')
-        ror = resultado.get('ror')
-        persistencia = resultado.get('persistencia', 0)
-        
-        alerta = False
-        
-        # Nivel crítico
-        if nivel > 0.5:
-            alerta = True
-        
-        # Proyección crítica
-        if proyeccion and proyeccion > 0.6:
-            alerta = True
-        
-        # RoR muy alto
-        if ror and ror > 0.1:
-            alerta = True
-        
-        # Persistencia alta
-        if persistencia >= 3:
-            alerta = True
-        
-        return alerta
+        return bool(self.evaluar(resultado).reglas)
+    
+    def nivel_alerta(self, resultado: Dict) -> str:
+        """Calcula el color de alerta (VERDE, AMARILLA o ROJA) a partir del riesgo"""
+        return self.evaluar(resultado).nivel
     
-    def enviar_alerta(self, resultado: Dict) -> bool:
+    def enviar_alerta(self, resultado: Dict, color: Optional[str] = None) -> bool:
         """
-        Envía alerta via webhook de n8n
+        Envía alerta via webhook de n8n.
+        
+        Con un despachador configurado el envío es asíncrono y deduplicado por
+        nodo; sin él se hace un POST síncrono. `color` evita reevaluar las
+        reglas si el llamador ya las evaluó.
         """
         try:
-            # Extraer valores del resultado
-            nivel_m = resultado.get('nivel_m', 0)
-            ror = resultado.get('ror')
-            persistencia = resultado.get('persistencia', 0)
-            proyeccion_30min = resultado.get('proyeccion_30min')
+            if color is None:
+                color = self.nivel_alerta(resultado)
             
-            # Calcular riesgo
-            riesgo = (
-                (nivel_m * 0.6) +                 
-                (min(ror or 0, 0.2) * 2.0) +    
-                ((persistencia or 0) * 0.05) +  
-                (0.1 if (proyeccion_30min and proyeccion_30min > 0.6) else 0.0)
-            )
-            
-            # Determinar color de alerta
-            if riesgo >= 0.9:
-                color = "ROJA"
-            elif riesgo >= 0.6:
-                color = "AMARILLA"
-            else:
-                color = "VERDE"
+            if self.despachador:
+                self.despachador.notificar(resultado.get('node_id', NODO_DESCONOCIDO), color)
+                return True
             
             # Solo enviar alerta si es ROJA o AMARILLA
             if color == "VERDE":
-                print(f"⏭️  Nivel VERDE - No se envía alerta")
+                log.debug("Nivel VERDE, no se envía alerta")
                 return True
             
             payload = {"nivel_alerta": color}
@@ -217,125 +289,407 @@ class HidrologiaProcessor:
             )
             
             if response.status_code in [200, 201, 202]:
-                print(f"✅ Alerta enviada exitosamente: {payload}")
+                log.info("Alerta enviada", extra=payload)
                 return True
             else:
-                print(f"⚠️ Error enviando alerta: {response.status_code} - {response.text}")
+                log.warning("Error enviando alerta", extra={**payload, "status": response.status_code, "respuesta": response.text})
                 return False
                 
         except Exception as e:
-            print(f"❌ Error enviando alerta: {e}")
+            log.warning("Error enviando alerta", extra={"error": str(e)})
             return False
         
-    def guardar_supabase(self, resultado: Dict) -> bool:
+    def fila_supabase(self, resultado: Dict) -> Dict:
+        """Convierte un resultado procesado en la fila de la tabla de mediciones"""
+        return {
+            "node_id": resultado['node_id'],
+            "ts": resultado['ts'],
+            "nivel_m": limitar_valor(resultado['nivel_m']),
+            "lluvia_mm": limitar_valor(resultado['lluvia_mm']),
+            "base_level": limitar_valor(resultado['base_level']),
+            "delta_h": limitar_valor(resultado['delta_h']),
+            "ror": limitar_valor(resultado['ror']),
+            "intensidad_lluvia": limitar_valor(resultado['intensidad_lluvia']),
+            "proyeccion_30min": limitar_valor(resultado['proyeccion_30min']),
+            "pendiente_hidraulica": limitar_valor(resultado['pendiente_hidraulica']),
+            "persistencia": resultado['persistencia'],
+            "procesado_en": resultado['procesado_en']
+        }
+    
+    def guardar_supabase(self, resultado: Dict, ack_id=None) -> bool:
         """
-        Guarda el resultado procesado en Supabase
+        Guarda el resultado procesado en Supabase.
+        
+        Con un escritor configurado la fila se encola para inserción por lotes y
+        `ack_id` se confirma cuando el lote queda persistido; sin él se hace un
+        insert síncrono.
         """
         if not self.supabase:
-            print("Supabase no configurado")
+            log.debug("Supabase no configurado")
             return False
         
+        if self.escritor:
+            self.escritor.encolar(self.fila_supabase(resultado), ack_id)
+            return True
+        
         try:
-            # Función helper para limitar valores numéricos a precision 8, scale 4
-            # (máximo absoluto: 9999.9999)
-            def limitar_valor(valor, max_abs=9999.9999):
-                if valor is None:
-                    return None
-                if abs(valor) > max_abs:
-                    return max_abs if valor > 0 else -max_abs
-                return valor
-            
-            data = {
-                "ts": resultado['ts'],
-                "nivel_m": limitar_valor(resultado['nivel_m']),
-                "lluvia_mm": limitar_valor(resultado['lluvia_mm']),
-                "base_level": limitar_valor(resultado['base_level']),
-                "delta_h": limitar_valor(resultado['delta_h']),
-                "ror": limitar_valor(resultado['ror']),
-                "intensidad_lluvia": limitar_valor(resultado['intensidad_lluvia']),
-                "proyeccion_30min": limitar_valor(resultado['proyeccion_30min']),
-                "pendiente_hidraulica": limitar_valor(resultado['pendiente_hidraulica']),
-                "persistencia": resultado['persistencia'],
-                "procesado_en": resultado['procesado_en']
-            }
-            
-            response = self.supabase.table(TABLE_NAME).insert(data).execute()
+            self.supabase.table(TABLE_NAME).insert(self.fila_supabase(resultado)).execute()
             
-            print(f"Dato guardado en Supabase: {resultado['ts']}")
+            log.debug("Dato guardado en Supabase", extra={"node_id": resultado['node_id'], "ts": resultado['ts']})
             return True
             
         except Exception as e:
-            print(f"Error guardando en Supabase: {e}")
+            log.warning("Error guardando en Supabase", extra={"error": str(e)})
             return False
 
 
-def consumir_cola():
+def consumir_cola(maximo: int = COLA_LOTE_MAX, espera: float = COLA_ESPERA_SEGUNDOS,
+                  particion: Optional[int] = None, particiones: int = 1) -> Optional[List[Dict]]:
+    """
+    Consume un lote de mensajes en arriendo. Cada mensaje trae su `id` y debe
+    confirmarse con `confirmar_cola` una vez guardado; si el ETL cae antes, la
+    cola los vuelve a entregar.
+    
+    La cola retiene la petición hasta `espera` segundos si está vacía, así que
+    un lote vacío ya implica haber esperado. Retorna None si la cola no responde.
+    Con `particion` solo se reciben los nodos de esa partición de `particiones`.
+    """
+    params = {"max": maximo, "wait": espera}
+    if particion is not None:
+        params.update(particion=particion, particiones=particiones)
     try:
-        response = requests.post(f"{COLA_URL}/consumir", timeout=5)
+        response = requests.post(
+            f"{COLA_URL}/consumir",
+            params=params,
+            timeout=espera + 5
+        )
         
         if response.status_code == 404:
-            return None  # No hay mensajes
+            return []  # No hay mensajes
         
         if response.status_code == 200:
             data = response.json()
-            return data.get('mensaje')
+            return data.get('mensajes', [])
         
         return None
         
     except Exception as e:
-        print(f"Error consumiendo cola: {e}")
+        log.warning("Error consumiendo cola", extra={"error": str(e)})
         return None
 
 
-def main():
-    print("Iniciando ETL de datos hidrológicos...")
+def confirmar_cola(ids: List[int]) -> bool:
+    if not ids:
+        return True
+    
+    try:
+        response = requests.post(f"{COLA_URL}/ack", json={"ids": ids}, timeout=5)
+        return response.status_code == 200
+    except Exception as e:
+        log.warning("Error confirmando mensajes en cola", extra={"error": str(e)})
+        return False
+
+
+def ruta_particion(ruta: str, particion: Optional[int]) -> str:
+    """Cada trabajador usa su propio spool y descartes para no pisarse al escribirlos"""
+    if particion is None:
+        return ruta
+    base, extension = os.path.splitext(ruta)
+    return f"{base}.{particion}{extension}"
+
+
+def servir_estado(log) -> Optional[CacheEstado]:
+    """Crea la caché del último estado por nodo y la expone en ETL_ESTADO_PUERTO"""
+    cache = CacheEstado(ETL_ESTADO_VENTANA)
+    try:
+        estado_nodos.servir(cache, ETL_ESTADO_PUERTO, max_clientes_sse=ETL_ESTADO_SSE_MAX, origen_cors=ETL_ESTADO_CORS)
+    except OSError as e:
+        log.warning("No se pudo exponer el estado por nodo", extra={"puerto": ETL_ESTADO_PUERTO, "error": str(e)})
+        return None
+    log.info("Estado por nodo expuesto", extra={"puerto": ETL_ESTADO_PUERTO})
+    return cache
+
+
+def recibir_estado(cola_estado, cache: CacheEstado):
+    """Pasa a la caché los lotes de los trabajadores; los que llegan juntos cuentan como una versión"""
+    while True:
+        filas = cola_estado.get()
+        try:
+            while len(filas) < 5000:
+                filas.extend(cola_estado.get_nowait())
+        except queue.Empty:
+            pass
+        cache.publicar(filas)
+
+
+def publicador_estado(cola_estado, log) -> Optional[Callable[[List[Dict]], None]]:
+    """
+    Cómo publica el trabajador el último estado de cada lote: con particiones
+    lo envía al supervisor por `cola_estado`; con un solo proceso la caché
+    vive aquí. None si la API de estado está desactivada o no pudo exponerse.
+    """
+    if cola_estado is None:
+        cache = servir_estado(log) if ETL_ESTADO_PUERTO else None
+        return cache.publicar if cache else None
+
+    # Al salir no esperar a que el supervisor lea lo pendiente: es solo caché
+    cola_estado.cancel_join_thread()
+
+    def publicar(filas: List[Dict]):
+        try:
+            cola_estado.put_nowait(filas)
+        except queue.Full:
+            ESTADO_DESCARTADOS.inc(valor=len(filas))
+    return publicar
+
+
+def detener_con_sigterm():
+    """
+    `docker stop` envía SIGTERM: se trata como Ctrl+C, para que el proceso
+    salga por el mismo camino que vacía los buffers
+    """
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+
+def ignorar_senales():
+    """Mientras se vacían los buffers, una segunda señal no interrumpe la salida"""
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def ejecutar_trabajador(particion: Optional[int] = None, particiones: int = 1, cola_estado=None):
+    """
+    Loop de consumo del ETL. Con `particion` el proceso solo recibe los nodos
+    de esa partición, así el estado por nodo del procesador, los agregados y
+    la deduplicación de alertas quedan locales al proceso y en orden. Con
+    `cola_estado` los resultados van a la caché de estado del supervisor.
+    """
+    registro.configurar()
+    detener_con_sigterm()
+    if particion is not None:
+        log = registro.obtener(f'etl.{particion}')
+        # Con supervisor la parada llega solo por él (SIGTERM): el Ctrl+C de
+        # la terminal también lo recibe todo el grupo de procesos
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+    else:
+        log = registro.obtener('etl')
+    
+    if ETL_METRICAS_PUERTO:
+        puerto = ETL_METRICAS_PUERTO + (particion or 0)
+        try:
+            metricas.servir(puerto)
+            log.info("Métricas expuestas", extra={"puerto": puerto})
+        except OSError as e:
+            log.warning("No se pudo exponer métricas", extra={"puerto": puerto, "error": str(e)})
+    
+    # Último estado por nodo para el dashboard
+    publicar_estado = publicador_estado(cola_estado, log)
+    
+    # recibido_en (epoch) de los mensajes aún no persistidos, para medir la
+    # latencia de extremo a extremo cuando el escritor los confirma
+    recibidos: Dict[int, float] = {}
+    
+    def al_persistir(ids: List[int]):
+        ahora = time.time()
+        latencias = [ahora - recibidos.pop(mensaje_id) for mensaje_id in ids if mensaje_id in recibidos]
+        LATENCIA_INGESTA.observar_varios(latencias, ('persistido',))
+        confirmar_cola(ids)
     
     # Inicializar Supabase si está configurado
     supabase = None
     if SUPABASE_URL and SUPABASE_KEY:
         try:
             supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-            print("Supabase conectado")
+            log.info("Supabase conectado")
         except Exception as e:
-            print(f"Error conectando Supabase: {e}")
+            log.error("Error conectando Supabase", extra={"error": str(e)})
+    
+    # Escritor por lotes: confirma en la cola lo que ya quedó persistido
+    escritor = None
+    if supabase:
+        escritor = EscritorSupabase(
+            supabase, TABLE_NAME,
+            tamano_lote=SUPABASE_LOTE,
+            intervalo_s=SUPABASE_INTERVALO_S,
+            ruta_spool=ruta_particion(SUPABASE_SPOOL_PATH, particion),
+            ruta_descartes=ruta_particion(SUPABASE_DESCARTES_PATH, particion),
+            conflictos={tabla: CONFLICTO_AGREGADOS for tabla in RESOLUCIONES},
+            al_persistir=al_persistir
+        )
+        escritor.iniciar()
+    
+    # Agregados por nodo para las consultas de rangos largos del dashboard
+    agregador = None
+    if escritor:
+        agregador = AgregadorRollups(
+            lambda tabla, fila: escritor.encolar(fila, tabla=tabla),
+            intervalo_s=AGREGADOS_INTERVALO_S
+        )
+    
+    # Alertas asíncronas y deduplicadas por nodo
+    despachador = DespachadorAlertas(
+        WEBHOOK_ALERTA_URL,
+        trabajadores=ALERTA_TRABAJADORES,
+        cooldown_s=ALERTA_COOLDOWN_S
+    )
+    despachador.iniciar()
     
     # Inicializar procesador
-    processor = HidrologiaProcessor(supabase)
+    processor = HidrologiaProcessor(supabase, escritor, despachador)
     
     # Loop principal
-    print("Iniciando consumo de cola...")
-    while True:
-        try:
-            # Consumir mensaje de la cola
-            medicion = consumir_cola()
-            
-            if medicion:
-                print(f"Procesando medición: {medicion.get('ts')}")
-                
-                # Procesar medición
-                resultado = processor.procesar_medicion(medicion)
-                
-                # Guardar en Supabase
-                processor.guardar_supabase(resultado)
+    log.info("Iniciando consumo de cola", extra={"particion": particion, "particiones": particiones})
+    try:
+        while True:
+            try:
+                # Consumir un lote de mensajes de la cola
+                mediciones = consumir_cola(particion=particion, particiones=particiones)
                 
-                # Evaluar alerta
-                if processor.evaluar_alerta(resultado):
-                    print("¡ALERTA DETECTADA!")
-                    processor.enviar_alerta(resultado)
+                if mediciones:
+                    ids_confirmados = []
+                    latencias = []
+                    estados = []
+                    for medicion in mediciones:
+                        if log.isEnabledFor(logging.DEBUG) and registro.muestrear():
+                            log.debug("Procesando medición", extra={"id": medicion.get('id'), "ts": medicion.get('ts')})
+                        
+                        # Procesar medición; una medición inválida se confirma para
+                        # que no se reentregue indefinidamente
+                        try:
+                            resultado = processor.procesar_medicion(medicion)
+                        except Exception as e:
+                            log.warning("Error procesando medición", extra={"id": medicion.get('id'), "error": str(e)})
+                            MEDICIONES_INVALIDAS.inc()
+                            ids_confirmados.append(medicion['id'])
+                            continue
+                        
+                        MEDICIONES_PROCESADAS.inc((resultado['node_id'],))
+                        recibido = epoch_iso(medicion.get('recibido_en'))
+                        if recibido is not None:
+                            latencias.append(recibido)
+                        
+                        # Guardar en Supabase; el escritor confirma el mensaje cuando el
+                        # lote queda persistido. Sin base de datos se confirma de inmediato
+                        if processor.escritor:
+                            if recibido is not None:
+                                recibidos[medicion['id']] = recibido
+                            processor.guardar_supabase(resultado, ack_id=medicion['id'])
+                        else:
+                            ids_confirmados.append(medicion['id'])
+                        
+                        if agregador:
+                            agregador.agregar(resultado)
+                        
+                        # Evaluar alerta
+                        evaluacion = processor.evaluar(resultado)
+                        if evaluacion.reglas:
+                            log.info("Alerta detectada", extra={"node_id": resultado['node_id'], "ts": resultado['ts'],
+                                                                "reglas": evaluacion.reglas, "riesgo": evaluacion.puntaje})
+                            processor.enviar_alerta(resultado, evaluacion.nivel)
+                        else:
+                            # Registrar el regreso a VERDE para que la próxima escalada se notifique
+                            despachador.notificar(resultado['node_id'], "VERDE")
+                        
+                        if publicar_estado:
+                            estados.append({**processor.fila_supabase(resultado), "nivel_alerta": evaluacion.nivel,
+                                            "riesgo": evaluacion.puntaje})
+                        
+                        if log.isEnabledFor(logging.DEBUG) and registro.muestrear():
+                            log.debug("Medición procesada", extra={"node_id": resultado['node_id'], "ts": resultado['ts']})
+                    
+                    ahora = time.time()
+                    LATENCIA_INGESTA.observar_varios([ahora - recibido for recibido in latencias], ('procesado',))
+                    confirmar_cola(ids_confirmados)
+                    if publicar_estado:
+                        publicar_estado(estados)
+                elif mediciones is None:
+                    # La cola no responde, esperar antes de reintentar
+                    time.sleep(5)
                 
-                print(f"Medición procesada: {resultado['ts']}")
-            else:
-                # No hay mensajes, esperar un poco
+                if agregador:
+                    agregador.publicar_abiertos()
+                    
+            except Exception as e:
+                log.error("Error en loop principal", extra={"error": str(e)})
                 time.sleep(5)
-                
-        except KeyboardInterrupt:
-            print("\nDeteniendo ETL...")
-            break
-        except Exception as e:
-            print(f"Error en loop principal: {e}")
-            time.sleep(5)
+    except KeyboardInterrupt:
+        ignorar_senales()
+        log.info("Deteniendo ETL")
+        if agregador:
+            agregador.publicar_abiertos(forzar=True)
+        if escritor:
+            escritor.detener()
+        despachador.detener(timeout=5)
+        registro.detener()
+
+
+def supervisar(trabajadores: int):
+    """
+    Lanza un proceso por partición y reinicia los que terminan inesperadamente.
+    Un trabajador reiniciado retoma su misma partición, y los mensajes que
+    tenía arrendados sin confirmar vuelven a entregársele al vencer el lease.
+    Con Ctrl+C o SIGTERM detiene a los trabajadores con SIGTERM y les da
+    `ETL_PLAZO_SALIDA_S` para vaciar sus buffers.
+    """
+    # La API de estado vive en el supervisor para ver todos los nodos; los
+    # trabajadores le envían sus lotes por una cola acotada
+    cola_estado = None
+    if ETL_ESTADO_PUERTO:
+        cache = servir_estado(log)
+        if cache:
+            cola_estado = multiprocessing.Queue(ESTADO_COLA_MAX)
+            threading.Thread(target=recibir_estado, args=(cola_estado, cache), name="estado-cola", daemon=True).start()
+    
+    def lanzar(particion: int) -> multiprocessing.Process:
+        proceso = multiprocessing.Process(
+            target=ejecutar_trabajador, args=(particion, trabajadores, cola_estado),
+            name=f"etl-{particion}", daemon=False
+        )
+        proceso.start()
+        return proceso
+    
+    detener_con_sigterm()
+    procesos = {particion: lanzar(particion) for particion in range(trabajadores)}
+    inicios = {particion: time.monotonic() for particion in procesos}
+    log.info("Trabajadores iniciados", extra={"trabajadores": trabajadores})
+    
+    try:
+        while True:
+            time.sleep(1)
+            for particion, proceso in procesos.items():
+                if proceso.is_alive():
+                    continue
+                # Evitar un ciclo de reinicios si el trabajador cae al arrancar
+                if time.monotonic() - inicios[particion] < ETL_REINICIO_MIN_S:
+                    continue
+                log.warning("Trabajador terminó, reiniciando",
+                            extra={"particion": particion, "codigo": proceso.exitcode})
+                procesos[particion] = lanzar(particion)
+                inicios[particion] = time.monotonic()
+    except KeyboardInterrupt:
+        # Sea Ctrl+C o SIGTERM, cada trabajador recibe SIGTERM y vacía sus buffers
+        ignorar_senales()
+        log.info("Esperando a los trabajadores")
+        for proceso in procesos.values():
+            proceso.terminate()
+        limite = time.monotonic() + ETL_PLAZO_SALIDA_S
+        for particion, proceso in procesos.items():
+            proceso.join(max(0.0, limite - time.monotonic()))
+            if proceso.is_alive():
+                log.warning("Trabajador no terminó a tiempo", extra={"particion": particion})
+                proceso.kill()
+                proceso.join()
+        registro.detener()
+
+
+def main():
+    registro.configurar()
+    log.info("Iniciando ETL de datos hidrológicos")
+    if ETL_TRABAJADORES > 1:
+        supervisar(ETL_TRABAJADORES)
+    else:
+        ejecutar_trabajador()
 
 
 if __name__ == '__main__':
     main()
-
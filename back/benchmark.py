@@ -0,0 +1,840 @@
+"""
+Benchmarks del ETL de datos hidrológicos
+
+Uso:
+    python benchmark.py nodos [--nodos 10 100 500 1000] [--lecturas 50]
+    python benchmark.py escritor [--filas 2000] [--latencia-ms 30] [--lote 500]
+    python benchmark.py alertas [--lecturas 200] [--latencia-ms 200]
+    python benchmark.py agregados [--dias 30] [--periodo 5]
+    python benchmark.py trabajadores [--trabajadores 1 2 4 8] [--latencia-ms 5]
+    python benchmark.py metricas [--lecturas 20000]
+    python benchmark.py logs [--mensajes 20000]
+    python benchmark.py timestamps [--lecturas 50000]
+    python benchmark.py reglas [--lecturas 1000000]
+    python benchmark.py estado [--nodos 1000] [--clientes 8] [--segundos 5]
+"""
+import argparse
+import collections
+import gc
+import importlib.util
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import requests
+
+import app as etl
+import estado_nodos
+import metricas
+import reglas
+import registro
+from agregados import RESOLUCIONES, AgregadorRollups
+from app import HidrologiaProcessor, TABLE_NAME
+from despachador_alertas import DespachadorAlertas
+from escritor_supabase import EscritorSupabase
+from estado_nodos import CacheEstado
+
+
+class SupabaseFalso:
+    """
+    Cliente falso con la API `table().insert().execute()` de supabase-py. Cada
+    execute tarda `latencia_s` (un round-trip de red) y puede fallar mientras
+    `caido` sea True.
+    """
+
+    def __init__(self, latencia_s: float = 0.03):
+        self.latencia_s = latencia_s
+        self.caido = False
+        self.filas: list = []
+        self.llamadas = 0
+        self._pendiente = None
+
+    def table(self, nombre: str):
+        return self
+
+    def insert(self, filas):
+        self._pendiente = filas if isinstance(filas, list) else [filas]
+        return self
+
+    def execute(self):
+        self.llamadas += 1
+        time.sleep(self.latencia_s)
+        if self.caido:
+            raise ConnectionError("Supabase falso caído")
+        self.filas.extend(self._pendiente)
+        return self
+
+
+def _webhook_local(latencia_s: float):
+    """Levanta un stub HTTP del webhook de n8n que tarda `latencia_s` por petición"""
+    recibidas = []
+
+    class Manejador(BaseHTTPRequestHandler):
+        def do_POST(self):
+            time.sleep(latencia_s)
+            recibidas.append(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            self.send_response(200)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), Manejador)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://127.0.0.1:{servidor.server_port}/webhook", recibidas
+
+
+def _lecturas_intercaladas(nodos: int, lecturas: int):
+    """
+    Lecturas de `nodos` sensores intercaladas como llegarían a la cola. Cada
+    nodo sube a un ritmo propio y constante (0.01 m/h * índice del nodo) para
+    poder verificar el RoR calculado.
+    """
+    inicio = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    for paso in range(lecturas):
+        ts = (inicio + timedelta(seconds=paso)).isoformat().replace('+00:00', 'Z')
+        for nodo in range(nodos):
+            yield {
+                "node_id": f"N{nodo:04d}",
+                "ts": ts,
+                "nivel_m": 0.2 + nodo * 0.01 * paso / 3600,
+                "lluvia_mm": 0.1
+            }
+
+
+def benchmark_nodos(cantidades, lecturas: int):
+    """Costo por lectura y correctitud del RoR por nodo con cientos de nodos intercalados"""
+    print(f"{'nodos':>8} {'lecturas':>10} {'us/lectura':>12} {'ror_incorrectos':>16}")
+    for nodos in cantidades:
+        processor = HidrologiaProcessor()
+        mediciones = list(_lecturas_intercaladas(nodos, lecturas))
+
+        incorrectos = 0
+        inicio = time.perf_counter()
+        for medicion in mediciones:
+            resultado = processor.procesar_medicion(medicion)
+            ror = resultado['ror']
+            if ror is not None:
+                esperado = int(medicion['node_id'][1:]) * 0.01
+                if abs(ror - esperado) > 1e-6:
+                    incorrectos += 1
+        segundos = time.perf_counter() - inicio
+
+        print(f"{nodos:>8} {len(mediciones):>10} {segundos / len(mediciones) * 1e6:>12.2f} {incorrectos:>16}")
+
+
+def benchmark_escritor(filas: int, latencia_ms: float, tamano_lote: int):
+    """Filas/s del insert síncrono por medición frente al escritor por lotes"""
+    mediciones = list(_lecturas_intercaladas(10, filas // 10))
+
+    cliente = SupabaseFalso(latencia_ms / 1000)
+    processor = HidrologiaProcessor(cliente)
+    inicio = time.perf_counter()
+    for medicion in mediciones:
+        processor.guardar_supabase(processor.procesar_medicion(medicion))
+    segundos_sinc = time.perf_counter() - inicio
+
+    with tempfile.TemporaryDirectory() as directorio:
+        cliente = SupabaseFalso(latencia_ms / 1000)
+        escritor = EscritorSupabase(
+            cliente, TABLE_NAME, tamano_lote=tamano_lote, intervalo_s=0.2,
+            ruta_spool=os.path.join(directorio, 'spool.jsonl')
+        )
+        escritor.iniciar()
+        processor = HidrologiaProcessor(cliente, escritor)
+        inicio = time.perf_counter()
+        for medicion in mediciones:
+            processor.guardar_supabase(processor.procesar_medicion(medicion))
+        escritor.detener()
+        segundos_lote = time.perf_counter() - inicio
+
+        # Caída de la base a mitad de la carga: nada debe perderse
+        cliente = SupabaseFalso(latencia_ms / 1000)
+        escritor = EscritorSupabase(
+            cliente, TABLE_NAME, tamano_lote=tamano_lote, intervalo_s=0.2,
+            ruta_spool=os.path.join(directorio, 'spool.jsonl'),
+            max_reintentos=2, backoff_base_s=0.01, espera_spool_s=0.1
+        )
+        escritor.iniciar()
+        processor = HidrologiaProcessor(cliente, escritor)
+        for i, medicion in enumerate(mediciones):
+            cliente.caido = len(mediciones) // 4 <= i < len(mediciones) // 2
+            processor.guardar_supabase(processor.procesar_medicion(medicion))
+        cliente.caido = False
+        time.sleep(0.5)
+        escritor.detener()
+        perdidas = len(mediciones) - len(cliente.filas)
+
+    print(f"{'modo':>10} {'filas/s':>12}")
+    print(f"{'sincrono':>10} {len(mediciones) / segundos_sinc:>12.0f}")
+    print(f"{'lotes':>10} {len(mediciones) / segundos_lote:>12.0f}")
+    print(f"Filas perdidas con caída de la base: {perdidas}")
+
+
+def benchmark_alertas(lecturas: int, latencia_ms: float):
+    """Tiempo del loop dentro de enviar_alerta y webhooks emitidos durante una creciente sostenida"""
+    servidor, url, recibidas = _webhook_local(latencia_ms / 1000)
+    inicio = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    creciente = [
+        {
+            "node_id": "N01",
+            "ts": (inicio + timedelta(seconds=i)).isoformat().replace('+00:00', 'Z'),
+            "nivel_m": 0.6 + 0.002 * i,
+            "lluvia_mm": 2.0
+        }
+        for i in range(lecturas)
+    ]
+
+    print(f"{'modo':>12} {'ms_en_loop':>12} {'webhooks':>10}")
+    for modo in ("sincrono", "despachador"):
+        recibidas.clear()
+        despachador = None
+        if modo == "despachador":
+            despachador = DespachadorAlertas(url, cooldown_s=3600)
+            despachador.iniciar()
+        else:
+            etl.WEBHOOK_ALERTA_URL = url
+        processor = HidrologiaProcessor(despachador=despachador)
+
+        en_loop = 0.0
+        for medicion in creciente:
+            resultado = processor.procesar_medicion(medicion)
+            if processor.evaluar_alerta(resultado):
+                t0 = time.perf_counter()
+                processor.enviar_alerta(resultado)
+                en_loop += time.perf_counter() - t0
+        if despachador:
+            time.sleep(latencia_ms / 1000 * 3)
+            despachador.detener()
+        print(f"{modo:>12} {en_loop * 1000:>12.1f} {len(recibidas):>10}")
+    servidor.shutdown()
+
+
+def benchmark_agregados(dias: int, periodo_s: int):
+    """
+    Bytes y latencia de la consulta de un gráfico de `dias` días para un nodo
+    leyendo las mediciones crudas frente a cada tabla de agregados. Usa SQLite
+    en memoria con los mismos índices (node_id, ts) como sustituto de Postgres.
+    """
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE mediciones_hidrologicas (node_id TEXT, ts TEXT, nivel_m REAL, lluvia_mm REAL)")
+    conn.execute("CREATE INDEX idx_crudas ON mediciones_hidrologicas(node_id, ts)")
+    for tabla in RESOLUCIONES:
+        conn.execute(f"CREATE TABLE {tabla} (node_id TEXT, ts TEXT, nivel_mean REAL, lluvia_sum REAL, "
+                     f"PRIMARY KEY (node_id, ts))")
+
+    def emitir(tabla, fila):
+        conn.execute(f"INSERT OR REPLACE INTO {tabla} VALUES (?, ?, ?, ?)",
+                     (fila['node_id'], fila['ts'], fila['nivel_mean'], fila['lluvia_sum']))
+
+    agregador = AgregadorRollups(emitir)
+    inicio = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    filas = []
+    for i in range(dias * 86400 // periodo_s):
+        ts = (inicio + timedelta(seconds=i * periodo_s)).isoformat().replace('+00:00', 'Z')
+        resultado = {"node_id": "N01", "ts": ts, "nivel_m": 0.3 + (i % 500) / 1000, "lluvia_mm": 0.1, "ror": None}
+        filas.append((resultado['node_id'], ts, resultado['nivel_m'], resultado['lluvia_mm']))
+        agregador.agregar(resultado)
+    agregador.publicar_abiertos(forzar=True)
+    conn.executemany("INSERT INTO mediciones_hidrologicas VALUES (?, ?, ?, ?)", filas)
+    conn.commit()
+
+    desde = inicio.isoformat().replace('+00:00', 'Z')
+    consultas = [("mediciones_hidrologicas", "ts, nivel_m, lluvia_mm")]
+    consultas += [(tabla, "ts, nivel_mean, lluvia_sum") for tabla in RESOLUCIONES]
+
+    print(f"{'tabla':>26} {'filas':>10} {'bytes_json':>12} {'ms':>10}")
+    for tabla, columnas in consultas:
+        t0 = time.perf_counter()
+        resultado = conn.execute(
+            f"SELECT {columnas} FROM {tabla} WHERE node_id = ? AND ts >= ? ORDER BY ts", ("N01", desde)
+        ).fetchall()
+        cuerpo = json.dumps(resultado)
+        milisegundos = (time.perf_counter() - t0) * 1000
+        print(f"{tabla:>26} {len(resultado):>10} {len(cuerpo):>12} {milisegundos:>10.1f}")
+
+
+def _cola_local():
+    """Levanta el servicio de cola real (backend en memoria) en un puerto libre"""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        puerto = s.getsockname()[1]
+    directorio = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'cola')
+    proceso = subprocess.Popen(
+        [sys.executable, '-c', f"from app import app; app.run(port={puerto}, threaded=True)"],
+        cwd=directorio, env={**os.environ, 'COLA_BACKEND': 'memoria'},
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    url = f"http://127.0.0.1:{puerto}"
+    for _ in range(100):
+        try:
+            requests.get(f"{url}/health", timeout=1)
+            return proceso, url
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    proceso.kill()
+    raise RuntimeError("La cola local no arrancó")
+
+
+def _trabajador_benchmark(particion, particiones, url, latencia_s, listo, arrancar, resultados):
+    """Loop del ETL con insert síncrono por medición hasta vaciar su partición"""
+    etl.COLA_URL = url
+    processor = HidrologiaProcessor(SupabaseFalso(latencia_s))
+    ultimo_ts = {}
+    procesadas = desordenadas = 0
+    listo.set()
+    arrancar.wait()
+    while True:
+        mediciones = etl.consumir_cola(maximo=100, espera=0, particion=particion, particiones=particiones)
+        if not mediciones:
+            break
+        for medicion in mediciones:
+            processor.guardar_supabase(processor.procesar_medicion(medicion))
+            nodo = medicion['node_id']
+            if medicion['ts'] < ultimo_ts.get(nodo, ''):
+                desordenadas += 1
+            ultimo_ts[nodo] = medicion['ts']
+            procesadas += 1
+        etl.confirmar_cola([medicion['id'] for medicion in mediciones])
+    resultados.put((procesadas, desordenadas, len(ultimo_ts)))
+
+
+def benchmark_trabajadores(cantidades, nodos: int, lecturas: int, latencia_ms: float):
+    """Mediciones/s del ETL con 1..N procesos particionados por node_id contra la cola real"""
+    cola, url = _cola_local()
+    mediciones = list(_lecturas_intercaladas(nodos, lecturas))
+    try:
+        print(f"{'trabajadores':>12} {'mediciones/s':>14} {'desordenadas':>13} {'nodos_repetidos':>16}")
+        for trabajadores in cantidades:
+            requests.post(f"{url}/limpiar", timeout=5)
+            for inicio in range(0, len(mediciones), 1000):
+                requests.post(f"{url}/mensajes/lote", json={"mensajes": mediciones[inicio:inicio + 1000]}, timeout=30)
+
+            arrancar = multiprocessing.Event()
+            resultados = multiprocessing.Queue()
+            procesos, listos = [], []
+            for particion in range(trabajadores):
+                listo = multiprocessing.Event()
+                procesos.append(multiprocessing.Process(
+                    target=_trabajador_benchmark,
+                    args=(particion if trabajadores > 1 else None, trabajadores, url,
+                          latencia_ms / 1000, listo, arrancar, resultados)
+                ))
+                listos.append(listo)
+            for proceso in procesos:
+                proceso.start()
+            for listo in listos:
+                listo.wait()
+
+            inicio = time.perf_counter()
+            arrancar.set()
+            parciales = [resultados.get() for _ in procesos]
+            segundos = time.perf_counter() - inicio
+            for proceso in procesos:
+                proceso.join()
+
+            procesadas = sum(p[0] for p in parciales)
+            desordenadas = sum(p[1] for p in parciales)
+            # Un nodo atendido por más de un trabajador rompería el estado por nodo
+            repetidos = sum(p[2] for p in parciales) - nodos
+            print(f"{trabajadores:>12} {procesadas / segundos:>14.0f} {desordenadas:>13} {repetidos:>16}")
+    finally:
+        cola.terminate()
+        cola.wait()
+
+
+def benchmark_metricas(lecturas: int):
+    """Costo por lectura de la instrumentación del loop del ETL (contador, parseo de recibido_en e histograma)"""
+    recibido_en = datetime.utcnow().isoformat() + "Z"
+    mediciones = [{**m, "recibido_en": recibido_en} for m in _lecturas_intercaladas(100, lecturas // 100)]
+
+    print(f"{'modo':>16} {'us/lectura':>12}")
+    tiempos = {}
+    for modo in ("sin_metricas", "con_metricas") * 3:
+        processor = HidrologiaProcessor()
+        inicio = time.perf_counter()
+        # Mismo patrón que el loop del ETL: lotes de 100, histograma al cerrar el lote
+        for desde in range(0, len(mediciones), 100):
+            latencias = []
+            for medicion in mediciones[desde:desde + 100]:
+                resultado = processor.procesar_medicion(medicion)
+                if modo == "con_metricas":
+                    etl.MEDICIONES_PROCESADAS.inc((resultado['node_id'],))
+                    latencias.append(etl.epoch_iso(medicion.get('recibido_en')))
+            if modo == "con_metricas":
+                ahora = time.time()
+                etl.LATENCIA_INGESTA.observar_varios([ahora - r for r in latencias], ('procesado',))
+        # Mejor de tres corridas alternadas para descontar ruido
+        us = (time.perf_counter() - inicio) / len(mediciones) * 1e6
+        tiempos[modo] = min(tiempos.get(modo, us), us)
+    for modo, us in tiempos.items():
+        print(f"{modo:>16} {us:>12.2f}")
+
+    inicio = time.perf_counter()
+    texto = metricas.exponer()
+    print(f"Sobrecosto: {tiempos['con_metricas'] - tiempos['sin_metricas']:.2f} us/lectura; "
+          f"/metrics con 100 nodos: {len(texto)} bytes en {(time.perf_counter() - inicio) * 1000:.2f} ms")
+
+
+def _validador_cola():
+    """`validar_medicion` de cola/app.py, cargado aparte porque el módulo también se llama app"""
+    directorio = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'cola')
+    os.environ.setdefault('COLA_BACKEND', 'memoria')
+    sys.path.insert(0, directorio)
+    try:
+        spec = importlib.util.spec_from_file_location('cola_app', os.path.join(directorio, 'app.py'))
+        modulo = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(modulo)
+    finally:
+        sys.path.remove(directorio)
+    return modulo.validar_medicion
+
+
+def _validar_anterior(data) -> str:
+    """Validación de la cola antes de ts_ms: parsea ts en cada mensaje"""
+    if not isinstance(data, dict):
+        return "La medición debe ser un objeto JSON"
+    for campo in ('ts', 'nivel_m', 'lluvia_mm'):
+        if campo not in data:
+            return f"Campo requerido faltante: {campo}"
+    try:
+        datetime.fromisoformat(data['ts'].replace('Z', '+00:00'))
+        float(data['nivel_m'])
+        float(data['lluvia_mm'])
+    except (ValueError, TypeError, AttributeError) as e:
+        return f"Error de validación: {str(e)}"
+    return ""
+
+
+class _ProcesadorAnterior(HidrologiaProcessor):
+    """RoR e intensidad como antes de ts_ms: parsean el ts actual y el anterior en cada llamada"""
+
+    def rate_of_rise(self, medicion_actual, medicion_anterior):
+        if not medicion_anterior:
+            return None
+        ts_actual = datetime.fromisoformat(medicion_actual['ts'].replace('Z', '+00:00'))
+        ts_anterior = datetime.fromisoformat(medicion_anterior['ts'].replace('Z', '+00:00'))
+        delta_tiempo = (ts_actual - ts_anterior).total_seconds() / 3600
+        if delta_tiempo <= 0:
+            return None
+        return (medicion_actual['nivel_m'] - medicion_anterior['nivel_m']) / delta_tiempo
+
+    def intensidad_lluvia(self, medicion_actual, medicion_anterior):
+        if not medicion_anterior:
+            return None
+        ts_actual = datetime.fromisoformat(medicion_actual['ts'].replace('Z', '+00:00'))
+        ts_anterior = datetime.fromisoformat(medicion_anterior['ts'].replace('Z', '+00:00'))
+        delta_tiempo = (ts_actual - ts_anterior).total_seconds() / 3600
+        if delta_tiempo <= 0:
+            return None
+        return medicion_actual['lluvia_mm'] / delta_tiempo
+
+
+class _AgregadorAnterior(AgregadorRollups):
+    """Agregador que, sin ts_ms en el resultado, parsea ts como antes"""
+
+    def agregar(self, resultado):
+        resultado.pop('ts_ms', None)
+        super().agregar(resultado)
+
+
+def benchmark_timestamps(lecturas: int):
+    """
+    CPU por mensaje en validación de la cola y en el ETL (procesador y
+    agregados) según dónde se parsea el timestamp: en cada etapa como antes,
+    una vez en la cola (productor HTTP sin ts_ms) o en el gateway (ts_ms ya
+    en el mensaje).
+    """
+    validar = _validador_cola()
+    base = list(_lecturas_intercaladas(100, lecturas // 100))
+    ts_ms = {m['ts']: etl.epoch_ms(dict(m)) for m in base}
+
+    modos = {
+        # Los mensajes llevan ts_ms para que el procesador actual no lo agregue;
+        # los métodos y el agregador anteriores lo ignoran y parsean ts
+        "antes": (_validar_anterior, _ProcesadorAnterior, _AgregadorAnterior, True),
+        "ts_ms_en_cola": (validar, HidrologiaProcessor, AgregadorRollups, False),
+        "ts_ms_en_gateway": (validar, HidrologiaProcessor, AgregadorRollups, True),
+    }
+    tiempos = {}
+    for _ in range(5):
+        for modo, (validador, procesador_cls, agregador_cls, con_ts_ms) in modos.items():
+            mensajes = [{**m, 'ts_ms': ts_ms[m['ts']]} if con_ts_ms else dict(m) for m in base]
+            processor = procesador_cls()
+            agregador = agregador_cls(lambda tabla, fila: None, intervalo_s=3600)
+
+            # Sin GC durante la medición, como timeit
+            gc.collect()
+            gc.disable()
+            inicio = time.perf_counter()
+            for mensaje in mensajes:
+                validador(mensaje)
+            en_cola = time.perf_counter() - inicio
+
+            inicio = time.perf_counter()
+            for mensaje in mensajes:
+                agregador.agregar(processor.procesar_medicion(mensaje))
+            en_etl = time.perf_counter() - inicio
+            gc.enable()
+
+            # Mejor de cinco corridas alternadas para descontar ruido
+            previo = tiempos.get(modo, (en_cola, en_etl))
+            tiempos[modo] = (min(previo[0], en_cola), min(previo[1], en_etl))
+
+    print(f"{'modo':>18} {'us_cola':>9} {'us_etl':>9} {'us_total':>9} {'ahorro_us':>10}")
+    total_antes = sum(tiempos["antes"]) / len(base) * 1e6
+    for modo, (en_cola, en_etl) in tiempos.items():
+        total = (en_cola + en_etl) / len(base) * 1e6
+        print(f"{modo:>18} {en_cola / len(base) * 1e6:>9.2f} {en_etl / len(base) * 1e6:>9.2f} "
+              f"{total:>9.2f} {total_antes - total:>10.2f}")
+
+
+def _evaluar_alerta_anterior(resultado) -> bool:
+    """`evaluar_alerta` antes del motor de reglas"""
+    proyeccion = resultado.get('proyeccion_30min')
+    ror = resultado.get('ror')
+    return (resultado['nivel_m'] > 0.5 or bool(proyeccion and proyeccion > 0.6) or bool(ror and ror > 0.1)
+            or resultado.get('persistencia', 0) >= 3)
+
+
+def _nivel_alerta_anterior(resultado) -> str:
+    """`nivel_alerta` antes del motor de reglas"""
+    ror = resultado.get('ror')
+    proyeccion_30min = resultado.get('proyeccion_30min')
+    riesgo = (
+        (resultado.get('nivel_m', 0) * 0.6) +
+        (min(ror or 0, 0.2) * 2.0) +
+        ((resultado.get('persistencia', 0) or 0) * 0.05) +
+        (0.1 if (proyeccion_30min and proyeccion_30min > 0.6) else 0.0)
+    )
+    if riesgo >= 0.9:
+        return "ROJA"
+    elif riesgo >= 0.6:
+        return "AMARILLA"
+    return "VERDE"
+
+
+def _resultados_aleatorios(lecturas: int, semilla: int = 0) -> dict:
+    """
+    Columnas de resultados del procesador: niveles al centímetro (caen justo
+    en los umbrales), RoR ausente en la primera lectura de cada nodo (~5 %)
+    """
+    rng = np.random.default_rng(semilla)
+    nivel = np.round(rng.uniform(0, 1.2, lecturas), 2)
+    ror = np.round(rng.normal(0, 0.1, lecturas), 3)
+    ror[rng.random(lecturas) < 0.05] = np.nan
+    return {
+        'nivel_m': nivel,
+        'ror': ror,
+        'proyeccion_30min': nivel + ror * 0.5,
+        'persistencia': rng.integers(0, 12, lecturas),
+    }
+
+
+def benchmark_reglas(lecturas: int):
+    """
+    Decisiones del ETL con el motor de reglas (por lectura y en lote con
+    NumPy) frente a evaluar_alerta/nivel_alerta anteriores. Las columnas
+    distintas deben quedar en 0.
+    """
+    columnas = _resultados_aleatorios(lecturas)
+    filas = [
+        {'nivel_m': nivel, 'ror': None if ror != ror else ror, 'proyeccion_30min': None if p != p else p,
+         'persistencia': persistencia}
+        for nivel, ror, p, persistencia in zip(*(columnas[c].tolist() for c in
+                                                  ('nivel_m', 'ror', 'proyeccion_30min', 'persistencia')))
+    ]
+    motor = reglas.motor('etl')
+
+    # Sin GC durante la medición, como timeit
+    gc.collect()
+    gc.disable()
+    inicio = time.perf_counter()
+    anteriores = [(_evaluar_alerta_anterior(fila), _nivel_alerta_anterior(fila)) for fila in filas]
+    tiempos = {'anterior': time.perf_counter() - inicio}
+
+    inicio = time.perf_counter()
+    evaluaciones = [motor.evaluar(fila) for fila in filas]
+    tiempos['motor'] = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    lote = motor.evaluar_lote(columnas)
+    alerta = np.logical_or.reduce(list(lote.reglas.values()))
+    niveles = np.asarray(motor.niveles)[lote.nivel]
+    tiempos['lote'] = time.perf_counter() - inicio
+    gc.enable()
+
+    por_lectura = [(bool(e.reglas), e.nivel) for e in evaluaciones]
+    en_lote = list(zip(alerta.tolist(), niveles.tolist()))
+
+    print(f"{'modo':>10} {'us/lectura':>11} {'lecturas/s':>12} {'alerta_distinta':>16} {'nivel_distinto':>15}")
+    for modo, decisiones in (('anterior', anteriores), ('motor', por_lectura), ('lote', en_lote)):
+        alerta_distinta = sum(a[0] != b[0] for a, b in zip(anteriores, decisiones))
+        nivel_distinto = sum(a[1] != b[1] for a, b in zip(anteriores, decisiones))
+        print(f"{modo:>10} {tiempos[modo] / lecturas * 1e6:>11.3f} {lecturas / tiempos[modo]:>12.0f} "
+              f"{alerta_distinta:>16} {nivel_distinto:>15}")
+    conteo = collections.Counter(nivel for _, nivel in anteriores)
+    print(f"alertas={sum(a for a, _ in anteriores)} " + " ".join(f"{n}={conteo[n]}" for n in motor.niveles))
+
+
+def _cliente_consulta(url: str, con_etag: bool, segundos: float, resultados):
+    """Consulta `url` sin pausa durante `segundos`, reenviando el ETag si `con_etag`"""
+    sesion = requests.Session()
+    etag = None
+    respuestas = bytes_recibidos = no_modificadas = 0
+    latencias = []
+    fin = time.perf_counter() + segundos
+    while time.perf_counter() < fin:
+        inicio = time.perf_counter()
+        respuesta = sesion.get(url, headers={'If-None-Match': etag} if etag else None)
+        latencias.append(time.perf_counter() - inicio)
+        respuestas += 1
+        bytes_recibidos += len(respuesta.content)
+        no_modificadas += respuesta.status_code == 304
+        if con_etag:
+            etag = respuesta.headers.get('ETag')
+    resultados.put((respuestas, bytes_recibidos, no_modificadas, latencias))
+
+
+def _cliente_sse(url: str, segundos: float, resultados):
+    """Suscriptor de /estado/eventos: momento de llegada de cada versión"""
+    llegadas = {}
+    fin = time.time() + segundos
+    with requests.get(url, stream=True, timeout=segundos + 5) as respuesta:
+        for linea in respuesta.iter_lines():
+            if linea.startswith(b'id: '):
+                llegadas[int(linea.rsplit(b'-', 1)[1])] = time.time()
+            if time.time() >= fin:
+                break
+    resultados.put(llegadas)
+
+
+def benchmark_estado(nodos: int, clientes: int, segundos: float, periodo_s: float):
+    """
+    API de estado del ETL con un lote de lecturas publicado cada `periodo_s`:
+    costo de publicar en el loop, consultas a /estado con y sin ETag, y
+    latencia de los eventos SSE. Los clientes corren en otros procesos para no
+    competir por el GIL del servidor.
+    """
+    lecturas = list(_lecturas_intercaladas(nodos, 3))
+    processor = HidrologiaProcessor()
+    resultados = [processor.procesar_medicion(m) for m in lecturas]
+    estados = [{**processor.fila_supabase(r), "nivel_alerta": "VERDE", "riesgo": 0.1} for r in resultados]
+
+    # Costo por lectura en el loop del ETL: armar la fila y publicarla en lotes de 100
+    cache = CacheEstado()
+    inicio = time.perf_counter()
+    for desde in range(0, len(resultados), 100):
+        cache.publicar([{**processor.fila_supabase(r), "nivel_alerta": "VERDE", "riesgo": 0.1}
+                        for r in resultados[desde:desde + 100]])
+    us_publicar = (time.perf_counter() - inicio) / len(resultados) * 1e6
+    inicio = time.perf_counter()
+    _, cuerpo = cache.estado()
+    print(f"Publicar: {us_publicar:.2f} us/lectura; /estado con {nodos} nodos: {len(cuerpo)} bytes, "
+          f"serializado en {(time.perf_counter() - inicio) * 1000:.2f} ms")
+
+    servidor = estado_nodos.servir(cache, 0, host='127.0.0.1')
+    base = f"http://127.0.0.1:{servidor.server_port}"
+    publicadas = {}
+    detener = threading.Event()
+
+    def publicador():
+        # Lotes de 100 lecturas de nodos rotativos, como el loop del ETL
+        i = 0
+        while not detener.wait(periodo_s):
+            lote = [estados[(i + j) % len(estados)] for j in range(100)]
+            i += 100
+            cache.publicar(lote)
+            publicadas[cache.version] = time.time()
+
+    hilo = threading.Thread(target=publicador, daemon=True)
+    hilo.start()
+
+    print(f"{'modo':>10} {'req/s':>10} {'MB/s':>8} {'304':>6} {'p50_ms':>8} {'p99_ms':>8}")
+    for modo, con_etag in (('sin_etag', False), ('con_etag', True)):
+        cola_resultados = multiprocessing.Queue()
+        procesos = [multiprocessing.Process(target=_cliente_consulta,
+                                            args=(f"{base}/estado", con_etag, segundos, cola_resultados))
+                    for _ in range(clientes)]
+        for proceso in procesos:
+            proceso.start()
+        parciales = [cola_resultados.get() for _ in procesos]
+        for proceso in procesos:
+            proceso.join()
+        respuestas = sum(p[0] for p in parciales)
+        latencias = np.array([l for p in parciales for l in p[3]]) * 1000
+        print(f"{modo:>10} {respuestas / segundos:>10.0f} {sum(p[1] for p in parciales) / segundos / 1e6:>8.1f} "
+              f"{sum(p[2] for p in parciales) / respuestas:>6.0%} {np.percentile(latencias, 50):>8.2f} "
+              f"{np.percentile(latencias, 99):>8.2f}")
+
+    cola_resultados = multiprocessing.Queue()
+    procesos = [multiprocessing.Process(target=_cliente_sse,
+                                        args=(f"{base}/estado/eventos", segundos, cola_resultados))
+                for _ in range(clientes)]
+    for proceso in procesos:
+        proceso.start()
+    llegadas = [cola_resultados.get() for _ in procesos]
+    for proceso in procesos:
+        proceso.join()
+    detener.set()
+    demoras = np.array([(t - publicadas[v]) * 1000 for cliente in llegadas for v, t in cliente.items()
+                        if v in publicadas])
+    print(f"SSE con {clientes} clientes: {len(demoras)} eventos, "
+          f"p50 {np.percentile(demoras, 50):.2f} ms, p99 {np.percentile(demoras, 99):.2f} ms")
+    servidor.shutdown()
+
+
+def _pipe_drenado(bytes_por_s: float = 0):
+    """
+    Archivo de texto sin buffer sobre un pipe que otro hilo vacía, como stdout
+    en Docker con PYTHONUNBUFFERED. Con `bytes_por_s` el lector es lento (un
+    driver de logs atrasado) y el pipe se llena.
+    """
+    lectura, escritura = os.pipe()
+
+    def drenar():
+        while True:
+            bloque = os.read(lectura, 4096)
+            if not bloque:
+                break
+            if bytes_por_s:
+                time.sleep(len(bloque) / bytes_por_s)
+
+    hilo = threading.Thread(target=drenar, daemon=True)
+    hilo.start()
+    return open(escritura, 'w', buffering=1, encoding='utf-8'), hilo
+
+
+def benchmark_logs(mensajes: int, lector_kb_s: float):
+    """Costo por mensaje en el loop: prints actuales frente al logger JSON asíncrono"""
+    lecturas = list(_lecturas_intercaladas(100, mensajes // 100))
+    salida, hilo = _pipe_drenado(lector_kb_s * 1024)
+
+    def con_prints(medicion):
+        print(f"Procesando medición: {medicion['ts']}", file=salida)
+        print("¡ALERTA DETECTADA!", file=salida)
+        print(f"Medición procesada: {medicion['ts']}", file=salida)
+
+    log = registro.obtener('etl.benchmark')
+
+    # Mismas llamadas que el loop del ETL
+    def con_logger(medicion):
+        if log.isEnabledFor(logging.DEBUG) and registro.muestrear():
+            log.debug("Procesando medición", extra={"ts": medicion['ts']})
+        log.info("Alerta detectada", extra={"node_id": medicion['node_id'], "ts": medicion['ts']})
+        if log.isEnabledFor(logging.DEBUG) and registro.muestrear():
+            log.debug("Medición procesada", extra={"node_id": medicion['node_id'], "ts": medicion['ts']})
+
+    def sin_info(medicion):
+        if log.isEnabledFor(logging.DEBUG) and registro.muestrear():
+            log.debug("Procesando medición", extra={"ts": medicion['ts']})
+        log.debug("Alerta detectada", extra={"node_id": medicion['node_id'], "ts": medicion['ts']})
+
+    modos = [
+        ("prints", con_prints, None, 1),
+        ("logger_info", con_logger, logging.INFO, 1),
+        ("logger_debug_1/100", con_logger, logging.DEBUG, 100),
+        ("logger_debug_todo", con_logger, logging.DEBUG, 1),
+        ("logger_desactivado", sin_info, logging.INFO, 1),
+    ]
+    print(f"{'modo':>20} {'us/mensaje':>12} {'ms_vaciado':>12} {'descartados':>12}")
+    for nombre, funcion, nivel, muestreo in modos:
+        if nivel is not None:
+            registro.LOG_MUESTREO_DEBUG = muestreo
+            registro.configurar(salida)
+            log.setLevel(nivel)
+        inicio = time.perf_counter()
+        for medicion in lecturas:
+            funcion(medicion)
+        en_loop = time.perf_counter() - inicio
+        registro.detener()
+        vaciado = time.perf_counter() - inicio - en_loop
+        descartados = registro.descartados()
+        print(f"{nombre:>20} {en_loop / len(lecturas) * 1e6:>12.2f} {vaciado * 1000:>12.1f} {descartados:>12}")
+    salida.close()
+    hilo.join(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks del ETL")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+
+    p_nodos = subparsers.add_parser("nodos", help="Escalamiento del estado por nodo")
+    p_nodos.add_argument("--nodos", type=int, nargs="+", default=[10, 100, 500, 1000])
+    p_nodos.add_argument("--lecturas", type=int, default=50, help="Lecturas por nodo")
+
+    p_esc = subparsers.add_parser("escritor", help="Insert síncrono vs escritor por lotes")
+    p_esc.add_argument("--filas", type=int, default=2000)
+    p_esc.add_argument("--latencia-ms", type=float, default=30.0, help="Round-trip simulado por insert")
+    p_esc.add_argument("--lote", type=int, default=500)
+
+    p_al = subparsers.add_parser("alertas", help="Envío síncrono vs despachador de alertas")
+    p_al.add_argument("--lecturas", type=int, default=200)
+    p_al.add_argument("--latencia-ms", type=float, default=200.0, help="Latencia simulada del webhook")
+
+    p_agr = subparsers.add_parser("agregados", help="Consulta de gráficos largos: crudas vs agregados")
+    p_agr.add_argument("--dias", type=int, default=30)
+    p_agr.add_argument("--periodo", type=int, default=5, help="Segundos entre mediciones simuladas")
+
+    p_trab = subparsers.add_parser("trabajadores", help="Escalamiento con procesos particionados por nodo")
+    p_trab.add_argument("--trabajadores", type=int, nargs="+", default=[1, 2, 4, 8])
+    p_trab.add_argument("--nodos", type=int, default=64)
+    p_trab.add_argument("--lecturas", type=int, default=50, help="Lecturas por nodo")
+    p_trab.add_argument("--latencia-ms", type=float, default=5.0, help="Round-trip simulado por insert")
+
+    p_met = subparsers.add_parser("metricas", help="Sobrecosto de la instrumentación por lectura")
+    p_met.add_argument("--lecturas", type=int, default=20000)
+
+    p_ts = subparsers.add_parser("timestamps", help="CPU por mensaje parseando ts en cada etapa frente a ts_ms")
+    p_ts.add_argument("--lecturas", type=int, default=50000)
+
+    p_logs = subparsers.add_parser("logs", help="Sobrecosto por mensaje de prints frente al logger asíncrono")
+    p_logs.add_argument("--mensajes", type=int, default=20000)
+    p_logs.add_argument("--lector-kb-s", type=float, default=0,
+                        help="Velocidad del lector de stdout (0 = sin límite)")
+
+    p_reg = subparsers.add_parser("reglas", help="Motor de reglas por lectura y en lote frente a las reglas fijas")
+    p_reg.add_argument("--lecturas", type=int, default=1000000)
+
+    p_est = subparsers.add_parser("estado", help="API de estado por nodo: consultas con y sin ETag y eventos SSE")
+    p_est.add_argument("--nodos", type=int, default=1000)
+    p_est.add_argument("--clientes", type=int, default=8, help="Procesos cliente simultáneos")
+    p_est.add_argument("--segundos", type=float, default=5.0, help="Duración de cada modo")
+    p_est.add_argument("--periodo", type=float, default=0.5, help="Segundos entre lotes publicados")
+
+    args = parser.parse_args()
+    if args.comando == "nodos":
+        benchmark_nodos(args.nodos, args.lecturas)
+    elif args.comando == "escritor":
+        benchmark_escritor(args.filas, args.latencia_ms, args.lote)
+    elif args.comando == "alertas":
+        benchmark_alertas(args.lecturas, args.latencia_ms)
+    elif args.comando == "agregados":
+        benchmark_agregados(args.dias, args.periodo)
+    elif args.comando == "trabajadores":
+        benchmark_trabajadores(args.trabajadores, args.nodos, args.lecturas, args.latencia_ms)
+    elif args.comando == "metricas":
+        benchmark_metricas(args.lecturas)
+    elif args.comando == "logs":
+        benchmark_logs(args.mensajes, args.lector_kb_s)
+    elif args.comando == "timestamps":
+        benchmark_timestamps(args.lecturas)
+    elif args.comando == "reglas":
+        benchmark_reglas(args.lecturas)
+    elif args.comando == "estado":
+        benchmark_estado(args.nodos, args.clientes, args.segundos, args.periodo)
+
+
+if __name__ == '__main__':
+    main()
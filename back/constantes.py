@@ -0,0 +1,17 @@
+"""
+Datos fijos del modelo hidrológico, compartidos por el ETL (app.py) y el
+cálculo en lote (procesamiento_lote.py). Sin dependencias, para que el
+cálculo en lote y el replay de simulacion/ no necesiten supabase ni dotenv.
+"""
+
+# Configuración de datos fijos del río
+DATOS_RIO = {
+    "altura_inicial_m": 2595.4,  # cota aguas arriba
+    "altura_final_m": 2589.6,    # cota aguas abajo
+    "largo_rio_m": 3200          # longitud del tramo modelado
+}
+
+# Las métricas derivadas se calculan por nodo; solo hace falta conservar las
+# últimas mediciones que mira `persistencia`
+VENTANA_PERSISTENCIA = 10
+NODO_DESCONOCIDO = 'desconocido'
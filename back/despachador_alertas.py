@@ -0,0 +1,167 @@
+"""
+Despachador asíncrono de alertas hacia el webhook de n8n
+"""
+import heapq
+import itertools
+import queue
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metricas
+import registro
+
+log = registro.obtener('etl.alertas')
+
+# Orden de severidad de los niveles de alerta
+NIVELES_ALERTA = {"VERDE": 0, "AMARILLA": 1, "ROJA": 2}
+
+ALERTAS = metricas.contador(
+    'etl_alertas_total', 'Alertas por nivel y resultado (enviada, suprimida, descartada, fallida)',
+    ('nivel', 'resultado')
+)
+DURACION_WEBHOOK = metricas.histograma(
+    'etl_webhook_segundos', 'Duración de cada POST al webhook de alertas', ('resultado',)
+)
+
+
+class DespachadorAlertas:
+    """
+    Envía alertas al webhook desde un pool de hilos con una sesión HTTP
+    compartida, de modo que el loop del ETL nunca espera la respuesta.
+
+    Por nodo solo se notifica cuando el nivel escala (VERDE→AMARILLA→ROJA) o
+    cuando se mantiene igual y ya pasó `cooldown_s` desde el último envío; los
+    descensos solo actualizan el estado. Los envíos fallidos se reintentan con
+    backoff exponencial desde una cola de reintentos acotada.
+
+    Una alerta que no llega al webhook (cola llena o reintentos agotados) no
+    cuenta como enviada: el nodo vuelve al estado anterior, para que la
+    siguiente lectura en ese nivel la intente de nuevo en lugar de suprimirla.
+    """
+
+    def __init__(self, url: str,
+                 trabajadores: int = 2,
+                 cooldown_s: float = 600.0,
+                 max_pendientes: int = 100,
+                 max_intentos: int = 3,
+                 backoff_base_s: float = 2.0,
+                 timeout_s: float = 10.0):
+        self.url = url
+        self.cooldown_s = cooldown_s
+        self.max_pendientes = max_pendientes
+        self.max_intentos = max_intentos
+        self.backoff_base_s = backoff_base_s
+        self.timeout_s = timeout_s
+
+        self.session = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=trabajadores)
+        self.session.mount('http://', adaptador)
+        self.session.mount('https://', adaptador)
+
+        # node_id -> (nivel actual, instante del último envío)
+        self._estado: Dict[str, Tuple[int, float]] = {}
+        self._lock = threading.Lock()
+        self._pendientes: queue.Queue = queue.Queue(maxsize=max_pendientes)
+        self._reintentos: list = []  # heap de (vence, secuencia, tarea)
+        self._secuencia = itertools.count()
+        self._detener = threading.Event()
+        self._hilos = [
+            threading.Thread(target=self._trabajador, name=f"alertas-{i}", daemon=True)
+            for i in range(trabajadores)
+        ]
+
+        self.enviadas = 0
+        self.suprimidas = 0
+        self.descartadas = 0
+        self.fallidas = 0
+
+    def iniciar(self):
+        for hilo in self._hilos:
+            hilo.start()
+
+    def detener(self, timeout: Optional[float] = None):
+        self._detener.set()
+        for hilo in self._hilos:
+            hilo.join(timeout)
+
+    def notificar(self, node_id: str, color: str) -> bool:
+        """
+        Registra el nivel actual del nodo y encola el envío si corresponde.
+        Nunca bloquea; retorna True si la alerta quedó encolada.
+        """
+        nivel = NIVELES_ALERTA[color]
+        ahora = time.monotonic()
+
+        with self._lock:
+            nivel_previo, ultimo_envio = self._estado.get(node_id, (0, float('-inf')))
+            escala = nivel > nivel_previo
+            repite = nivel == nivel_previo and ahora - ultimo_envio >= self.cooldown_s
+            if nivel == 0 or not (escala or repite):
+                if nivel > 0:
+                    self.suprimidas += 1
+                    ALERTAS.inc((color, 'suprimida'))
+                self._estado[node_id] = (nivel, ultimo_envio)
+                return False
+
+            # El estado se registra solo si la alerta entra en la cola; la
+            # tarea lleva el anterior para restaurarlo si el envío falla
+            previo = (nivel_previo, ultimo_envio)
+            try:
+                self._pendientes.put_nowait(
+                    ({"nivel_alerta": color, "node_id": node_id}, 0, previo, (nivel, ahora)))
+            except queue.Full:
+                self.descartadas += 1
+                ALERTAS.inc((color, 'descartada'))
+                log.warning("Cola de alertas llena, se descarta alerta",
+                            extra={"nivel_alerta": color, "node_id": node_id})
+                return False
+            self._estado[node_id] = (nivel, ahora)
+            return True
+
+    def _siguiente(self):
+        with self._lock:
+            if self._reintentos and self._reintentos[0][0] <= time.monotonic():
+                return heapq.heappop(self._reintentos)[2]
+        try:
+            return self._pendientes.get(timeout=0.5)
+        except queue.Empty:
+            return None
+
+    def _trabajador(self):
+        while not self._detener.is_set():
+            tarea = self._siguiente()
+            if tarea:
+                self._enviar(*tarea)
+
+    def _enviar(self, payload: Dict, intentos: int, previo: Tuple[int, float], registrado: Tuple[int, float]):
+        inicio = time.perf_counter()
+        try:
+            response = self.session.post(self.url, json=payload, timeout=self.timeout_s)
+            if response.status_code in [200, 201, 202]:
+                DURACION_WEBHOOK.observar(time.perf_counter() - inicio, ('ok',))
+                self.enviadas += 1
+                ALERTAS.inc((payload["nivel_alerta"], 'enviada'))
+                log.info("Alerta enviada", extra=payload)
+                return
+            DURACION_WEBHOOK.observar(time.perf_counter() - inicio, ('error',))
+            log.warning("Error enviando alerta", extra={**payload, "status": response.status_code, "respuesta": response.text})
+        except Exception as e:
+            DURACION_WEBHOOK.observar(time.perf_counter() - inicio, ('error',))
+            log.warning("Error enviando alerta", extra={**payload, "error": str(e)})
+
+        intentos += 1
+        with self._lock:
+            if intentos >= self.max_intentos or len(self._reintentos) >= self.max_pendientes:
+                self.fallidas += 1
+                ALERTAS.inc((payload["nivel_alerta"], 'fallida'))
+                # Salvo que otra lectura ya lo haya cambiado
+                if self._estado.get(payload["node_id"]) == registrado:
+                    self._estado[payload["node_id"]] = previo
+                return
+            vence = time.monotonic() + self.backoff_base_s * (2 ** (intentos - 1))
+            heapq.heappush(self._reintentos,
+                           (vence, next(self._secuencia), (payload, intentos, previo, registrado)))
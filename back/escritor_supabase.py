@@ -0,0 +1,323 @@
+"""
+Escritor en segundo plano para Supabase: agrupa filas, reintenta y usa un
+buffer en disco cuando la base de datos no está disponible
+"""
+import json
+import os
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import metricas
+import registro
+
+log = registro.obtener('etl.escritor')
+
+DURACION_SUPABASE = metricas.histograma(
+    'etl_supabase_segundos', 'Duración de cada insert/upsert a Supabase', ('tabla', 'resultado')
+)
+FILAS_SPOOL = metricas.contador('etl_filas_spool_total', 'Filas desviadas al spool en disco')
+FILAS_DESCARTADAS = metricas.contador(
+    'etl_filas_descartadas_total', 'Filas rechazadas por Supabase y apartadas en el archivo de descartes', ('tabla',)
+)
+
+# Errores de PostgREST que no dependen de la disponibilidad de la base y no
+# se arreglan reintentando: datos inválidos (22), restricciones (23) y
+# columnas o tablas inexistentes (42), o un 4xx sin cuerpo JSON. Quedan
+# fuera la autenticación (42501, 401/403), el timeout (408) y el 429.
+CLASES_SQL_PERMANENTES = ('22', '23', '42')
+ESTADOS_HTTP_TEMPORALES = (401, 403, 408, 429)
+
+
+def es_permanente(error: Exception) -> bool:
+    """True si Supabase rechazó el lote por su contenido (APIError de postgrest-py)"""
+    codigo = getattr(error, 'code', None)
+    if isinstance(codigo, int) or (isinstance(codigo, str) and len(codigo) == 3 and codigo.isdigit()):
+        # postgrest-py pone el estado HTTP en `code` cuando la respuesta no es
+        # JSON; los SQLSTATE tienen 5 caracteres
+        return 400 <= int(codigo) < 500 and int(codigo) not in ESTADOS_HTTP_TEMPORALES
+    if not isinstance(codigo, str):
+        return False
+    if codigo.startswith(('PGRST1', 'PGRST2')):  # petición o esquema inválidos (4xx)
+        return True
+    return codigo[:2] in CLASES_SQL_PERMANENTES and codigo != '42501'
+
+
+class EscritorSupabase:
+    """
+    Acumula filas en memoria y las inserta en Supabase con inserts de varias
+    filas, cuando el lote llega a `tamano_lote` o pasan `intervalo_s` segundos.
+
+    Cada inserción se reintenta con backoff exponencial; si todos los intentos
+    fallan el lote se agrega a un archivo JSONL local (spool) que se reenvía,
+    en orden, antes de cualquier lote nuevo en cuanto la base vuelve a
+    responder. Una fila se considera persistida cuando quedó en Supabase o en
+    el spool; en ese momento se llama a `al_persistir` con los `ack_id` del lote.
+
+    Si Supabase rechaza un lote por su contenido (ver `es_permanente`) no se
+    reintenta: se parte en mitades hasta aislar las filas inválidas, que se
+    apartan en `ruta_descartes` con el error, y el resto se escribe. Así una
+    fila mala no bloquea el spool ni todo lo que llega detrás.
+    Mientras el spool no se pueda reenviar, los lotes nuevos van directo al
+    disco y el reenvío se reintenta cada `espera_spool_s` segundos, para no
+    frenar el procesamiento durante una caída larga. Un error inesperado no
+    detiene el hilo: se registra y el lote queda sin confirmar.
+
+    Por defecto las filas van a `tabla`; `encolar` admite otra tabla, y las
+    tablas listadas en `conflictos` se escriben con upsert sobre esa clave.
+
+    `supabase` puede ser cualquier objeto con la API `table(...).insert(...).execute()`,
+    lo que permite probarlo con un cliente falso.
+    """
+
+    def __init__(self, supabase, tabla: str,
+                 tamano_lote: int = 500,
+                 intervalo_s: float = 1.0,
+                 ruta_spool: str = 'spool_supabase.jsonl',
+                 ruta_descartes: str = 'descartes_supabase.jsonl',
+                 max_reintentos: int = 4,
+                 backoff_base_s: float = 0.5,
+                 espera_spool_s: float = 10.0,
+                 conflictos: Optional[Dict[str, str]] = None,
+                 al_persistir: Optional[Callable[[List], None]] = None):
+        self.supabase = supabase
+        self.tabla = tabla
+        self.tamano_lote = tamano_lote
+        self.intervalo_s = intervalo_s
+        self.ruta_spool = ruta_spool
+        self.ruta_descartes = ruta_descartes
+        self.max_reintentos = max_reintentos
+        self.backoff_base_s = backoff_base_s
+        self.espera_spool_s = espera_spool_s
+        self.conflictos = conflictos or {}
+        self.al_persistir = al_persistir
+
+        # Acotada para aplicar contrapresión al loop principal si la base se atrasa
+        self._pendientes: queue.Queue = queue.Queue(maxsize=tamano_lote * 10)
+        self._detener = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+        self._proximo_reenvio = 0.0
+
+        self.filas_escritas = 0
+        self.filas_en_spool = 0
+        self.filas_descartadas = 0
+        self.errores = 0
+
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self._loop, name="escritor-supabase", daemon=True)
+        self._hilo.start()
+
+    def detener(self, timeout: Optional[float] = None):
+        """Vacía lo pendiente y detiene el hilo"""
+        self._detener.set()
+        if self._hilo:
+            self._hilo.join(timeout)
+
+    def encolar(self, fila: Dict, ack_id=None, tabla: Optional[str] = None):
+        self._pendientes.put((tabla or self.tabla, fila, ack_id))
+
+    def _loop(self):
+        while not (self._detener.is_set() and self._pendientes.empty()):
+            lote = self._tomar_lote()
+            try:
+                if lote:
+                    self._escribir(lote)
+                elif os.path.exists(self.ruta_spool):
+                    self._reenviar_spool()
+            except Exception:
+                # Si el hilo muere, `encolar` se bloquea para siempre con la cola
+                # llena. El lote no se confirma: la cola lo vuelve a entregar al
+                # vencer el arriendo.
+                self.errores += 1
+                self._proximo_reenvio = time.monotonic() + self.espera_spool_s
+                log.exception("Error inesperado en el escritor, lote sin confirmar",
+                              extra={"filas": len(lote)})
+
+        # Último intento de vaciar el spool antes de salir; si falla queda en disco
+        if os.path.exists(self.ruta_spool):
+            self._proximo_reenvio = 0.0
+            try:
+                self._reenviar_spool()
+            except Exception:
+                log.exception("Error reenviando el spool al detener", extra={"spool": self.ruta_spool})
+
+    def _tomar_lote(self) -> List[tuple]:
+        lote = []
+        limite = time.monotonic() + self.intervalo_s
+        while len(lote) < self.tamano_lote:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                lote.append(self._pendientes.get(timeout=restante))
+            except queue.Empty:
+                break
+        return lote
+
+    def _insertar(self, tabla: str, filas: List[Dict]) -> List[Dict]:
+        """Escribe `filas` y retorna las que quedaron pendientes por un error temporal"""
+        conflicto = self.conflictos.get(tabla)
+        if conflicto:
+            # Un upsert no puede tocar dos veces la misma fila: queda la última versión
+            claves = conflicto.split(',')
+            filas = list({tuple(fila[c] for c in claves): fila for fila in filas}.values())
+        return self._insertar_partiendo(tabla, filas, conflicto)
+
+    def _insertar_partiendo(self, tabla: str, filas: List[Dict], conflicto: Optional[str]) -> List[Dict]:
+        error = self._ejecutar(tabla, filas, conflicto)
+        if error is None:
+            self.filas_escritas += len(filas)
+            return []
+        if not es_permanente(error):
+            return filas
+        if len(filas) == 1:
+            self._descartar(tabla, filas[0], error)
+            return []
+        # Si una mitad queda pendiente, la otra va detrás para conservar el orden
+        mitad = len(filas) // 2
+        pendientes = self._insertar_partiendo(tabla, filas[:mitad], conflicto)
+        if pendientes:
+            return pendientes + filas[mitad:]
+        return self._insertar_partiendo(tabla, filas[mitad:], conflicto)
+
+    def _ejecutar(self, tabla: str, filas: List[Dict], conflicto: Optional[str]) -> Optional[Exception]:
+        """Un insert/upsert con reintentos; retorna None si se escribió o el último error"""
+        error = None
+        for intento in range(self.max_reintentos):
+            inicio = time.perf_counter()
+            try:
+                if conflicto:
+                    self.supabase.table(tabla).upsert(filas, on_conflict=conflicto).execute()
+                else:
+                    self.supabase.table(tabla).insert(filas).execute()
+                DURACION_SUPABASE.observar(time.perf_counter() - inicio, (tabla, 'ok'))
+                return None
+            except Exception as e:
+                error = e
+                self.errores += 1
+                if es_permanente(e):
+                    DURACION_SUPABASE.observar(time.perf_counter() - inicio, (tabla, 'rechazado'))
+                    log.warning("Supabase rechazó el lote",
+                                extra={"tabla": tabla, "filas": len(filas), "error": str(e)})
+                    return e
+                DURACION_SUPABASE.observar(time.perf_counter() - inicio, (tabla, 'error'))
+                log.warning("Error insertando lote en Supabase",
+                            extra={"tabla": tabla, "intento": intento + 1, "error": str(e)})
+                if intento + 1 < self.max_reintentos:
+                    time.sleep(self.backoff_base_s * (2 ** intento))
+        return error
+
+    def _descartar(self, tabla: str, fila: Dict, error: Exception):
+        with open(self.ruta_descartes, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({"tabla": tabla, "fila": fila, "error": str(error)}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.filas_descartadas += 1
+        FILAS_DESCARTADAS.inc((tabla,))
+        log.error("Fila rechazada por Supabase, apartada en descartes",
+                  extra={"tabla": tabla, "node_id": fila.get('node_id'), "ts": fila.get('ts'),
+                         "descartes": self.ruta_descartes, "error": str(error)})
+
+    def _escribir(self, lote: List[tuple]):
+        por_tabla: Dict[str, List[Dict]] = {}
+        for tabla, fila, _ in lote:
+            por_tabla.setdefault(tabla, []).append(fila)
+
+        # El spool contiene filas más antiguas: mientras no se vacíe, lo nuevo va detrás
+        if os.path.exists(self.ruta_spool) and not self._reenviar_spool():
+            self._guardar_spool([(tabla, fila) for tabla, fila, _ in lote])
+        else:
+            for tabla, filas in por_tabla.items():
+                pendientes = self._insertar(tabla, filas)
+                if pendientes:
+                    self._guardar_spool([(tabla, fila) for fila in pendientes])
+                    self._proximo_reenvio = time.monotonic() + self.espera_spool_s
+                else:
+                    log.info("Lote guardado en Supabase", extra={"tabla": tabla, "filas": len(filas)})
+
+        if self.al_persistir:
+            ids = [ack_id for _, _, ack_id in lote if ack_id is not None]
+            if ids:
+                self.al_persistir(ids)
+
+    def _guardar_spool(self, filas: List[tuple]):
+        with open(self.ruta_spool, 'a+b') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell():
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    # Una escritura interrumpida dejó media línea: lo nuevo empieza en otra
+                    f.write(b'\n')
+            f.write(''.join(json.dumps({"tabla": tabla, "fila": fila}) + '\n'
+                            for tabla, fila in filas).encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+        self.filas_en_spool += len(filas)
+        FILAS_SPOOL.inc(valor=len(filas))
+        log.warning("Supabase no disponible, filas guardadas en spool",
+                    extra={"filas": len(filas), "spool": self.ruta_spool})
+
+    def _reenviar_spool(self) -> bool:
+        """Reenvía el spool en orden; retorna True si quedó vacío"""
+        if time.monotonic() < self._proximo_reenvio:
+            return False
+
+        filas = self._leer_spool()
+
+        inicio = 0
+        while inicio < len(filas):
+            # Tramos consecutivos de la misma tabla, en el orden original
+            tabla = filas[inicio][0]
+            fin = inicio
+            while fin < len(filas) and fin - inicio < self.tamano_lote and filas[fin][0] == tabla:
+                fin += 1
+            pendientes = self._insertar(tabla, [fila for _, fila in filas[inicio:fin]])
+            if pendientes:
+                # Conservar solo lo que falta por enviar
+                self._reescribir_spool([(tabla, fila) for fila in pendientes] + filas[fin:])
+                self._proximo_reenvio = time.monotonic() + self.espera_spool_s
+                return False
+            inicio = fin
+
+        os.remove(self.ruta_spool)
+        self.filas_en_spool = 0
+        log.info("Spool reenviado a Supabase", extra={"filas": len(filas)})
+        return True
+
+    def _leer_spool(self) -> List[tuple]:
+        """
+        Las filas del spool en orden. Las líneas ilegibles (por ejemplo la
+        última a medio escribir si el proceso murió) se apartan en
+        `<ruta_spool>.corrupto` en lugar de frenar el reenvío.
+        """
+        filas, corruptas = [], []
+        with open(self.ruta_spool, encoding='utf-8', errors='replace') as f:
+            for linea in f:
+                if not linea.strip():
+                    continue
+                try:
+                    registro = json.loads(linea)
+                    filas.append((registro['tabla'], registro['fila']))
+                except (ValueError, TypeError, KeyError):
+                    corruptas.append(linea if linea.endswith('\n') else linea + '\n')
+        if corruptas:
+            with open(self.ruta_spool + '.corrupto', 'a', encoding='utf-8') as f:
+                f.writelines(corruptas)
+                f.flush()
+                os.fsync(f.fileno())
+            # Sin ellas, para no apartarlas de nuevo en el próximo reenvío
+            self._reescribir_spool(filas)
+            log.error("Líneas ilegibles en el spool, apartadas",
+                      extra={"lineas": len(corruptas), "corrupto": self.ruta_spool + '.corrupto'})
+        return filas
+
+    def _reescribir_spool(self, filas: List[tuple]):
+        temporal = self.ruta_spool + '.tmp'
+        with open(temporal, 'w', encoding='utf-8') as f:
+            for tabla, fila in filas:
+                f.write(json.dumps({"tabla": tabla, "fila": fila}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporal, self.ruta_spool)
+        self.filas_en_spool = len(filas)
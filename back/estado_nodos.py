@@ -0,0 +1,275 @@
+"""
+Caché local del último estado por nodo, servida por HTTP al dashboard.
+
+El ETL publica aquí cada lote procesado y el dashboard lee los niveles
+actuales de esta API en vez de Supabase, que queda para el histórico; así el
+pico de visitas durante una crecida no cae sobre la base justo entonces.
+
+    GET /estado              último resultado de cada nodo
+    GET /estado/<node_id>    último resultado y ventana de lecturas recientes
+    GET /estado/eventos      SSE: un evento por lote con los nodos que cambiaron
+    GET /metrics             métricas del proceso que sirve la caché (el
+                             supervisor, con varios trabajadores)
+
+Las respuestas llevan ETag y contestan 304 a If-None-Match. El JSON de cada
+versión se arma una sola vez y lo comparten todos los clientes, igual que el
+evento SSE de cada lote. Un cliente SSE que reconecta con Last-Event-ID recibe
+solo lo que cambió desde entonces (todo, si la caché se reinició).
+"""
+import json
+import threading
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import unquote
+
+import metricas
+
+# Campos de cada lectura en la ventana reciente de un nodo
+CAMPOS_VENTANA = ('ts', 'nivel_m', 'lluvia_mm', 'ror', 'nivel_alerta')
+
+RESPUESTAS = metricas.contador(
+    'etl_estado_respuestas_total', 'Respuestas de la API de estado por ruta y código', ('ruta', 'codigo')
+)
+CLIENTES_SSE = metricas.medidor('etl_estado_clientes_sse', 'Clientes conectados a /estado/eventos')
+
+
+def _json(valor) -> bytes:
+    return json.dumps(valor, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class CacheEstado:
+    """
+    Último resultado y las `ventana` lecturas más recientes de cada nodo.
+
+    `publicar` avanza la versión una vez por lote y despierta a los clientes
+    SSE. Los nodos se guardan en orden de última actualización, así los
+    cambios desde una versión se recorren desde el final sin mirar el resto.
+    Los resultados publicados no se modifican después: se serializan fuera
+    del lock.
+    """
+
+    def __init__(self, ventana: int = 60):
+        self.ventana = ventana
+        self.instancia = uuid.uuid4().hex[:8]  # distingue las versiones de otro arranque
+        self.version = 0
+        self._nodos: Dict[str, Tuple[int, dict]] = {}  # node_id -> (versión, último resultado)
+        self._ventanas: Dict[str, deque] = {}
+        self._cuerpo: Tuple[int, bytes] = (-1, b'')
+        self._cuerpos_nodo: Dict[str, Tuple[int, bytes]] = {}
+        self._evento: Tuple[int, int, bytes] = (-1, -1, b'')  # (desde, versión, evento SSE)
+        self._cambio = threading.Condition()
+
+    def etag(self, version: int) -> str:
+        return f'"{self.instancia}-{version}"'
+
+    def publicar(self, resultados: List[dict]):
+        if not resultados:
+            return
+        with self._cambio:
+            self.version += 1
+            version = self.version
+            for resultado in resultados:
+                node_id = resultado['node_id']
+                self._nodos.pop(node_id, None)
+                self._nodos[node_id] = (version, resultado)
+                ventana = self._ventanas.get(node_id)
+                if ventana is None:
+                    ventana = self._ventanas[node_id] = deque(maxlen=self.ventana)
+                ventana.append(tuple(resultado.get(campo) for campo in CAMPOS_VENTANA))
+            self._cambio.notify_all()
+
+    def estado(self, etag_cliente: str = '') -> Tuple[str, Optional[bytes]]:
+        """ETag y JSON de todos los nodos; cuerpo None si el cliente ya tiene esa versión"""
+        with self._cambio:
+            version = self.version
+            etag = self.etag(version)
+            if _coincide(etag_cliente, etag):
+                return etag, None
+            if self._cuerpo[0] == version:
+                return etag, self._cuerpo[1]
+            nodos = {node_id: resultado for node_id, (_, resultado) in self._nodos.items()}
+        cuerpo = _json({"version": version, "nodos": nodos})
+        with self._cambio:
+            if self._cuerpo[0] < version:
+                self._cuerpo = (version, cuerpo)
+        return etag, cuerpo
+
+    def nodo(self, node_id: str, etag_cliente: str = '') -> Tuple[Optional[str], Optional[bytes]]:
+        """Como `estado` para un nodo, con su ventana; (None, None) si el nodo no existe"""
+        with self._cambio:
+            actual = self._nodos.get(node_id)
+            if actual is None:
+                return None, None
+            version, resultado = actual
+            etag = self.etag(version)
+            if _coincide(etag_cliente, etag):
+                return etag, None
+            guardado = self._cuerpos_nodo.get(node_id)
+            if guardado is not None and guardado[0] == version:
+                return etag, guardado[1]
+            ventana = list(self._ventanas[node_id])
+        cuerpo = _json({"version": version, "node_id": node_id, "ultimo": resultado,
+                        "ventana": [dict(zip(CAMPOS_VENTANA, lectura)) for lectura in ventana]})
+        with self._cambio:
+            guardado = self._cuerpos_nodo.get(node_id)
+            if guardado is None or guardado[0] < version:
+                self._cuerpos_nodo[node_id] = (version, cuerpo)
+        return etag, cuerpo
+
+    def evento(self, desde: int) -> Tuple[int, Optional[bytes]]:
+        """
+        Versión actual y evento SSE con los nodos actualizados después de
+        `desde` (None si no hay ninguno). Los clientes al día piden el mismo
+        `desde`, así que el evento se serializa una vez por lote.
+        """
+        with self._cambio:
+            version = self.version
+            if version <= desde:
+                return version, None
+            if self._evento[:2] == (desde, version):
+                return version, self._evento[2]
+            cambios = {}
+            for node_id, (version_nodo, resultado) in reversed(self._nodos.items()):
+                if version_nodo <= desde:
+                    break
+                cambios[node_id] = resultado
+        datos = _json({"version": version, "completo": desde == 0, "nodos": cambios})
+        evento = b"id: " + f"{self.instancia}-{version}".encode() + b"\nevent: estado\ndata: " + datos + b"\n\n"
+        with self._cambio:
+            if self._evento[1] <= version:
+                self._evento = (desde, version, evento)
+        return version, evento
+
+    def esperar(self, version: int, timeout: float) -> bool:
+        """Espera hasta que haya una versión posterior a `version`; False si vence el timeout"""
+        with self._cambio:
+            return self._cambio.wait_for(lambda: self.version > version, timeout)
+
+    def version_cliente(self, last_event_id: str) -> int:
+        """Versión desde la que retomar un Last-Event-ID; 0 (todo) si es de otro arranque"""
+        instancia, _, version = (last_event_id or '').partition('-')
+        if instancia != self.instancia or not version.isdigit():
+            return 0
+        return min(int(version), self.version)
+
+
+def _coincide(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidatos = [valor.strip() for valor in if_none_match.split(',')]
+    return '*' in candidatos or etag in candidatos or f'W/{etag}' in candidatos
+
+
+def servir(cache: CacheEstado, puerto: int, host: str = "0.0.0.0", max_clientes_sse: int = 200,
+           origen_cors: str = '*', keepalive_s: float = 15.0) -> ThreadingHTTPServer:
+    """Expone la caché en un hilo de fondo, como metricas.servir"""
+    clientes = [0]
+    lock_clientes = threading.Lock()
+
+    class Manejador(BaseHTTPRequestHandler):
+        # Keep-alive para los clientes que consultan con ETag cada pocos segundos
+        protocol_version = "HTTP/1.1"
+
+        def _cabeceras_comunes(self):
+            if origen_cors:
+                self.send_header('Access-Control-Allow-Origin', origen_cors)
+                self.send_header('Access-Control-Expose-Headers', 'ETag')
+
+        def _responder(self, ruta: str, etag: Optional[str], cuerpo: Optional[bytes]):
+            codigo = 304 if cuerpo is None else 200
+            self.send_response(codigo)
+            self._cabeceras_comunes()
+            self.send_header('ETag', etag)
+            # Que el navegador revalide siempre: con ETag la respuesta es 304 sin cuerpo
+            self.send_header('Cache-Control', 'no-cache')
+            if cuerpo is None:
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            else:
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(cuerpo)))
+                self.end_headers()
+                self.wfile.write(cuerpo)
+            RESPUESTAS.inc((ruta, str(codigo)))
+
+        def do_OPTIONS(self):
+            # Preflight de CORS cuando el dashboard manda If-None-Match o Last-Event-ID a mano
+            self.send_response(204)
+            self._cabeceras_comunes()
+            self.send_header('Access-Control-Allow-Methods', 'GET')
+            self.send_header('Access-Control-Allow-Headers', 'If-None-Match, Last-Event-ID')
+            self.send_header('Access-Control-Max-Age', '86400')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def do_GET(self):
+            ruta = self.path.split('?')[0].rstrip('/')
+            if ruta == '/estado':
+                etag, cuerpo = cache.estado(self.headers.get('If-None-Match', ''))
+                self._responder('estado', etag, cuerpo)
+            elif ruta == '/estado/eventos':
+                self._eventos()
+            elif ruta == '/metrics':
+                cuerpo = metricas.exponer().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', metricas.TIPO_CONTENIDO)
+                self.send_header('Content-Length', str(len(cuerpo)))
+                self.end_headers()
+                self.wfile.write(cuerpo)
+            elif ruta.startswith('/estado/'):
+                etag, cuerpo = cache.nodo(unquote(ruta[len('/estado/'):]), self.headers.get('If-None-Match', ''))
+                if etag is None:
+                    RESPUESTAS.inc(('nodo', '404'))
+                    self.send_error(404, "Nodo sin lecturas")
+                    return
+                self._responder('nodo', etag, cuerpo)
+            else:
+                self.send_error(404)
+
+        def _eventos(self):
+            with lock_clientes:
+                if clientes[0] >= max_clientes_sse:
+                    RESPUESTAS.inc(('eventos', '503'))
+                    self.send_error(503, "Demasiados clientes SSE")
+                    return
+                clientes[0] += 1
+                CLIENTES_SSE.fijar(clientes[0])
+            try:
+                self.send_response(200)
+                self._cabeceras_comunes()
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Cache-Control', 'no-cache')
+                self.send_header('X-Accel-Buffering', 'no')  # que un proxy no retenga los eventos
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                RESPUESTAS.inc(('eventos', '200'))
+                self.close_connection = True
+
+                # Reconectar a los 3 s si se corta
+                self.wfile.write(b"retry: 3000\n\n")
+                desde = cache.version_cliente(self.headers.get('Last-Event-ID', ''))
+                while True:
+                    desde, evento = cache.evento(desde)
+                    if evento is not None:
+                        self.wfile.write(evento)
+                        self.wfile.flush()
+                    if not cache.esperar(desde, keepalive_s):
+                        # Comentario SSE: mantiene viva la conexión a través de proxies
+                        self.wfile.write(b": ping\n\n")
+                        self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                with lock_clientes:
+                    clientes[0] -= 1
+                    CLIENTES_SSE.fijar(clientes[0])
+
+        def log_message(self, *args):
+            pass
+
+    servidor = ThreadingHTTPServer((host, puerto), Manejador)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name="estado", daemon=True).start()
+    return servidor
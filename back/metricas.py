@@ -0,0 +1,192 @@
+"""
+Métricas en formato de texto de Prometheus, sin dependencias externas.
+
+Este archivo está duplicado en cola/, back/ y simulacion/ porque cada servicio
+se construye con su propio contexto de Docker; simulacion/tests/test_copias.py
+falla si las copias difieren.
+
+Uso:
+    RECIBIDOS = metricas.contador('cola_mensajes_total', 'Mensajes recibidos', ('node_id',))
+    RECIBIDOS.inc(('N01',))
+    metricas.exponer()  # texto para /metrics
+"""
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Límites en segundos para latencias de red y de extremo a extremo
+LIMITES_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_metricas: List["_Metrica"] = []
+_registro_lock = threading.Lock()
+
+
+def _escapar(valor) -> str:
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _formato(valor: float) -> str:
+    if valor == float('inf'):
+        return '+Inf'
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class _Metrica:
+    tipo = ""
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Sequence[str] = ()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._lock = threading.Lock()
+
+    def _selector(self, valores: Tuple, extra: str = "") -> str:
+        pares = [f'{nombre}="{_escapar(valor)}"' for nombre, valor in zip(self.etiquetas, valores)]
+        if extra:
+            pares.append(extra)
+        return "{" + ",".join(pares) + "}" if pares else ""
+
+    def muestras(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Contador(_Metrica):
+    """Valor que solo crece; la tasa (p. ej. paquetes/s) se obtiene con rate() en Prometheus"""
+    tipo = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._valores: Dict[Tuple, float] = {}
+
+    def inc(self, etiquetas: Tuple = (), valor: float = 1):
+        with self._lock:
+            self._valores[etiquetas] = self._valores.get(etiquetas, 0) + valor
+
+    def valores(self) -> Dict[Tuple, float]:
+        """Copia de los valores actuales por etiquetas"""
+        with self._lock:
+            return dict(self._valores)
+
+    def muestras(self) -> List[str]:
+        with self._lock:
+            valores = list(self._valores.items())
+        if not valores and not self.etiquetas:
+            valores = [((), 0)]
+        return [f"{self.nombre}{self._selector(e)} {_formato(v)}" for e, v in valores]
+
+
+class Medidor(_Metrica):
+    """Valor instantáneo; con `funcion` se calcula recién al exponer (p. ej. profundidad de la cola)"""
+    tipo = "gauge"
+
+    def __init__(self, *args, funcion: Optional[Callable[[], float]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.funcion = funcion
+        self._valores: Dict[Tuple, float] = {}
+
+    def fijar(self, valor: float, etiquetas: Tuple = ()):
+        self._valores[etiquetas] = valor
+
+    def muestras(self) -> List[str]:
+        if self.funcion is not None:
+            return [f"{self.nombre} {_formato(self.funcion())}"]
+        return [f"{self.nombre}{self._selector(e)} {_formato(v)}" for e, v in list(self._valores.items())]
+
+
+class Histograma(_Metrica):
+    """Distribución en buckets acumulados, con suma y conteo"""
+    tipo = "histogram"
+
+    def __init__(self, *args, limites: Sequence[float] = LIMITES_LATENCIA, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.limites = tuple(sorted(limites))
+        # etiquetas -> [conteos por bucket (último = +Inf), suma]
+        self._series: Dict[Tuple, list] = {}
+
+    def observar(self, valor: float, etiquetas: Tuple = ()):
+        self.observar_varios((valor,), etiquetas)
+
+    def observar_varios(self, valores: Sequence[float], etiquetas: Tuple = ()):
+        """Registra varias observaciones tomando el lock una sola vez (p. ej. un lote)"""
+        with self._lock:
+            serie = self._series.get(etiquetas)
+            if serie is None:
+                serie = self._series[etiquetas] = [[0] * (len(self.limites) + 1), 0.0]
+            conteos = serie[0]
+            for valor in valores:
+                conteos[bisect.bisect_left(self.limites, valor)] += 1
+                serie[1] += valor
+
+    def muestras(self) -> List[str]:
+        with self._lock:
+            series = [(e, list(conteos), suma) for e, (conteos, suma) in self._series.items()]
+        lineas = []
+        for etiquetas, conteos, suma in series:
+            acumulado = 0
+            for limite, conteo in zip(self.limites + (float('inf'),), conteos):
+                acumulado += conteo
+                selector = self._selector(etiquetas, f'le="{_formato(limite)}"')
+                lineas.append(f"{self.nombre}_bucket{selector} {acumulado}")
+            lineas.append(f"{self.nombre}_sum{self._selector(etiquetas)} {_formato(suma)}")
+            lineas.append(f"{self.nombre}_count{self._selector(etiquetas)} {acumulado}")
+        return lineas
+
+
+def _registrar(metrica):
+    with _registro_lock:
+        _metricas.append(metrica)
+    return metrica
+
+
+def contador(nombre: str, ayuda: str, etiquetas: Sequence[str] = ()) -> Contador:
+    return _registrar(Contador(nombre, ayuda, etiquetas))
+
+
+def medidor(nombre: str, ayuda: str, etiquetas: Sequence[str] = (),
+            funcion: Optional[Callable[[], float]] = None) -> Medidor:
+    return _registrar(Medidor(nombre, ayuda, etiquetas, funcion=funcion))
+
+
+def histograma(nombre: str, ayuda: str, etiquetas: Sequence[str] = (),
+               limites: Sequence[float] = LIMITES_LATENCIA) -> Histograma:
+    return _registrar(Histograma(nombre, ayuda, etiquetas, limites=limites))
+
+
+def exponer(tipos: Optional[Sequence[str]] = None) -> str:
+    """Las métricas registradas en formato de texto 0.0.4 de Prometheus; con `tipos`, solo las de esos tipos"""
+    with _registro_lock:
+        metricas = [m for m in _metricas if tipos is None or m.tipo in tipos]
+    lineas = []
+    for metrica in metricas:
+        lineas.append(f"# HELP {metrica.nombre} {metrica.ayuda}")
+        lineas.append(f"# TYPE {metrica.nombre} {metrica.tipo}")
+        lineas.extend(metrica.muestras())
+    return "\n".join(lineas) + "\n"
+
+
+TIPO_CONTENIDO = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def servir(puerto: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Expone /metrics en un hilo de fondo para procesos que no son servidores web"""
+
+    class Manejador(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            cuerpo = exponer().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', TIPO_CONTENIDO)
+            self.send_header('Content-Length', str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+        def log_message(self, *args):
+            pass
+
+    servidor = ThreadingHTTPServer((host, puerto), Manejador)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name="metricas", daemon=True).start()
+    return servidor
@@ -0,0 +1,207 @@
+"""
+Cálculo vectorizado de las métricas hidrológicas sobre históricos completos.
+
+Produce exactamente los mismos valores que `HidrologiaProcessor.procesar_medicion`
+aplicado fila por fila en el mismo orden, pero en una sola pasada con NumPy.
+
+Uso (backfill desde un export de `mediciones_hidrologicas`):
+    python procesamiento_lote.py export.csv --salida recalculado.csv
+    python procesamiento_lote.py export.parquet --salida recalculado.parquet
+    python procesamiento_lote.py export.csv --supabase   # upsert por id
+"""
+import argparse
+import csv
+import os
+from datetime import datetime, timezone
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+from constantes import DATOS_RIO, NODO_DESCONOCIDO, VENTANA_PERSISTENCIA
+
+COLUMNAS_DERIVADAS = [
+    'base_level', 'delta_h', 'ror', 'intensidad_lluvia',
+    'proyeccion_30min', 'pendiente_hidraulica', 'persistencia'
+]
+
+
+def epoch_us(ts) -> np.ndarray:
+    """Convierte timestamps ISO 8601 (o datetime64) a microsegundos epoch int64, parseando cada uno una vez"""
+    ts = np.asarray(ts)
+    if np.issubdtype(ts.dtype, np.datetime64):
+        return ts.astype('datetime64[us]').astype(np.int64)
+    if np.issubdtype(ts.dtype, np.integer):
+        return ts.astype(np.int64)
+
+    origen = datetime(1970, 1, 1, tzinfo=timezone.utc)
+    resultado = np.empty(len(ts), dtype=np.int64)
+    for i, valor in enumerate(ts):
+        fecha = datetime.fromisoformat(str(valor).replace('Z', '+00:00'))
+        if fecha.tzinfo is None:
+            fecha = fecha.replace(tzinfo=timezone.utc)
+        delta = fecha - origen
+        resultado[i] = (delta.days * 86400 + delta.seconds) * 10**6 + delta.microseconds
+    return resultado
+
+
+def procesar_columnas(ts, nivel_m, lluvia_mm, node_id: Optional[Sequence] = None,
+                      umbral_alerta: float = 0.5) -> Dict[str, np.ndarray]:
+    """
+    Calcula las métricas derivadas para columnas de mediciones en orden de
+    llegada. Cada fila se compara con la fila anterior del mismo nodo, igual
+    que el procesador en streaming. Los valores que en streaming son None
+    (primera medición del nodo o delta de tiempo <= 0) quedan como NaN.
+    """
+    # En milisegundos, como `epoch_ms` del procesador en streaming
+    t_ms = epoch_us(ts) // 1000
+    nivel = np.asarray(nivel_m, dtype=np.float64)
+    lluvia = np.asarray(lluvia_mm, dtype=np.float64)
+    n = len(nivel)
+
+    # Agrupar por nodo conservando el orden de llegada dentro de cada uno
+    if node_id is None:
+        orden = np.arange(n)
+        nuevo_nodo = np.zeros(n, dtype=bool)
+    else:
+        nodos = np.asarray([NODO_DESCONOCIDO if v is None else str(v) for v in node_id])
+        orden = np.argsort(nodos, kind='stable')
+        nodos_ordenados = nodos[orden]
+        nuevo_nodo = np.empty(n, dtype=bool)
+        nuevo_nodo[1:] = nodos_ordenados[1:] != nodos_ordenados[:-1]
+    if n:
+        nuevo_nodo[0] = True
+
+    t_o = t_ms[orden]
+    nivel_o = nivel[orden]
+    lluvia_o = lluvia[orden]
+
+    # Mismas operaciones que rate_of_rise (ms / 1000 / 3600) para obtener resultados idénticos
+    delta_horas = np.full(n, np.nan)
+    delta_horas[1:] = (t_o[1:] - t_o[:-1]) / 10**3 / 3600
+    delta_horas[nuevo_nodo] = np.nan
+    valido = delta_horas > 0
+
+    ror_o = np.full(n, np.nan)
+    ror_o[1:] = np.where(valido[1:], (nivel_o[1:] - nivel_o[:-1]) / np.where(valido[1:], delta_horas[1:], 1), np.nan)
+    intensidad_o = np.where(valido, lluvia_o / np.where(valido, delta_horas, 1), np.nan)
+
+    # Persistencia: racha de mediciones consecutivas del nodo sobre el umbral,
+    # acotada a la actual más las últimas VENTANA_PERSISTENCIA
+    sobre = nivel_o > umbral_alerta
+    indices = np.arange(n)
+    ultimo_bajo = np.maximum.accumulate(np.where(~sobre, indices, -1)) if n else indices
+    inicio_nodo = np.maximum.accumulate(np.where(nuevo_nodo, indices, 0)) if n else indices
+    racha = np.where(sobre, indices - np.maximum(ultimo_bajo + 1, inicio_nodo) + 1, 0)
+    persistencia_o = np.minimum(racha, VENTANA_PERSISTENCIA + 1)
+
+    # Volver al orden de llegada
+    inverso = np.empty(n, dtype=np.int64)
+    inverso[orden] = np.arange(n)
+    ror = ror_o[inverso]
+
+    return {
+        'base_level': nivel.copy(),
+        'delta_h': nivel - DATOS_RIO["altura_inicial_m"],
+        'ror': ror,
+        'intensidad_lluvia': intensidad_o[inverso],
+        'proyeccion_30min': nivel + (ror * 0.5),
+        'pendiente_hidraulica': ((DATOS_RIO["altura_inicial_m"] + nivel) - DATOS_RIO["altura_final_m"])
+                                / DATOS_RIO["largo_rio_m"],
+        'persistencia': persistencia_o[inverso].astype(np.int64),
+    }
+
+
+def procesar_tabla(tabla, umbral_alerta: float = 0.5) -> Dict[str, np.ndarray]:
+    """Igual que `procesar_columnas` para un DataFrame o un dict de columnas con ts, nivel_m, lluvia_mm y opcionalmente node_id"""
+    node_id = tabla['node_id'] if 'node_id' in tabla else None
+    return procesar_columnas(tabla['ts'], tabla['nivel_m'], tabla['lluvia_mm'], node_id, umbral_alerta)
+
+
+def leer_export(ruta: str) -> Dict[str, list]:
+    if ruta.endswith('.parquet'):
+        try:
+            import pandas as pd
+        except ImportError:
+            raise SystemExit("Leer Parquet requiere pandas y pyarrow (pip install pandas pyarrow)")
+        df = pd.read_parquet(ruta)
+        return {columna: df[columna].tolist() for columna in df.columns}
+
+    with open(ruta, newline='', encoding='utf-8') as f:
+        filas = list(csv.DictReader(f))
+    columnas = {columna: [fila[columna] for fila in filas] for columna in (filas[0].keys() if filas else [])}
+    for columna in ('nivel_m', 'lluvia_mm'):
+        columnas[columna] = [float(valor) for valor in columnas.get(columna, [])]
+    if 'node_id' in columnas:
+        columnas['node_id'] = [valor or None for valor in columnas['node_id']]
+    return columnas
+
+
+def _filas_resultado(columnas: Dict[str, list], derivadas: Dict[str, np.ndarray]):
+    for i in range(len(columnas['ts'])):
+        fila = {columna: valores[i] for columna, valores in columnas.items()}
+        for columna in COLUMNAS_DERIVADAS:
+            valor = derivadas[columna][i].item()
+            fila[columna] = None if isinstance(valor, float) and np.isnan(valor) else valor
+        yield fila
+
+
+def _escribir_salida(ruta: str, filas: list):
+    if ruta.endswith('.parquet'):
+        import pandas as pd
+        pd.DataFrame(filas).to_parquet(ruta, index=False)
+        return
+    with open(ruta, 'w', newline='', encoding='utf-8') as f:
+        escritor = csv.DictWriter(f, fieldnames=list(filas[0].keys()) if filas else [])
+        escritor.writeheader()
+        escritor.writerows(filas)
+
+
+def _subir_supabase(filas: list, tamano_lote: int = 1000):
+    from app import SUPABASE_KEY, SUPABASE_URL, TABLE_NAME, HidrologiaProcessor, create_client
+
+    if 'id' not in filas[0]:
+        raise SystemExit("El export debe incluir la columna id para actualizar las filas existentes")
+
+    supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+    processor = HidrologiaProcessor(supabase)
+    procesado_en = datetime.utcnow().isoformat() + "Z"
+    for inicio in range(0, len(filas), tamano_lote):
+        lote = [
+            {"id": int(fila['id']), **processor.fila_supabase({"node_id": None, **fila, "procesado_en": procesado_en})}
+            for fila in filas[inicio:inicio + tamano_lote]
+        ]
+        supabase.table(TABLE_NAME).upsert(lote).execute()
+        print(f"Backfill: {inicio + len(lote)}/{len(filas)} filas actualizadas")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recalcula métricas hidrológicas sobre un export histórico")
+    parser.add_argument("entrada", help="Export CSV o Parquet con ts, nivel_m, lluvia_mm y opcionalmente node_id e id")
+    parser.add_argument("--salida", help="Archivo CSV o Parquet con las columnas recalculadas")
+    parser.add_argument("--supabase", action="store_true", help="Actualiza las filas en Supabase por id")
+    args = parser.parse_args()
+
+    columnas = leer_export(args.entrada)
+    if not columnas or not columnas.get('ts'):
+        raise SystemExit(f"{args.entrada} no contiene mediciones")
+
+    # Reproducir el orden de llegada: por id si el export lo trae, si no por ts
+    if 'id' in columnas:
+        orden = np.argsort(np.asarray(columnas['id'], dtype=np.int64), kind='stable')
+    else:
+        orden = np.argsort(epoch_us(columnas['ts']), kind='stable')
+    columnas = {columna: [valores[i] for i in orden] for columna, valores in columnas.items()}
+
+    derivadas = procesar_tabla(columnas)
+    filas = list(_filas_resultado(columnas, derivadas))
+    print(f"Métricas recalculadas para {len(filas)} mediciones")
+
+    if args.salida:
+        _escribir_salida(args.salida, filas)
+        print(f"Resultado escrito en {os.path.abspath(args.salida)}")
+    if args.supabase:
+        _subir_supabase(filas)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+"""
+Motor de reglas de alerta, compartido por el ETL y el gateway.
+
+Este archivo está duplicado en back/ y simulacion/ porque cada servicio se
+construye con su propio contexto de Docker; simulacion/tests/test_copias.py
+falla si las copias difieren.
+
+Las reglas se leen del JSON indicado en `REGLAS_ALERTA` (o de CONFIG_DEFECTO),
+con un conjunto por servicio:
+
+    {"etl": {"reglas": [...], "factores": [...], "niveles": [...], "nivel_base": "VERDE"},
+     "gateway": {...}}
+
+- Regla: `nombre`, `campo`, `operador` (>, >=, <, <=) y `umbral`. Opcionales:
+  `peso` (se suma al puntaje si se cumple), `nivel` (nivel mínimo que impone)
+  y `salida`: si el nivel anterior ya era el de la regla o uno más alto, la
+  regla sigue cumplida mientras el campo pase `salida` (histéresis).
+- Factor: `campo` y `peso`, y opcionalmente `maximo`; suma
+  peso * min(campo, maximo) al puntaje.
+- Niveles: de menor a mayor gravedad, cada uno con un `puntaje` mínimo
+  opcional. El nivel resultante es el más alto entre el del puntaje y el de
+  las reglas cumplidas.
+
+Un campo ausente o None (NaN en lote) no cumple ninguna regla y vale 0 en los
+factores. `Motor` compila el conjunto una sola vez; `evaluar` recibe una
+lectura y `evaluar_lote` columnas de NumPy.
+
+    motor = reglas.motor('etl')
+    motor.evaluar({'nivel_m': 0.7, 'ror': 0.05, 'persistencia': 4})
+    # Resultado(reglas=('nivel_critico', 'persistencia_alta'), puntaje=0.72, nivel='AMARILLA')
+"""
+import copy
+import json
+import operator
+import os
+from typing import Dict, NamedTuple, Optional, Sequence, Tuple
+
+REGLAS_ALERTA = os.getenv('REGLAS_ALERTA', '')
+
+OPERADORES = {'>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le}
+
+# Reproduce las decisiones anteriores al motor: evaluar_alerta y nivel_alerta
+# del ETL, y el detector del gateway (TH_ALERTA 0.55, TH_PRECAUCION 0.45,
+# pendiente 0.007 m/s, histéresis 0.03 m y mitad de la pendiente). Las
+# salidas se calculan como las calculaba el detector: 0.45 - 0.03 no es 0.42
+# en punto flotante, y un promedio de exactamente 0.42 debe bajar a NORMAL.
+CONFIG_DEFECTO = {
+    "etl": {
+        "reglas": [
+            {"nombre": "nivel_critico", "campo": "nivel_m", "operador": ">", "umbral": 0.5},
+            {"nombre": "proyeccion_critica", "campo": "proyeccion_30min", "operador": ">", "umbral": 0.6,
+             "peso": 0.1},
+            {"nombre": "ror_alto", "campo": "ror", "operador": ">", "umbral": 0.1},
+            {"nombre": "persistencia_alta", "campo": "persistencia", "operador": ">=", "umbral": 3},
+        ],
+        "factores": [
+            {"campo": "nivel_m", "peso": 0.6},
+            {"campo": "ror", "peso": 2.0, "maximo": 0.2},
+            {"campo": "persistencia", "peso": 0.05},
+        ],
+        "niveles": [{"nombre": "AMARILLA", "puntaje": 0.6}, {"nombre": "ROJA", "puntaje": 0.9}],
+        "nivel_base": "VERDE",
+    },
+    "gateway": {
+        "reglas": [
+            {"nombre": "promedio_alerta", "campo": "promedio", "operador": ">=", "umbral": 0.55, "salida": 0.55 - 0.03,
+             "nivel": "ALERTA"},
+            {"nombre": "pendiente_alerta", "campo": "pendiente", "operador": ">=", "umbral": 0.007, "salida": 0.007 / 2,
+             "nivel": "ALERTA"},
+            {"nombre": "promedio_precaucion", "campo": "promedio", "operador": ">=", "umbral": 0.45,
+             "salida": 0.45 - 0.03, "nivel": "PRECAUCION"},
+        ],
+        "niveles": [{"nombre": "PRECAUCION"}, {"nombre": "ALERTA"}],
+        "nivel_base": "NORMAL",
+    },
+}
+
+
+class Resultado(NamedTuple):
+    reglas: Tuple[str, ...]  # reglas cumplidas, en el orden de la configuración
+    puntaje: float
+    nivel: str
+
+
+class ResultadoLote(NamedTuple):
+    reglas: Dict[str, object]  # nombre -> máscara booleana
+    puntaje: object            # ndarray float64
+    nivel: object              # ndarray con el índice en Motor.niveles
+
+
+class Motor:
+    """
+    Conjunto de reglas compilado: campos, operadores y umbrales se resuelven
+    una vez en tuplas que `evaluar` y `nivel` recorren por lectura. Un
+    conjunto mal formado lanza ValueError al compilarse, no al evaluar la
+    primera lectura.
+    """
+
+    def __init__(self, conjunto: dict):
+        self.niveles: Tuple[str, ...] = (conjunto.get('nivel_base', 'NORMAL'),) + tuple(
+            nivel['nombre'] for nivel in conjunto.get('niveles', ())
+        )
+        rangos = {nombre: rango for rango, nombre in enumerate(self.niveles)}
+        if len(rangos) != len(self.niveles):
+            raise ValueError(f"Niveles repetidos: {self.niveles}")
+
+        reglas = []
+        for regla in conjunto.get('reglas', ()):
+            nombre = regla.get('nombre')
+            operador = regla.get('operador')
+            if operador not in OPERADORES:
+                raise ValueError(f"Regla {nombre}: operador inválido {operador!r}")
+            if 'campo' not in regla or 'umbral' not in regla:
+                raise ValueError(f"Regla {nombre}: faltan 'campo' o 'umbral'")
+            nivel = regla.get('nivel')
+            if nivel is not None and nivel not in rangos:
+                raise ValueError(f"Regla {nombre}: nivel desconocido {nivel!r}")
+            salida = regla.get('salida')
+            if salida is not None and nivel is None:
+                raise ValueError(f"Regla {nombre}: 'salida' requiere 'nivel'")
+            reglas.append((nombre, regla['campo'], operador, regla['umbral'], salida, float(regla.get('peso', 0)),
+                           rangos.get(nivel, 0)))
+        self._reglas = tuple(reglas)
+        self._factores = tuple(
+            (factor['campo'], float(factor['peso']), factor.get('maximo')) for factor in conjunto.get('factores', ())
+        )
+        # (puntaje mínimo, rango) de mayor a menor gravedad
+        self._cortes = tuple(sorted(
+            ((nivel['puntaje'], rangos[nivel['nombre']]) for nivel in conjunto.get('niveles', ()) if 'puntaje' in nivel),
+            key=lambda corte: corte[1], reverse=True
+        ))
+        self._evaluar, self._nivel = self._generar(rangos)
+
+    def _generar(self, rangos: Dict[str, int]):
+        """
+        Arma `evaluar` y `nivel` como clausuras sobre las reglas ya resueltas:
+        (nombre, campo, función del operador, umbral, salida, peso, rango). Por
+        lectura no se consulta la configuración ni OPERADORES, y no se genera
+        ni ejecuta código a partir de ella.
+        """
+        niveles = self.niveles
+        factores = self._factores
+        cortes = self._cortes
+        reglas = tuple(
+            (nombre, campo, OPERADORES[operador], umbral, salida, peso, rango)
+            for nombre, campo, operador, umbral, salida, peso, rango in self._reglas
+        )
+        con_salida = any(salida is not None for _, _, _, _, salida, _, _ in reglas)
+
+        def evaluar(lectura, previo):
+            get = lectura.get
+            rango_previo = rangos.get(previo, 0) if con_salida and previo else 0
+            puntaje = 0.0
+            for campo, peso, maximo in factores:
+                v = get(campo) or 0
+                if maximo is not None and v > maximo:
+                    v = maximo
+                puntaje += v * peso
+            cumplidas = []
+            rango = 0
+            for nombre, campo, cumple, umbral, salida, peso, rango_regla in reglas:
+                v = get(campo)
+                if v is not None and (cumple(v, umbral) or (
+                        salida is not None and rango_previo >= rango_regla and cumple(v, salida))):
+                    cumplidas.append(nombre)
+                    if peso:
+                        puntaje += peso
+                    if rango < rango_regla:
+                        rango = rango_regla
+            # El primer corte que aplica, de mayor a menor gravedad
+            for minimo, rango_corte in cortes:
+                if rango < rango_corte and puntaje >= minimo:
+                    rango = rango_corte
+                    break
+            return Resultado(tuple(cumplidas), puntaje, niveles[rango])
+
+        if cortes:
+            def nivel(lectura, previo):
+                return evaluar(lectura, previo).nivel
+            return evaluar, nivel
+
+        # Sin cortes por puntaje, el nivel es el de la primera regla cumplida
+        # recorriendo de mayor a menor gravedad
+        por_gravedad = tuple(
+            (campo, cumple, umbral, salida, rango)
+            for rango in range(len(niveles) - 1, 0, -1)
+            for _, campo, cumple, umbral, salida, _, rango_regla in reglas if rango_regla == rango
+        )
+
+        def nivel(lectura, previo):
+            get = lectura.get
+            rango_previo = rangos.get(previo, 0) if con_salida and previo else 0
+            for campo, cumple, umbral, salida, rango in por_gravedad:
+                v = get(campo)
+                if v is not None and (cumple(v, umbral) or (
+                        salida is not None and rango_previo >= rango and cumple(v, salida))):
+                    return niveles[rango]
+            return niveles[0]
+
+        return evaluar, nivel
+
+    def evaluar(self, lectura: dict, previo: Optional[str] = None) -> Resultado:
+        """Evalúa una lectura; `previo` es el nivel anterior de su nodo, para las reglas con `salida`"""
+        return self._evaluar(lectura, previo)
+
+    def nivel(self, lectura: dict, previo: Optional[str] = None) -> str:
+        """Solo el nivel, sin armar Resultado; para el camino por lectura del gateway"""
+        return self._nivel(lectura, previo)
+
+    def evaluar_lote(self, columnas: Dict[str, Sequence]) -> ResultadoLote:
+        """
+        Evalúa columnas alineadas (listas o arrays, None/NaN = ausente). Las
+        reglas con `salida` dependen del nivel anterior de cada nodo, así que
+        en lote se evalúan solo contra `umbral`.
+        """
+        import numpy as np
+
+        arrays = {}
+
+        def columna(campo):
+            if campo not in arrays:
+                arrays[campo] = np.asarray(columnas[campo], dtype=np.float64)
+            return arrays[campo]
+
+        n = len(next(iter(columnas.values()))) if columnas else 0
+        puntaje = np.zeros(n)
+        for campo, peso, maximo in self._factores:
+            valor = np.nan_to_num(columna(campo))
+            if maximo is not None:
+                valor = np.minimum(valor, maximo)
+            puntaje += valor * peso
+
+        cumplidas = {}
+        rango = np.zeros(n, dtype=np.int8)
+        with np.errstate(invalid='ignore'):
+            for nombre, campo, operador, umbral, _, peso, rango_regla in self._reglas:
+                cumple = OPERADORES[operador](columna(campo), umbral)
+                cumplidas[nombre] = cumple
+                if peso:
+                    puntaje += np.where(cumple, peso, 0.0)
+                if rango_regla:
+                    rango[cumple & (rango < rango_regla)] = rango_regla
+        for minimo, rango_corte in self._cortes:
+            rango[(puntaje >= minimo) & (rango < rango_corte)] = rango_corte
+        return ResultadoLote(cumplidas, puntaje, rango)
+
+
+def cargar(ruta: str = REGLAS_ALERTA) -> dict:
+    """Configuración del JSON en `ruta`; los conjuntos que no trae se toman de CONFIG_DEFECTO"""
+    config = copy.deepcopy(CONFIG_DEFECTO)
+    if ruta:
+        with open(ruta, encoding='utf-8') as f:
+            config.update(json.load(f))
+    return config
+
+
+def motor(conjunto: str, ruta: str = REGLAS_ALERTA) -> Motor:
+    return Motor(cargar(ruta)[conjunto])
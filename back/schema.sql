@@ -3,6 +3,7 @@
 
 CREATE TABLE IF NOT EXISTS mediciones_hidrologicas (
     id BIGSERIAL PRIMARY KEY,
+    node_id TEXT,
     ts TIMESTAMPTZ NOT NULL,
     nivel_m DECIMAL(10, 2) NOT NULL,
     lluvia_mm DECIMAL(10, 2) NOT NULL,
@@ -17,9 +18,38 @@ CREATE TABLE IF NOT EXISTS mediciones_hidrologicas (
     created_at TIMESTAMPTZ DEFAULT NOW()
 );
 
+-- Para tablas creadas antes de registrar el nodo de origen
+ALTER TABLE mediciones_hidrologicas ADD COLUMN IF NOT EXISTS node_id TEXT;
+
 -- Índice para búsquedas por timestamp
 CREATE INDEX IF NOT EXISTS idx_mediciones_ts ON mediciones_hidrologicas(ts);
 
 -- Índice para búsquedas por fecha de procesamiento
 CREATE INDEX IF NOT EXISTS idx_mediciones_procesado ON mediciones_hidrologicas(procesado_en);
 
+
+-- Índice para las consultas por nodo y rango de tiempo del dashboard
+CREATE INDEX IF NOT EXISTS idx_mediciones_nodo_ts ON mediciones_hidrologicas(node_id, ts);
+
+-- Agregados por nodo que mantiene el ETL (ver back/agregados.py). Cada fila
+-- resume un bucket que empieza en `ts`; el dashboard consulta la resolución
+-- adecuada según la ventana de tiempo en lugar de las mediciones crudas.
+CREATE TABLE IF NOT EXISTS mediciones_1min (
+    node_id TEXT NOT NULL,
+    ts TIMESTAMPTZ NOT NULL,
+    muestras INTEGER NOT NULL,
+    nivel_min DECIMAL(10, 2),
+    nivel_max DECIMAL(10, 2),
+    nivel_mean DECIMAL(10, 4),
+    nivel_last DECIMAL(10, 2),
+    lluvia_sum DECIMAL(12, 2),
+    ror_max DECIMAL(10, 4),
+    PRIMARY KEY (node_id, ts)
+);
+
+CREATE TABLE IF NOT EXISTS mediciones_15min (LIKE mediciones_1min INCLUDING ALL);
+CREATE TABLE IF NOT EXISTS mediciones_1h (LIKE mediciones_1min INCLUDING ALL);
+
+CREATE INDEX IF NOT EXISTS idx_mediciones_1min_ts ON mediciones_1min(ts);
+CREATE INDEX IF NOT EXISTS idx_mediciones_15min_ts ON mediciones_15min(ts);
+CREATE INDEX IF NOT EXISTS idx_mediciones_1h_ts ON mediciones_1h(ts);
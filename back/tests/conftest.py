@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Los módulos del servicio se importan por nombre, como dentro del contenedor
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
@@ -0,0 +1,199 @@
+"""
+DespachadorAlertas contra un webhook local: deduplicación por nivel,
+vencimiento del cooldown, reintentos con backoff desde el heap y
+`notificar` sin bloquear aunque el webhook no responda.
+"""
+import json
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import despachador_alertas
+from despachador_alertas import DespachadorAlertas
+
+
+class Webhook(ThreadingHTTPServer):
+    """Guarda cada cuerpo recibido y responde con los estados de `respuestas` (200 al agotarse)"""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _Manejador)
+        self.recibidas = []
+        self.respuestas = []
+        self.liberar = threading.Event()
+        self.liberar.set()
+        self.en_curso = threading.Event()
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}/webhook'
+
+
+class _Manejador(BaseHTTPRequestHandler):
+    def do_POST(self):
+        cuerpo = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.en_curso.set()
+        self.server.liberar.wait(5)
+        self.server.recibidas.append((cuerpo['node_id'], cuerpo['nivel_alerta']))
+        estado = self.server.respuestas.pop(0) if self.server.respuestas else 200
+        self.send_response(estado)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class Reloj:
+    def __init__(self):
+        self.ahora = 1000.0
+
+    def monotonic(self) -> float:
+        return self.ahora
+
+    def avanzar(self, segundos: float):
+        self.ahora += segundos
+
+
+@pytest.fixture
+def webhook():
+    servidor = Webhook()
+    hilo = threading.Thread(target=servidor.serve_forever, args=(0.05,), daemon=True)
+    hilo.start()
+    yield servidor
+    servidor.liberar.set()
+    servidor.shutdown()
+    servidor.server_close()
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    reloj = Reloj()
+    monkeypatch.setattr(despachador_alertas, 'time',
+                        types.SimpleNamespace(monotonic=reloj.monotonic, perf_counter=time.perf_counter))
+    return reloj
+
+
+@pytest.fixture
+def crear(webhook):
+    creados = []
+
+    def crear(**opciones):
+        despachador = DespachadorAlertas(webhook.url, **{'trabajadores': 1, 'timeout_s': 5, **opciones})
+        despachador.iniciar()
+        creados.append(despachador)
+        return despachador
+
+    yield crear
+    for despachador in creados:
+        despachador.detener(2)
+
+
+def _esperar(condicion, limite_s: float = 3.0):
+    fin = time.monotonic() + limite_s
+    while not condicion():
+        assert time.monotonic() < fin, 'no se cumplió a tiempo'
+        time.sleep(0.01)
+
+
+def test_deduplica_por_nivel(crear, webhook, reloj):
+    despachador = crear()
+    notificados = [despachador.notificar(node_id, color) for node_id, color in [
+        ('N1', 'AMARILLA'), ('N1', 'AMARILLA'),  # repetida dentro del cooldown
+        ('N1', 'ROJA'), ('N1', 'ROJA'), ('N1', 'AMARILLA'),  # el descenso solo actualiza
+        ('N2', 'AMARILLA'),  # cada nodo por separado
+        ('N1', 'VERDE'), ('N1', 'AMARILLA'),  # después de VERDE vuelve a escalar
+    ]]
+    assert notificados == [True, False, True, False, False, True, False, True]
+    _esperar(lambda: len(webhook.recibidas) == 4)
+    assert webhook.recibidas == [('N1', 'AMARILLA'), ('N1', 'ROJA'), ('N2', 'AMARILLA'), ('N1', 'AMARILLA')]
+    assert despachador.suprimidas == 3
+
+
+def test_repite_al_vencer_el_cooldown(crear, webhook, reloj):
+    despachador = crear(cooldown_s=600)
+    assert despachador.notificar('N1', 'ROJA')
+    reloj.avanzar(599)
+    assert not despachador.notificar('N1', 'ROJA')
+    reloj.avanzar(1)
+    assert despachador.notificar('N1', 'ROJA')
+    # El cooldown cuenta desde el último envío, no desde la última lectura
+    reloj.avanzar(599)
+    assert not despachador.notificar('N1', 'ROJA')
+    _esperar(lambda: despachador.enviadas == 2)
+    assert webhook.recibidas == [('N1', 'ROJA')] * 2
+
+
+def test_reintenta_con_backoff(crear, webhook, reloj):
+    webhook.respuestas = [500, 503]
+    despachador = crear(max_intentos=3, backoff_base_s=10)
+    despachador.notificar('N1', 'ROJA')
+
+    _esperar(lambda: len(despachador._reintentos) == 1)
+    assert despachador._reintentos[0][0] == reloj.ahora + 10
+    reloj.avanzar(9)
+    time.sleep(0.6)
+    assert len(webhook.recibidas) == 1
+
+    reloj.avanzar(1)
+    # El segundo fallo espera el doble
+    _esperar(lambda: len(webhook.recibidas) == 2 and despachador._reintentos)
+    assert despachador._reintentos[0][0] == reloj.ahora + 20
+    reloj.avanzar(20)
+    _esperar(lambda: despachador.enviadas == 1)
+    assert webhook.recibidas == [('N1', 'ROJA')] * 3
+    assert despachador.fallidas == 0 and not despachador._reintentos
+
+
+def test_reintentos_agotados_restauran_el_estado(crear, webhook, reloj):
+    webhook.respuestas = [500, 500]
+    despachador = crear(max_intentos=2, backoff_base_s=10)
+    despachador.notificar('N1', 'ROJA')
+    _esperar(lambda: despachador._reintentos)
+    # Mientras se reintenta, la misma alerta se suprime
+    assert not despachador.notificar('N1', 'ROJA')
+    reloj.avanzar(10)
+    _esperar(lambda: despachador.fallidas == 1)
+
+    # Nunca llegó: la siguiente lectura en ROJA se envía sin esperar el cooldown
+    assert despachador.notificar('N1', 'ROJA')
+    _esperar(lambda: despachador.enviadas == 1)
+    assert len(webhook.recibidas) == 3
+
+
+def test_falla_sin_pisar_un_estado_mas_nuevo(crear, webhook, reloj):
+    webhook.respuestas = [500]
+    despachador = crear(max_intentos=1)
+    webhook.liberar.clear()
+    despachador.notificar('N1', 'AMARILLA')
+    webhook.en_curso.wait(2)
+    # Escala mientras el primer envío sigue en curso; el fallo de AMARILLA no la deshace
+    assert despachador.notificar('N1', 'ROJA')
+    webhook.liberar.set()
+    _esperar(lambda: despachador.fallidas == 1 and despachador.enviadas == 1)
+    assert not despachador.notificar('N1', 'ROJA')
+
+
+def test_notificar_no_bloquea(crear, webhook, reloj):
+    webhook.liberar.clear()
+    despachador = crear(max_pendientes=2)
+    assert despachador.notificar('N0', 'ROJA')
+    webhook.en_curso.wait(2)
+
+    # El único trabajador espera al webhook: caben dos más y el resto se descarta
+    inicio = time.perf_counter()
+    notificados = [despachador.notificar(f'N{i}', 'ROJA') for i in range(1, 6)]
+    assert time.perf_counter() - inicio < 0.5
+    assert notificados == [True, True, False, False, False]
+    assert despachador.descartadas == 3
+
+    webhook.liberar.set()
+    _esperar(lambda: despachador.enviadas == 3)
+    # Las descartadas no quedaron registradas como enviadas
+    assert despachador.notificar('N3', 'ROJA')
+    _esperar(lambda: despachador.enviadas == 4)
+    assert sorted(webhook.recibidas) == [('N0', 'ROJA'), ('N1', 'ROJA'), ('N2', 'ROJA'), ('N3', 'ROJA')]
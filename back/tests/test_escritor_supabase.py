@@ -0,0 +1,222 @@
+"""
+EscritorSupabase con un cliente falso: lotes por tamaño y por tiempo, spool
+ante una caída y reenvío en orden, clasificación de errores permanentes,
+partición del lote hasta aislar las filas inválidas y confirmación solo de
+lo persistido.
+"""
+import json
+import os
+import time
+
+import pytest
+
+from escritor_supabase import EscritorSupabase, es_permanente
+
+
+class APIError(Exception):
+    """Como postgrest.exceptions.APIError: el SQLSTATE o el estado HTTP en `code`"""
+
+    def __init__(self, code):
+        super().__init__(f'error {code}')
+        self.code = code
+
+
+class ClienteFalso:
+    """`table(...).insert(...).execute()`; `caido` simula la base sin responder"""
+
+    def __init__(self):
+        self.caido = False
+        self.filas = []
+        self.llamadas = []
+
+    def table(self, tabla):
+        return _Consulta(self, tabla)
+
+
+class _Consulta:
+    def __init__(self, cliente, tabla):
+        self.cliente, self.tabla, self.filas = cliente, tabla, None
+
+    def insert(self, filas):
+        self.filas = filas
+        return self
+
+    def upsert(self, filas, on_conflict):
+        self.filas = filas
+        return self
+
+    def execute(self):
+        self.cliente.llamadas.append((self.tabla, len(self.filas)))
+        if self.cliente.caido:
+            raise ConnectionError('sin conexión')
+        if any(fila.get('invalida') for fila in self.filas):
+            raise APIError('23502')
+        self.cliente.filas.extend((self.tabla, fila['i']) for fila in self.filas)
+
+
+@pytest.fixture
+def cliente():
+    return ClienteFalso()
+
+
+@pytest.fixture
+def crear(cliente, tmp_path):
+    confirmados = []
+
+    def crear(**opciones):
+        opciones = {'tamano_lote': 100, 'intervalo_s': 0.05, 'max_reintentos': 2, 'backoff_base_s': 0,
+                    'espera_spool_s': 0, 'ruta_spool': str(tmp_path / 'spool.jsonl'),
+                    'ruta_descartes': str(tmp_path / 'descartes.jsonl'), 'al_persistir': confirmados.extend,
+                    **opciones}
+        escritor = EscritorSupabase(cliente, 'mediciones', **opciones)
+        escritor.confirmados = confirmados
+        return escritor
+
+    return crear
+
+
+def _lote(desde: int, hasta: int, tabla: str = 'mediciones') -> list:
+    return [(tabla, {'i': i}, i) for i in range(desde, hasta)]
+
+
+def _esperar(condicion, limite_s: float = 2.0):
+    fin = time.monotonic() + limite_s
+    while not condicion():
+        assert time.monotonic() < fin, 'no se cumplió a tiempo'
+        time.sleep(0.01)
+
+
+def test_lotes_por_tamano(crear, cliente):
+    escritor = crear(tamano_lote=3)
+    for i in range(7):
+        escritor.encolar({'i': i}, ack_id=i)
+    escritor.iniciar()
+    escritor.detener(2)
+    assert cliente.llamadas == [('mediciones', 3), ('mediciones', 3), ('mediciones', 1)]
+    assert [i for _, i in cliente.filas] == list(range(7))
+    assert escritor.confirmados == list(range(7))
+
+
+def test_lote_por_tiempo(crear, cliente):
+    escritor = crear(intervalo_s=0.1)
+    escritor.iniciar()
+    escritor.encolar({'i': 0}, ack_id=0)
+    escritor.encolar({'i': 1}, ack_id=1)
+    # Sin llegar a tamano_lote, se escribe al vencer el intervalo
+    _esperar(lambda: cliente.filas)
+    assert cliente.llamadas == [('mediciones', 2)]
+    escritor.detener(2)
+
+
+def test_spool_ante_caida_y_reenvio_en_orden(crear, cliente):
+    escritor = crear()
+    cliente.caido = True
+    escritor._escribir(_lote(0, 3))
+    escritor._escribir(_lote(3, 5, tabla='rollups') + _lote(5, 6))
+    assert escritor.filas_en_spool == 6
+    assert cliente.filas == []
+    # En el spool cuentan como persistidas
+    assert escritor.confirmados == list(range(6))
+
+    cliente.caido = False
+    escritor._escribir(_lote(6, 8))
+    assert cliente.filas == [('mediciones', 0), ('mediciones', 1), ('mediciones', 2),
+                             ('rollups', 3), ('rollups', 4), ('mediciones', 5),
+                             ('mediciones', 6), ('mediciones', 7)]
+    assert not os.path.exists(escritor.ruta_spool)
+    assert escritor.filas_en_spool == 0
+    assert escritor.confirmados == list(range(8))
+
+
+def test_reenvio_parcial_conserva_lo_que_falta(crear, cliente):
+    escritor = crear(tamano_lote=2)
+    escritor._guardar_spool([('mediciones', {'i': i}) for i in range(5)])
+    reales = cliente.table
+
+    def caer_tras_el_primer_tramo(tabla):
+        if len(cliente.llamadas) >= 1:
+            cliente.caido = True
+        return reales(tabla)
+
+    cliente.table = caer_tras_el_primer_tramo
+    assert not escritor._reenviar_spool()
+    assert [i for _, i in cliente.filas] == [0, 1]
+    with open(escritor.ruta_spool, encoding='utf-8') as f:
+        assert [json.loads(linea)['fila']['i'] for linea in f] == [2, 3, 4]
+
+
+def test_lineas_ilegibles_del_spool_se_apartan(crear, cliente, tmp_path):
+    escritor = crear()
+    with open(escritor.ruta_spool, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'tabla': 'mediciones', 'fila': {'i': 0}}) + '\n')
+        f.write('["sin", "tabla"]\n')
+        f.write('{"tabla": "mediciones", "fi')  # el proceso murió a media línea
+    # Lo siguiente no queda pegado a la línea cortada
+    escritor._guardar_spool([('mediciones', {'i': 1})])
+
+    assert escritor._reenviar_spool()
+    assert [i for _, i in cliente.filas] == [0, 1]
+    with open(escritor.ruta_spool + '.corrupto', encoding='utf-8') as f:
+        assert f.read() == '["sin", "tabla"]\n{"tabla": "mediciones", "fi\n'
+
+
+@pytest.mark.parametrize('codigo, permanente', [
+    ('23505', True), ('23502', True), ('22P02', True), ('42703', True), ('42P01', True),
+    ('PGRST102', True), ('PGRST204', True), (400, True), ('404', True), (422, True),
+    ('42501', False), ('PGRST301', False), ('08006', False), ('40001', False), ('57014', False),
+    (401, False), ('403', False), (408, False), (429, False), (500, False), ('503', False), (None, False),
+])
+def test_es_permanente(codigo, permanente):
+    assert es_permanente(APIError(codigo)) is permanente
+
+
+def test_es_permanente_sin_codigo():
+    assert not es_permanente(ConnectionError('sin conexión'))
+    assert not es_permanente(TimeoutError())
+
+
+def test_filas_invalidas_se_apartan_y_el_resto_se_escribe(crear, cliente):
+    escritor = crear()
+    lote = _lote(0, 8)
+    for _, fila, ack_id in lote:
+        fila['invalida'] = ack_id in (2, 5)
+    escritor._escribir(lote)
+
+    assert [i for _, i in cliente.filas] == [0, 1, 3, 4, 6, 7]
+    with open(escritor.ruta_descartes, encoding='utf-8') as f:
+        descartes = [json.loads(linea) for linea in f]
+    assert [d['fila']['i'] for d in descartes] == [2, 5]
+    assert all(d['tabla'] == 'mediciones' and '23502' in d['error'] for d in descartes)
+    assert escritor.filas_descartadas == 2
+    assert not os.path.exists(escritor.ruta_spool)
+    # Un rechazo no se reintenta: se parte en mitades y cada parte se envía una sola vez
+    assert [filas for _, filas in cliente.llamadas] == [8, 4, 2, 2, 1, 1, 4, 2, 1, 1, 2]
+    assert escritor.confirmados == list(range(8))
+
+
+def test_se_confirma_solo_despues_de_persistir(crear, cliente):
+    persistidas_al_confirmar = []
+    escritor = crear()
+    escritor.al_persistir = lambda ids: persistidas_al_confirmar.append(
+        ([i for _, i in cliente.filas], escritor.filas_en_spool, ids))
+
+    escritor._escribir(_lote(0, 2))
+    cliente.caido = True
+    escritor._escribir(_lote(2, 3))
+    assert persistidas_al_confirmar == [([0, 1], 0, [0, 1]), ([0, 1], 1, [2])]
+
+
+def test_sin_confirmar_si_no_se_pudo_persistir(crear, cliente, tmp_path):
+    # Base caída y spool en un directorio inexistente: el lote no queda en ningún lado
+    escritor = crear(ruta_spool=str(tmp_path / 'no-existe' / 'spool.jsonl'))
+    cliente.caido = True
+    escritor.iniciar()
+    escritor.encolar({'i': 0}, ack_id=0)
+    _esperar(lambda: escritor.errores >= 3)
+    # El hilo sigue vivo y lo siguiente se escribe cuando la base vuelve
+    assert escritor._hilo.is_alive()
+    assert escritor.confirmados == []
+    cliente.caido = False
+    escritor.encolar({'i': 1}, ack_id=1)
+    escritor.detener(2)
+    assert escritor.confirmados == [1]
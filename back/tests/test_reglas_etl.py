@@ -0,0 +1,134 @@
+"""
+El conjunto "etl" de reglas.py por defecto decide igual que evaluar_alerta
+y nivel_alerta anteriores al motor, por lectura y en lote.
+"""
+import itertools
+import math
+
+import numpy as np
+import pytest
+
+import reglas
+
+
+def _evaluar_alerta_anterior(resultado) -> bool:
+    """HidrologiaProcessor.evaluar_alerta antes del motor de reglas"""
+    nivel = resultado['nivel_m']
+    proyeccion = resultado.get('proyeccion_30min')
+    ror = resultado.get('ror')
+    persistencia = resultado.get('persistencia', 0)
+
+    alerta = False
+    if nivel > 0.5:
+        alerta = True
+    if proyeccion and proyeccion > 0.6:
+        alerta = True
+    if ror and ror > 0.1:
+        alerta = True
+    if persistencia >= 3:
+        alerta = True
+    return alerta
+
+
+def _nivel_alerta_anterior(resultado) -> str:
+    """HidrologiaProcessor.nivel_alerta antes del motor de reglas"""
+    nivel_m = resultado.get('nivel_m', 0)
+    ror = resultado.get('ror')
+    persistencia = resultado.get('persistencia', 0)
+    proyeccion_30min = resultado.get('proyeccion_30min')
+
+    riesgo = (
+        (nivel_m * 0.6) +
+        (min(ror or 0, 0.2) * 2.0) +
+        ((persistencia or 0) * 0.05) +
+        (0.1 if (proyeccion_30min and proyeccion_30min > 0.6) else 0.0)
+    )
+    if riesgo >= 0.9:
+        return "ROJA"
+    elif riesgo >= 0.6:
+        return "AMARILLA"
+    return "VERDE"
+
+
+@pytest.fixture(scope='module')
+def motor():
+    return reglas.Motor(reglas.CONFIG_DEFECTO['etl'])
+
+
+def _cerca(x: float):
+    return math.nextafter(x, -math.inf), x, math.nextafter(x, math.inf)
+
+
+def _casos_borde():
+    """Cada umbral y el flotante de cada lado, el tope del RoR, riesgos justo en 0.6 y 0.9, y ausentes"""
+    niveles = [0.0, *_cerca(0.5), 0.8, *_cerca(1.0), 1.3, *_cerca(1.5)]
+    rors = [None, math.nan, -0.05, 0.0, *_cerca(0.1), *_cerca(0.2), 0.35]
+    proyecciones = [None, math.nan, 0.0, *_cerca(0.6), 0.9]
+    persistencias = [None, 0, 2, 3, 4, 6]
+    for nivel, ror, proyeccion, persistencia in itertools.product(niveles, rors, proyecciones, persistencias):
+        resultado = {'nivel_m': nivel, 'ror': ror, 'proyeccion_30min': proyeccion}
+        # Sin la clave, como antes de la primera persistencia calculada
+        if persistencia is not None:
+            resultado['persistencia'] = persistencia
+        yield resultado
+
+
+def _casos_aleatorios(lecturas: int, semilla: int = 0):
+    """Al centímetro (caen justo en los umbrales) y con RoR ausente en ~5 % de las lecturas"""
+    rng = np.random.default_rng(semilla)
+    nivel = np.round(rng.uniform(0, 1.6, lecturas), 2).tolist()
+    ror = np.round(rng.normal(0, 0.1, lecturas), 2).tolist()
+    ausente = (rng.random(lecturas) < 0.05).tolist()
+    persistencia = rng.integers(0, 8, lecturas).tolist()
+    for i in range(lecturas):
+        r = None if ausente[i] else ror[i]
+        yield {'nivel_m': nivel[i], 'ror': r, 'proyeccion_30min': None if r is None else round(nivel[i] + r, 2),
+               'persistencia': persistencia[i]}
+
+
+def _comparar_por_lectura(motor, resultados):
+    for resultado in resultados:
+        evaluacion = motor.evaluar(resultado)
+        assert bool(evaluacion.reglas) == _evaluar_alerta_anterior(resultado), resultado
+        assert evaluacion.nivel == _nivel_alerta_anterior(resultado), resultado
+        assert motor.nivel(resultado) == evaluacion.nivel, resultado
+
+
+def _comparar_en_lote(motor, resultados):
+    """En lote un campo ausente es NaN; se compara contra la decisión anterior con None"""
+    resultados = [r for r in resultados if not any(isinstance(v, float) and math.isnan(v) for v in r.values())]
+    columnas = {
+        campo: [np.nan if r.get(campo) is None else r[campo] for r in resultados]
+        for campo in ('nivel_m', 'ror', 'proyeccion_30min', 'persistencia')
+    }
+    lote = motor.evaluar_lote(columnas)
+    alerta = np.logical_or.reduce(list(lote.reglas.values())).tolist()
+    niveles = np.asarray(motor.niveles)[lote.nivel].tolist()
+    esperado_alerta = [_evaluar_alerta_anterior(r) for r in resultados]
+    esperado_nivel = [_nivel_alerta_anterior(r) for r in resultados]
+    assert [i for i, (a, b) in enumerate(zip(alerta, esperado_alerta)) if a != b] == []
+    assert [i for i, (a, b) in enumerate(zip(niveles, esperado_nivel)) if a != b] == []
+
+
+def test_iguales_por_lectura_en_los_bordes(motor):
+    _comparar_por_lectura(motor, _casos_borde())
+
+
+def test_iguales_en_lote_en_los_bordes(motor):
+    _comparar_en_lote(motor, list(_casos_borde()))
+
+
+def test_iguales_con_valores_aleatorios(motor):
+    resultados = list(_casos_aleatorios(100000))
+    _comparar_por_lectura(motor, resultados)
+    _comparar_en_lote(motor, resultados)
+    # Los casos cubren los tres colores y ambas decisiones de alerta
+    assert {_nivel_alerta_anterior(r) for r in resultados} == {'VERDE', 'AMARILLA', 'ROJA'}
+    assert {_evaluar_alerta_anterior(r) for r in resultados} == {True, False}
+
+
+def test_ejemplo_del_docstring(motor):
+    resultado = motor.evaluar({'nivel_m': 0.7, 'ror': 0.05, 'persistencia': 4})
+    assert resultado.reglas == ('nivel_critico', 'persistencia_alta')
+    assert resultado.nivel == 'AMARILLA'
+    assert resultado.puntaje == pytest.approx(0.72)
@@ -0,0 +1,95 @@
+"""
+Supervisor de trabajadores particionados: cada proceso recibe su partición
+fija, el que cae se reinicia con la misma, y SIGTERM (docker stop) detiene
+a todos por el camino que vacía los buffers.
+"""
+import functools
+import os
+import signal
+import sys
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('supabase')
+pytest.importorskip('dotenv')
+
+import app  # noqa: E402
+
+
+def _arranques(directorio, particion: int) -> list:
+    ruta = os.path.join(directorio, f'arranques-{particion}')
+    if not os.path.exists(ruta):
+        return []
+    with open(ruta) as f:
+        return f.read().split()
+
+
+def _trabajador_falso(directorio, particion, particiones, cola_estado):
+    """Anota cada arranque con su partición; la 0 cae en el primero. Al detenerse deja una marca"""
+    app.detener_con_sigterm()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    with open(os.path.join(directorio, f'arranques-{particion}'), 'a') as f:
+        f.write(f'{particion}/{particiones}\n')
+    if particion == 0 and len(_arranques(directorio, 0)) == 1:
+        sys.exit(3)
+    try:
+        while True:
+            time.sleep(0.05)
+    except KeyboardInterrupt:
+        app.ignorar_senales()
+        with open(os.path.join(directorio, f'detenido-{particion}'), 'a') as f:
+            f.write('ok\n')
+
+
+@pytest.fixture
+def senales():
+    """supervisar instala sus manejadores en este proceso: se restauran al terminar"""
+    previas = {s: signal.getsignal(s) for s in (signal.SIGTERM, signal.SIGINT)}
+    yield
+    for senal, manejador in previas.items():
+        signal.signal(senal, manejador)
+
+
+def test_reinicia_la_particion_caida_y_detiene_con_sigterm(monkeypatch, tmp_path, senales):
+    monkeypatch.setattr(app, 'ETL_ESTADO_PUERTO', 0)
+    monkeypatch.setattr(app, 'ETL_REINICIO_MIN_S', 0)
+    monkeypatch.setattr(app, 'ETL_PLAZO_SALIDA_S', 5)
+    monkeypatch.setattr(app, 'ejecutar_trabajador', functools.partial(_trabajador_falso, str(tmp_path)))
+
+    def detener_tras_el_reinicio():
+        fin = time.monotonic() + 10
+        while time.monotonic() < fin:
+            if len(_arranques(tmp_path, 0)) == 2 and _arranques(tmp_path, 1) and _arranques(tmp_path, 2):
+                break
+            time.sleep(0.05)
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    threading.Thread(target=detener_tras_el_reinicio, daemon=True).start()
+    app.supervisar(3)
+
+    # La partición que cayó se relanza con la misma partición; las demás no se tocan
+    assert _arranques(tmp_path, 0) == ['0/3', '0/3']
+    assert _arranques(tmp_path, 1) == ['1/3']
+    assert _arranques(tmp_path, 2) == ['2/3']
+    # Cada trabajador vivo, también el reiniciado, salió por su camino de parada
+    for particion in range(3):
+        assert (tmp_path / f'detenido-{particion}').read_text() == 'ok\n'
+
+
+def test_consume_solo_su_particion(monkeypatch):
+    peticiones = []
+
+    class Respuesta:
+        status_code = 404
+
+    def post(url, params=None, **opciones):
+        peticiones.append(params)
+        return Respuesta()
+
+    monkeypatch.setattr(app.requests, 'post', post)
+    assert app.consumir_cola(particion=2, particiones=4) == []
+    assert app.consumir_cola() == []
+    assert peticiones[0]['particion'] == 2 and peticiones[0]['particiones'] == 4
+    assert 'particion' not in peticiones[1]
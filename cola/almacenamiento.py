@@ -0,0 +1,667 @@
+"""
+Backends de almacenamiento para la cola de mediciones
+"""
+import bisect
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from heapq import merge
+from itertools import islice
+from operator import itemgetter
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import orjson
+
+# (índice, total) de particiones: un consumidor solo recibe los mensajes cuyo
+# node_id cae en su partición, así cada nodo lo procesa siempre el mismo
+Particion = Tuple[int, int]
+
+
+def nodo(mensaje: Dict) -> str:
+    return str(mensaje.get('node_id', ''))
+
+
+def clave_nodo(mensaje: Dict) -> int:
+    """Hash estable (CRC32) del node_id del mensaje, el mismo en todos los procesos"""
+    return zlib.crc32(nodo(mensaje).encode('utf-8'))
+
+
+# Mensajes con prioridad alta (lecturas que el gateway ya clasificó como
+# PRECAUCION o ALERTA) van a un carril que se consume antes que el normal
+PRIORIDAD_ALTA = 'alta'
+
+# Qué hacer cuando la cola está en su profundidad máxima
+POLITICA_RECHAZAR = 'rechazar'                    # el lote se rechaza (429) y el productor reintenta
+POLITICA_DESCARTAR_ANTIGUOS = 'descartar_antiguos'  # se descartan los pendientes más antiguos
+POLITICAS_DESBORDE = (POLITICA_RECHAZAR, POLITICA_DESCARTAR_ANTIGUOS)
+
+
+def es_prioritario(mensaje: Dict) -> bool:
+    return mensaje.get('prioridad') == PRIORIDAD_ALTA
+
+
+def _epoch_recibido(mensaje: Dict) -> Optional[float]:
+    recibido_en = mensaje.get('recibido_en')
+    if not recibido_en:
+        return None
+    fecha = datetime.fromisoformat(recibido_en.replace('Z', '+00:00'))
+    if fecha.tzinfo is None:
+        fecha = fecha.replace(tzinfo=timezone.utc)
+    return fecha.timestamp()
+
+
+class ColaLlena(Exception):
+    """La cola está en su profundidad máxima y el lote no cabe con la política configurada"""
+
+    def __init__(self, profundidad: int):
+        super().__init__(f"Cola llena ({profundidad} mensajes)")
+        self.profundidad = profundidad
+
+
+class AlmacenamientoCola:
+    """
+    Interfaz común de los backends de la cola: FIFO con un carril prioritario.
+
+    Con `max_profundidad` > 0 la cola no crece más allá de ese número de
+    mensajes (pendientes y arrendados). Un lote que no cabe se rechaza con
+    ColaLlena o, con POLITICA_DESCARTAR_ANTIGUOS, entra descartando los
+    pendientes normales más antiguos. Los mensajes prioritarios siempre
+    pueden desplazar pendientes normales: solo los normales del lote
+    necesitan lugar libre para no ser rechazados. Un prioritario nunca se
+    descarta: si no quedan normales que desplazar, el lote se rechaza.
+
+    Para no desordenar un nodo, su primer mensaje prioritario mueve al carril
+    prioritario los mensajes normales de ese nodo que aún esperan.
+    """
+    max_profundidad = 0
+    politica = POLITICA_RECHAZAR
+
+    def configurar_limite(self, max_profundidad: int, politica: str = POLITICA_RECHAZAR,
+                          al_descartar: Callable[[int], None] = lambda cantidad: None):
+        """`al_descartar(n)` se llama cada vez que se descartan n pendientes por desborde"""
+        if politica not in POLITICAS_DESBORDE:
+            raise ValueError(f"Política de desborde desconocida: {politica}")
+        self.max_profundidad = max_profundidad
+        self.politica = politica
+        self.al_descartar = al_descartar
+
+    def _exceso(self, mensajes: List[Dict], total: int) -> int:
+        """
+        Cuántos pendientes hay que descartar para que entre el lote; lanza
+        ColaLlena si la política no lo permite. Si no hay tantos pendientes
+        normales (el resto es prioritario o está arrendado) el backend también
+        lanza ColaLlena.
+        """
+        if not self.max_profundidad:
+            return 0
+        exceso = total + len(mensajes) - self.max_profundidad
+        if exceso <= 0:
+            return 0
+        if len(mensajes) > self.max_profundidad:
+            # Un lote más grande que la cola entera no cabe con ninguna política
+            raise ColaLlena(total)
+        if self.politica == POLITICA_RECHAZAR:
+            normales = sum(1 for mensaje in mensajes if not es_prioritario(mensaje))
+            if normales > max(self.max_profundidad - total, 0):
+                raise ColaLlena(total)
+        return exceso
+
+    def agregar(self, mensaje: Dict) -> int:
+        return self.agregar_lote([mensaje])[0]
+
+    def agregar_lote(self, mensajes: List[Dict]) -> List[int]:
+        """Agrega los mensajes en orden; lanza ColaLlena si no caben"""
+        raise NotImplementedError
+
+    def consumir(self) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def consumir_lote(self, maximo: int, lease_segundos: float,
+                      particion: Optional[Particion] = None) -> List[Dict]:
+        """
+        Entrega hasta `maximo` mensajes en arriendo (lease). Los mensajes no se
+        eliminan hasta que se confirman con `confirmar`; si el arriendo vence sin
+        confirmación vuelven a estar disponibles en su posición original.
+
+        Con `particion` solo se entregan, en orden, los mensajes de esa partición
+        de node_id; los demás quedan en su lugar para los otros consumidores.
+        """
+        raise NotImplementedError
+
+    def confirmar(self, ids: List[int]) -> int:
+        """
+        Elimina definitivamente los mensajes indicados cuyo arriendo sigue
+        vigente y retorna cuántos eran. Un id desconocido, pendiente o con el
+        arriendo vencido no cuenta, y un mensaje vencido se vuelve a entregar.
+        """
+        raise NotImplementedError
+
+    def pagina(self, despues: int, limite: int) -> List[Dict]:
+        """
+        Hasta `limite` mensajes (pendientes y arrendados) con id mayor que
+        `despues`, en orden de id y con su `id`: paginación por cursor
+        """
+        raise NotImplementedError
+
+    def iterar(self, despues: int = -1, tamano_pagina: int = 500) -> Iterator[Dict]:
+        """Recorre la cola de a una página por vez, sin tomar el lock más que lo que dura cada página"""
+        while True:
+            mensajes = self.pagina(despues, tamano_pagina)
+            yield from mensajes
+            if len(mensajes) < tamano_pagina:
+                return
+            despues = mensajes[-1]['id']
+
+    def limpiar(self) -> int:
+        raise NotImplementedError
+
+    def por_nodo(self) -> Dict[str, int]:
+        """Mensajes en la cola por node_id; se mantiene al encolar y eliminar, sin recorrer la cola"""
+        raise NotImplementedError
+
+    def prioritarios(self) -> int:
+        """Mensajes del carril prioritario, pendientes y arrendados"""
+        raise NotImplementedError
+
+    def antiguedad(self) -> float:
+        """Segundos desde el recibido_en del pendiente más antiguo (0 si no hay)"""
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+
+class _Carril:
+    """
+    Pendientes (id, mensaje) de un carril, repartidos en una deque por
+    partición de node_id (clave % n) y cada una ordenada por id. Un
+    consumidor particionado toma de su deque en O(1) sin recorrer los
+    mensajes de las demás particiones; el resto de las operaciones ve el
+    carril como un solo FIFO, eligiendo entre los frentes de las n deques.
+    `n` es el número de particiones del último consumidor particionado: si
+    cambia, los pendientes se reparten de nuevo una sola vez.
+    """
+
+    def __init__(self):
+        self.n = 1
+        self._deques: List[deque] = [deque()]
+        self._total = 0
+
+    def __len__(self) -> int:
+        return self._total
+
+    def agregar(self, item: tuple, clave: int):
+        self._deques[clave % self.n].append(item)
+        self._total += 1
+
+    def _frente(self) -> Optional[deque]:
+        """Deque cuyo frente es el pendiente más antiguo del carril"""
+        frente = None
+        for pendientes in self._deques:
+            if pendientes and (frente is None or pendientes[0][0] < frente[0][0]):
+                frente = pendientes
+        return frente
+
+    def primero(self) -> Optional[tuple]:
+        frente = self._frente()
+        return frente[0] if frente else None
+
+    def popleft(self) -> tuple:
+        item = self._frente().popleft()
+        self._total -= 1
+        return item
+
+    def tomar(self, maximo: int, particion: Optional[Particion]) -> List[tuple]:
+        """Quita hasta `maximo` pendientes en orden de id, solo de `particion` si se indica"""
+        if particion is None:
+            return [self.popleft() for _ in range(min(maximo, self._total))]
+        indice, particiones = particion
+        if particiones != self.n:
+            self._repartir(particiones)
+        pendientes = self._deques[indice]
+        items = [pendientes.popleft() for _ in range(min(maximo, len(pendientes)))]
+        self._total -= len(items)
+        return items
+
+    def _repartir(self, n: int):
+        todos = list(merge(*self._deques))
+        self.n = n
+        self._deques = [deque() for _ in range(n)]
+        for item in todos:
+            self._deques[clave_nodo(item[1]) % n].append(item)
+
+    def devolver(self, items: List[tuple]):
+        """Reinserta pendientes ordenados por id en su posición (normalmente, al frente)"""
+        por_deque: Dict[int, List[tuple]] = {}
+        for item in items:
+            por_deque.setdefault(clave_nodo(item[1]) % self.n, []).append(item)
+        for indice, volver in por_deque.items():
+            pendientes = self._deques[indice]
+            if not pendientes or volver[-1][0] < pendientes[0][0]:
+                pendientes.extendleft(reversed(volver))
+            else:
+                self._deques[indice] = deque(merge(volver, pendientes))
+        self._total += len(items)
+
+    def extraer_nodo(self, clave: int) -> List[tuple]:
+        """Quita y retorna, en orden, los pendientes del nodo con esa clave"""
+        indice = clave % self.n
+        quedan, extraidos = deque(), []
+        for item in self._deques[indice]:
+            (extraidos if clave_nodo(item[1]) == clave else quedan).append(item)
+        if extraidos:
+            self._deques[indice] = quedan
+            self._total -= len(extraidos)
+        return extraidos
+
+    def desde(self, despues: int, limite: int) -> List[tuple]:
+        """Hasta `limite` pendientes con id mayor que `despues`, por búsqueda binaria en cada deque"""
+        fuentes = []
+        for pendientes in self._deques:
+            inicio = bisect.bisect_right(pendientes, despues, key=itemgetter(0))
+            fuentes.append(islice(pendientes, inicio, inicio + limite))
+        return list(islice(merge(*fuentes), limite))
+
+    def clear(self):
+        for pendientes in self._deques:
+            pendientes.clear()
+        self._total = 0
+
+
+class AlmacenamientoMemoria(AlmacenamientoCola):
+    """
+    Cola en memoria con un _Carril por prioridad: encolar y desencolar en
+    O(1), también con consumidores particionados, sin persistencia. Cada
+    carril se mantiene ordenado por id, lo que permite paginar con búsqueda
+    binaria.
+    """
+
+    def __init__(self):
+        self._prioritarios = _Carril()  # pendientes del carril prioritario
+        self._mensajes = _Carril()  # pendientes del carril normal
+        self._arrendados: Dict[int, tuple] = {}  # id -> (vence, mensaje, prioritario)
+        self._prioritarios_arrendados = 0
+        # Nodos cuyo último mensaje fue prioritario: no tienen pendientes en el carril normal
+        self._claves_prioritarias: set = set()
+        self._por_nodo: Dict[str, int] = {}
+        self._siguiente_id = 0
+        self._lock = threading.Lock()
+
+    def _quitar(self, mensaje: Dict):
+        node_id = nodo(mensaje)
+        restantes = self._por_nodo[node_id] - 1
+        if restantes:
+            self._por_nodo[node_id] = restantes
+        else:
+            del self._por_nodo[node_id]
+
+    def _recuperar_vencidos(self):
+        if not self._arrendados:
+            return
+        ahora = time.time()
+        vencidos = sorted(
+            (mensaje_id, mensaje, prioritario)
+            for mensaje_id, (vence, mensaje, prioritario) in self._arrendados.items()
+            if vence <= ahora
+        )
+        for mensaje_id, _, prioritario in vencidos:
+            del self._arrendados[mensaje_id]
+            self._prioritarios_arrendados -= prioritario
+        # Los vencidos vuelven a su carril en orden de id
+        for prioritario, carril in ((True, self._prioritarios), (False, self._mensajes)):
+            volver = [(mensaje_id, mensaje) for mensaje_id, mensaje, p in vencidos if p == prioritario]
+            if volver:
+                carril.devolver(volver)
+
+    def _promover(self, clave: int):
+        """Mueve al carril prioritario los pendientes normales del nodo, en orden de id"""
+        promovidos = self._mensajes.extraer_nodo(clave)
+        if promovidos:
+            self._prioritarios.devolver(promovidos)
+
+    def _descartar(self, cantidad: int):
+        if not cantidad:
+            return
+        self._recuperar_vencidos()
+        if cantidad > len(self._mensajes):
+            raise ColaLlena(len(self))
+        for _ in range(cantidad):
+            self._quitar(self._mensajes.popleft()[1])
+        self.al_descartar(cantidad)
+
+    def agregar_lote(self, mensajes: List[Dict]) -> List[int]:
+        with self._lock:
+            self._descartar(self._exceso(mensajes, len(self)))
+            ids = []
+            por_nodo = self._por_nodo
+            for mensaje in mensajes:
+                ids.append(self._siguiente_id)
+                node_id = nodo(mensaje)
+                por_nodo[node_id] = por_nodo.get(node_id, 0) + 1
+                clave = clave_nodo(mensaje)
+                if es_prioritario(mensaje):
+                    if clave not in self._claves_prioritarias:
+                        self._promover(clave)
+                        self._claves_prioritarias.add(clave)
+                    self._prioritarios.agregar((self._siguiente_id, mensaje), clave)
+                else:
+                    if self._claves_prioritarias:
+                        self._claves_prioritarias.discard(clave)
+                    self._mensajes.agregar((self._siguiente_id, mensaje), clave)
+                self._siguiente_id += 1
+            return ids
+
+    def consumir(self) -> Optional[Dict]:
+        with self._lock:
+            self._recuperar_vencidos()
+            carril = self._prioritarios or self._mensajes
+            if not carril:
+                return None
+            mensaje = carril.popleft()[1]
+            self._quitar(mensaje)
+            return mensaje
+
+    def consumir_lote(self, maximo: int, lease_segundos: float,
+                      particion: Optional[Particion] = None) -> List[Dict]:
+        with self._lock:
+            self._recuperar_vencidos()
+            vence = time.time() + lease_segundos
+            lote = []
+            for prioritario, carril in ((True, self._prioritarios), (False, self._mensajes)):
+                for mensaje_id, mensaje in carril.tomar(maximo - len(lote), particion):
+                    self._arrendados[mensaje_id] = (vence, mensaje, prioritario)
+                    lote.append({**mensaje, "id": mensaje_id})
+                if prioritario:
+                    # El carril prioritario se toma primero: todo lo del lote hasta acá es prioritario
+                    self._prioritarios_arrendados += len(lote)
+            return lote
+
+    def confirmar(self, ids: List[int]) -> int:
+        with self._lock:
+            ahora = time.time()
+            confirmados = 0
+            for mensaje_id in ids:
+                arrendado = self._arrendados.get(mensaje_id)
+                # Un arriendo vencido ya no confirma: el mensaje vuelve a entregarse
+                if arrendado is not None and arrendado[0] > ahora:
+                    del self._arrendados[mensaje_id]
+                    self._quitar(arrendado[1])
+                    self._prioritarios_arrendados -= arrendado[2]
+                    confirmados += 1
+            return confirmados
+
+    def pagina(self, despues: int, limite: int) -> List[Dict]:
+        with self._lock:
+            fuentes = [sorted((i, m) for i, (_, m, _) in self._arrendados.items() if i > despues)[:limite]]
+            for carril in (self._prioritarios, self._mensajes):
+                fuentes.append(carril.desde(despues, limite))
+        return [{**mensaje, "id": mensaje_id} for mensaje_id, mensaje in islice(merge(*fuentes), limite)]
+
+    def limpiar(self) -> int:
+        with self._lock:
+            total = len(self)
+            self._prioritarios.clear()
+            self._mensajes.clear()
+            self._arrendados.clear()
+            self._prioritarios_arrendados = 0
+            self._claves_prioritarias.clear()
+            self._por_nodo.clear()
+            return total
+
+    def por_nodo(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._por_nodo)
+
+    def prioritarios(self) -> int:
+        return len(self._prioritarios) + self._prioritarios_arrendados
+
+    def antiguedad(self) -> float:
+        with self._lock:
+            frentes = [carril.primero() for carril in (self._prioritarios, self._mensajes) if carril]
+        recibido = _epoch_recibido(min(frentes)[1]) if frentes else None
+        return max(time.time() - recibido, 0.0) if recibido is not None else 0.0
+
+    def __len__(self) -> int:
+        return len(self._prioritarios) + len(self._mensajes) + len(self._arrendados)
+
+
+class AlmacenamientoSQLite(AlmacenamientoCola):
+    """
+    Cola persistente sobre SQLite en modo WAL, compartible entre procesos
+    (varios workers de gunicorn sobre el mismo archivo).
+
+    Cada mensaje es una fila con id autoincremental; se consume siempre la de
+    mayor prioridad y menor id, que SQLite resuelve desde el extremo del
+    índice (prioridad, id) sin recorrer la tabla. Con synchronous=NORMAL los
+    commits se agregan al WAL y el fsync se agrupa en los checkpoints, y al
+    reabrir el archivo tras una caída SQLite recupera automáticamente las
+    transacciones confirmadas.
+
+    Los arriendos se guardan en la columna `visible_desde`, de modo que un
+    consumidor que cae sin confirmar no pierde mensajes. La columna `clave`
+    guarda el hash del node_id para filtrar por partición sin parsear el JSON.
+    Los conteos total y de prioritarios (`resumen`) y por nodo (`por_nodo`) se
+    actualizan dentro de las mismas transacciones, así todos los procesos ven los mismos
+    valores sin recorrer la tabla.
+    """
+
+    def __init__(self, ruta: str):
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+
+        self._lock = threading.Lock()
+        # timeout: cuánto espera un proceso el lock de escritura que tiene otro
+        self._conn = sqlite3.connect(ruta, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # Con varios procesos abriendo a la vez, el esquema se crea una sola vez
+        with self._escritura():
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS mensajes ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " cuerpo TEXT NOT NULL,"
+                " visible_desde REAL NOT NULL DEFAULT 0,"
+                " clave INTEGER NOT NULL,"
+                " prioridad INTEGER NOT NULL DEFAULT 0,"
+                " node_id TEXT NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS mensajes_carril ON mensajes (prioridad DESC, id)")
+            # Para promover los normales de un nodo sin recorrer todo el carril
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS mensajes_normales_clave ON mensajes (clave) WHERE prioridad = 0"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS resumen (id INTEGER PRIMARY KEY CHECK (id = 0),"
+                " total INTEGER NOT NULL, prioritarios INTEGER NOT NULL)"
+            )
+            self._conn.execute("INSERT OR IGNORE INTO resumen (id, total, prioritarios) VALUES (0, 0, 0)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS por_nodo (node_id TEXT PRIMARY KEY, total INTEGER NOT NULL) WITHOUT ROWID"
+            )
+
+    @contextmanager
+    def _escritura(self):
+        """
+        Transacción de escritura. BEGIN IMMEDIATE toma el lock de escritura de
+        SQLite al empezar, así dos procesos no pueden leer los mismos
+        pendientes y arrendarlos ambos.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _contar(self) -> int:
+        return self._conn.execute("SELECT total FROM resumen").fetchone()[0]
+
+    def _sumar(self, cantidad: int, prioritarios: int = 0):
+        if cantidad or prioritarios:
+            self._conn.execute(
+                "UPDATE resumen SET total = total + ?, prioritarios = prioritarios + ?", (cantidad, prioritarios)
+            )
+
+    def _sumar_nodos(self, node_ids: List[str], signo: int):
+        """Actualiza `por_nodo` con una sentencia por nodo distinto, no por mensaje"""
+        self._conn.executemany(
+            "INSERT INTO por_nodo (node_id, total) VALUES (?, ?)"
+            " ON CONFLICT (node_id) DO UPDATE SET total = total + excluded.total",
+            [(node_id, signo * cantidad) for node_id, cantidad in Counter(node_ids).items()]
+        )
+
+    def _descartar(self, cantidad: int, total: int) -> int:
+        """Elimina los pendientes normales más antiguos; debe llamarse dentro de la transacción"""
+        node_ids = [fila[0] for fila in self._conn.execute(
+            "DELETE FROM mensajes WHERE id IN (SELECT id FROM mensajes"
+            " WHERE prioridad = 0 AND visible_desde <= ? ORDER BY id LIMIT ?) RETURNING node_id",
+            (time.time(), cantidad)
+        )]
+        if len(node_ids) < cantidad:
+            # Sale por la excepción: _escritura hace ROLLBACK de lo borrado
+            raise ColaLlena(total)
+        self._sumar_nodos(node_ids, -1)
+        return cantidad
+
+    def agregar_lote(self, mensajes: List[Dict]) -> List[int]:
+        ids = []
+        node_ids = [nodo(mensaje) for mensaje in mensajes]
+        with self._escritura():
+            total = self._contar()
+            exceso = self._exceso(mensajes, total)
+            # Solo se descartan normales: el conteo de prioritarios no cambia
+            descartados = self._descartar(exceso, total) if exceso else 0
+            prioritarios = 0
+            for mensaje, node_id in zip(mensajes, node_ids):
+                clave = clave_nodo(mensaje)
+                prioritario = es_prioritario(mensaje)
+                if prioritario:
+                    prioritarios += 1 + self._conn.execute(
+                        "UPDATE mensajes SET prioridad = 1 WHERE prioridad = 0 AND clave = ?", (clave,)
+                    ).rowcount
+                cursor = self._conn.execute(
+                    "INSERT INTO mensajes (cuerpo, clave, prioridad, node_id) VALUES (?, ?, ?, ?)",
+                    (orjson.dumps(mensaje).decode(), clave, int(prioritario), node_id)
+                )
+                ids.append(cursor.lastrowid)
+            self._sumar(len(ids) - descartados, prioritarios)
+            self._sumar_nodos(node_ids, 1)
+        if descartados:
+            self.al_descartar(descartados)
+        return ids
+
+    def consumir(self) -> Optional[Dict]:
+        with self._escritura():
+            fila = self._conn.execute(
+                "SELECT id, cuerpo FROM mensajes WHERE visible_desde <= ?"
+                " ORDER BY prioridad DESC, id LIMIT 1",
+                (time.time(),)
+            ).fetchone()
+            if fila is not None:
+                node_id, prioridad = self._conn.execute(
+                    "DELETE FROM mensajes WHERE id = ? RETURNING node_id, prioridad", (fila[0],)
+                ).fetchone()
+                self._sumar(-1, -prioridad)
+                self._sumar_nodos([node_id], -1)
+        return orjson.loads(fila[1]) if fila is not None else None
+
+    def consumir_lote(self, maximo: int, lease_segundos: float,
+                      particion: Optional[Particion] = None) -> List[Dict]:
+        with self._escritura():
+            ahora = time.time()
+            if particion is None:
+                filas = self._conn.execute(
+                    "SELECT id, cuerpo FROM mensajes WHERE visible_desde <= ?"
+                    " ORDER BY prioridad DESC, id LIMIT ?",
+                    (ahora, maximo)
+                ).fetchall()
+            else:
+                filas = self._conn.execute(
+                    "SELECT id, cuerpo FROM mensajes WHERE visible_desde <= ? AND clave % ? = ?"
+                    " ORDER BY prioridad DESC, id LIMIT ?",
+                    (ahora, particion[1], particion[0], maximo)
+                ).fetchall()
+            self._conn.executemany(
+                "UPDATE mensajes SET visible_desde = ? WHERE id = ?",
+                [(ahora + lease_segundos, fila[0]) for fila in filas]
+            )
+        return [{**orjson.loads(cuerpo), "id": mensaje_id} for mensaje_id, cuerpo in filas]
+
+    def confirmar(self, ids: List[int]) -> int:
+        with self._escritura():
+            ahora = time.time()
+            node_ids = []
+            prioritarios = 0
+            for inicio in range(0, len(ids), 500):
+                bloque = ids[inicio:inicio + 500]
+                # Solo con el arriendo vigente; uno vencido vuelve a entregarse
+                for node_id, prioridad in self._conn.execute(
+                    f"DELETE FROM mensajes WHERE id IN ({','.join('?' * len(bloque))})"
+                    " AND visible_desde > ? RETURNING node_id, prioridad", (*bloque, ahora)
+                ):
+                    node_ids.append(node_id)
+                    prioritarios += prioridad
+            self._sumar(-len(node_ids), -prioritarios)
+            self._sumar_nodos(node_ids, -1)
+        return len(node_ids)
+
+    def pagina(self, despues: int, limite: int) -> List[Dict]:
+        with self._lock:
+            filas = self._conn.execute(
+                "SELECT id, cuerpo FROM mensajes WHERE id > ? ORDER BY id LIMIT ?", (despues, limite)
+            ).fetchall()
+        return [{**orjson.loads(cuerpo), "id": mensaje_id} for mensaje_id, cuerpo in filas]
+
+    def limpiar(self) -> int:
+        with self._escritura():
+            total = self._contar()
+            self._conn.execute("DELETE FROM mensajes")
+            self._conn.execute("UPDATE resumen SET total = 0, prioritarios = 0")
+            self._conn.execute("DELETE FROM por_nodo")
+        return total
+
+    def por_nodo(self) -> Dict[str, int]:
+        with self._lock:
+            filas = self._conn.execute("SELECT node_id, total FROM por_nodo WHERE total > 0").fetchall()
+        return dict(filas)
+
+    def prioritarios(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT prioritarios FROM resumen").fetchone()[0]
+
+    def antiguedad(self) -> float:
+        with self._lock:
+            fila = self._conn.execute(
+                "SELECT cuerpo FROM mensajes WHERE visible_desde <= ? ORDER BY id LIMIT 1", (time.time(),)
+            ).fetchone()
+        recibido = _epoch_recibido(orjson.loads(fila[0])) if fila else None
+        return max(time.time() - recibido, 0.0) if recibido is not None else 0.0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._contar()
+
+
+def crear_almacenamiento(backend: str, ruta: str = "cola.db", max_profundidad: int = 0,
+                         politica: str = POLITICA_RECHAZAR,
+                         al_descartar: Callable[[int], None] = lambda cantidad: None) -> AlmacenamientoCola:
+    """
+    Crea el backend de almacenamiento configurado ('memoria' o 'sqlite'), con
+    `max_profundidad` mensajes como máximo (0 = sin límite)
+    """
+    if backend == "memoria":
+        almacenamiento = AlmacenamientoMemoria()
+    elif backend == "sqlite":
+        almacenamiento = AlmacenamientoSQLite(ruta)
+    else:
+        raise ValueError(f"Backend de cola desconocido: {backend}")
+    almacenamiento.configurar_limite(max_profundidad, politica, al_descartar)
+    return almacenamiento
@@ -1,40 +1,203 @@
 """
 Aplicación de cola simple para recibir datos de medición
 """
-from flask import Flask, request, jsonify
-import json
-from datetime import datetime
+from flask import Flask, Response, request, jsonify
+from flask.json.provider import JSONProvider
+from datetime import datetime, timedelta, timezone
 import os
+import threading
+import time
+
+import orjson
+
+import metricas
+from almacenamiento import ColaLlena, crear_almacenamiento
+
+
+class ProveedorOrjson(JSONProvider):
+    """request.get_json y jsonify con orjson, varias veces más rápido que el json de la stdlib"""
+
+    mimetype = "application/json"
+
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype=self.mimetype)
+
 
 app = Flask(__name__)
+app.json = ProveedorOrjson(app)
+
+# Backend de almacenamiento: 'sqlite' (persistente) o 'memoria'
+COLA_BACKEND = os.environ.get('COLA_BACKEND', 'sqlite')
+COLA_DB_PATH = os.environ.get('COLA_DB_PATH', 'cola.db')
+
+# Tiempo que un lote consumido queda reservado esperando confirmación (/ack)
+COLA_LEASE_SEGUNDOS = float(os.environ.get('COLA_LEASE_SEGUNDOS', 60))
+
+# Máximo de segundos que /consumir?wait=N puede bloquear esperando mensajes
+COLA_ESPERA_MAX_SEGUNDOS = float(os.environ.get('COLA_ESPERA_MAX_SEGUNDOS', 30))
+
+# Mensajes por página de GET /mensajes (por defecto y máximo)
+COLA_PAGINA = int(os.environ.get('COLA_PAGINA', 100))
+COLA_PAGINA_MAX = int(os.environ.get('COLA_PAGINA_MAX', 1000))
+
+# Procesos de gunicorn (gunicorn.conf.py). Con más de uno la cola debe ser
+# SQLite, que comparten a través del archivo
+COLA_WORKERS = int(os.environ.get('COLA_WORKERS', 1))
+if COLA_WORKERS > 1 and COLA_BACKEND != 'sqlite':
+    raise ValueError("Con COLA_WORKERS > 1 la cola debe usar COLA_BACKEND=sqlite")
+
+# Profundidad máxima de la cola (0 = sin límite) y qué hacer al llegar a ella:
+# 'rechazar' responde 429 y el productor reintenta; 'descartar_antiguos' hace
+# lugar descartando los pendientes más antiguos
+COLA_MAX_PROFUNDIDAD = int(os.environ.get('COLA_MAX_PROFUNDIDAD', 100000))
+COLA_POLITICA_DESBORDE = os.environ.get('COLA_POLITICA_DESBORDE', 'rechazar')
+# Segundos sugeridos en Retry-After cuando la cola está llena
+COLA_REINTENTO_SEGUNDOS = int(os.environ.get('COLA_REINTENTO_SEGUNDOS', 5))
+
+cola_datos = crear_almacenamiento(
+    COLA_BACKEND, COLA_DB_PATH, COLA_MAX_PROFUNDIDAD, COLA_POLITICA_DESBORDE,
+    al_descartar=lambda cantidad: MENSAJES_DESCARTADOS.inc(valor=cantidad)
+)
 
-# Almacenamiento simple en memoria (en producción usar Redis o RabbitMQ)
-cola_datos = []
+# Origen y unidad para convertir ts a ts_ms
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+UN_MS = timedelta(milliseconds=1)
+
+MENSAJES_RECIBIDOS = metricas.contador(
+    'cola_mensajes_recibidos_total', 'Mensajes aceptados por nodo', ('node_id',)
+)
+MENSAJES_RECHAZADOS = metricas.contador('cola_mensajes_rechazados_total', 'Mediciones inválidas rechazadas')
+COLA_LLENA = metricas.contador('cola_llena_total', 'Peticiones de ingesta rechazadas con 429 por cola llena')
+MENSAJES_DESCARTADOS = metricas.contador(
+    'cola_mensajes_descartados_total', 'Pendientes más antiguos descartados para hacer lugar en la cola llena'
+)
+MENSAJES_ENTREGADOS = metricas.contador('cola_mensajes_entregados_total', 'Mensajes entregados a consumidores')
+MENSAJES_CONFIRMADOS = metricas.contador('cola_mensajes_confirmados_total', 'Mensajes confirmados con /ack')
+PROFUNDIDAD = metricas.medidor(
+    'cola_profundidad', 'Mensajes en la cola, pendientes y arrendados', funcion=lambda: len(cola_datos)
+)
+PROFUNDIDAD_PRIORITARIA = metricas.medidor(
+    'cola_profundidad_prioritaria', 'Mensajes en el carril prioritario, pendientes y arrendados',
+    funcion=lambda: cola_datos.prioritarios()
+)
+ANTIGUEDAD = metricas.medidor(
+    'cola_antiguedad_segundos', 'Segundos que lleva esperando el mensaje pendiente más antiguo',
+    funcion=lambda: cola_datos.antiguedad()
+)
+DURACION_INGESTA = metricas.histograma(
+    'cola_ingesta_segundos', 'Duración de las peticiones de ingesta', ('endpoint',)
+)
+
+def registrar_recibidos(mensajes):
+    for mensaje in mensajes:
+        MENSAJES_RECIBIDOS.inc((str(mensaje.get('node_id', '')),))
+
+def estado_cola() -> dict:
+    """Profundidad y antigüedad del pendiente más antiguo, para que los productores regulen su ritmo"""
+    return {
+        "total_en_cola": len(cola_datos),
+        "max_profundidad": COLA_MAX_PROFUNDIDAD,
+        "antiguedad_s": round(cola_datos.antiguedad(), 3)
+    }
+
+def respuesta_cola_llena():
+    """429 con Retry-After: el productor debe conservar los mensajes y reintentar"""
+    COLA_LLENA.inc()
+    respuesta = jsonify({"error": "Cola llena", **estado_cola()})
+    respuesta.headers['Retry-After'] = str(COLA_REINTENTO_SEGUNDOS)
+    return respuesta, 429
+
+# Se notifica cada vez que llegan mensajes nuevos para despertar a los consumidores en espera
+hay_mensajes = threading.Condition()
+# La condición solo despierta a los hilos del mismo proceso: con varios workers
+# los mensajes que recibe otro proceso se descubren revisando más seguido
+INTERVALO_ESPERA = 1.0 if COLA_WORKERS == 1 else 0.05
+
+def consumir_con_espera(consumir, espera: float):
+    """
+    Ejecuta `consumir` y, si la cola está vacía, bloquea hasta `espera` segundos
+    a que llegue un mensaje. La comprobación se hace con la condición tomada,
+    así que una notificación no puede perderse entre consumir y esperar; el
+    timeout acotado cubre arriendos que vencen sin notificación.
+    """
+    limite = time.monotonic() + espera
+    with hay_mensajes:
+        resultado = consumir()
+        while not resultado:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            hay_mensajes.wait(min(restante, INTERVALO_ESPERA))
+            resultado = consumir()
+    return resultado
 
 @app.route('/health', methods=['GET'])
 def health():
     """Endpoint de salud"""
     return jsonify({"status": "ok"}), 200
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Métricas en formato de texto de Prometheus. Con varios workers cada scrape
+    lo atiende uno distinto y sus contadores e histogramas son del proceso, así
+    que rate() vería saltos falsos: solo se exponen los medidores, que se leen
+    del archivo SQLite compartido
+    """
+    tipos = ('gauge',) if COLA_WORKERS > 1 else None
+    return Response(metricas.exponer(tipos), mimetype=metricas.TIPO_CONTENIDO)
+
+def validar_medicion(data) -> str:
+    """
+    Valida una medición entrante; retorna el mensaje de error o cadena vacía.
+    `ts` tiene que ser ISO 8601 aunque venga `ts_ms` (epoch en milisegundos);
+    si no viene `ts_ms` se lo agrega a partir de `ts`, así el ETL no vuelve a
+    parsear el timestamp ISO.
+    """
+    if not isinstance(data, dict):
+        return "La medición debe ser un objeto JSON"
+    
+    # Validar campos requeridos
+    campos_requeridos = ['ts', 'nivel_m', 'lluvia_mm']
+    for campo in campos_requeridos:
+        if campo not in data:
+            return f"Campo requerido faltante: {campo}"
+    
+    # Validar tipos
+    try:
+        fecha = datetime.fromisoformat(data['ts'].replace('Z', '+00:00'))
+        ts_ms = data.get('ts_ms')
+        if ts_ms is None:
+            if fecha.tzinfo is None:
+                fecha = fecha.replace(tzinfo=timezone.utc)
+            data['ts_ms'] = (fecha - EPOCH) // UN_MS
+        elif isinstance(ts_ms, bool) or not isinstance(ts_ms, int):
+            return "Error de validación: ts_ms debe ser un entero (epoch en ms)"
+        float(data['nivel_m'])
+        float(data['lluvia_mm'])
+    except (ValueError, TypeError, AttributeError) as e:
+        return f"Error de validación: {str(e)}"
+    
+    return ""
+
 @app.route('/mensaje', methods=['POST'])
 def recibir_mensaje():
     """Recibe un mensaje y lo agrega a la cola"""
+    inicio = time.perf_counter()
     try:
         data = request.get_json()
         
-        # Validar campos requeridos
-        campos_requeridos = ['ts', 'nivel_m', 'lluvia_mm']
-        for campo in campos_requeridos:
-            if campo not in data:
-                return jsonify({"error": f"Campo requerido faltante: {campo}"}), 400
-        
-        # Validar tipos
-        try:
-            datetime.fromisoformat(data['ts'].replace('Z', '+00:00'))
-            float(data['nivel_m'])
-            float(data['lluvia_mm'])
-        except (ValueError, TypeError) as e:
-            return jsonify({"error": f"Error de validación: {str(e)}"}), 400
+        error = validar_medicion(data)
+        if error:
+            MENSAJES_RECHAZADOS.inc()
+            return jsonify({"error": error}), 400
         
         # Agregar timestamp de recepción
         mensaje = {
@@ -42,48 +205,200 @@ def recibir_mensaje():
             "recibido_en": datetime.utcnow().isoformat() + "Z"
         }
         
-        cola_datos.append(mensaje)
+        mensaje_id = cola_datos.agregar(mensaje)
+        with hay_mensajes:
+            hay_mensajes.notify_all()
+        registrar_recibidos([mensaje])
+        DURACION_INGESTA.observar(time.perf_counter() - inicio, ('mensaje',))
         
         return jsonify({
             "mensaje": "Dato recibido correctamente",
-            "id": len(cola_datos) - 1,
-            "total_en_cola": len(cola_datos)
+            "id": mensaje_id,
+            **estado_cola()
         }), 201
         
+    except ColaLlena:
+        return respuesta_cola_llena()
+    except Exception as e:
+        return jsonify({"error": f"Error interno: {str(e)}"}), 500
+
+@app.route('/mensajes/lote', methods=['POST'])
+def recibir_lote():
+    """
+    Recibe varias mediciones en una sola petición (`{"mensajes": [...]}`) y las
+    agrega a la cola en orden y en una sola transacción. Las mediciones
+    inválidas se reportan en `rechazados` sin impedir que entren las demás,
+    para que un productor que reenvía su buffer no se quede bloqueado por una
+    lectura corrupta.
+    
+    Las mediciones con `"prioridad": "alta"` van al carril prioritario. Si
+    la cola está llena el lote entero se rechaza con 429 y Retry-After.
+    """
+    inicio = time.perf_counter()
+    try:
+        data = request.get_json(silent=True) or {}
+        mediciones = data.get('mensajes') if isinstance(data, dict) else None
+        if not isinstance(mediciones, list):
+            return jsonify({"error": "Campo requerido faltante: mensajes"}), 400
+        
+        recibido_en = datetime.utcnow().isoformat() + "Z"
+        validas = []
+        rechazados = []
+        for indice, medicion in enumerate(mediciones):
+            error = validar_medicion(medicion)
+            if error:
+                rechazados.append({"indice": indice, "error": error})
+            else:
+                validas.append({**medicion, "recibido_en": recibido_en})
+        
+        ids = cola_datos.agregar_lote(validas) if validas else []
+        if ids:
+            with hay_mensajes:
+                hay_mensajes.notify_all()
+        registrar_recibidos(validas)
+        if rechazados:
+            MENSAJES_RECHAZADOS.inc(valor=len(rechazados))
+        DURACION_INGESTA.observar(time.perf_counter() - inicio, ('lote',))
+        
+        return jsonify({
+            "mensaje": f"{len(ids)} datos recibidos correctamente",
+            "ids": ids,
+            "rechazados": rechazados,
+            **estado_cola()
+        }), 201
+        
+    except ColaLlena:
+        return respuesta_cola_llena()
     except Exception as e:
         return jsonify({"error": f"Error interno: {str(e)}"}), 500
 
 @app.route('/mensajes', methods=['GET'])
 def obtener_mensajes():
-    """Obtiene todos los mensajes en la cola (para debug)"""
+    """
+    Mensajes en la cola en orden de llegada (para debug), paginados por
+    cursor: `?despues=<id>&limite=N` entrega hasta N mensajes con id mayor y
+    en `siguiente` el cursor de la página que sigue (null al final).
+    
+    Con `?formato=ndjson` transmite toda la cola, un mensaje por línea,
+    leyendo una página por vez: la respuesta nunca se arma entera en memoria
+    ni bloquea la cola más de lo que tarda cada página.
+    """
+    try:
+        despues = int(request.args.get('despues', -1))
+        limite = min(int(request.args.get('limite', COLA_PAGINA)), COLA_PAGINA_MAX)
+    except ValueError as e:
+        return jsonify({"error": f"Parámetro inválido: {str(e)}"}), 400
+    if limite < 1:
+        return jsonify({"error": "limite debe ser positivo"}), 400
+    
+    if request.args.get('formato') == 'ndjson':
+        lineas = (orjson.dumps(mensaje) + b"\n" for mensaje in cola_datos.iterar(despues, limite))
+        return Response(lineas, mimetype='application/x-ndjson')
+    
+    mensajes = cola_datos.pagina(despues, limite)
     return jsonify({
         "total": len(cola_datos),
-        "mensajes": cola_datos
+        "mensajes": mensajes,
+        "siguiente": mensajes[-1]["id"] if len(mensajes) == limite else None
+    }), 200
+
+@app.route('/stats', methods=['GET'])
+def estadisticas():
+    """Resumen de la cola (profundidad, antigüedad, mensajes por nodo) sin recorrer los mensajes"""
+    return jsonify({
+        **estado_cola(),
+        "prioritarios": cola_datos.prioritarios(),
+        "por_nodo": cola_datos.por_nodo()
     }), 200
 
 @app.route('/consumir', methods=['POST'])
 def consumir_mensaje():
-    """Consume el siguiente mensaje de la cola (FIFO)"""
-    if not cola_datos:
+    """
+    Consume el siguiente mensaje de la cola: primero el carril prioritario y
+    dentro de cada carril en orden de llegada (FIFO).
+
+    Con `?max=N` entrega un lote de hasta N mensajes en arriendo: cada mensaje
+    incluye su `id` y debe confirmarse con `/ack`; si no se confirma antes de
+    `lease` segundos vuelve a entregarse.
+    
+    Con `?wait=S` la petición bloquea hasta S segundos (long-polling) si la
+    cola está vacía, en lugar de responder 404 de inmediato.
+    
+    Con `?particion=i&particiones=P` (junto a `max`) solo se entregan los
+    mensajes cuyo node_id cae en la partición i de P, para que varios
+    trabajadores se repartan los nodos sin romper el orden de cada uno.
+    """
+    try:
+        espera = min(float(request.args.get('wait', 0)), COLA_ESPERA_MAX_SEGUNDOS)
+    except ValueError as e:
+        return jsonify({"error": f"Parámetro inválido: {str(e)}"}), 400
+    
+    if 'max' in request.args:
+        try:
+            maximo = int(request.args['max'])
+            lease = float(request.args.get('lease', COLA_LEASE_SEGUNDOS))
+            particiones = int(request.args.get('particiones', 1))
+            indice = int(request.args.get('particion', 0))
+        except ValueError as e:
+            return jsonify({"error": f"Parámetro inválido: {str(e)}"}), 400
+        if maximo < 1 or lease <= 0:
+            return jsonify({"error": "max y lease deben ser positivos"}), 400
+        if particiones < 1 or not 0 <= indice < particiones:
+            return jsonify({"error": "particion debe estar entre 0 y particiones - 1"}), 400
+        
+        particion = (indice, particiones) if particiones > 1 else None
+        mensajes = consumir_con_espera(
+            lambda: cola_datos.consumir_lote(maximo, lease, particion), espera
+        )
+        if not mensajes:
+            return jsonify({"mensaje": "No hay mensajes en la cola"}), 404
+        
+        MENSAJES_ENTREGADOS.inc(valor=len(mensajes))
+        return jsonify({
+            "mensajes": mensajes,
+            "lease_segundos": lease,
+            "restantes": len(cola_datos) - len(mensajes)
+        }), 200
+    
+    mensaje = consumir_con_espera(cola_datos.consumir, espera)
+    if mensaje is None:
         return jsonify({"mensaje": "No hay mensajes en la cola"}), 404
     
-    mensaje = cola_datos.pop(0)
+    MENSAJES_ENTREGADOS.inc()
     return jsonify({
         "mensaje": mensaje,
         "restantes": len(cola_datos)
     }), 200
 
+@app.route('/ack', methods=['POST'])
+def confirmar_mensajes():
+    """
+    Confirma el procesamiento de mensajes arrendados y los elimina de la cola.
+    Solo cuentan los de arriendo vigente: uno vencido ya volvió a la cola y se
+    entrega de nuevo.
+    """
+    data = request.get_json(silent=True) or {}
+    ids = data.get('ids')
+    if not isinstance(ids, list):
+        return jsonify({"error": "Campo requerido faltante: ids"}), 400
+    
+    confirmados = cola_datos.confirmar(ids)
+    MENSAJES_CONFIRMADOS.inc(valor=confirmados)
+    return jsonify({
+        "confirmados": confirmados,
+        "restantes": len(cola_datos)
+    }), 200
+
 @app.route('/limpiar', methods=['POST'])
 def limpiar_cola():
     """Limpia todos los mensajes de la cola (para testing)"""
-    global cola_datos
-    total = len(cola_datos)
-    cola_datos = []
+    total = cola_datos.limpiar()
     return jsonify({
         "mensaje": f"Cola limpiada. Se eliminaron {total} mensajes"
     }), 200
 
 if __name__ == '__main__':
+    # Servidor de desarrollo; en producción: gunicorn -c gunicorn.conf.py app:app
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=True)
 
@@ -0,0 +1,483 @@
+"""
+Benchmarks de la cola de mediciones
+
+Uso:
+    python benchmark.py almacenamiento [--tamanos 10000 100000 1000000] [--operaciones 10000]
+    python benchmark.py lotes [--mensajes 20000] [--lotes 1 10 100 500] [--url http://localhost:5000]
+    python benchmark.py latencia [--muestras 30] [--sondeo 5] [--espera 20] [--url http://localhost:5000]
+    python benchmark.py desborde [--segundos 60] [--produccion 5000] [--consumo 2000] [--max-profundidad 20000]
+    python benchmark.py servidor [--segundos 15] [--productores 4] [--consumidores 2] [--workers 1 4]
+    python benchmark.py inspeccion [--profundidad 200000]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import orjson
+
+from almacenamiento import (
+    POLITICA_DESCARTAR_ANTIGUOS, POLITICA_RECHAZAR, PRIORIDAD_ALTA,
+    AlmacenamientoMemoria, AlmacenamientoSQLite, ColaLlena
+)
+
+
+def _mensaje(i: int) -> dict:
+    return {
+        "node_id": f"N{i % 8:02d}",
+        "ts": "2024-01-01T00:00:00Z",
+        "nivel_m": 0.42,
+        "lluvia_mm": 1.5,
+        "recibido_en": "2024-01-01T00:00:00Z"
+    }
+
+
+def _prellenar(backend, tamano: int, bloque: int = 10000):
+    for inicio in range(0, tamano, bloque):
+        backend.agregar_lote([_mensaje(i) for i in range(inicio, min(tamano, inicio + bloque))])
+
+
+def _medir_lista(tamano: int, operaciones: int) -> float:
+    """Implementación original: lista de Python con pop(0)"""
+    cola = [_mensaje(i) for i in range(tamano)]
+    inicio = time.perf_counter()
+    for i in range(operaciones):
+        cola.append(_mensaje(i))
+        cola.pop(0)
+    return time.perf_counter() - inicio
+
+
+def _medir_backend(backend, tamano: int, operaciones: int) -> float:
+    _prellenar(backend, tamano)
+    inicio = time.perf_counter()
+    for i in range(operaciones):
+        backend.agregar(_mensaje(i))
+        backend.consumir()
+    return time.perf_counter() - inicio
+
+
+def benchmark_almacenamiento(tamanos, operaciones: int):
+    """Costo por operación (encolar + desencolar) con la cola precargada a distintas profundidades"""
+    print(f"{'profundidad':>12} {'backend':>10} {'us/op':>10} {'ops/s':>12}")
+    for tamano in tamanos:
+        with tempfile.TemporaryDirectory() as directorio:
+            candidatos = [
+                ("lista", lambda: _medir_lista(tamano, operaciones)),
+                ("memoria", lambda: _medir_backend(AlmacenamientoMemoria(), tamano, operaciones)),
+                ("sqlite", lambda: _medir_backend(
+                    AlmacenamientoSQLite(os.path.join(directorio, "cola.db")), tamano, operaciones
+                )),
+            ]
+            for nombre, medir in candidatos:
+                segundos = medir()
+                print(f"{tamano:>12} {nombre:>10} {segundos / operaciones * 1e6:>10.2f} "
+                      f"{operaciones / segundos:>12.0f}")
+
+
+class _ClienteHTTP:
+    """Cliente mínimo sobre un servidor real (requests) o el test client de Flask"""
+
+    def __init__(self, url=None):
+        if url:
+            import requests
+            self._session = requests.Session()
+            self._url = url.rstrip('/')
+        else:
+            os.environ.setdefault('COLA_BACKEND', 'memoria')
+            import app as cola_app
+            self._test = cola_app.app.test_client()
+
+    def post(self, ruta: str, **kwargs):
+        if hasattr(self, '_test'):
+            respuesta = self._test.post(ruta, query_string=kwargs.get('params'), json=kwargs.get('json'))
+            return respuesta.status_code, respuesta.get_json()
+        respuesta = self._session.post(self._url + ruta, timeout=30, **kwargs)
+        return respuesta.status_code, respuesta.json()
+
+
+def benchmark_lotes(total: int, tamanos_lote, url=None):
+    """Mensajes/s consumidos y confirmados según el tamaño de lote de /consumir?max=N"""
+    cliente = _ClienteHTTP(url)
+    print(f"{'lote':>8} {'msg/s':>12} {'peticiones':>12}")
+    for tamano_lote in tamanos_lote:
+        cliente.post('/limpiar')
+        for inicio in range(0, total, 1000):
+            cliente.post('/mensajes/lote', json={
+                "mensajes": [_mensaje(i) for i in range(inicio, min(total, inicio + 1000))]
+            })
+
+        peticiones = 0
+        consumidos = 0
+        inicio = time.perf_counter()
+        while consumidos < total:
+            estado, cuerpo = cliente.post('/consumir', params={"max": tamano_lote})
+            if estado != 200:
+                break
+            ids = [m["id"] for m in cuerpo["mensajes"]]
+            cliente.post('/ack', json={"ids": ids})
+            consumidos += len(ids)
+            peticiones += 2
+        segundos = time.perf_counter() - inicio
+        print(f"{tamano_lote:>8} {consumidos / segundos:>12.0f} {peticiones:>12}")
+
+
+def _percentil(valores, p: float) -> float:
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
+
+
+def _medir_latencia(modo: str, muestras: int, sondeo: float, espera: float, url=None):
+    productor = _ClienteHTTP(url)
+    consumidor = _ClienteHTTP(url)
+    productor.post('/limpiar')
+    latencias = []
+
+    def consumir():
+        while len(latencias) < muestras:
+            params = {"max": 100}
+            if modo == "long-poll":
+                params["wait"] = espera
+            estado, cuerpo = consumidor.post('/consumir', params=params)
+            if estado != 200:
+                if modo == "sondeo":
+                    time.sleep(sondeo)
+                continue
+            recibido = time.time()
+            latencias.extend(recibido - m["enviado_en"] for m in cuerpo["mensajes"])
+            consumidor.post('/ack', json={"ids": [m["id"] for m in cuerpo["mensajes"]]})
+
+    hilo = threading.Thread(target=consumir, daemon=True)
+    hilo.start()
+    rng = random.Random(42)
+    for i in range(muestras):
+        # Llegadas espaciadas para que el consumidor encuentre la cola vacía
+        time.sleep(rng.uniform(0.2, 1.0))
+        productor.post('/mensaje', json={**_mensaje(i), "enviado_en": time.time()})
+    hilo.join()
+    return latencias
+
+
+def benchmark_latencia(muestras: int, sondeo: float, espera: float, url=None):
+    """Latencia ingesta -> entrega al ETL con sondeo cada `sondeo` s vs long-polling"""
+    print(f"{'modo':>10} {'media_ms':>10} {'p50_ms':>10} {'p99_ms':>10}")
+    for modo in ("sondeo", "long-poll"):
+        latencias = _medir_latencia(modo, muestras, sondeo, espera, url)
+        print(f"{modo:>10} {statistics.mean(latencias) * 1000:>10.1f} "
+              f"{_percentil(latencias, 0.5) * 1000:>10.1f} {_percentil(latencias, 0.99) * 1000:>10.1f}")
+
+
+# Duración simulada de cada vuelta del benchmark de desborde
+_TICK_S = 0.01
+
+
+def _inundar(cola, vueltas: int, por_vuelta: int, consumo_por_vuelta: int, carril: bool) -> dict:
+    """
+    Productor más rápido que el ETL: cada vuelta llega un lote de lecturas
+    normales y una vez por segundo una lectura de un nodo en ALERTA; el ETL
+    consume y confirma `consumo_por_vuelta`. Como el gateway, ante ColaLlena
+    se reintentan solas las prioritarias y las normales quedan afuera. Las
+    latencias se cuentan en vueltas simuladas.
+    """
+    cada_alerta = round(1 / _TICK_S)
+    latencias_alerta, latencias_normal = [], []
+    rechazados = maxima = 0
+    for vuelta in range(vueltas):
+        lote = [{**_mensaje(vuelta * por_vuelta + i), "vuelta": vuelta} for i in range(por_vuelta)]
+        if vuelta % cada_alerta == 0:
+            alerta = {**_mensaje(0), "node_id": "ALERTA", "vuelta": vuelta}
+            if carril:
+                alerta["prioridad"] = PRIORIDAD_ALTA
+            lote.append(alerta)
+        try:
+            cola.agregar_lote(lote)
+        except ColaLlena:
+            prioritarios = [m for m in lote if "prioridad" in m]
+            rechazados += len(lote) - len(prioritarios)
+            if prioritarios:
+                cola.agregar_lote(prioritarios)
+        maxima = max(maxima, len(cola))
+
+        mensajes = cola.consumir_lote(consumo_por_vuelta, 60)
+        cola.confirmar([m["id"] for m in mensajes])
+        for m in mensajes:
+            espera = (vuelta - m["vuelta"]) * _TICK_S
+            (latencias_alerta if m["node_id"] == "ALERTA" else latencias_normal).append(espera)
+    return {"maxima": maxima, "rechazados": rechazados,
+            "alerta": latencias_alerta, "normal": latencias_normal}
+
+
+def benchmark_desborde(segundos: float, produccion: int, consumo: int, max_profundidad: int):
+    """
+    Inunda la cola con el ETL más lento que el productor y compara la cola sin
+    límite ni carril prioritario (comportamiento original) con las dos
+    políticas de desborde: profundidad máxima, memoria y latencia de las
+    lecturas de alerta hasta que el ETL las recibe.
+    """
+    vueltas = int(segundos / _TICK_S)
+    por_vuelta = max(1, round(produccion * _TICK_S))
+    consumo_por_vuelta = max(1, round(consumo * _TICK_S))
+    print(f"{vueltas * por_vuelta} lecturas en {segundos:.0f} s simulados, ETL a {consumo} msg/s")
+    print(f"{'backend':>8} {'config':>20} {'prof_max':>9} {'MB':>7} {'rechaz':>8} {'descart':>8} "
+          f"{'alerta_p50':>11} {'alerta_max':>11} {'normal_p50':>11}")
+    configuraciones = [
+        ("sin límite", 0, POLITICA_RECHAZAR, False),
+        (POLITICA_RECHAZAR, max_profundidad, POLITICA_RECHAZAR, True),
+        (POLITICA_DESCARTAR_ANTIGUOS, max_profundidad, POLITICA_DESCARTAR_ANTIGUOS, True),
+    ]
+    for backend in ("memoria", "sqlite"):
+        for nombre, limite, politica, carril in configuraciones:
+            with tempfile.TemporaryDirectory() as directorio:
+                ruta = os.path.join(directorio, "cola.db")
+                descartados = []
+                if backend == "memoria":
+                    tracemalloc.start()
+                    cola = AlmacenamientoMemoria()
+                else:
+                    cola = AlmacenamientoSQLite(ruta)
+                cola.configurar_limite(limite, politica, descartados.append)
+                r = _inundar(cola, vueltas, por_vuelta, consumo_por_vuelta, carril)
+                if backend == "memoria":
+                    megas = tracemalloc.get_traced_memory()[1] / 1e6
+                    tracemalloc.stop()
+                else:
+                    megas = sum(os.path.getsize(ruta + sufijo) for sufijo in ("", "-wal")
+                                if os.path.exists(ruta + sufijo)) / 1e6
+            print(f"{backend:>8} {nombre:>20} {r['maxima']:>9} {megas:>7.1f} {r['rechazados']:>8} "
+                  f"{sum(descartados):>8} {_percentil(r['alerta'], 0.5):>10.2f}s "
+                  f"{max(r['alerta']):>10.2f}s {_percentil(r['normal'], 0.5):>10.2f}s")
+
+
+def _puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _arrancar_servidor(comando, entorno: dict, url: str) -> subprocess.Popen:
+    """Lanza el servidor en su propio grupo de procesos y espera a que responda /health"""
+    import requests
+    proceso = subprocess.Popen(
+        comando, cwd=os.path.dirname(os.path.abspath(__file__)), env={**os.environ, **entorno},
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True
+    )
+    limite = time.monotonic() + 30
+    while time.monotonic() < limite:
+        try:
+            if requests.get(url + "/health", timeout=1).status_code == 200:
+                return proceso
+        except requests.RequestException:
+            time.sleep(0.2)
+    os.killpg(proceso.pid, signal.SIGTERM)
+    raise RuntimeError(f"El servidor no arrancó: {' '.join(comando)}")
+
+
+def _cliente_mixto(url: str, rol: str, segundos: float, lote: int, resultados):
+    """Productor (POST /mensajes/lote) o consumidor (/consumir?max=100 + /ack) en su propio proceso"""
+    import requests
+    session = requests.Session()
+    latencias = {}
+    mensajes = errores = 0
+    fin = time.monotonic() + segundos
+    while time.monotonic() < fin:
+        inicio = time.perf_counter()
+        if rol == "productor":
+            endpoint = "lote"
+            respuesta = session.post(url + "/mensajes/lote", json={
+                "mensajes": [_mensaje(i) for i in range(lote)]
+            }, timeout=30)
+            ok = respuesta.status_code == 201
+            mensajes += lote if ok else 0
+        else:
+            endpoint = "consumir"
+            respuesta = session.post(url + "/consumir", params={"max": 100}, timeout=30)
+            ok = respuesta.status_code in (200, 404)
+            if respuesta.status_code == 200:
+                latencias.setdefault(endpoint, []).append(time.perf_counter() - inicio)
+                ids = [m["id"] for m in respuesta.json()["mensajes"]]
+                endpoint, inicio = "ack", time.perf_counter()
+                ok = session.post(url + "/ack", json={"ids": ids}, timeout=30).status_code == 200
+                mensajes += len(ids)
+        latencias.setdefault(endpoint, []).append(time.perf_counter() - inicio)
+        errores += not ok
+    resultados.put((rol, latencias, mensajes, errores))
+
+
+def _medir_servidor(url: str, segundos: float, productores: int, consumidores: int, lote: int) -> dict:
+    resultados = multiprocessing.Queue()
+    clientes = [
+        multiprocessing.Process(target=_cliente_mixto, args=(url, rol, segundos, lote, resultados))
+        for rol in ["productor"] * productores + ["consumidor"] * consumidores
+    ]
+    for cliente in clientes:
+        cliente.start()
+    latencias = {}
+    recibidos = entregados = errores = 0
+    for _ in clientes:
+        rol, por_endpoint, mensajes, fallidas = resultados.get()
+        for endpoint, valores in por_endpoint.items():
+            latencias.setdefault(endpoint, []).extend(valores)
+        if rol == "productor":
+            recibidos += mensajes
+        else:
+            entregados += mensajes
+        errores += fallidas
+    for cliente in clientes:
+        cliente.join()
+    return {"latencias": latencias, "recibidos": recibidos, "entregados": entregados, "errores": errores}
+
+
+def _serializacion(lote: int, repeticiones: int = 2000):
+    """µs por lote de json (stdlib) vs orjson: cuerpo de /mensajes/lote de ida y vuelta"""
+    cuerpo = {"mensajes": [{**_mensaje(i), "ts_ms": 1704067200000 + i} for i in range(lote)]}
+    for nombre, dumps, loads in (("json", json.dumps, json.loads), ("orjson", orjson.dumps, orjson.loads)):
+        inicio = time.perf_counter()
+        for _ in range(repeticiones):
+            loads(dumps(cuerpo))
+        print(f"{nombre:>8} {(time.perf_counter() - inicio) / repeticiones * 1e6:>10.1f} us/lote de {lote}")
+
+
+def benchmark_servidor(segundos: float, productores: int, consumidores: int, lote: int, workers):
+    """
+    Peticiones/s y p99 con carga mixta de productores y consumidores contra el
+    servidor de desarrollo de Flask (python app.py) y contra gunicorn con
+    distintos números de workers, todos sobre SQLite
+    """
+    _serializacion(lote)
+    modos = [("flask dev", [sys.executable, "app.py"], 1)]
+    modos += [(f"gunicorn x{n}", [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"], n)
+              for n in workers]
+    print(f"{'servidor':>12} {'req/s':>8} {'in msg/s':>9} {'out msg/s':>10} {'errores':>8} "
+          f"{'lote_p50':>9} {'lote_p99':>9} {'cons_p99':>9} {'ack_p99':>9}")
+    for nombre, comando, n in modos:
+        with tempfile.TemporaryDirectory() as directorio:
+            puerto = _puerto_libre()
+            url = f"http://127.0.0.1:{puerto}"
+            proceso = _arrancar_servidor(comando, {
+                "PORT": str(puerto), "COLA_BACKEND": "sqlite", "COLA_WORKERS": str(n),
+                "COLA_DB_PATH": os.path.join(directorio, "cola.db"), "COLA_MAX_PROFUNDIDAD": "0",
+            }, url)
+            try:
+                r = _medir_servidor(url, segundos, productores, consumidores, lote)
+            finally:
+                os.killpg(proceso.pid, signal.SIGTERM)
+                proceso.wait()
+        lat = r["latencias"]
+        peticiones = sum(len(valores) for valores in lat.values())
+        p = lambda endpoint, q: _percentil(lat[endpoint], q) * 1000 if lat.get(endpoint) else float("nan")
+        print(f"{nombre:>12} {peticiones / segundos:>8.0f} {r['recibidos'] / segundos:>9.0f} "
+              f"{r['entregados'] / segundos:>10.0f} {r['errores']:>8} {p('lote', 0.5):>7.1f}ms "
+              f"{p('lote', 0.99):>7.1f}ms {p('consumir', 0.99):>7.1f}ms {p('ack', 0.99):>7.1f}ms")
+
+
+def _medir_inspeccion(cola, nombre: str, inspeccionar):
+    """Tiempo total, pico de memoria y la llamada a `pagina` más larga (cota del tiempo con la cola tomada)"""
+    pagina = cola.pagina
+    bloqueos = [0.0]
+
+    def pagina_medida(despues, limite):
+        inicio = time.perf_counter()
+        try:
+            return pagina(despues, limite)
+        finally:
+            bloqueos.append(time.perf_counter() - inicio)
+
+    cola.pagina = pagina_medida
+    tracemalloc.start()
+    inicio = time.perf_counter()
+    inspeccionar(cola)
+    segundos = time.perf_counter() - inicio
+    pico = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del cola.pagina
+    print(f"{nombre:>16} {segundos * 1000:>10.1f} {pico / 1e6:>10.1f} {max(bloqueos) * 1000:>12.1f}")
+
+
+def _ndjson(cola):
+    for mensaje in cola.iterar(tamano_pagina=1000):
+        orjson.dumps(mensaje)
+
+
+def benchmark_inspeccion(profundidad: int):
+    """
+    Costo de inspeccionar una cola profunda: la respuesta completa de antes
+    (toda la cola en un JSON) vs una página, el recorrido NDJSON y /stats
+    """
+    print(f"{'backend':>8} {'consulta':>16} {'ms':>10} {'pico_MB':>10} {'bloqueo_ms':>12}")
+    with tempfile.TemporaryDirectory() as directorio:
+        for backend, cola in (("memoria", AlmacenamientoMemoria()),
+                              ("sqlite", AlmacenamientoSQLite(os.path.join(directorio, "cola.db")))):
+            _prellenar(cola, profundidad)
+            consultas = [
+                ("completa", lambda c: orjson.dumps({"mensajes": c.pagina(-1, len(c))})),
+                ("página de 100", lambda c: orjson.dumps({"mensajes": c.pagina(-1, 100)})),
+                ("ndjson", _ndjson),
+                ("stats", lambda c: orjson.dumps({"por_nodo": c.por_nodo(), "antiguedad_s": c.antiguedad(),
+                                                  "prioritarios": c.prioritarios(), "total": len(c)})),
+            ]
+            for nombre, inspeccionar in consultas:
+                print(f"{backend:>8}", end=" ")
+                _medir_inspeccion(cola, nombre, inspeccionar)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de la cola")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+
+    p_alm = subparsers.add_parser("almacenamiento", help="Compara lista vs backends de almacenamiento")
+    p_alm.add_argument("--tamanos", type=int, nargs="+", default=[10000, 100000, 1000000])
+    p_alm.add_argument("--operaciones", type=int, default=10000)
+
+    p_lotes = subparsers.add_parser("lotes", help="Throughput de consumo por lotes con lease/ack")
+    p_lotes.add_argument("--mensajes", type=int, default=20000)
+    p_lotes.add_argument("--lotes", type=int, nargs="+", default=[1, 10, 100, 500])
+    p_lotes.add_argument("--url", default=None, help="Cola en ejecución; por defecto usa el test client")
+
+    p_lat = subparsers.add_parser("latencia", help="Latencia de entrega: sondeo vs long-polling")
+    p_lat.add_argument("--muestras", type=int, default=30)
+    p_lat.add_argument("--sondeo", type=float, default=5.0, help="Pausa del ETL con la cola vacía")
+    p_lat.add_argument("--espera", type=float, default=20.0, help="Parámetro wait del long-polling")
+    p_lat.add_argument("--url", default=None, help="Cola en ejecución; por defecto usa el test client")
+
+    p_des = subparsers.add_parser("desborde", help="Inunda la cola con el ETL atrasado: memoria y latencia de alertas")
+    p_des.add_argument("--segundos", type=float, default=60, help="Duración simulada de la inundación")
+    p_des.add_argument("--produccion", type=int, default=5000, help="Lecturas/s que llegan")
+    p_des.add_argument("--consumo", type=int, default=2000, help="Lecturas/s que procesa el ETL")
+    p_des.add_argument("--max-profundidad", type=int, default=20000)
+
+    p_srv = subparsers.add_parser("servidor", help="Carga mixta contra el servidor de desarrollo y gunicorn")
+    p_srv.add_argument("--segundos", type=float, default=15)
+    p_srv.add_argument("--productores", type=int, default=4)
+    p_srv.add_argument("--consumidores", type=int, default=2)
+    p_srv.add_argument("--lote", type=int, default=20, help="Mediciones por POST /mensajes/lote")
+    p_srv.add_argument("--workers", type=int, nargs="+", default=[1, 4], help="Workers de gunicorn a comparar")
+
+    p_ins = subparsers.add_parser("inspeccion", help="Memoria y bloqueo de /mensajes y /stats con la cola profunda")
+    p_ins.add_argument("--profundidad", type=int, default=200000)
+
+    args = parser.parse_args()
+    if args.comando == "almacenamiento":
+        benchmark_almacenamiento(args.tamanos, args.operaciones)
+    elif args.comando == "lotes":
+        benchmark_lotes(args.mensajes, args.lotes, args.url)
+    elif args.comando == "latencia":
+        benchmark_latencia(args.muestras, args.sondeo, args.espera, args.url)
+    elif args.comando == "desborde":
+        benchmark_desborde(args.segundos, args.produccion, args.consumo, args.max_profundidad)
+    elif args.comando == "servidor":
+        benchmark_servidor(args.segundos, args.productores, args.consumidores, args.lote, args.workers)
+    elif args.comando == "inspeccion":
+        benchmark_inspeccion(args.profundidad)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,21 @@
+"""
+Configuración de gunicorn para la cola en producción:
+
+    gunicorn -c gunicorn.conf.py app:app
+
+Cada worker atiende COLA_HILOS peticiones a la vez (gthread), lo que hace
+falta porque /consumir?wait=N deja un hilo bloqueado durante el long-polling.
+Con COLA_WORKERS > 1 los procesos comparten la cola a través del archivo
+SQLite; la cola en memoria solo funciona con un worker. En ese caso /metrics
+expone solo los medidores leídos del archivo, no los contadores de cada proceso.
+"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('COLA_WORKERS', 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('COLA_HILOS', 16))
+# Margen sobre el long-polling más largo permitido
+timeout = int(float(os.environ.get('COLA_ESPERA_MAX_SEGUNDOS', 30))) + 30
+# El gateway y el ETL reutilizan la conexión entre lotes
+keepalive = 30
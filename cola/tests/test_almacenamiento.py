@@ -0,0 +1,207 @@
+"""
+Límite de profundidad y carril prioritario de los dos backends de la cola:
+la profundidad nunca pasa de `max_profundidad` con ninguna política, un
+prioritario nunca se descarta y el carril prioritario se consume antes que
+el atraso normal.
+"""
+import random
+import zlib
+
+import pytest
+
+from almacenamiento import (POLITICA_DESCARTAR_ANTIGUOS, POLITICA_RECHAZAR, POLITICAS_DESBORDE,
+                            AlmacenamientoSQLite, ColaLlena, clave_nodo, crear_almacenamiento)
+
+MAXIMO = 20
+
+
+def _mensaje(node_id: str, valor: int, prioritario: bool = False) -> dict:
+    mensaje = {'node_id': node_id, 'ts': '2024-01-01T00:00:00Z', 'nivel_m': valor, 'lluvia_mm': 0.0}
+    if prioritario:
+        mensaje['prioridad'] = 'alta'
+    return mensaje
+
+
+@pytest.fixture(params=['memoria', 'sqlite'])
+def crear(request, tmp_path):
+    """Fábrica de colas del backend del parámetro; cuenta los descartes en `descartados`"""
+    descartados = []
+
+    def crear(max_profundidad: int = MAXIMO, politica: str = POLITICA_RECHAZAR):
+        cola = crear_almacenamiento(request.param, str(tmp_path / 'cola.db'), max_profundidad, politica,
+                                    al_descartar=descartados.append)
+        cola.descartados = descartados
+        return cola
+
+    return crear
+
+
+def _prioritarios_recorriendo(cola) -> int:
+    """El conteo de prioritarios recorriendo los mensajes, para comparar con el que mantiene el backend"""
+    if isinstance(cola, AlmacenamientoSQLite):
+        return cola._conn.execute("SELECT COUNT(*) FROM mensajes WHERE prioridad = 1").fetchone()[0]
+    return len(cola._prioritarios) + sum(prioritario for _, _, prioritario in cola._arrendados.values())
+
+
+def test_rechazar_no_pasa_del_maximo(crear):
+    cola = crear(politica=POLITICA_RECHAZAR)
+    cola.agregar_lote([_mensaje('N000', i) for i in range(MAXIMO)])
+    with pytest.raises(ColaLlena):
+        cola.agregar(_mensaje('N001', 0))
+    # El lote se rechaza entero aunque una parte cupiera
+    cola.consumir()
+    with pytest.raises(ColaLlena):
+        cola.agregar_lote([_mensaje('N001', 0), _mensaje('N001', 1)])
+    assert len(cola) == MAXIMO - 1
+    assert cola.descartados == []
+
+
+def test_rechazar_un_prioritario_desplaza_al_normal_mas_antiguo(crear):
+    cola = crear(politica=POLITICA_RECHAZAR)
+    cola.agregar_lote([_mensaje('N000', i) for i in range(MAXIMO)])
+    cola.agregar(_mensaje('N001', 99, prioritario=True))
+    assert len(cola) == MAXIMO
+    assert cola.descartados == [1]
+    assert [m['nivel_m'] for m in cola.iterar()] == list(range(1, MAXIMO)) + [99]
+
+
+def test_descartar_antiguos_no_pasa_del_maximo(crear):
+    cola = crear(politica=POLITICA_DESCARTAR_ANTIGUOS)
+    for i in range(3 * MAXIMO):
+        cola.agregar(_mensaje(f'N{i % 3:03d}', i))
+        assert len(cola) <= MAXIMO
+    # Quedan los más recientes, en orden
+    assert [m['nivel_m'] for m in cola.iterar()] == list(range(2 * MAXIMO, 3 * MAXIMO))
+    assert sum(cola.descartados) == 2 * MAXIMO
+    assert cola.por_nodo() == {'N000': 6, 'N001': 7, 'N002': 7}
+
+
+@pytest.mark.parametrize('politica', POLITICAS_DESBORDE)
+def test_los_prioritarios_nunca_se_descartan(crear, politica):
+    cola = crear(politica=politica)
+    cola.agregar_lote([_mensaje('N000', i) for i in range(MAXIMO // 2)])
+    cola.agregar_lote([_mensaje(f'P{i:03d}', i, prioritario=True) for i in range(MAXIMO)])
+    assert len(cola) == MAXIMO
+    assert cola.prioritarios() == MAXIMO
+    # Sin normales que desplazar, ni un prioritario más ni un normal entran
+    for mensaje in (_mensaje('P999', 0, prioritario=True), _mensaje('N000', 0)):
+        with pytest.raises(ColaLlena):
+            cola.agregar(mensaje)
+    assert sorted(m['node_id'] for m in cola.iterar()) == [f'P{i:03d}' for i in range(MAXIMO)]
+
+
+@pytest.mark.parametrize('politica', POLITICAS_DESBORDE)
+def test_los_arrendados_cuentan_y_no_se_descartan(crear, politica):
+    cola = crear(politica=politica)
+    cola.agregar_lote([_mensaje('N000', i) for i in range(MAXIMO)])
+    arrendados = cola.consumir_lote(MAXIMO, 60)
+    assert len(arrendados) == MAXIMO
+    with pytest.raises(ColaLlena):
+        cola.agregar(_mensaje('N001', 0, prioritario=True))
+    assert cola.confirmar([m['id'] for m in arrendados]) == MAXIMO
+    cola.agregar(_mensaje('N001', 0))
+    assert len(cola) == 1
+
+
+@pytest.mark.parametrize('politica', POLITICAS_DESBORDE)
+def test_profundidad_acotada_con_carga_aleatoria(crear, politica):
+    cola = crear(politica=politica)
+    rng = random.Random(7)
+    arrendados = []
+    for paso in range(500):
+        operacion = rng.random()
+        if operacion < 0.6:
+            lote = [_mensaje(f'N{rng.randrange(8):03d}', paso, rng.random() < 0.2) for _ in range(rng.randint(1, 5))]
+            try:
+                cola.agregar_lote(lote)
+            except ColaLlena:
+                pass
+        elif operacion < 0.8:
+            # Con arriendo 0 el lote vuelve a la cola en la operación siguiente
+            arrendados.extend(cola.consumir_lote(rng.randint(1, 4), rng.choice([0, 60])))
+        elif operacion < 0.85:
+            cola.consumir()
+        elif arrendados:
+            rng.shuffle(arrendados)
+            cola.confirmar([m['id'] for m in arrendados[:3]])
+            del arrendados[:3]
+        assert len(cola) <= MAXIMO
+        assert sum(cola.por_nodo().values()) == len(cola)
+        assert cola.prioritarios() == _prioritarios_recorriendo(cola)
+
+
+def test_prioritarios_antes_que_el_atraso(crear):
+    cola = crear(max_profundidad=0)
+    cola.agregar_lote([_mensaje(f'N{i % 5:03d}', i) for i in range(100)])
+    cola.agregar_lote([_mensaje('P000', 1000, prioritario=True), _mensaje('P001', 1001, prioritario=True)])
+    cola.agregar(_mensaje('P000', 1002, prioritario=True))
+    assert cola.prioritarios() == 3
+
+    lote = cola.consumir_lote(5, 60)
+    assert [m['nivel_m'] for m in lote] == [1000, 1001, 1002, 0, 1]
+    assert cola.consumir()['nivel_m'] == 2
+    # Arrendados siguen contando hasta que se confirman
+    assert cola.prioritarios() == 3
+    cola.confirmar([m['id'] for m in lote])
+    assert cola.prioritarios() == 0
+    cola.agregar(_mensaje('P000', 1003, prioritario=True))
+    assert cola.limpiar() == 98 and cola.prioritarios() == 0
+
+
+def test_prioritario_promueve_los_pendientes_de_su_nodo(crear):
+    cola = crear(max_profundidad=0)
+    cola.agregar_lote([_mensaje(f'N{i % 2:03d}', i) for i in range(6)])
+    cola.agregar(_mensaje('N001', 10, prioritario=True))
+    # N001 sale primero y en orden; después el atraso de N000
+    assert [m['nivel_m'] for m in cola.consumir_lote(10, 60)] == [1, 3, 5, 10, 0, 2, 4]
+
+
+def test_prioritarios_antes_que_el_atraso_por_particion(crear):
+    cola = crear(max_profundidad=0)
+    # Dos nodos por partición de dos
+    ids = (f'N{i:03d}' for i in range(1000))
+    nodos = {0: [], 1: []}
+    for node_id in ids:
+        particion = nodos[clave_nodo({'node_id': node_id}) % 2]
+        if len(particion) < 2:
+            particion.append(node_id)
+    cola.agregar_lote([_mensaje(nodos[i % 2][i // 2 % 2], i) for i in range(40)])
+    cola.agregar_lote([_mensaje(nodos[p][1], 100 + p, prioritario=True) for p in (0, 1)])
+    for numero in range(2):
+        lote = cola.consumir_lote(50, 60, (numero, 2))
+        prioritario, normal = nodos[numero][1], nodos[numero][0]
+        # El nodo con prioritario sale entero primero (promovido, en orden), después el atraso
+        assert [m['node_id'] for m in lote] == [prioritario] * 11 + [normal] * 10
+        assert lote[10]['nivel_m'] == 100 + numero
+
+
+@pytest.mark.parametrize('particiones', [2, 3, 4])
+def test_cada_nodo_pertenece_a_una_sola_particion(crear, particiones):
+    """Un consumidor recibe exactamente los nodos con crc32(node_id) % particiones == su índice"""
+    cola = crear(max_profundidad=0)
+    nodos = [f'N{i:03d}' for i in range(40)]
+    cola.agregar_lote([_mensaje(node_id, i) for i in range(3) for node_id in nodos])
+    for indice in range(particiones):
+        lote = cola.consumir_lote(1000, 60, (indice, particiones))
+        esperados = [n for n in nodos if zlib.crc32(n.encode('utf-8')) % particiones == indice]
+        assert sorted({m['node_id'] for m in lote}) == esperados
+        assert len(lote) == 3 * len(esperados)
+    assert cola.consumir_lote(1000, 60) == []
+
+
+@pytest.fixture
+def cliente(monkeypatch):
+    monkeypatch.setenv('COLA_BACKEND', 'memoria')
+    import app
+
+    monkeypatch.setattr(app, 'cola_datos', crear_almacenamiento('memoria', max_profundidad=2))
+    return app.app.test_client()
+
+
+def test_cola_llena_responde_429(cliente):
+    cuerpo = {'mensajes': [_mensaje('N000', 0), _mensaje('N000', 1)]}
+    assert cliente.post('/mensajes/lote', json=cuerpo).status_code == 201
+    respuesta = cliente.post('/mensaje', json=_mensaje('N000', 2))
+    assert respuesta.status_code == 429
+    assert respuesta.headers['Retry-After']
+    assert respuesta.get_json()['total_en_cola'] == 2
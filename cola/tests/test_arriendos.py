@@ -0,0 +1,136 @@
+"""
+Arriendos y confirmaciones (/consumir?max=N, /ack) en los dos backends: un
+mensaje sin confirmar vuelve a entregarse al vencer su arriendo, y solo un
+arriendo vigente lo confirma.
+"""
+import types
+
+import pytest
+
+import almacenamiento
+from almacenamiento import crear_almacenamiento
+
+LEASE = 30
+
+
+class Reloj:
+    def __init__(self):
+        self.ahora = 1_700_000_000.0
+
+    def time(self) -> float:
+        return self.ahora
+
+    def avanzar(self, segundos: float):
+        self.ahora += segundos
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    reloj = Reloj()
+    monkeypatch.setattr(almacenamiento, 'time', types.SimpleNamespace(time=reloj.time))
+    return reloj
+
+
+@pytest.fixture(params=['memoria', 'sqlite'])
+def cola(request, tmp_path, reloj):
+    return crear_almacenamiento(request.param, str(tmp_path / 'cola.db'))
+
+
+def _mensaje(valor: int) -> dict:
+    return {'node_id': 'N000', 'ts': '2024-01-01T00:00:00Z', 'nivel_m': valor, 'lluvia_mm': 0.0}
+
+
+def _ids(mensajes) -> list:
+    return [m['id'] for m in mensajes]
+
+
+def test_vuelve_a_entregarse_al_vencer_el_arriendo(cola, reloj):
+    ids = cola.agregar_lote([_mensaje(0), _mensaje(1)])
+    assert _ids(cola.consumir_lote(10, LEASE)) == ids
+    # Arrendados: no se entregan de nuevo ni se pierden
+    assert cola.consumir_lote(10, LEASE) == []
+    assert len(cola) == 2
+
+    reloj.avanzar(LEASE + 1)
+    reentregados = cola.consumir_lote(10, LEASE)
+    assert _ids(reentregados) == ids
+    assert [m['nivel_m'] for m in reentregados] == [0, 1]
+
+
+def test_vencido_antes_de_un_nuevo_mensaje_sale_primero(cola, reloj):
+    primero = cola.agregar(_mensaje(0))
+    cola.consumir_lote(1, LEASE)
+    reloj.avanzar(LEASE + 1)
+    cola.agregar(_mensaje(1))
+    assert _ids(cola.consumir_lote(1, LEASE)) == [primero]
+
+
+def test_confirmar_solo_con_el_arriendo_vigente(cola, reloj):
+    confirmado, arrendado, vencido = cola.agregar_lote([_mensaje(0), _mensaje(1), _mensaje(2)])
+    assert _ids(cola.consumir_lote(1, LEASE)) == [confirmado]
+    assert cola.confirmar([confirmado]) == 1
+    assert _ids(cola.consumir_lote(1, LEASE)) == [arrendado]
+    assert _ids(cola.consumir_lote(1, 5)) == [vencido]
+
+    # Desconocido, ya confirmado, y el mismo id dos veces en una petición
+    assert cola.confirmar([999, confirmado]) == 0
+    assert cola.confirmar([arrendado, arrendado]) == 1
+
+    reloj.avanzar(10)
+    assert cola.confirmar([vencido]) == 0
+    assert len(cola) == 1
+    assert _ids(cola.consumir_lote(10, LEASE)) == [vencido]
+    assert cola.confirmar([vencido]) == 1
+    assert len(cola) == 0
+
+
+def test_no_se_confirma_un_mensaje_nunca_arrendado(cola):
+    mensaje_id = cola.agregar(_mensaje(0))
+    assert cola.confirmar([mensaje_id]) == 0
+    assert _ids(cola.consumir_lote(10, LEASE)) == [mensaje_id]
+
+
+def test_confirmacion_que_compite_con_la_reentrega(cola, reloj):
+    """
+    A arrienda y se atrasa; el mensaje vuelve a entregarse a B. La
+    confirmación de A llega con el arriendo de B vigente y lo elimina: B ya
+    no puede confirmarlo y el mensaje no vuelve a entregarse.
+    """
+    mensaje_id = cola.agregar(_mensaje(0))
+    assert _ids(cola.consumir_lote(1, LEASE)) == [mensaje_id]  # A
+    reloj.avanzar(LEASE + 1)
+    assert _ids(cola.consumir_lote(1, LEASE)) == [mensaje_id]  # B
+
+    assert cola.confirmar([mensaje_id]) == 1  # A
+    assert cola.confirmar([mensaje_id]) == 0  # B
+    reloj.avanzar(LEASE + 1)
+    assert cola.consumir_lote(10, LEASE) == []
+    assert len(cola) == 0 and cola.por_nodo() == {}
+
+
+@pytest.fixture
+def cliente(monkeypatch, reloj):
+    monkeypatch.setenv('COLA_BACKEND', 'memoria')
+    import app
+
+    monkeypatch.setattr(app, 'cola_datos', crear_almacenamiento('memoria'))
+    return app.app.test_client()
+
+
+def test_consumir_y_confirmar_por_http(cliente, reloj):
+    cuerpo = {'mensajes': [_mensaje(0), _mensaje(1)]}
+    assert cliente.post('/mensajes/lote', json=cuerpo).status_code == 201
+
+    respuesta = cliente.post(f'/consumir?max=10&lease={LEASE}')
+    assert respuesta.status_code == 200
+    ids = _ids(respuesta.get_json()['mensajes'])
+    assert len(ids) == 2
+    assert cliente.post('/consumir?max=10').status_code == 404
+
+    reloj.avanzar(LEASE + 1)
+    assert _ids(cliente.post(f'/consumir?max=10&lease={LEASE}').get_json()['mensajes']) == ids
+    respuesta = cliente.post('/ack', json={'ids': ids + [999]})
+    assert respuesta.get_json() == {'confirmados': 2, 'restantes': 0}
+
+    assert cliente.post('/ack', json={}).status_code == 400
+    assert cliente.post('/consumir?max=10&lease=0').status_code == 400
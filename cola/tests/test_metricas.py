@@ -0,0 +1,34 @@
+"""
+/metrics con uno y con varios workers: con varios solo salen los medidores
+que se leen del almacenamiento compartido, no los contadores de cada proceso.
+"""
+import pytest
+
+from almacenamiento import crear_almacenamiento
+
+
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.setenv('COLA_BACKEND', 'memoria')
+    import app
+
+    monkeypatch.setattr(app, 'cola_datos', crear_almacenamiento('memoria'))
+    return app
+
+
+def _nombres(cliente) -> set:
+    respuesta = cliente.get('/metrics')
+    assert respuesta.status_code == 200
+    return {linea.split()[2] for linea in respuesta.get_data(as_text=True).splitlines()
+            if linea.startswith('# TYPE')}
+
+
+def test_un_worker_expone_todo(app):
+    nombres = _nombres(app.app.test_client())
+    assert {'cola_profundidad', 'cola_mensajes_recibidos_total', 'cola_ingesta_segundos'} <= nombres
+
+
+def test_varios_workers_solo_los_medidores(app, monkeypatch):
+    monkeypatch.setattr(app, 'COLA_WORKERS', 2)
+    assert _nombres(app.app.test_client()) == {
+        'cola_profundidad', 'cola_profundidad_prioritaria', 'cola_antiguedad_segundos'}
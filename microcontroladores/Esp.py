@@ -11,9 +11,50 @@
 #define LORA_DIO0 26
 #define BAND 915E6 // ajustar según región
 
+// Trama binaria v1 (20 bytes, ver trama.py). Con 0 se envía el JSON anterior
+#define USAR_TRAMA_BINARIA 1
+#define TRAMA_MAGIC 0xA7
+#define TRAMA_VERSION 1
+#define TAMANO_TRAMA 20
+
 NewPing sonar(TRIGGER_PIN, ECHO_PIN, MAX_DISTANCE);
 
 String node_id = "N01";
+uint16_t seq = 0;
+
+// CRC-16/CCITT-FALSE (polinomio 0x1021, valor inicial 0xFFFF)
+uint16_t crc16_ccitt(const uint8_t *data, size_t len) {
+  uint16_t crc = 0xFFFF;
+  for (size_t i = 0; i < len; i++) {
+    crc ^= (uint16_t)data[i] << 8;
+    for (int b = 0; b < 8; b++) {
+      crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
+    }
+  }
+  return crc;
+}
+
+void escribir_u16(uint8_t *p, uint16_t v) {
+  p[0] = v & 0xFF;
+  p[1] = (v >> 8) & 0xFF;
+}
+
+void escribir_u32(uint8_t *p, uint32_t v) {
+  for (int i = 0; i < 4; i++) p[i] = (v >> (8 * i)) & 0xFF;
+}
+
+// Arma la trama little-endian: magic, versión, node_id[4], ts, nivel_mm, lluvia_dmm, seq, crc
+void armar_trama(uint8_t *trama, uint32_t ts, float nivel_m, float lluvia_mm) {
+  memset(trama, 0, TAMANO_TRAMA);
+  trama[0] = TRAMA_MAGIC;
+  trama[1] = TRAMA_VERSION;
+  for (int i = 0; i < 4 && i < (int)node_id.length(); i++) trama[2 + i] = node_id[i];
+  escribir_u32(trama + 6, ts);
+  escribir_u32(trama + 10, (uint32_t)(int32_t)lroundf(nivel_m * 1000));
+  escribir_u16(trama + 14, (uint16_t)lroundf(lluvia_mm * 10));
+  escribir_u16(trama + 16, seq++);
+  escribir_u16(trama + 18, crc16_ccitt(trama, TAMANO_TRAMA - 2));
+}
 
 void setup() {
   Serial.begin(115200);
@@ -35,6 +76,15 @@ void loop() {
   float nivel_m = distance_cm / 100.0; // convertir a metros
   float lluvia_mm = random(0, 50) / 10.0; // simulación de lluvia 0-5mm
 
+#if USAR_TRAMA_BINARIA
+  uint8_t trama[TAMANO_TRAMA];
+  armar_trama(trama, (uint32_t)time(nullptr), nivel_m, lluvia_mm);
+
+  Serial.println("Enviando trama binaria seq " + String(seq - 1));
+  LoRa.beginPacket();
+  LoRa.write(trama, TAMANO_TRAMA);
+  LoRa.endPacket();
+#else
   // generar JSON
   String payload = "{";
   payload += "\"node_id\":\"" + node_id + "\",";
@@ -47,6 +97,7 @@ void loop() {
   LoRa.beginPacket();
   LoRa.print(payload);
   LoRa.endPacket();
+#endif
 
   delay(1000); // cada 1s
 }
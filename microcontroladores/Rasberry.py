@@ -1,8 +1,9 @@
 import socket
 import time
-import json
 from lora import LoRa  # librería pyLoRa
 
+from trama import decodificar
+
 UDP_HOST = "127.0.0.1"
 UDP_PORT = 5005
 
@@ -15,11 +16,13 @@ print("Gateway LoRa iniciado, reenviando a UDP localhost:5005...")
 
 while True:
     if lora.received_packet():
-        payload = lora.read_payload().decode()
+        # Se reenvía el payload sin modificar (trama binaria o JSON); solo se
+        # decodifica para validarlo y registrarlo
+        payload = bytes(lora.read_payload())
         try:
-            data = json.loads(payload)
+            data = decodificar(payload)
             print(f"[RX-LORA] {data}")
-            sock.sendto(payload.encode(), (UDP_HOST, UDP_PORT))
-        except Exception as e:
-            print("Error parseando JSON LoRa:", e)
+            sock.sendto(payload, (UDP_HOST, UDP_PORT))
+        except ValueError as e:
+            print("Error decodificando payload LoRa:", e)
     time.sleep(0.1)
@@ -0,0 +1,38 @@
+"""
+Benchmark de decodificación de payloads de sensores: JSON vs trama binaria v1
+
+Uso:
+    python benchmark.py [--mensajes 200000]
+"""
+import argparse
+import json
+import time
+
+from trama import codificar, decodificar
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput de decodificación JSON vs binario")
+    parser.add_argument("--mensajes", type=int, default=200000)
+    args = parser.parse_args()
+
+    ts = 1700000000
+    payloads = {
+        "json": [
+            json.dumps({"node_id": f"N{i % 64:02d}", "ts": str(ts + i), "nivel_m": 0.42, "lluvia_mm": 1.5}).encode()
+            for i in range(args.mensajes)
+        ],
+        "binario": [codificar(f"N{i % 64:02d}", ts + i, 0.42, 1.5, i) for i in range(args.mensajes)],
+    }
+
+    print(f"{'formato':>8} {'bytes':>6} {'msg/s':>12} {'us/msg':>8}")
+    for formato, lista in payloads.items():
+        inicio = time.perf_counter()
+        for payload in lista:
+            decodificar(payload)
+        segundos = time.perf_counter() - inicio
+        print(f"{formato:>8} {len(lista[0]):>6} {len(lista) / segundos:>12.0f} {segundos / len(lista) * 1e6:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,643 @@
+"""
+Benchmarks del gateway
+
+Uso:
+    python benchmark.py pipeline [--paquetes 5000] [--nodos 200] [--tasa 300] [--caida-s 0]
+    python benchmark.py io [--paquetes 10000] [--nodos 50]
+    python benchmark.py decodificacion [--paquetes 100000]
+    python benchmark.py logs [--paquetes 20000] [--lector-kb-s 0]
+    python benchmark.py detector [--nodos 10000] [--lecturas 50]
+    python benchmark.py replay [--semillas 20] [--periodo 8]
+    python benchmark.py ingesta [--nodos 1000] [--lecturas 50] [--duplicados 0.05] [--desorden 0.05]
+    python benchmark.py reglas [--lecturas 1000000]
+"""
+import argparse
+import builtins
+import collections
+import contextlib
+import io
+import json
+import logging
+import os
+import queue
+import random
+import socket
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import detector
+import gateway
+import ingesta
+import registro
+import reglas
+import sensor_simulator
+import trama
+
+
+def _puerto_libre(tipo=socket.SOCK_STREAM) -> int:
+    with socket.socket(socket.AF_INET, tipo) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _cola_falsa(latencia_s: float = 0.0):
+    """
+    Stub HTTP de la cola que registra el instante de llegada de cada ts (único
+    por paquete en el generador). Mientras `caida` esté activo responde 503.
+    """
+    llegadas = {}
+    caida = threading.Event()
+
+    class Manejador(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Cabeceras y cuerpo van en escrituras separadas: sin esto el ACK
+        # retardado de TCP agrega ~40 ms a cada respuesta keep-alive
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            cuerpo = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            if latencia_s:
+                time.sleep(latencia_s)
+            if caida.is_set():
+                self.send_response(503)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            ahora = time.perf_counter()
+            mensajes = cuerpo.get('mensajes', [cuerpo]) if isinstance(cuerpo, dict) else []
+            for mensaje in mensajes:
+                llegadas[mensaje['ts']] = ahora
+            respuesta = json.dumps({"ids": list(range(len(mensajes))), "rechazados": []}).encode()
+            self.send_response(201)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(respuesta)))
+            self.end_headers()
+            self.wfile.write(respuesta)
+
+        def log_message(self, *args):
+            pass
+
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), Manejador)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://127.0.0.1:{servidor.server_port}", llegadas, caida
+
+
+def _pipe_drenado(bytes_por_s: float = 0):
+    """
+    Archivo de texto sin buffer sobre un pipe que otro hilo vacía, como stdout
+    en Docker con PYTHONUNBUFFERED. Con `bytes_por_s` el lector es lento (un
+    driver de logs atrasado) y el pipe se llena.
+    """
+    lectura, escritura = os.pipe()
+
+    def drenar():
+        while True:
+            bloque = os.read(lectura, 4096)
+            if not bloque:
+                break
+            if bytes_por_s:
+                time.sleep(len(bloque) / bytes_por_s)
+
+    hilo = threading.Thread(target=drenar, daemon=True)
+    hilo.start()
+    return open(escritura, 'w', buffering=1, encoding='utf-8'), hilo
+
+
+def _colas_sin_limite():
+    """Sin hilos consumidores: colas sin límite para no medir la ruta de descarte"""
+    gateway.forward_q = queue.Queue()
+    gateway.analyze_q = queue.Queue()
+    gateway.pending_analysis.clear()
+    # Cada modo reenvía los mismos paquetes: sin esto serían duplicados
+    gateway.ingest = ingesta.Ingesta(gateway.REORDER_WAIT_S, gateway.REORDER_MAX, gateway.count)
+
+
+def _percentil(valores, p):
+    if not valores:
+        return float('nan')
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p / 100))]
+
+
+def benchmark_pipeline(paquetes: int, nodos: int, tasa: float, latencia_cola_ms: float, caida_s: float):
+    """
+    Paquetes/s, latencia UDP→cola (p50/p99) y pérdidas del gateway bajo una
+    ráfaga de muchos nodos. Con caida_s > 0 la cola responde 503 durante ese
+    tiempo a partir de un tercio de la ráfaga, para medir el spool.
+    """
+    registro.configurar(io.StringIO())
+    servidor, url, llegadas, caida = _cola_falsa(latencia_cola_ms / 1000)
+    gateway.COLA_URL = url
+    gateway.UDP_HOST = '127.0.0.1'
+    gateway.UDP_PORT = _puerto_libre(socket.SOCK_DGRAM)
+    gateway.SPOOL_RETRY_S = 0.5
+
+    directorio = tempfile.mkdtemp()
+    os.chdir(directorio)  # state.json, alerts.log, sms_sent.log, gateway_spool.jsonl
+
+    salida = io.StringIO()
+    with contextlib.redirect_stdout(salida):
+        gateway.start_workers()
+        threading.Thread(target=gateway.receiver, daemon=True).start()
+        time.sleep(0.2)
+
+        hilos_max = [threading.active_count()]
+        terminado = threading.Event()
+
+        def vigilar_hilos():
+            while not terminado.wait(0.01):
+                hilos_max[0] = max(hilos_max[0], threading.active_count())
+
+        threading.Thread(target=vigilar_hilos, daemon=True).start()
+        inicio_ts = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        enviados = {}
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        destino = ('127.0.0.1', gateway.UDP_PORT)
+
+        inicio = time.perf_counter()
+        for i in range(paquetes):
+            if caida_s and i == paquetes // 3:
+                caida.set()
+                threading.Timer(caida_s, caida.clear).start()
+            if tasa:
+                espera = inicio + i / tasa - time.perf_counter()
+                if espera > 0:
+                    time.sleep(espera)
+            nodo = f"N{i % nodos:04d}"
+            ts = (inicio_ts + timedelta(milliseconds=i)).isoformat().replace('+00:00', 'Z')
+            # Con seq: en orden salen sin esperar la ventana de reordenamiento
+            paquete = json.dumps({"node_id": nodo, "ts": ts, "nivel_m": 0.3, "lluvia_mm": 0.0, "seq": i // nodos})
+            enviados[ts] = time.perf_counter()
+            sock.sendto(paquete.encode(), destino)
+        fin_envio = time.perf_counter()
+
+        # Esperar a que termine la caída y deje de llegar tráfico a la cola
+        anteriores = -1
+        while caida.is_set() or len(llegadas) != anteriores:
+            anteriores = len(llegadas)
+            time.sleep(1.0)
+        ultima = max(llegadas.values(), default=fin_envio)
+        terminado.set()
+
+    latencias = [(llegadas[k] - t) * 1000 for k, t in enviados.items() if k in llegadas]
+    recibidos = len(latencias)
+    contadores = gateway.stats_snapshot()
+
+    print(f"{'enviados':>10} {'en_cola':>10} {'perdidos':>10} {'paquetes/s':>12} "
+          f"{'p50_ms':>8} {'p99_ms':>8} {'hilos_max':>10}")
+    print(f"{paquetes:>10} {recibidos:>10} {paquetes - recibidos:>10} "
+          f"{recibidos / max(ultima - inicio, 1e-9):>12.0f} "
+          f"{_percentil(latencias, 50):>8.1f} {_percentil(latencias, 99):>8.1f} {hilos_max[0]:>10}")
+    print(f"Contadores del gateway: {contadores}")
+    servidor.shutdown()
+
+
+def _syscalls_escritura() -> int:
+    """write() del proceso completo (todos los hilos), de /proc/self/io"""
+    with open('/proc/self/io') as f:
+        for linea in f:
+            if linea.startswith('syscw:'):
+                return int(linea.split()[1])
+    raise RuntimeError("/proc/self/io no tiene syscw")
+
+
+def _maybe_alert_anterior(node_id):
+    """maybe_alert antes del publicador de estado: reescribe los JSON y reabre los logs en cada paquete"""
+    status = gateway.analyze_node(node_id)
+    print(f"[ANALYZER] Nodo {node_id} -> {status}")
+    with open("state.json", "w") as f:
+        json.dump({"state": status, "time": time.ctime()}, f)
+    with open("last_sms.json", "w") as f:
+        json.dump({"msg": f"Estado actual: {status}", "time": time.ctime()}, f)
+    if status == "ALERTA":
+        message = f"ALERTA URGENTE - Nodo {node_id} detecta crecida. Diríjase ya a zonas altas."
+        for num in gateway.LEADERS:
+            print("[SMS-SIM] Enviando a", num, "->", message)
+            with open("sms_sent.log", "a") as f:
+                f.write(f"{time.ctime()} | {num} | {message}\n")
+        print("[ACTUATOR] Activando sirena y semáforo ROJO (simulado).")
+        with open("alerts.log", "a") as f:
+            f.write(f"{time.ctime()} | {node_id} | ALERTA\n")
+
+
+def benchmark_io(paquetes: int, nodos: int):
+    """
+    Syscalls write() y aperturas de archivo por cada 1000 paquetes en la ruta
+    de análisis, antes (escritura por paquete) y después (publicador de estado
+    y escritor de logs). De cada 20 rondas todos los nodos pasan 6 sobre el
+    umbral de ALERTA, así hay transiciones y líneas en alerts.log / sms_sent.log.
+    """
+    os.chdir(tempfile.mkdtemp())
+    registro.configurar(io.StringIO())
+    gateway.start_workers()
+    aperturas = [0]
+    open_original = builtins.open
+
+    def open_contado(*args, **kwargs):
+        aperturas[0] += 1
+        return open_original(*args, **kwargs)
+
+    def correr(analizar):
+        gateway.estimators.clear()
+        # stdout a memoria: los print no deben contar como escrituras
+        with contextlib.redirect_stdout(io.StringIO()):
+            builtins.open = open_contado
+            aperturas[0] = 0
+            antes = _syscalls_escritura()
+            inicio = time.perf_counter()
+            for i in range(paquetes):
+                nodo = f"N{i % nodos:04d}"
+                ronda = i // nodos
+                nivel = 0.6 if ronda % 20 >= 14 else 0.3
+                gateway.add_reading(nodo, ronda * 10.0, nivel)
+                analizar(nodo)
+            # Esperar a que los hilos de fondo escriban lo pendiente
+            while not gateway.log_q.empty():
+                time.sleep(0.01)
+            gateway.state_changed.set()
+            time.sleep(0.2)
+            duracion = time.perf_counter() - inicio
+            escrituras = _syscalls_escritura() - antes
+            builtins.open = open_original
+        return escrituras, aperturas[0], duracion
+
+    print(f"{'version':>10} {'write/1k':>10} {'open/1k':>10} {'us/paquete':>12}")
+    for nombre, analizar in (("antes", _maybe_alert_anterior), ("despues", gateway.maybe_alert)):
+        escrituras, abiertos, duracion = correr(analizar)
+        print(f"{nombre:>10} {escrituras * 1000 / paquetes:>10.1f} {abiertos * 1000 / paquetes:>10.1f} "
+              f"{duracion * 1e6 / paquetes:>12.1f}")
+    with open('state.json') as f:
+        print(f"state.json: {len(json.load(f)['nodos'])} nodos publicados")
+
+
+def benchmark_decodificacion(paquetes: int):
+    """us por paquete en handle_packet (decodificar + buffer + encolar) con JSON y con trama binaria"""
+    ts = 1700000000
+    formatos = {
+        "json": [
+            json.dumps({"node_id": f"N{i % 64:02d}", "ts": datetime.fromtimestamp(ts + i, tz=timezone.utc).isoformat(),
+                        "nivel_m": 0.42, "lluvia_mm": 1.5}).encode()
+            for i in range(paquetes)
+        ],
+        "binario": [trama.codificar(f"N{i % 64:02d}", ts + i, 0.42, 1.5, i // 64) for i in range(paquetes)],
+    }
+
+    registro.configurar(io.StringIO())
+    print(f"{'formato':>8} {'bytes':>6} {'paquetes/s':>12} {'us/paquete':>11}")
+    for formato, lista in formatos.items():
+        _colas_sin_limite()
+        with contextlib.redirect_stdout(io.StringIO()):
+            inicio = time.perf_counter()
+            for payload in lista:
+                gateway.handle_packet(payload)
+            segundos = time.perf_counter() - inicio
+        print(f"{formato:>8} {len(lista[0]):>6} {len(lista) / segundos:>12.0f} {segundos / len(lista) * 1e6:>11.2f}")
+    print(f"Contadores del gateway: {gateway.stats_snapshot()}")
+
+
+def benchmark_logs(paquetes: int, lector_kb_s: float):
+    """
+    us por paquete en handle_packet + maybe_alert con stdout en un pipe:
+    las tres líneas print por paquete de antes (RX, ANALYZER y la respuesta
+    de la cola) frente al logger JSON asíncrono
+    """
+    lista = [trama.codificar(f"N{i % 64:02d}", 1700000000 + i, 0.3, 1.5, i // 64) for i in range(paquetes)]
+    # Campos ya decodificados para las líneas de antes, así ambos modos decodifican una sola vez
+    campos = [trama.decodificar(payload) for payload in lista]
+    salida, hilo = _pipe_drenado(lector_kb_s * 1024)
+    os.chdir(tempfile.mkdtemp())
+
+    def con_prints(payload, j):
+        gateway.handle_packet(payload)
+        print(f"[RX] {j['node_id']} @ {j['ts']} -> {j['nivel_m']} m, lluvia: {j['lluvia_mm']} mm", file=salida)
+        print("[COLA] ✓ Mensaje enviado", file=salida)
+        gateway.maybe_alert(j['node_id'])
+        print(f"[ANALYZER] Nodo {j['node_id']} -> NORMAL", file=salida)
+
+    def con_logger(payload, j):
+        gateway.handle_packet(payload)
+        gateway.maybe_alert(j['node_id'])
+
+    modos = [
+        # En "prints" el logger queda en INFO, donde el gateway no escribe nada por paquete
+        ("prints", con_prints, logging.INFO, 1),
+        ("logger_info", con_logger, logging.INFO, 1),
+        ("logger_debug_1/100", con_logger, logging.DEBUG, 100),
+        ("logger_debug_todo", con_logger, logging.DEBUG, 1),
+    ]
+    print(f"{'modo':>20} {'us/paquete':>12} {'ms_vaciado':>12} {'descartados':>12}")
+    for nombre, funcion, nivel, muestreo in modos:
+        _colas_sin_limite()
+        registro.LOG_MUESTREO_DEBUG = muestreo
+        registro.configurar(salida)
+        logging.getLogger("gateway").setLevel(nivel)
+        inicio = time.perf_counter()
+        for payload, j in zip(lista, campos):
+            funcion(payload, j)
+        en_loop = time.perf_counter() - inicio
+        registro.detener()
+        vaciado = time.perf_counter() - inicio - en_loop
+        print(f"{nombre:>20} {en_loop / len(lista) * 1e6:>12.2f} {vaciado * 1000:>12.1f} {registro.descartados():>12}")
+    salida.close()
+    hilo.join(1)
+
+
+# Umbrales fijos del gateway antes del motor de reglas
+_TH_PRECAUCION = 0.45
+_TH_ALERTA = 0.55
+_SLOPE_THRESH = 0.007
+_HYSTERESIS_M = 0.03
+
+
+def _analizar_anterior(buf) -> str:
+    """analyze_node antes del estimador: reconstruye listas y usa solo las dos últimas lecturas para la pendiente"""
+    if len(buf) < 2:
+        return "NORMAL"
+    levels = [v for _, v in buf]
+    times = [t for t, _ in buf]
+    ma = sum(levels[-5:]) / min(5, len(levels))
+    slope = (levels[-1] - levels[-2]) / max(1, times[-1] - times[-2])
+    if ma >= _TH_ALERTA or slope >= _SLOPE_THRESH:
+        return "ALERTA"
+    elif ma >= _TH_PRECAUCION:
+        return "PRECAUCION"
+    return "NORMAL"
+
+
+class _DetectorAnterior:
+    """Mismo uso que EstimadorNodo sobre el deque de antes"""
+    __slots__ = ('buf', 'estado')
+
+    def __init__(self):
+        self.buf = collections.deque(maxlen=gateway.BUFFER_LEN)
+        self.estado = "NORMAL"
+
+    def agregar(self, ts, nivel):
+        self.buf.append((ts, nivel))
+        self.estado = _analizar_anterior(self.buf)
+        return self.estado
+
+
+_DETECTORES = {
+    "anterior": _DetectorAnterior,
+    "estimador": lambda: detector.EstimadorNodo(gateway.UMBRALES, gateway.MOTOR_REGLAS),
+}
+
+
+def benchmark_detector(nodos: int, lecturas: int):
+    """us por lectura y memoria por nodo con `nodos` nodos que envían intercalados"""
+    rng = random.Random(0)
+    serie = [(f"N{i % nodos:05d}", (i // nodos) * 8.0, 0.3 + rng.uniform(-0.03, 0.03)) for i in range(nodos * lecturas)]
+
+    print(f"{'detector':>10} {'us/lectura':>11} {'bytes/nodo':>11}")
+    for nombre, crear in _DETECTORES.items():
+        tracemalloc.start()
+        estados = {nodo: crear() for nodo in {nodo for nodo, _, _ in serie[:nodos]}}
+        for nodo, ts, nivel in serie[:nodos * gateway.BUFFER_LEN]:
+            estados[nodo].agregar(ts, nivel)
+        memoria = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        inicio = time.perf_counter()
+        for nodo, ts, nivel in serie:
+            estados[nodo].agregar(ts, nivel)
+        segundos = time.perf_counter() - inicio
+        print(f"{nombre:>10} {segundos / len(serie) * 1e6:>11.2f} {memoria / nodos:>11.0f}")
+
+
+def benchmark_replay(semillas: int, periodo: float):
+    """
+    Reproduce crecidas de sensor_simulator.make_readings (una por semilla, 4
+    nodos, cada nodo muestrea cada `periodo` segundos) por ambos detectores.
+
+    falsas_alertas: lecturas en ALERTA durante el tramo normal (muestras 0-29)
+    detectadas: nodos que llegan a ALERTA antes del final de la subida
+    anticipacion_s: promedio de segundos entre la primera ALERTA y el inicio del pico (muestra 60)
+    transiciones: cambios de estado promedio por nodo (1 o 2 subidas y bajadas es lo esperado)
+    """
+    print(f"{'detector':>10} {'falsas_alertas':>15} {'detectadas':>11} {'anticipacion_s':>15} {'transiciones':>13}")
+    for nombre, crear in _DETECTORES.items():
+        falsas = detectadas = cambios = nodos_total = 0
+        anticipaciones = []
+        for semilla in range(semillas):
+            estados = {}
+            primera_alerta = {}
+            for seq, nodo, nivel_cm, _ in sensor_simulator.make_readings(random.Random(semilla)):
+                det = estados.get(nodo)
+                if det is None:
+                    det = estados[nodo] = crear()
+                anterior = det.estado
+                estado = det.agregar(seq * periodo, nivel_cm / 100)
+                cambios += estado != anterior
+                if estado == "ALERTA":
+                    if seq < 30:
+                        falsas += 1
+                    elif seq < 60:
+                        primera_alerta.setdefault(nodo, seq)
+            nodos_total += len(estados)
+            detectadas += len(primera_alerta)
+            anticipaciones.extend((60 - seq) * periodo for seq in primera_alerta.values())
+        anticipacion = sum(anticipaciones) / len(anticipaciones) if anticipaciones else float('nan')
+        print(f"{nombre:>10} {falsas:>15} {detectadas:>5}/{nodos_total:<5} {anticipacion:>15.1f} "
+              f"{cambios / nodos_total:>13.1f}")
+
+
+class _SinIngesta:
+    """Entrada de antes: toda lectura decodificada se reenvía y analiza"""
+
+    def agregar(self, lectura, ahora):
+        return [lectura]
+
+    def vencidas(self, ahora):
+        return []
+
+
+def _canal_lora(nodos: int, lecturas: int, duplicados: float, desorden: float, perdida: float, semilla: int):
+    """
+    Tramas de `nodos` sensores que suben 1 mm cada 10 s (RoR exacto de 0.36
+    m/h), en orden de llegada tras un canal que duplica, atrasa una ronda o
+    pierde cada paquete con las probabilidades dadas
+    """
+    rng = random.Random(semilla)
+    llegadas = []
+    for ronda in range(lecturas):
+        for n in range(nodos):
+            if rng.random() < perdida:
+                continue
+            trama_ = trama.codificar(f"{n:04X}", 1700000000 + ronda * 10, 0.3 + ronda / 1000, 0.0, ronda)
+            orden = ronda + n / nodos
+            llegadas.append((orden + (1.5 if rng.random() < desorden else 0), trama_))
+            if rng.random() < duplicados:
+                llegadas.append((orden + rng.uniform(0, 3), trama_))
+    llegadas.sort(key=lambda x: x[0])
+    return [trama_ for _, trama_ in llegadas]
+
+
+def _revisar_reenvios(payloads) -> dict:
+    """Duplicados, lecturas fuera de orden y RoR mal calculado (como rate_of_rise del ETL) en lo reenviado"""
+    vistos, anterior = set(), {}
+    resultado = {"duplicados": 0, "desordenados": 0, "ror_erroneo": 0}
+    for p in payloads:
+        clave = (p["node_id"], p["ts_ms"])
+        resultado["duplicados"] += clave in vistos
+        vistos.add(clave)
+        previo = anterior.get(p["node_id"])
+        if previo is not None:
+            horas = (p["ts_ms"] - previo["ts_ms"]) / 1000 / 3600
+            resultado["desordenados"] += horas < 0
+            if horas <= 0 or abs((p["nivel_m"] - previo["nivel_m"]) / horas - 0.36) > 1e-6:
+                resultado["ror_erroneo"] += 1
+        anterior[p["node_id"]] = p
+    return resultado
+
+
+def benchmark_ingesta(nodos: int, lecturas: int, duplicados: float, desorden: float, perdida: float):
+    """
+    Lecturas reenviadas a la cola, duplicados, desorden y RoR erróneo con y
+    sin la etapa de ingesta, más el costo por paquete de handle_packet y la
+    memoria por nodo de la ingesta con pocas y muchas lecturas por nodo
+    """
+    paquetes = _canal_lora(nodos, lecturas, duplicados, desorden, perdida, semilla=0)
+    registro.configurar(io.StringIO())
+
+    print(f"{'entrada':>12} {'paquetes':>9} {'reenviados':>11} {'duplicados':>11} {'desordenados':>13} "
+          f"{'ror_erroneo':>12} {'us/paquete':>11}")
+    for nombre in ("sin_ingesta", "ingesta"):
+        _colas_sin_limite()
+        if nombre == "sin_ingesta":
+            gateway.ingest = _SinIngesta()
+        inicio = time.perf_counter()
+        for payload in paquetes:
+            gateway.handle_packet(payload)
+        segundos = time.perf_counter() - inicio
+        time.sleep(gateway.REORDER_WAIT_S)
+        gateway.flush_reorder()
+
+        reenviados = []
+        while not gateway.forward_q.empty():
+            reenviados.append(gateway.forward_q.get_nowait()[1])
+        r = _revisar_reenvios(reenviados)
+        print(f"{nombre:>12} {len(paquetes):>9} {len(reenviados):>11} {r['duplicados']:>11} {r['desordenados']:>13} "
+              f"{r['ror_erroneo']:>12} {segundos / len(paquetes) * 1e6:>11.2f}")
+    eventos = gateway.stats_snapshot()
+    print("Contadores de la ingesta: " + ", ".join(
+        f"{evento}={eventos.get(evento, 0)}" for evento in ("duplicados", "atrasados", "reordenados", "perdidos")))
+
+    print(f"{'lecturas/nodo':>14} {'bytes/nodo':>11}")
+    for por_nodo in (10, 100, 1000):
+        filtro = ingesta.Ingesta()
+        lista = [trama.decodificar(p) for p in _canal_lora(1000, por_nodo, duplicados, desorden, perdida, semilla=1)]
+        tracemalloc.start()
+        for j in lista:
+            filtro.agregar(j, 0.0)
+        memoria = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f"{por_nodo:>14} {memoria / 1000:>11.0f}")
+
+
+def _decidir_anterior(ma: float, pendiente: float, estado: str) -> str:
+    """Decisión de EstimadorNodo antes del motor de reglas, con la histéresis escrita en el código"""
+    if ma >= _TH_ALERTA or pendiente >= _SLOPE_THRESH:
+        return detector.ALERTA
+    if estado == detector.ALERTA and (ma >= _TH_ALERTA - _HYSTERESIS_M or pendiente >= _SLOPE_THRESH / 2):
+        return detector.ALERTA
+    if ma >= _TH_PRECAUCION:
+        return detector.PRECAUCION
+    if estado != detector.NORMAL and ma >= _TH_PRECAUCION - _HYSTERESIS_M:
+        return detector.PRECAUCION
+    return detector.NORMAL
+
+
+def benchmark_reglas(lecturas: int):
+    """
+    Estados del conjunto "gateway" de reglas.py frente a la decisión fija
+    anterior, sobre `lecturas` combinaciones aleatorias de promedio,
+    pendiente y estado previo. distintas debe ser 0.
+    """
+    rng = random.Random(0)
+    estados = (detector.NORMAL, detector.PRECAUCION, detector.ALERTA)
+    casos = [(rng.uniform(0.35, 0.65), rng.uniform(-0.002, 0.01), rng.choice(estados)) for _ in range(lecturas)]
+    motor = reglas.motor("gateway")
+
+    inicio = time.perf_counter()
+    anteriores = [_decidir_anterior(ma, pendiente, previo) for ma, pendiente, previo in casos]
+    t_anterior = time.perf_counter() - inicio
+    inicio = time.perf_counter()
+    nuevos = [motor.nivel({'promedio': ma, 'pendiente': pendiente}, previo) for ma, pendiente, previo in casos]
+    t_motor = time.perf_counter() - inicio
+
+    distintas = sum(a != b for a, b in zip(anteriores, nuevos))
+    conteo = collections.Counter(nuevos)
+    print(f"{'decisión':>10} {'us/lectura':>11}")
+    print(f"{'anterior':>10} {t_anterior / lecturas * 1e6:>11.2f}")
+    print(f"{'motor':>10} {t_motor / lecturas * 1e6:>11.2f}")
+    print(f"distintas={distintas} " + " ".join(f"{estado}={conteo[estado]}" for estado in estados))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks del gateway")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+
+    p_pipe = subparsers.add_parser("pipeline", help="Ráfaga UDP → gateway → cola falsa")
+    p_pipe.add_argument("--paquetes", type=int, default=5000)
+    p_pipe.add_argument("--nodos", type=int, default=200)
+    p_pipe.add_argument("--tasa", type=float, default=300, help="Paquetes/s del generador (0 = lo más rápido posible)")
+    p_pipe.add_argument("--latencia-cola-ms", type=float, default=2.0, help="Latencia simulada de la cola")
+    p_pipe.add_argument("--caida-s", type=float, default=0.0, help="Segundos que la cola responde 503")
+
+    p_io = subparsers.add_parser("io", help="Escrituras de estado y logs por 1000 paquetes, antes y después")
+    p_io.add_argument("--paquetes", type=int, default=10000)
+    p_io.add_argument("--nodos", type=int, default=50)
+
+    p_dec = subparsers.add_parser("decodificacion", help="handle_packet con JSON vs trama binaria")
+    p_dec.add_argument("--paquetes", type=int, default=100000)
+
+    p_logs = subparsers.add_parser("logs", help="Sobrecosto por paquete de prints frente al logger asíncrono")
+    p_logs.add_argument("--paquetes", type=int, default=20000)
+    p_logs.add_argument("--lector-kb-s", type=float, default=0,
+                        help="Velocidad del lector de stdout (0 = sin límite)")
+
+    p_det = subparsers.add_parser("detector", help="Costo por lectura y memoria del detector con muchos nodos")
+    p_det.add_argument("--nodos", type=int, default=10000)
+    p_det.add_argument("--lecturas", type=int, default=50, help="Lecturas por nodo")
+
+    p_rep = subparsers.add_parser("replay", help="Crecidas del simulador por el detector anterior y el estimador")
+    p_rep.add_argument("--semillas", type=int, default=20)
+    p_rep.add_argument("--periodo", type=float, default=8.0, help="Segundos entre lecturas de un nodo")
+
+    p_ing = subparsers.add_parser("ingesta", help="Duplicados y desorden de LoRa con y sin la etapa de ingesta")
+    p_ing.add_argument("--nodos", type=int, default=1000)
+    p_ing.add_argument("--lecturas", type=int, default=50, help="Lecturas por nodo")
+    p_ing.add_argument("--duplicados", type=float, default=0.05, help="Probabilidad de duplicar un paquete")
+    p_ing.add_argument("--desorden", type=float, default=0.05, help="Probabilidad de atrasar un paquete una ronda")
+    p_ing.add_argument("--perdida", type=float, default=0.01, help="Probabilidad de perder un paquete")
+
+    p_reg = subparsers.add_parser("reglas", help="Motor de reglas del gateway frente a la decisión fija anterior")
+    p_reg.add_argument("--lecturas", type=int, default=1000000)
+
+    args = parser.parse_args()
+    if args.comando == "pipeline":
+        benchmark_pipeline(args.paquetes, args.nodos, args.tasa, args.latencia_cola_ms, args.caida_s)
+    elif args.comando == "io":
+        benchmark_io(args.paquetes, args.nodos)
+    elif args.comando == "decodificacion":
+        benchmark_decodificacion(args.paquetes)
+    elif args.comando == "logs":
+        benchmark_logs(args.paquetes, args.lector_kb_s)
+    elif args.comando == "detector":
+        benchmark_detector(args.nodos, args.lecturas)
+    elif args.comando == "replay":
+        benchmark_replay(args.semillas, args.periodo)
+    elif args.comando == "ingesta":
+        benchmark_ingesta(args.nodos, args.lecturas, args.duplicados, args.desorden, args.perdida)
+    elif args.comando == "reglas":
+        benchmark_reglas(args.lecturas)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,424 @@
+"""
+Generador de carga determinista y benchmark de extremo a extremo
+sensor → gateway → cola → ETL → Supabase
+
+Levanta localmente la cola real (backend en memoria), el gateway real y uno o
+más trabajadores del ETL real, con Supabase y el webhook de alertas
+reemplazados por stubs. Las lecturas salen de un RNG con semilla y llevan
+timestamps de un reloj virtual (inicio fijo + periodo por muestra), así dos
+corridas con la misma semilla envían exactamente los mismos datos, a la tasa
+real que se pida.
+
+Reporta throughput, percentiles de latencia por etapa y pérdidas, y guarda el
+resultado en JSON (con el commit) para comparar corridas:
+
+    python carga.py --nodos 200 --lecturas 50 --tasa 1000 --escenario crecida --salida base.json
+    python carga.py --nodos 200 --lecturas 50 --tasa 1000 --escenario crecida --comparar base.json
+
+Escenarios:
+    normal   niveles alrededor de 0.3 m con ruido
+    crecida  cada nodo sigue una crecida de sensor_simulator.make_timeline
+    rafaga   como normal, pero cada ronda de todos los nodos sale de golpe
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+import sensor_simulator
+import trama
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+DIRECTORIO_COLA = os.path.join(DIRECTORIO, '..', 'cola')
+DIRECTORIO_BACK = os.path.join(DIRECTORIO, '..', 'back')
+
+# Inicio del reloj virtual de los sensores (2023-11-14T22:13:20Z)
+INICIO_VIRTUAL = 1_700_000_000
+ESCENARIOS = ("normal", "crecida", "rafaga")
+
+
+def _puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _esperar_http(url: str, proceso: subprocess.Popen, nombre: str):
+    for _ in range(100):
+        if proceso.poll() is not None:
+            break
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    proceso.kill()
+    raise RuntimeError(f"{nombre} no arrancó")
+
+
+def _metricas(url: str) -> dict:
+    """Muestras de un /metrics: {'nombre{etiquetas}': valor}"""
+    muestras = {}
+    for linea in requests.get(url, timeout=5).text.splitlines():
+        if linea and not linea.startswith('#'):
+            serie, _, valor = linea.rpartition(' ')
+            muestras[serie] = float(valor)
+    return muestras
+
+
+def _total(muestras: dict, nombre: str) -> float:
+    """Suma de todas las series de una métrica, sin importar las etiquetas"""
+    return sum(v for serie, v in muestras.items() if serie.split('{')[0] == nombre)
+
+
+def _webhook_falso():
+    """Stub del webhook de n8n; cuenta las alertas recibidas"""
+    recibidas = []
+
+    class Manejador(BaseHTTPRequestHandler):
+        def do_POST(self):
+            recibidas.append(json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}'))
+            self.send_response(200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), Manejador)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://127.0.0.1:{servidor.server_port}/webhook", recibidas
+
+
+# ---------- Generador ----------
+
+def generar(escenario: str, nodos: int, lecturas: int, periodo_s: float, semilla: int):
+    """
+    Lecturas (node_id, ts_epoch, nivel_m, lluvia_mm) en orden de envío: ronda
+    k, todos los nodos. El ts es virtual: INICIO_VIRTUAL + k * periodo_s.
+    """
+    rng = random.Random(semilla)
+    ids = [f"N{i:03d}" if nodos <= 1000 else f"{i:04X}" for i in range(nodos)]
+    if escenario == "crecida":
+        # Una crecida por nodo, estirada o comprimida a `lecturas` muestras
+        curvas = [sensor_simulator.make_timeline(rng) for _ in ids]
+    for k in range(lecturas):
+        ts = INICIO_VIRTUAL + int(k * periodo_s)
+        lluvia = round(rng.uniform(0, 5), 1)
+        for i, nodo in enumerate(ids):
+            if escenario == "crecida":
+                curva = curvas[i]
+                nivel = curva[k * len(curva) // lecturas] / 100
+            else:
+                nivel = 0.3
+            yield nodo, ts, round(nivel + rng.uniform(-0.01, 0.01), 3), lluvia
+
+
+def enviar(lecturas, destino, tasa: float, rafaga_de: int = 0):
+    """
+    Envía las tramas por UDP a `tasa` paquetes/s (0 = lo más rápido posible).
+    Con `rafaga_de` los paquetes salen en grupos de ese tamaño sin pausa y la
+    pausa se acumula entre grupos. Retorna {(node_id, ts_iso): envío (epoch)}.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    envios = {}
+    seqs = {}
+    inicio = time.perf_counter()
+    for i, (nodo, ts, nivel, lluvia) in enumerate(lecturas):
+        if tasa and (not rafaga_de or i % rafaga_de == 0):
+            espera = inicio + i / tasa - time.perf_counter()
+            if espera > 0:
+                time.sleep(espera)
+        # Un contador por nodo, como el firmware
+        seq = seqs[nodo] = seqs.get(nodo, -1) + 1
+        payload = trama.codificar(nodo, ts, nivel, lluvia, seq)
+        clave = (nodo, datetime.fromtimestamp(ts, tz=timezone.utc).isoformat().replace('+00:00', 'Z'))
+        envios[clave] = time.time()
+        sock.sendto(payload, destino)
+    sock.close()
+    return envios
+
+
+# ---------- Procesos ----------
+
+class _SupabaseFalso:
+    """Cliente con la API de supabase-py que usa el escritor; registra cuándo persiste cada fila"""
+
+    def __init__(self, latencia_s: float, persistidas: list):
+        self.latencia_s = latencia_s
+        self.persistidas = persistidas
+        self.filas_agregados = 0
+        self._tabla = None
+        self._filas = []
+
+    def table(self, nombre):
+        self._tabla = nombre
+        return self
+
+    def insert(self, filas):
+        self._filas = filas if isinstance(filas, list) else [filas]
+        return self
+
+    def upsert(self, filas, on_conflict=None):
+        return self.insert(filas)
+
+    def execute(self):
+        time.sleep(self.latencia_s)
+        ahora = time.time()
+        if self._tabla == 'mediciones_hidrologicas':
+            self.persistidas.extend((f['node_id'], f['ts'], f['procesado_en'], ahora) for f in self._filas)
+        else:
+            self.filas_agregados += len(self._filas)
+        return self
+
+
+def _trabajador_etl(entorno: dict, particion, particiones: int, latencia_s: float, salida: str):
+    """
+    Proceso hijo: ejecuta el loop real del ETL con Supabase falso. Registra
+    recibido_en de cada mensaje consumido y al recibir SIGINT escribe lo
+    observado en `salida`.
+    """
+    os.environ.update(entorno)
+    sys.path.insert(0, DIRECTORIO_BACK)
+    import app as etl
+
+    consumidas = {}
+    persistidas = []
+    consumir = etl.consumir_cola
+
+    def consumir_registrando(*args, **kwargs):
+        mediciones = consumir(*args, **kwargs)
+        for medicion in mediciones or ():
+            consumidas[f"{medicion.get('node_id')}|{medicion['ts']}"] = medicion.get('recibido_en')
+        return mediciones
+
+    cliente = _SupabaseFalso(latencia_s, persistidas)
+    etl.consumir_cola = consumir_registrando
+    etl.create_client = lambda url, key: cliente
+    try:
+        etl.ejecutar_trabajador(particion, particiones)
+    finally:
+        with open(salida, 'w') as f:
+            json.dump({"consumidas": consumidas, "persistidas": persistidas,
+                       "filas_agregados": cliente.filas_agregados}, f)
+
+
+def _epoch(iso: str) -> float:
+    return datetime.fromisoformat(iso.replace('Z', '+00:00')).replace(tzinfo=timezone.utc).timestamp()
+
+
+def _percentiles(valores) -> dict:
+    if not valores:
+        return {}
+    ordenados = sorted(valores)
+
+    def p(q):
+        return round(ordenados[min(len(ordenados) - 1, int(len(ordenados) * q / 100))] * 1000, 1)
+
+    return {"p50_ms": p(50), "p95_ms": p(95), "p99_ms": p(99), "max_ms": round(ordenados[-1] * 1000, 1)}
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=DIRECTORIO,
+                              capture_output=True, text=True, timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def ejecutar(escenario: str, nodos: int, lecturas: int, periodo_s: float, tasa: float, semilla: int,
+             trabajadores: int, latencia_supabase_ms: float, espera_max_s: float) -> dict:
+    directorio = tempfile.mkdtemp(prefix='carga_')
+    webhook, url_webhook, alertas = _webhook_falso()
+    puerto_cola, puerto_udp, puerto_metricas = _puerto_libre(), _puerto_libre(), _puerto_libre()
+    url_cola = f"http://127.0.0.1:{puerto_cola}"
+
+    cola = subprocess.Popen(
+        [sys.executable, '-c', f"from app import app; app.run(port={puerto_cola}, threaded=True)"],
+        cwd=DIRECTORIO_COLA, env={**os.environ, 'COLA_BACKEND': 'memoria'},
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    procesos = []
+    gateway = None
+    try:
+        _esperar_http(f"{url_cola}/health", cola, "La cola")
+        gateway = subprocess.Popen(
+            [sys.executable, os.path.join(DIRECTORIO, 'gateway.py')], cwd=directorio,
+            env={**os.environ, 'COLA_URL': url_cola, 'UDP_HOST': '127.0.0.1', 'UDP_PORT': str(puerto_udp),
+                 'GATEWAY_METRICAS_PUERTO': str(puerto_metricas), 'LOG_NIVEL': 'WARNING',
+                 'GATEWAY_SPOOL_PATH': os.path.join(directorio, 'gateway_spool.jsonl'), 'SPOOL_RETRY_S': '1'},
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        _esperar_http(f"http://127.0.0.1:{puerto_metricas}/metrics", gateway, "El gateway")
+
+        entorno = {
+            'COLA_URL': url_cola, 'COLA_ESPERA_SEGUNDOS': '1', 'WEBHOOK_ALERTA_URL': url_webhook,
+            'SUPABASE_URL': 'http://supabase.falso', 'SUPABASE_KEY': 'falsa', 'SUPABASE_INTERVALO_S': '0.2',
+            'ETL_METRICAS_PUERTO': '0', 'LOG_NIVEL': 'ERROR',
+        }
+        contexto = multiprocessing.get_context('spawn')
+        for particion in range(trabajadores):
+            salida = os.path.join(directorio, f"etl_{particion}.json")
+            entorno_particion = {**entorno, 'SUPABASE_SPOOL_PATH': os.path.join(directorio, f"spool_{particion}.jsonl")}
+            proceso = contexto.Process(
+                target=_trabajador_etl,
+                args=(entorno_particion, particion if trabajadores > 1 else None, trabajadores,
+                      latencia_supabase_ms / 1000, salida)
+            )
+            proceso.start()
+            procesos.append((proceso, salida))
+        time.sleep(1.0)  # importación del ETL
+
+        serie = generar(escenario, nodos, lecturas, periodo_s, semilla)
+        inicio = time.time()
+        envios = enviar(serie, ('127.0.0.1', puerto_udp), tasa, rafaga_de=nodos if escenario == "rafaga" else 0)
+        fin_envio = time.time()
+
+        # Esperar a que la cola quede vacía (todo confirmado tras persistir) y
+        # no lleguen más mensajes del gateway
+        anterior, estable_desde = -1, time.time()
+        while time.time() - fin_envio < espera_max_s:
+            m = _metricas(f"{url_cola}/metrics")
+            recibidos = _total(m, 'cola_mensajes_recibidos_total')
+            if recibidos != anterior:
+                anterior, estable_desde = recibidos, time.time()
+            elif m.get('cola_profundidad', 1) == 0 and time.time() - estable_desde > 2:
+                break
+            time.sleep(0.2)
+        metricas_gateway = _metricas(f"http://127.0.0.1:{puerto_metricas}/metrics")
+    finally:
+        for proceso, _ in procesos:
+            if proceso.is_alive():
+                os.kill(proceso.pid, signal.SIGINT)
+        for proceso, _ in procesos:
+            proceso.join(30)
+            if proceso.is_alive():
+                proceso.terminate()
+        for servicio in (gateway, cola):
+            if servicio is not None:
+                servicio.terminate()
+                servicio.wait()
+        webhook.shutdown()
+
+    consumidas, persistidas, filas_agregados = {}, [], 0
+    for _, salida in procesos:
+        with open(salida) as f:
+            datos = json.load(f)
+        consumidas.update(datos["consumidas"])
+        persistidas.extend(datos["persistidas"])
+        filas_agregados += datos["filas_agregados"]
+
+    etapas = {"gateway": [], "cola_etl": [], "escritura": [], "total": []}
+    persistidas_unicas = set()
+    for nodo, ts, procesado_en, persistido in persistidas:
+        clave = (nodo, ts)
+        persistidas_unicas.add(clave)
+        envio = envios.get(clave)
+        recibido_en = consumidas.get(f"{nodo}|{ts}")
+        procesado = _epoch(procesado_en)
+        if envio is None or recibido_en is None:
+            continue
+        recibido = _epoch(recibido_en)
+        etapas["gateway"].append(recibido - envio)
+        etapas["cola_etl"].append(procesado - recibido)
+        etapas["escritura"].append(persistido - procesado)
+        etapas["total"].append(persistido - envio)
+
+    ultima = max((p[3] for p in persistidas), default=fin_envio)
+    recibidos_gateway = int(_total(metricas_gateway, 'gateway_paquetes_total'))
+    eventos_gateway = {serie.split('"')[1]: int(v) for serie, v in metricas_gateway.items()
+                       if serie.startswith('gateway_eventos_total{')}
+    return {
+        "commit": _commit(),
+        "fecha": datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z'),
+        "parametros": {
+            "escenario": escenario, "nodos": nodos, "lecturas": lecturas, "periodo_s": periodo_s,
+            "tasa": tasa, "semilla": semilla, "trabajadores": trabajadores,
+            "latencia_supabase_ms": latencia_supabase_ms,
+        },
+        "enviados": len(envios),
+        "en_gateway": recibidos_gateway,
+        "en_cola": int(anterior),
+        "persistidos": len(persistidas_unicas),
+        "duplicados": len(persistidas) - len(persistidas_unicas),
+        "perdidos": len(envios) - len(persistidas_unicas & set(envios)),
+        # Dónde se perdieron: buffer UDP del kernel, gateway (colas internas llenas o rechazos), cola/ETL
+        "perdidos_por_etapa": {
+            "udp": len(envios) - recibidos_gateway,
+            "gateway": recibidos_gateway - int(anterior),
+            "cola_etl": int(anterior) - len(persistidas_unicas),
+        },
+        "envio_por_s": round(len(envios) / max(fin_envio - inicio, 1e-9), 1),
+        "persistidos_por_s": round(len(persistidas_unicas) / max(ultima - inicio, 1e-9), 1),
+        "latencia": {etapa: _percentiles(valores) for etapa, valores in etapas.items()},
+        "alertas_webhook": len(alertas),
+        "filas_agregados": filas_agregados,
+        "eventos_gateway": eventos_gateway,
+    }
+
+
+def imprimir(resultado: dict, base: dict = None):
+    print(f"commit {resultado['commit'] or '?'} | {resultado['parametros']}")
+    print(f"enviados={resultado['enviados']} en_gateway={resultado['en_gateway']} en_cola={resultado['en_cola']} "
+          f"persistidos={resultado['persistidos']} duplicados={resultado['duplicados']} "
+          f"alertas_webhook={resultado['alertas_webhook']}")
+    print(f"perdidos={resultado['perdidos']} {resultado['perdidos_por_etapa']} | gateway {resultado['eventos_gateway']}")
+    print(f"envío {resultado['envio_por_s']:.0f}/s, persistidos {resultado['persistidos_por_s']:.0f}/s")
+    print(f"{'etapa':>10} {'p50_ms':>9} {'p95_ms':>9} {'p99_ms':>9} {'max_ms':>9}")
+    for etapa, p in resultado['latencia'].items():
+        print(f"{etapa:>10} " + " ".join(f"{p.get(k, float('nan')):>9.1f}" for k in ('p50_ms', 'p95_ms', 'p99_ms', 'max_ms')))
+    if base:
+        print(f"\nContra {base.get('commit') or '?'} ({base.get('fecha', '')}):")
+        for clave in ('persistidos_por_s', 'perdidos'):
+            print(f"{clave:>18} {base[clave]:>10} -> {resultado[clave]:<10}")
+        for etapa in ('gateway', 'total'):
+            antes = base['latencia'].get(etapa, {}).get('p99_ms')
+            ahora = resultado['latencia'].get(etapa, {}).get('p99_ms')
+            print(f"{etapa + ' p99_ms':>18} {antes:>10} -> {ahora:<10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Carga determinista y benchmark gateway → cola → ETL")
+    parser.add_argument("--escenario", choices=ESCENARIOS, default="normal")
+    parser.add_argument("--nodos", type=int, default=100)
+    parser.add_argument("--lecturas", type=int, default=50, help="Muestras por nodo")
+    parser.add_argument("--periodo", type=float, default=10.0, help="Segundos virtuales entre muestras de un nodo")
+    parser.add_argument("--tasa", type=float, default=500, help="Paquetes/s reales (0 = lo más rápido posible)")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--trabajadores", type=int, default=1, help="Procesos del ETL")
+    parser.add_argument("--latencia-supabase-ms", type=float, default=30.0)
+    parser.add_argument("--espera-max", type=float, default=120.0, help="Segundos máximos para drenar tras enviar")
+    parser.add_argument("--salida", help="Guardar el resultado en este JSON")
+    parser.add_argument("--comparar", help="JSON de una corrida anterior para comparar")
+    args = parser.parse_args()
+
+    if args.periodo < 1:
+        parser.error("--periodo debe ser al menos 1 s (la trama binaria lleva ts en segundos)")
+
+    resultado = ejecutar(args.escenario, args.nodos, args.lecturas, args.periodo, args.tasa, args.semilla,
+                         args.trabajadores, args.latencia_supabase_ms, args.espera_max)
+    base = None
+    if args.comparar:
+        with open(args.comparar) as f:
+            base = json.load(f)
+    imprimir(resultado, base)
+    if args.salida:
+        with open(args.salida, 'w') as f:
+            json.dump(resultado, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
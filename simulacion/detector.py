@@ -0,0 +1,104 @@
+"""
+Detector de crecidas por nodo, incremental: cada lectura actualiza el estado
+en O(1), sin recorrer la ventana.
+
+- Promedio móvil de las últimas `ventana_ma` lecturas con una suma acumulada.
+- Pendiente por mínimos cuadrados sobre las últimas `ventana` lecturas, con
+  sumas acumuladas (Σt, Σy, Σt², Σty). Usa el dt real entre lecturas, así que
+  también sirve con muestras de menos de un segundo.
+- EWMA de la pendiente, para que una sola lectura ruidosa no dispare ALERTA.
+- El estado sale del conjunto "gateway" del motor de reglas (reglas.py) sobre
+  `promedio` y `pendiente`. Sus umbrales de `salida` dan la histéresis: para
+  bajar de estado el promedio debe quedar por debajo de ellos, así un nivel
+  que oscila en el borde no alterna estados.
+
+Los tiempos se guardan relativos a un origen por nodo que se corre cada
+hora, para que Σt² no pierda precisión con epochs del orden de 1e9.
+"""
+from collections import deque
+from typing import NamedTuple
+
+import reglas
+
+NORMAL = "NORMAL"
+PRECAUCION = "PRECAUCION"
+ALERTA = "ALERTA"
+
+# Cada cuánto (segundos desde el origen) se recalculan las sumas con un origen nuevo
+_MOVER_ORIGEN_S = 3600.0
+
+
+class Umbrales(NamedTuple):
+    ventana: int = 12          # lecturas para la pendiente
+    ventana_ma: int = 5        # lecturas para el promedio móvil
+    alfa: float = 0.3          # peso de la pendiente nueva en la EWMA
+
+
+class EstimadorNodo:
+    """Estado compacto de un nodo; `agregar` devuelve el estado tras la lectura"""
+    __slots__ = ('umbrales', 'motor', 'lecturas', 'origen', 'suma_ma', 's_t', 's_y', 's_tt', 's_ty',
+                 'promedio', 'pendiente', 'estado')
+
+    def __init__(self, umbrales: Umbrales, motor: reglas.Motor):
+        self.umbrales = umbrales
+        self.motor = motor  # compartido entre nodos: se compila una vez
+        self.lecturas = deque()  # (t relativo al origen, nivel), a lo sumo `ventana`
+        self.origen = None
+        self.suma_ma = 0.0
+        self.s_t = self.s_y = self.s_tt = self.s_ty = 0.0
+        self.promedio = 0.0
+        self.pendiente = 0.0  # EWMA de la pendiente por mínimos cuadrados (m/s)
+        self.estado = NORMAL
+
+    def _mover_origen(self, origen: float):
+        desplazamiento = origen - self.origen
+        self.origen = origen
+        self.lecturas = deque((t - desplazamiento, y) for t, y in self.lecturas)
+        self.s_t = self.s_y = self.s_tt = self.s_ty = 0.0
+        for t, y in self.lecturas:
+            self.s_t += t
+            self.s_y += y
+            self.s_tt += t * t
+            self.s_ty += t * y
+
+    def agregar(self, ts: float, nivel: float) -> str:
+        u = self.umbrales
+        if self.origen is None:
+            self.origen = ts
+        elif ts - self.origen > _MOVER_ORIGEN_S:
+            self._mover_origen(self.lecturas[0][0] + self.origen if self.lecturas else ts)
+
+        lecturas = self.lecturas
+        t = ts - self.origen
+
+        # Promedio móvil: sale la lectura que queda fuera de las últimas ventana_ma
+        if len(lecturas) >= u.ventana_ma:
+            self.suma_ma -= lecturas[-u.ventana_ma][1]
+        self.suma_ma += nivel
+
+        lecturas.append((t, nivel))
+        self.s_t += t
+        self.s_y += nivel
+        self.s_tt += t * t
+        self.s_ty += t * nivel
+        if len(lecturas) > u.ventana:
+            t0, y0 = lecturas.popleft()
+            self.s_t -= t0
+            self.s_y -= y0
+            self.s_tt -= t0 * t0
+            self.s_ty -= t0 * y0
+
+        n = len(lecturas)
+        self.promedio = self.suma_ma / min(n, u.ventana_ma)
+        if n < 2:
+            return self.estado
+
+        # Con menos de ventana_ma lecturas la pendiente es casi solo ruido: no
+        # se calcula ni se usa para iniciar la EWMA
+        if n >= u.ventana_ma:
+            denominador = n * self.s_tt - self.s_t * self.s_t
+            pendiente = (n * self.s_ty - self.s_t * self.s_y) / denominador if denominador > 1e-9 else 0.0
+            self.pendiente = pendiente if n == u.ventana_ma else u.alfa * pendiente + (1 - u.alfa) * self.pendiente
+
+        self.estado = self.motor.nivel({'promedio': self.promedio, 'pendiente': self.pendiente}, self.estado)
+        return self.estado
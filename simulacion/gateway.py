@@ -1,10 +1,16 @@
 # gateway.py
-import socket, json, time, threading, collections, os, requests
-from datetime import datetime
+import socket, json, time, threading, os, queue, logging, requests
+from requests.adapters import HTTPAdapter
+import detector
+import ingesta
+import metricas
+import registro
+import reglas
+import trama
 
 # ---------- CONFIG ----------
-UDP_HOST = "0.0.0.0"
-UDP_PORT = 5005
+UDP_HOST = os.getenv("UDP_HOST", "0.0.0.0")
+UDP_PORT = int(os.getenv("UDP_PORT", 5005))
 COLA_URL = os.getenv("COLA_URL", "http://cola:5000")
 MODE_SMS = os.getenv("MODE_SMS", "SIMULATE")  # options: SIMULATE, TWILIO, GSM
 TWILIO_CONFIG = {
@@ -15,28 +21,112 @@ TWILIO_CONFIG = {
 GSM_SERIAL_PORT = "/dev/ttyS0"
 LEADERS = ["+573001234567"]
 
-# detection thresholds
-TH_PRECAUCION = 0.45  # ahora en metros
-TH_ALERTA = 0.55      # ahora en metros
-SLOPE_THRESH = 0.007  # m/s (aprox 0.7 cm/s)
-BUFFER_LEN = 12
+# detection: umbrales e histéresis en el conjunto "gateway" de REGLAS_ALERTA (reglas.py)
+BUFFER_LEN = 12       # lecturas para la pendiente por mínimos cuadrados
+MA_LEN = 5            # lecturas para el promedio móvil
+SLOPE_EWMA_ALPHA = float(os.getenv("SLOPE_EWMA_ALPHA", 0.3))
+
+UMBRALES = detector.Umbrales(ventana=BUFFER_LEN, ventana_ma=MA_LEN, alfa=SLOPE_EWMA_ALPHA)
+MOTOR_REGLAS = reglas.motor("gateway")
+
+# ---------- Pipeline ----------
+# El receptor solo parsea y encola; un hilo reenvía a la cola por lotes y un
+# número fijo de hilos analiza. Si una cola interna se llena el paquete se
+# descarta y se cuenta: UDP no permite frenar al emisor, así que la
+# contrapresión es explícita. Los SMS los envía un hilo aparte: el módem GSM
+# tarda más de 10 s por mensaje y Twilio es una llamada de red, y el análisis
+# de los demás nodos no debe esperar detrás.
+ANALYZE_WORKERS = int(os.getenv("ANALYZE_WORKERS", 1))
+PIPELINE_QUEUE_MAX = int(os.getenv("PIPELINE_QUEUE_MAX", 10000))
+SMS_QUEUE_MAX = int(os.getenv("SMS_QUEUE_MAX", 100))
+STATS_INTERVAL_S = float(os.getenv("STATS_INTERVAL_S", 30))
+
+forward_q = queue.Queue(maxsize=PIPELINE_QUEUE_MAX)  # (recibido, payload) para /mensajes/lote
+analyze_q = queue.Queue(maxsize=PIPELINE_QUEUE_MAX)  # node_id
+pending_analysis = set()  # nodos con un análisis ya encolado
+sms_q = queue.Queue(maxsize=SMS_QUEUE_MAX)  # (número, mensaje)
+
+# Reenvío por lotes a /mensajes/lote. Si la cola no responde el lote va a un
+# spool local (JSONL, solo agregar) que se reenvía en orden al recuperarse,
+# siempre antes que los lotes nuevos
+FORWARD_BATCH_MAX = int(os.getenv("FORWARD_BATCH_MAX", 200))
+FORWARD_BATCH_INTERVAL_S = float(os.getenv("FORWARD_BATCH_INTERVAL_S", 0.05))
+SPOOL_PATH = os.getenv("GATEWAY_SPOOL_PATH", "gateway_spool.jsonl")
+SPOOL_RETRY_S = float(os.getenv("SPOOL_RETRY_S", 5))
+
+# Ventana de reordenamiento por nodo (ver ingesta.py): cuánto se retiene una
+# lectura que llegó después de un hueco y cuántas como máximo
+REORDER_WAIT_S = float(os.getenv("REORDER_WAIT_S", 0.5))
+REORDER_MAX = int(os.getenv("REORDER_MAX", 8))
+
+# Puerto de /metrics (Prometheus); 0 lo desactiva
+GATEWAY_METRICAS_PUERTO = int(os.getenv("GATEWAY_METRICAS_PUERTO", 9101))
+
+# invalidos, reenviados, rechazados, errores_cola, cola_llena, en_spool,
+# descartados_envio, descartados_analisis, descartados_log, descartados_sms,
+# errores_sms, errores_reenvio, corruptas_spool,
+# duplicados, atrasados, reordenados, perdidos, reinicios (ingesta)
+EVENTOS = metricas.contador("gateway_eventos_total", "Eventos del pipeline del gateway", ("evento",))
+PAQUETES = metricas.contador("gateway_paquetes_total", "Paquetes válidos recibidos por nodo", ("node_id",))
+PROFUNDIDAD_ENVIO = metricas.medidor(
+    "gateway_cola_envio", "Lecturas esperando reenvío a la cola", funcion=lambda: forward_q.qsize()
+)
+PROFUNDIDAD_ANALISIS = metricas.medidor(
+    "gateway_cola_analisis", "Nodos esperando análisis", funcion=lambda: analyze_q.qsize()
+)
+PROFUNDIDAD_SMS = metricas.medidor(
+    "gateway_cola_sms", "SMS esperando envío", funcion=lambda: sms_q.qsize()
+)
+DURACION_COLA = metricas.histograma(
+    "gateway_duracion_cola_segundos", "Duración de POST /mensajes/lote", ("resultado",)
+)
+LATENCIA_REENVIO = metricas.histograma(
+    "gateway_latencia_reenvio_segundos", "Tiempo desde la recepción UDP hasta que la cola confirma la lectura"
+)
+TRANSICIONES = metricas.contador("gateway_transiciones_total", "Cambios de estado de los nodos", ("estado",))
+ALERTAS = metricas.contador("gateway_alertas_total", "Análisis con resultado ALERTA por nodo", ("node_id",))
+
+# Conexión HTTP reutilizada por el hilo de reenvío
+session = requests.Session()
+session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+# La última respuesta de la cola fue 429: se llegó a COLA_MAX_PROFUNDIDAD
+cola_llena = False
+
+# ---------- Logs ----------
+# Niveles por sección con LOG_NIVELES, p. ej. gateway.rx=DEBUG (líneas por
+# paquete, muestreadas con LOG_MUESTREO_DEBUG)
+log = registro.obtener("gateway")
+log_rx = registro.obtener("gateway.rx")
+log_cola = registro.obtener("gateway.cola")
+log_analisis = registro.obtener("gateway.analisis")
+log_sms = registro.obtener("gateway.sms")
+
+def count(name, n=1):
+    EVENTOS.inc((name,), n)
+
+def stats_snapshot():
+    snapshot = {"recibidos": sum(PAQUETES.valores().values())}
+    snapshot.update((evento, n) for (evento,), n in EVENTOS.valores().items())
+    return snapshot
 
 # ---------- Buffers ----------
-buffers = {}  # node_id -> deque of (ts, level)
+estimators = {}  # node_id -> detector.EstimadorNodo
 lock = threading.Lock()
+# Solo la usa el hilo receptor
+ingest = ingesta.Ingesta(espera_s=REORDER_WAIT_S, max_retenidas=REORDER_MAX, contar=count)
 
 # ---------- SMS functions ----------
 def send_sms_simulate(number, message):
-    print("[SMS-SIM] Enviando a", number, "->", message)
-    with open("sms_sent.log","a") as f:
-        f.write(f"{time.ctime()} | {number} | {message}\n")
+    log_sms.info("SMS simulado", extra={"numero": number, "mensaje": message})
+    log_event("sms_sent.log", f"{time.ctime()} | {number} | {message}\n")
     return True
 
 def send_sms_twilio(number, message):
     from twilio.rest import Client
     client = Client(TWILIO_CONFIG["account_sid"], TWILIO_CONFIG["auth_token"])
     msg = client.messages.create(body=message, from_=TWILIO_CONFIG["from_number"], to=number)
-    print("[SMS-TWILIO] SID:", msg.sid)
+    log_sms.info("SMS enviado por Twilio", extra={"numero": number, "sid": msg.sid})
     return True
 
 def send_sms_gsm(number, message):
@@ -50,7 +140,7 @@ def send_sms_gsm(number, message):
     ser.write((message + "\x1A").encode())
     time.sleep(10)
     resp = ser.read_all().decode(errors="ignore")
-    print("[SMS-GSM] resp:", resp)
+    log_sms.info("Respuesta del módem GSM", extra={"numero": number, "respuesta": resp})
     ser.close()
     return "OK" in resp or ">" in resp
 
@@ -65,98 +155,388 @@ def send_sms(number, message):
         return send_sms_simulate(number, message)
 
 # ---------- UI / state ----------
-def update_ui_state(state):
-    with open("state.json","w") as f:
-        json.dump({"state": state, "time": time.ctime()}, f)
-    with open("last_sms.json","w") as f:
-        json.dump({"msg": f"Estado actual: {state}", "time": time.ctime()}, f)
+# El estado de cada nodo vive en memoria; un solo hilo publica state.json y
+# last_sms.json (tmp + rename) cuando algún nodo cambia de estado o cada
+# STATE_PUBLISH_INTERVAL_S. alerts.log y sms_sent.log los escribe un único
+# hilo con los archivos abiertos, agrupando las líneas pendientes.
+STATE_PUBLISH_INTERVAL_S = float(os.getenv("STATE_PUBLISH_INTERVAL_S", 10))
+SEVERITY = {"NORMAL": 0, "PRECAUCION": 1, "ALERTA": 2}
+
+node_states = {}  # node_id -> {"state": ..., "time": ...}
+state_lock = threading.Lock()
+state_changed = threading.Event()  # despierta al publicador ante una transición
+state_version = 0  # aumenta con cada actualización, para no publicar sin cambios
+
+log_q = queue.Queue(maxsize=PIPELINE_QUEUE_MAX)  # (archivo, línea)
+
+def update_ui_state(node_id, state):
+    """Registra el estado del nodo; retorna True si es una transición"""
+    global state_version
+    with state_lock:
+        previous = node_states.get(node_id)
+        node_states[node_id] = {"state": state, "time": time.ctime()}
+        state_version += 1
+    if previous is None or previous["state"] != state:
+        TRANSICIONES.inc((state,))
+        state_changed.set()
+        return True
+    return False
+
+def write_atomic(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+def publish_state():
+    with state_lock:
+        nodes = {node: dict(s) for node, s in node_states.items()}
+    # Estado global: el más grave entre los nodos
+    state = max((s["state"] for s in nodes.values()), key=SEVERITY.get, default="NORMAL")
+    write_atomic("state.json", {"state": state, "time": time.ctime(), "nodos": nodes})
+    write_atomic("last_sms.json", {"msg": f"Estado actual: {state}", "time": time.ctime()})
+
+def log_event(path, line):
+    try:
+        log_q.put_nowait((path, line))
+    except queue.Full:
+        count("descartados_log")
 
 # ---------- Detection logic ----------
+def add_reading(node_id, ts, level):
+    """Actualiza el estimador del nodo con una lectura (O(1)); retorna su estado"""
+    with lock:
+        est = estimators.get(node_id)
+        if est is None:
+            est = estimators[node_id] = detector.EstimadorNodo(UMBRALES, MOTOR_REGLAS)
+        return est.agregar(ts, level)
+
 def analyze_node(node_id):
+    # El estado ya está calculado: cada lectura actualizó el estimador al llegar
     with lock:
-        buf = buffers.get(node_id, collections.deque(maxlen=BUFFER_LEN))
-        if len(buf) < 2:
-            return "NORMAL"
-        levels = [v for _,v in buf]
-        times = [t for t,_ in buf]
-    ma = sum(levels[-5:]) / min(5, len(levels))
-    slope = (levels[-1] - levels[-2]) / max(1, times[-1] - times[-2])
-    if ma >= TH_ALERTA or slope >= SLOPE_THRESH:
-        return "ALERTA"
-    elif ma >= TH_PRECAUCION:
-        return "PRECAUCION"
-    else:
-        return "NORMAL"
+        est = estimators.get(node_id)
+        return est.estado if est is not None else "NORMAL"
 
-def enviar_a_cola(ts_str, nivel_m, lluvia_mm):
-    """Envía los datos a la cola en el formato esperado"""
+def enviar_lote_a_cola(payloads):
+    """Envía un lote de lecturas a /mensajes/lote; retorna False si la cola no las recibió"""
+    global cola_llena
+    inicio = time.perf_counter()
     try:
-        payload = {
-            "ts": ts_str,
-            "nivel_m": nivel_m,
-            "lluvia_mm": lluvia_mm
-        }
-        response = requests.post(f"{COLA_URL}/mensaje", json=payload, timeout=2)
-        if response.status_code in [200, 201]:
-            print(f"[COLA] ✓ Datos enviados: {nivel_m}m, {lluvia_mm}mm")
+        response = session.post(f"{COLA_URL}/mensajes/lote", json={"mensajes": payloads}, timeout=5)
+        ok = response.status_code in [200, 201]
+        cola_llena = response.status_code == 429
+        DURACION_COLA.observar(time.perf_counter() - inicio, ("ok" if ok else "error",))
+        if ok:
+            rechazados = response.json().get("rechazados", [])
+            count("reenviados", len(payloads) - len(rechazados))
+            if rechazados:
+                # Reintentar no las haría válidas: se cuentan y se descartan
+                count("rechazados", len(rechazados))
+                log_cola.warning("Lecturas rechazadas por la cola", extra={"rechazados": len(rechazados), "ejemplos": rechazados[:3]})
+            log_cola.debug("Lote enviado", extra={"lecturas": len(payloads)})
             return True
-        else:
-            print(f"[COLA] ✗ Error {response.status_code}: {response.text}")
+        if cola_llena:
+            count("cola_llena")
+            log_cola.warning("Cola llena", extra={"lecturas": len(payloads), "respuesta": response.text[:200]})
             return False
+        log_cola.warning("Error de la cola", extra={"status": response.status_code, "respuesta": response.text[:200]})
     except Exception as e:
-        print(f"[COLA] ✗ Error enviando a cola: {e}")
-        return False
+        cola_llena = False
+        DURACION_COLA.observar(time.perf_counter() - inicio, ("error",))
+        log_cola.warning("Error enviando a cola", extra={"error": str(e)})
+    count("errores_cola")
+    return False
+
+def enviar_prioritarias(payloads):
+    """
+    Con la cola llena (429) las lecturas prioritarias igual entran, desplazando
+    las normales más antiguas: se envían solas en vez de esperar en el spool.
+    Retorna las lecturas que quedan para el spool.
+    """
+    prioritarias = [payload for payload in payloads if "prioridad" in payload]
+    if not cola_llena or not prioritarias or not enviar_lote_a_cola(prioritarias):
+        return payloads
+    return [payload for payload in payloads if "prioridad" not in payload]
+
+def spool_append(payloads):
+    with open(SPOOL_PATH, "a+b") as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell():
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                # Una escritura interrumpida dejó media línea: lo nuevo empieza en otra
+                f.write(b"\n")
+        f.write("".join(json.dumps(payload) + "\n" for payload in payloads).encode())
+        f.flush()
+        os.fsync(f.fileno())
+    count("en_spool", len(payloads))
+    log_cola.warning("Cola no disponible, lecturas guardadas en spool", extra={"lecturas": len(payloads), "spool": SPOOL_PATH})
+
+def spool_rewrite(payloads):
+    """Reemplaza el spool por `payloads` (escritura atómica: tmp + rename)"""
+    with open(SPOOL_PATH + ".tmp", "w") as f:
+        for payload in payloads:
+            f.write(json.dumps(payload) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(SPOOL_PATH + ".tmp", SPOOL_PATH)
+
+def spool_read():
+    """
+    Las lecturas del spool en orden. Las líneas ilegibles (la última a medio
+    escribir si el proceso murió) se apartan en `<spool>.corrupto`.
+    """
+    pendientes, corruptas = [], []
+    with open(SPOOL_PATH, errors="replace") as f:
+        for linea in f:
+            if not linea.strip():
+                continue
+            try:
+                pendientes.append(json.loads(linea))
+            except ValueError:
+                corruptas.append(linea if linea.endswith("\n") else linea + "\n")
+    if corruptas:
+        with open(SPOOL_PATH + ".corrupto", "a") as f:
+            f.writelines(corruptas)
+            f.flush()
+            os.fsync(f.fileno())
+        # Sin ellas, para no apartarlas de nuevo en el próximo reenvío
+        spool_rewrite(pendientes)
+        count("corruptas_spool", len(corruptas))
+        log_cola.error("Líneas ilegibles en el spool, apartadas", extra={"lineas": len(corruptas), "corrupto": SPOOL_PATH + ".corrupto"})
+    return pendientes
+
+def spool_replay():
+    """Reenvía el spool en orden; retorna True si quedó vacío"""
+    pendientes = spool_read()
+    enviados = 0
+    while enviados < len(pendientes):
+        lote = pendientes[enviados:enviados + FORWARD_BATCH_MAX]
+        if not enviar_lote_a_cola(lote):
+            # Conservar solo lo que falta
+            spool_rewrite(pendientes[enviados:])
+            return False
+        enviados += len(lote)
+    os.remove(SPOOL_PATH)
+    log_cola.info("Spool reenviado a la cola", extra={"lecturas": len(pendientes)})
+    return True
+
+def take_batch():
+    """Espera la primera lectura y junta las que lleguen hasta el máximo o el intervalo"""
+    try:
+        lote = [forward_q.get(timeout=SPOOL_RETRY_S)]
+    except queue.Empty:
+        return []
+    limite = time.monotonic() + FORWARD_BATCH_INTERVAL_S
+    while len(lote) < FORWARD_BATCH_MAX:
+        restante = limite - time.monotonic()
+        if restante <= 0:
+            break
+        try:
+            lote.append(forward_q.get(timeout=restante))
+        except queue.Empty:
+            break
+    return lote
 
 def maybe_alert(node_id):
     status = analyze_node(node_id)
-    print(f"[ANALYZER] Nodo {node_id} -> {status}")
-    update_ui_state(status)
+    if log_analisis.isEnabledFor(logging.DEBUG) and registro.muestrear():
+        log_analisis.debug("Nodo analizado", extra={"node_id": node_id, "estado": status})
+    update_ui_state(node_id, status)
     if status == "ALERTA":
+        ALERTAS.inc((node_id,))
         message = f"ALERTA URGENTE - Nodo {node_id} detecta crecida. Diríjase ya a zonas altas."
         for num in LEADERS:
-            send_sms(num, message)
-        print("[ACTUATOR] Activando sirena y semáforo ROJO (simulado).")
-        with open("alerts.log","a") as f:
-            f.write(f"{time.ctime()} | {node_id} | ALERTA\n")
+            try:
+                sms_q.put_nowait((num, message))
+            except queue.Full:
+                count("descartados_sms")
+                log_sms.error("Cola de SMS llena, mensaje descartado", extra={"numero": num, "node_id": node_id})
+        log_analisis.warning("Activando sirena y semáforo ROJO (simulado)", extra={"node_id": node_id})
+        log_event("alerts.log", f"{time.ctime()} | {node_id} | ALERTA\n")
+
+# ---------- Workers ----------
+def forward_worker():
+    next_replay = 0.0
+    while True:
+        lote = take_batch()
+        try:
+            next_replay = forward_batch(lote, next_replay)
+        except Exception:
+            # Sin este hilo forward_q se llena y se pierde todo lo que llega
+            count("errores_reenvio")
+            count("descartados_envio", len(lote))
+            log_cola.exception("Error reenviando lote, lecturas descartadas", extra={"lecturas": len(lote)})
+            next_replay = time.monotonic() + SPOOL_RETRY_S
+
+def forward_batch(lote, next_replay):
+    """Reenvía un lote de forward_q, o lo agrega al spool; retorna cuándo reintentar el spool"""
+    # Lo que está en el spool es más antiguo: mientras no se vacíe, lo nuevo va detrás
+    if os.path.exists(SPOOL_PATH):
+        vaciado = False
+        if time.monotonic() >= next_replay:
+            vaciado = spool_replay()
+            if not vaciado:
+                next_replay = time.monotonic() + SPOOL_RETRY_S
+        if not vaciado:
+            restantes = enviar_prioritarias([payload for _, payload in lote])
+            if restantes:
+                spool_append(restantes)
+            return next_replay
+    if not lote:
+        return next_replay
+    payloads = [payload for _, payload in lote]
+    if enviar_lote_a_cola(payloads):
+        ahora = time.monotonic()
+        LATENCIA_REENVIO.observar_varios([ahora - recibido for recibido, _ in lote])
+        return next_replay
+    restantes = enviar_prioritarias(payloads)
+    if restantes:
+        spool_append(restantes)
+    return time.monotonic() + SPOOL_RETRY_S
+
+def analyze_worker():
+    while True:
+        node = analyze_q.get()
+        with lock:
+            pending_analysis.discard(node)
+        maybe_alert(node)
+
+def sms_sender():
+    while True:
+        number, message = sms_q.get()
+        try:
+            send_sms(number, message)
+        except Exception as e:
+            count("errores_sms")
+            log_sms.error("Error enviando SMS", extra={"numero": number, "error": str(e)})
+
+def state_publisher():
+    published = -1
+    while True:
+        # Las transiciones que llegan mientras se escribe se publican juntas en la siguiente vuelta
+        state_changed.wait(STATE_PUBLISH_INTERVAL_S)
+        state_changed.clear()
+        if state_version != published:
+            published = state_version
+            publish_state()
+
+def log_writer():
+    files = {}
+    while True:
+        items = [log_q.get()]
+        while True:
+            try:
+                items.append(log_q.get_nowait())
+            except queue.Empty:
+                break
+        for path, line in items:
+            if path not in files:
+                files[path] = open(path, "a")
+            files[path].write(line)
+        for f in files.values():
+            f.flush()
+
+def stats_reporter():
+    while True:
+        time.sleep(STATS_INTERVAL_S)
+        log.info("Estadísticas", extra={**stats_snapshot(), "cola_envio": forward_q.qsize(), "cola_analisis": analyze_q.qsize(), "cola_sms": sms_q.qsize()})
+
+def start_workers():
+    threading.Thread(target=forward_worker, name="forward", daemon=True).start()
+    for i in range(ANALYZE_WORKERS):
+        threading.Thread(target=analyze_worker, name=f"analyze-{i}", daemon=True).start()
+    threading.Thread(target=sms_sender, name="sms", daemon=True).start()
+    threading.Thread(target=state_publisher, name="state", daemon=True).start()
+    threading.Thread(target=log_writer, name="log-writer", daemon=True).start()
+    threading.Thread(target=stats_reporter, name="stats", daemon=True).start()
 
 # ---------- UDP receiver ----------
+def handle_packet(data):
+    """Decodifica un datagrama (trama binaria o JSON) y entrega, en orden y sin duplicados, las lecturas que quedan listas"""
+    try:
+        j = trama.decodificar(data)
+        lectura = {
+            "node_id": j.get("node_id", "UNKNOWN"),
+            "ts": j["ts"],        # ISO 8601, para la cola
+            "epoch": j["epoch"],  # timestamp Unix, para análisis de slope y ts_ms en la cola
+            "nivel_m": j["nivel_m"],
+            "lluvia_mm": j["lluvia_mm"],
+            "seq": None if j.get("seq") is None else int(j["seq"]),
+        }
+    except Exception as e:
+        count("invalidos")
+        log_rx.warning("Paquete inválido", extra={"error": str(e)})
+        return
+    
+    for entregada in ingest.agregar(lectura, time.monotonic()):
+        accept_reading(entregada)
+
+def flush_reorder():
+    """Entrega las lecturas que esperaron un hueco más de REORDER_WAIT_S"""
+    for lectura in ingest.vencidas(time.monotonic()):
+        accept_reading(lectura)
+
+def accept_reading(lectura):
+    """Actualiza el estimador del nodo y encola la lectura para reenvío y análisis"""
+    node = lectura["node_id"]
+    ts = lectura["epoch"]
+    nivel_m = lectura["nivel_m"]
+    
+    PAQUETES.inc((node,))
+    estado = add_reading(node, ts, nivel_m)
+    with lock:
+        # Un análisis pendiente ya verá este estado: no hace falta otro
+        analizar = node not in pending_analysis
+        if analizar:
+            pending_analysis.add(node)
+    
+    if log_rx.isEnabledFor(logging.DEBUG) and registro.muestrear():
+        log_rx.debug("Paquete recibido", extra={"node_id": node, "ts": lectura["ts"], "nivel_m": nivel_m,
+                                                "lluvia_mm": lectura["lluvia_mm"], "seq": lectura["seq"]})
+    
+    # Enviar datos a la cola; las lecturas en PRECAUCION o ALERTA van al carril prioritario
+    payload = {"node_id": node, "ts": lectura["ts"], "ts_ms": round(ts * 1000),
+               "nivel_m": nivel_m, "lluvia_mm": lectura["lluvia_mm"]}
+    if estado != detector.NORMAL:
+        payload["prioridad"] = "alta"
+    try:
+        forward_q.put_nowait((time.monotonic(), payload))
+    except queue.Full:
+        count("descartados_envio")
+    
+    # Analizar para alertas
+    if analizar:
+        try:
+            analyze_q.put_nowait(node)
+        except queue.Full:
+            with lock:
+                pending_analysis.discard(node)
+            count("descartados_analisis")
+
 def receiver():
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     sock.bind((UDP_HOST, UDP_PORT))
-    print(f"[GATEWAY] Escuchando UDP en {UDP_HOST}:{UDP_PORT}")
+    # Sin tráfico, el timeout igual deja vencer las lecturas retenidas
+    if REORDER_WAIT_S > 0:
+        sock.settimeout(REORDER_WAIT_S / 2)
+    log.info("Escuchando UDP", extra={"host": UDP_HOST, "puerto": UDP_PORT})
     while True:
-        data, addr = sock.recvfrom(4096)
         try:
-            j = json.loads(data.decode())
-            node = j.get("node_id", "UNKNOWN")
-            ts_str = j.get("ts", None)
-            nivel_m = float(j.get("nivel_m", 0))
-            lluvia_mm = float(j.get("lluvia_mm", 0))
-            
-            # Asegurar que ts_str esté en formato ISO
-            if not ts_str:
-                ts_str = datetime.utcnow().isoformat() + "Z"
-            
-            # convertir ts a timestamp Unix para análisis de slope
-            try:
-                ts = datetime.fromisoformat(ts_str.replace('Z', '+00:00')).timestamp()
-            except:
-                ts = time.time()
-            
-            with lock:
-                buf = buffers.setdefault(node, collections.deque(maxlen=BUFFER_LEN))
-                buf.append((ts, nivel_m))
-            
-            print(f"[RX] {node} @ {ts_str} -> {nivel_m} m, lluvia: {lluvia_mm} mm")
-            
-            # Enviar datos a la cola
-            threading.Thread(target=enviar_a_cola, args=(ts_str, nivel_m, lluvia_mm)).start()
-            
-            # Analizar para alertas
-            threading.Thread(target=maybe_alert, args=(node,)).start()
-        except Exception as e:
-            print("Error parseando paquete:", e)
+            data, addr = sock.recvfrom(4096)
+            handle_packet(data)
+        except socket.timeout:
+            pass
+        flush_reorder()
 
 if __name__ == "__main__":
-    print("Gateway iniciado. MODE_SMS =", MODE_SMS)
-    receiver()
+    registro.configurar()
+    log.info("Gateway iniciado", extra={"mode_sms": MODE_SMS})
+    if GATEWAY_METRICAS_PUERTO:
+        metricas.servir(GATEWAY_METRICAS_PUERTO)
+        log.info("Métricas expuestas", extra={"puerto": GATEWAY_METRICAS_PUERTO})
+    start_workers()
+    try:
+        receiver()
+    finally:
+        registro.detener()
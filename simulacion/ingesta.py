@@ -0,0 +1,195 @@
+"""
+Deduplicación y ventana de reordenamiento por nodo a la entrada del gateway.
+
+LoRa y el reenvío por UDP pueden entregar un paquete dos veces o fuera de
+orden. Por cada nodo se guarda:
+
+- El último seq entregado y una máscara de bits con cuáles de los VENTANA
+  anteriores ya se vieron (como la ventana anti-replay de IPsec), así un
+  duplicado se detecta en O(1) y con memoria fija.
+- A lo sumo `max_retenidas` lecturas que llegaron después de un hueco. Se
+  retienen hasta que llega la que falta o pasan `espera_s`, y salen en orden
+  de seq.
+
+Los seq son de 16 bits y dan la vuelta, así que se comparan con aritmética
+modular. Una lectura con seq anterior al último entregado se descarta
+(duplicada si ya se vio, atrasada si no), salvo que su ts sea posterior: eso
+indica que el sensor se reinició y su seq volvió a 0.
+
+Las lecturas sin seq (JSON de otros firmwares) no permiten ver un hueco,
+así que todas se retienen con la misma ventana, ordenadas por ts: salen al
+cumplir `espera_s` (con las de ts anterior) o al pasar de `max_retenidas`.
+Se descarta la que repite un ts retenido o no supera el último entregado.
+"""
+import bisect
+from typing import Callable, Dict, List
+
+VENTANA = 64
+_MASCARA = (1 << VENTANA) - 1
+_SEQ_MOD = 1 << 16
+
+
+class VentanaNodo:
+    __slots__ = ('entregado', 'vistos', 'ts', 'retenidas', 'sin_seq')
+
+    def __init__(self):
+        self.entregado = None  # último seq entregado
+        self.vistos = 0        # bit i: se vio el seq entregado - i
+        self.ts = None         # epoch de la última lectura entregada
+        self.retenidas: Dict[int, tuple] = {}  # seq -> (llegada, lectura)
+        self.sin_seq: List[tuple] = []         # (epoch, llegada, lectura) ordenadas por epoch
+
+
+class Ingesta:
+    """
+    Filtro de entrada: `agregar` y `vencidas` retornan las lecturas listas
+    para reenviar y analizar, sin duplicados y en orden por nodo. Los
+    descartes se reportan con `contar(evento, n)`: duplicados, atrasados,
+    reordenados (retenidas que salieron en orden al llenarse el hueco, o sin
+    seq, las que llegaron después de una de ts posterior),
+    perdidos (seq que se dejaron de esperar) y reinicios.
+    """
+
+    def __init__(self, espera_s: float = 0.5, max_retenidas: int = 8,
+                 contar: Callable[..., None] = lambda evento, n=1: None):
+        self.espera_s = espera_s
+        self.max_retenidas = max_retenidas
+        self.contar = contar
+        self.nodos: Dict[str, VentanaNodo] = {}
+        self._con_retenidas: Dict[str, VentanaNodo] = {}
+
+    def agregar(self, lectura: dict, ahora: float) -> List[dict]:
+        """Recibe una lectura con node_id, epoch y opcionalmente seq; `ahora` es un reloj monotónico"""
+        node_id = lectura['node_id']
+        nodo = self.nodos.get(node_id)
+        if nodo is None:
+            nodo = self.nodos[node_id] = VentanaNodo()
+
+        seq = lectura.get('seq')
+        if seq is None:
+            listas = self._ubicar_por_ts(nodo, lectura, ahora)
+        else:
+            seq %= _SEQ_MOD
+            if not nodo.retenidas and nodo.entregado is not None and (seq - nodo.entregado) % _SEQ_MOD == 1:
+                # Caso común: la siguiente en orden y nada retenido
+                nodo.vistos = ((nodo.vistos << 1) | 1) & _MASCARA
+                nodo.entregado = seq
+                nodo.ts = lectura['epoch']
+                return [lectura]
+            listas = self._ubicar(nodo, seq, lectura, ahora)
+
+        if nodo.retenidas or nodo.sin_seq:
+            self._con_retenidas[node_id] = nodo
+        else:
+            self._con_retenidas.pop(node_id, None)
+        return listas
+
+    def vencidas(self, ahora: float) -> List[dict]:
+        """Entrega las lecturas retenidas más de espera_s, dando por perdido el hueco que esperaban"""
+        listas = []
+        for node_id, nodo in list(self._con_retenidas.items()):
+            while nodo.retenidas and min(llegada for llegada, _ in nodo.retenidas.values()) + self.espera_s <= ahora:
+                listas.extend(self._saltar(nodo))
+            if nodo.sin_seq:
+                # Una vencida sale con todas las de ts anterior, para no desordenarlas
+                ultima = max((i for i, (_, llegada, _) in enumerate(nodo.sin_seq) if llegada + self.espera_s <= ahora),
+                             default=-1)
+                if ultima >= 0:
+                    listas.extend(self._soltar_por_ts(nodo, ultima + 1))
+            if not (nodo.retenidas or nodo.sin_seq):
+                del self._con_retenidas[node_id]
+        return listas
+
+    def _ubicar_por_ts(self, nodo: VentanaNodo, lectura: dict, ahora: float) -> List[dict]:
+        epoch = lectura['epoch']
+        if nodo.ts is not None and epoch <= nodo.ts:
+            self.contar("duplicados" if epoch == nodo.ts else "atrasados")
+            return []
+        if self.espera_s <= 0:
+            nodo.ts = epoch
+            return [lectura]
+
+        i = bisect.bisect_left(nodo.sin_seq, (epoch,))
+        if i < len(nodo.sin_seq):
+            if nodo.sin_seq[i][0] == epoch:
+                self.contar("duplicados")
+                return []
+            # Llegó después de una posterior que sigue retenida: sale antes que ella
+            self.contar("reordenados")
+        nodo.sin_seq.insert(i, (epoch, ahora, lectura))
+        if len(nodo.sin_seq) > self.max_retenidas:
+            return self._soltar_por_ts(nodo, 1)
+        return []
+
+    def _soltar_por_ts(self, nodo: VentanaNodo, cuantas: int) -> List[dict]:
+        """Entrega las `cuantas` retenidas sin seq de menor ts"""
+        listas = [lectura for _, _, lectura in nodo.sin_seq[:cuantas]]
+        del nodo.sin_seq[:cuantas]
+        nodo.ts = listas[-1]['epoch']
+        return listas
+
+    def _ubicar(self, nodo: VentanaNodo, seq: int, lectura: dict, ahora: float) -> List[dict]:
+        if nodo.entregado is None:
+            return self._entregar(nodo, seq, lectura)
+
+        adelante = (seq - nodo.entregado) % _SEQ_MOD
+        if adelante == 0 or adelante >= _SEQ_MOD // 2:
+            if nodo.ts is not None and lectura['epoch'] > nodo.ts:
+                # seq hacia atrás con ts posterior: el sensor se reinició
+                self.contar("reinicios")
+                listas = self._liberar_todas(nodo)
+                nodo.entregado = None
+                nodo.vistos = 0
+                return listas + self._entregar(nodo, seq, lectura)
+            atras = (nodo.entregado - seq) % _SEQ_MOD
+            visto = atras < VENTANA and nodo.vistos >> atras & 1
+            self.contar("duplicados" if visto else "atrasados")
+            return []
+
+        if adelante == 1:
+            return self._entregar(nodo, seq, lectura)
+
+        if seq in nodo.retenidas:
+            self.contar("duplicados")
+            return []
+        if self.espera_s <= 0 or adelante - 1 > self.max_retenidas:
+            # Hueco demasiado grande para esperarlo: lo anterior sale ya
+            return self._liberar_todas(nodo) + self._entregar(nodo, seq, lectura)
+        nodo.retenidas[seq] = (ahora, lectura)
+        if len(nodo.retenidas) > self.max_retenidas:
+            return self._saltar(nodo)
+        return []
+
+    def _marcar(self, nodo: VentanaNodo, seq: int, lectura: dict):
+        salto = 1 if nodo.entregado is None else (seq - nodo.entregado) % _SEQ_MOD
+        if salto > 1:
+            self.contar("perdidos", salto - 1)
+        nodo.vistos = ((nodo.vistos << salto) | 1) & _MASCARA
+        nodo.entregado = seq
+        nodo.ts = lectura['epoch']
+
+    def _entregar(self, nodo: VentanaNodo, seq: int, lectura: dict) -> List[dict]:
+        """Entrega `seq` y las retenidas que quedan consecutivas a él"""
+        self._marcar(nodo, seq, lectura)
+        listas = [lectura]
+        while nodo.retenidas:
+            siguiente = (nodo.entregado + 1) % _SEQ_MOD
+            retenida = nodo.retenidas.pop(siguiente, None)
+            if retenida is None:
+                break
+            self.contar("reordenados")
+            self._marcar(nodo, siguiente, retenida[1])
+            listas.append(retenida[1])
+        return listas
+
+    def _saltar(self, nodo: VentanaNodo) -> List[dict]:
+        """Deja de esperar el hueco: entrega la retenida de menor seq y las consecutivas"""
+        primera = min(nodo.retenidas, key=lambda s: (s - nodo.entregado) % _SEQ_MOD)
+        _, lectura = nodo.retenidas.pop(primera)
+        return self._entregar(nodo, primera, lectura)
+
+    def _liberar_todas(self, nodo: VentanaNodo) -> List[dict]:
+        listas = []
+        while nodo.retenidas:
+            listas.extend(self._saltar(nodo))
+        return listas
@@ -0,0 +1,152 @@
+"""
+Logging estructurado (una línea JSON por evento) que no bloquea el loop del ETL.
+
+Este archivo está duplicado en back/ y simulacion/ porque cada servicio se
+construye con su propio contexto de Docker; simulacion/tests/test_copias.py
+falla si las copias difieren.
+
+Los registros se encolan en memoria y un hilo de fondo los formatea y escribe
+en stdout, así el loop nunca espera la escritura al pipe del contenedor. Si la
+cola se llena los registros se descartan (y se cuentan) en lugar de frenar.
+
+Configuración por variables de entorno:
+    LOG_NIVEL=INFO                          nivel por defecto
+    LOG_NIVELES=etl.escritor=DEBUG,...      niveles por módulo
+    LOG_MUESTREO_DEBUG=100                  escribe 1 de cada N líneas DEBUG por mensaje
+
+Uso:
+    log = registro.obtener('etl')
+    log.info("medicion procesada", extra={"node_id": "N01", "ts": ts})
+
+    # Líneas por mensaje: sin costo si DEBUG está desactivado, y muestreadas
+    # antes de construir el registro si está activado
+    if log.isEnabledFor(logging.DEBUG) and registro.muestrear():
+        log.debug(...)
+"""
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+from datetime import datetime, timezone
+from typing import Optional
+
+LOG_NIVEL = os.getenv('LOG_NIVEL', 'INFO').upper()
+LOG_NIVELES = os.getenv('LOG_NIVELES', '')
+LOG_MUESTREO_DEBUG = int(os.getenv('LOG_MUESTREO_DEBUG', 100))
+LOG_COLA_MAX = int(os.getenv('LOG_COLA_MAX', 10000))
+
+# Atributos propios de LogRecord; todo lo demás vino en `extra` y va al JSON
+_ATRIBUTOS_BASE = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_configurado_en: Optional[int] = None
+_listener: Optional["EscritorFondo"] = None
+_manejador: Optional["ManejadorCola"] = None
+_lock = threading.Lock()
+
+
+class FormatoJSON(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        evento = {
+            "fecha": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat().replace('+00:00', 'Z'),
+            "nivel": record.levelname,
+            "modulo": record.name,
+            "msg": record.getMessage(),
+        }
+        for clave, valor in vars(record).items():
+            if clave not in _ATRIBUTOS_BASE:
+                evento[clave] = valor
+        if record.exc_info:
+            evento["error"] = self.formatException(record.exc_info)
+        return json.dumps(evento, ensure_ascii=False, default=str)
+
+
+_vistos = 0
+
+
+def muestrear() -> bool:
+    """True para 1 de cada LOG_MUESTREO_DEBUG llamadas"""
+    global _vistos
+    _vistos += 1
+    return LOG_MUESTREO_DEBUG <= 1 or _vistos % LOG_MUESTREO_DEBUG == 0
+
+
+class ManejadorCola(logging.handlers.QueueHandler):
+    """QueueHandler que no formatea en el hilo llamador y descarta si la cola está llena"""
+
+    def __init__(self, cola: queue.Queue):
+        super().__init__(cola)
+        self.descartados = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # El formateo (incluido msg % args) se hace en el hilo de fondo
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+
+
+class EscritorFondo(logging.handlers.QueueListener):
+    """Hilo que escribe los registros encolados; al detenerse espera a vaciar la cola aunque esté llena"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+def configurar(flujo=None):
+    """
+    Instala el manejador asíncrono en el logger raíz. Es idempotente dentro
+    de un proceso y vuelve a configurarse en cada proceso hijo, donde el hilo
+    de escritura del padre no existe.
+    """
+    global _configurado_en, _listener, _manejador
+    with _lock:
+        if _configurado_en == os.getpid():
+            return
+        _configurado_en = os.getpid()
+
+        # Sin nombre de archivo/línea ni datos de proceso e hilo: evita recorrer
+        # la pila en cada registro (ver "Optimization" en el HOWTO de logging)
+        logging._srcfile = None
+        logging.logThreads = False
+        logging.logProcesses = False
+        logging.logMultiprocessing = False
+
+        salida = logging.StreamHandler(flujo or sys.stdout)
+        salida.setFormatter(FormatoJSON())
+        cola: queue.Queue = queue.Queue(maxsize=LOG_COLA_MAX)
+        _manejador = ManejadorCola(cola)
+
+        raiz = logging.getLogger()
+        raiz.handlers = [_manejador]
+        raiz.setLevel(LOG_NIVEL)
+        for par in filter(None, (p.strip() for p in LOG_NIVELES.split(','))):
+            modulo, _, nivel = par.partition('=')
+            logging.getLogger(modulo.strip()).setLevel(nivel.strip().upper())
+
+        _listener = EscritorFondo(cola, salida)
+        _listener.start()
+
+
+def detener():
+    """Escribe lo que quede en la cola y detiene el hilo de fondo"""
+    global _configurado_en, _listener
+    with _lock:
+        if _listener is not None and _configurado_en == os.getpid():
+            _listener.stop()
+        _listener = None
+        _configurado_en = None
+
+
+def descartados() -> int:
+    """Registros descartados por cola llena desde que se configuró el proceso"""
+    return _manejador.descartados if _manejador is not None else 0
+
+
+def obtener(nombre: str) -> logging.Logger:
+    return logging.getLogger(nombre)
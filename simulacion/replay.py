@@ -0,0 +1,374 @@
+"""
+Replay de lecturas grabadas a través de los dos detectores de crecidas, más
+rápido que el tiempo real, para ajustar umbrales:
+
+- ETL: métricas de `HidrologiaProcessor` calculadas en lote con
+  back/procesamiento_lote.py y el conjunto "etl" de reglas.py evaluado en
+  lote (alerta = alguna regla cumplida, como `evaluar_alerta`).
+- Gateway: `detector.EstimadorNodo` con el conjunto "gateway", el mismo que
+  usa `analyze_node`.
+
+Las reglas salen de --reglas (o REGLAS_ALERTA) y cada --ajuste
+conjunto.regla.clave=valor cambia un umbral sin editar el archivo.
+
+Entradas:
+    export CSV o Parquet de mediciones_hidrologicas (ts, nivel_m, lluvia_mm, node_id)
+    captura UDP en formato pcap (tcpdump -w captura.pcap udp port 5005),
+    con tramas binarias o JSON
+    --sintetico: lecturas con semilla de carga.generar
+
+Para cada detector reporta los episodios de alerta por nodo, la anticipación
+respecto del pico de cada crecida y las falsas alarmas. Una crecida es una
+racha de lecturas con nivel >= --nivel-crecida (las rachas a menos de
+--anticipacion-max de distancia se unen); una alarma es verdadera si se
+solapa con [inicio - --anticipacion-max, fin] de alguna crecida del nodo.
+
+    python replay.py export.csv --ajuste etl.ror_alto.umbral=0.5 --ajuste gateway.promedio_alerta.umbral=0.6
+    python replay.py captura.pcap --velocidad 60 --linea-tiempo
+    python replay.py --sintetico --escenario crecida --nodos 1000 --lecturas 1000
+"""
+import argparse
+import json
+import os
+import struct
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+import detector
+import reglas
+import trama
+
+DIRECTORIO_BACK = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'back')
+sys.path.append(DIRECTORIO_BACK)
+
+import procesamiento_lote  # noqa: E402  (back/, solo requiere numpy)
+
+
+# ---------- Entradas ----------
+
+# Magic de pcap (µs o ns) -> orden de bytes; se usa el ts de la lectura, no el de captura
+_PCAP_MAGIC = {b'\xd4\xc3\xb2\xa1': '<', b'\xa1\xb2\xc3\xd4': '>', b'\x4d\x3c\xb2\xa1': '<', b'\xa1\xb2\x3c\x4d': '>'}
+# Tipo de enlace -> bytes de cabecera antes del paquete IP y offset del ethertype (None si no tiene)
+_ENLACES = {0: (4, None), 1: (14, 12), 12: (0, None), 101: (0, None), 113: (16, 14), 276: (20, 0)}
+
+
+def _udp_payload(paquete: bytes, puerto: int):
+    """Payload UDP de un paquete IPv4/IPv6 dirigido a `puerto`, o None"""
+    if not paquete:
+        return None
+    version = paquete[0] >> 4
+    if version == 4:
+        cabecera = (paquete[0] & 0x0F) * 4
+        if paquete[9] != 17:
+            return None
+    elif version == 6:
+        cabecera = 40
+        if paquete[6] != 17:
+            return None
+    else:
+        return None
+    destino, largo = struct.unpack_from('>2xHH', paquete, cabecera)
+    if puerto and destino != puerto:
+        return None
+    return paquete[cabecera + 8:cabecera + largo]
+
+
+def leer_pcap(ruta: str, puerto: int) -> dict:
+    """Decodifica los datagramas de sensores de una captura pcap; los inválidos se cuentan y se omiten"""
+    with open(ruta, 'rb') as f:
+        datos = f.read()
+    if datos[:4] not in _PCAP_MAGIC:
+        raise SystemExit(f"{ruta} no es pcap (si es pcapng: editcap -F pcap {ruta} salida.pcap)")
+    orden = _PCAP_MAGIC[datos[:4]]
+    (enlace,) = struct.unpack_from(orden + 'I', datos, 20)
+    if enlace not in _ENLACES:
+        raise SystemExit(f"Tipo de enlace pcap no soportado: {enlace}")
+    salto, offset_tipo = _ENLACES[enlace]
+    registro = struct.Struct(orden + 'IIII')
+
+    columnas = {'node_id': [], 'ts': [], 'nivel_m': [], 'lluvia_mm': []}
+    invalidos = 0
+    pos = 24
+    while pos + registro.size <= len(datos):
+        _, _, capturado, _ = registro.unpack_from(datos, pos)
+        pos += registro.size
+        trama_enlace = datos[pos:pos + capturado]
+        pos += capturado
+
+        inicio = salto
+        if offset_tipo is not None:
+            (tipo,) = struct.unpack_from('>H', trama_enlace, offset_tipo)
+            if tipo == 0x8100:  # VLAN 802.1Q
+                (tipo,) = struct.unpack_from('>H', trama_enlace, offset_tipo + 4)
+                inicio += 4
+            if tipo not in (0x0800, 0x86DD):
+                continue
+        try:
+            payload = _udp_payload(trama_enlace[inicio:], puerto)
+            if payload is None:
+                continue
+            lectura = trama.decodificar(payload)
+        except (ValueError, struct.error):
+            invalidos += 1
+            continue
+        columnas['node_id'].append(str(lectura['node_id']))
+        columnas['ts'].append(int(lectura['epoch'] * 10**6))
+        columnas['nivel_m'].append(lectura['nivel_m'])
+        columnas['lluvia_mm'].append(lectura['lluvia_mm'])
+    if invalidos:
+        print(f"{invalidos} datagramas inválidos omitidos", file=sys.stderr)
+    return columnas
+
+
+def leer_export(ruta: str) -> dict:
+    """Export de la base en orden de llegada (por id si lo trae, si no por ts)"""
+    columnas = procesamiento_lote.leer_export(ruta)
+    if not columnas or not columnas.get('ts'):
+        raise SystemExit(f"{ruta} no contiene mediciones")
+    ts = procesamiento_lote.epoch_us(columnas['ts'])
+    if 'id' in columnas:
+        orden = np.argsort(np.asarray(columnas['id'], dtype=np.int64), kind='stable')
+    else:
+        orden = np.argsort(ts, kind='stable')
+    nodos = columnas.get('node_id') or [None] * len(ts)
+    return {
+        'node_id': [str(nodos[i]) for i in orden],
+        'ts': ts[orden],
+        'nivel_m': [columnas['nivel_m'][i] for i in orden],
+        'lluvia_mm': [columnas['lluvia_mm'][i] for i in orden],
+    }
+
+
+def leer_sintetico(escenario: str, nodos: int, lecturas: int, periodo_s: float, semilla: int) -> dict:
+    import carga
+
+    columnas = {'node_id': [], 'ts': [], 'nivel_m': [], 'lluvia_mm': []}
+    for nodo, ts, nivel, lluvia in carga.generar(escenario, nodos, lecturas, periodo_s, semilla):
+        columnas['node_id'].append(nodo)
+        columnas['ts'].append(ts * 10**6)
+        columnas['nivel_m'].append(nivel)
+        columnas['lluvia_mm'].append(lluvia)
+    return columnas
+
+
+# ---------- Detectores ----------
+
+def aplicar_ajuste(config: dict, ajuste: str):
+    """Aplica `conjunto.regla.clave=valor` (p. ej. gateway.promedio_alerta.salida=0.5) a la configuración"""
+    try:
+        ruta, valor = ajuste.split('=', 1)
+        conjunto, nombre, clave = ruta.split('.')
+        regla = next(r for r in config[conjunto]['reglas'] if r['nombre'] == nombre)
+        regla[clave] = float(valor)
+    except (ValueError, KeyError, StopIteration):
+        raise SystemExit(f"Ajuste inválido: {ajuste} (formato conjunto.regla.clave=valor con una regla existente)")
+
+
+def alertas_etl(columnas: dict, motor: reglas.Motor, umbral_persistencia: float) -> np.ndarray:
+    """`evaluar_alerta` por lectura: el motor en lote sobre las métricas de procesamiento_lote"""
+    derivadas = procesamiento_lote.procesar_columnas(columnas['ts'], columnas['nivel_m'], columnas['lluvia_mm'],
+                                                     columnas['node_id'], umbral_alerta=umbral_persistencia)
+    # Las métricas NaN (primera lectura del nodo) no cumplen ninguna regla, como el None del ETL
+    cumplidas = motor.evaluar_lote({'nivel_m': columnas['nivel_m'], **derivadas}).reglas
+    if not cumplidas:
+        return np.zeros(len(columnas['nivel_m']), dtype=bool)
+    return np.logical_or.reduce(list(cumplidas.values()))
+
+
+def alertas_gateway(columnas: dict, umbrales: detector.Umbrales, motor: reglas.Motor) -> np.ndarray:
+    """Estado ALERTA de `EstimadorNodo` tras cada lectura, en orden de llegada"""
+    estimadores = {}
+    alerta = np.zeros(len(columnas['node_id']), dtype=bool)
+    segundos = (np.asarray(columnas['ts'], dtype=np.int64) / 10**6).tolist()
+    for i, (nodo, ts, nivel) in enumerate(zip(columnas['node_id'], segundos, columnas['nivel_m'])):
+        est = estimadores.get(nodo)
+        if est is None:
+            est = estimadores[nodo] = detector.EstimadorNodo(umbrales, motor)
+        alerta[i] = est.agregar(ts, nivel) == detector.ALERTA
+    return alerta
+
+
+# ---------- Evaluación ----------
+
+def _rachas(activo: np.ndarray):
+    """Índices (inicio, fin) inclusivos de cada racha de True"""
+    cambios = np.diff(np.concatenate(([0], activo.astype(np.int8), [0])))
+    return zip(np.flatnonzero(cambios == 1).tolist(), (np.flatnonzero(cambios == -1) - 1).tolist())
+
+
+def evaluar(columnas: dict, alertas: dict, nivel_crecida: float, anticipacion_max_s: float):
+    """
+    Agrupa por nodo y compara los episodios de alerta de cada detector con las
+    crecidas. Retorna (resumen por detector, episodios en orden de inicio).
+    """
+    nodos = np.asarray(columnas['node_id'])
+    t = np.asarray(columnas['ts'], dtype=np.int64) / 10**6
+    nivel = np.asarray(columnas['nivel_m'], dtype=np.float64)
+
+    orden = np.argsort(nodos, kind='stable')
+    nodos_o = nodos[orden]
+    cortes = np.flatnonzero(nodos_o[1:] != nodos_o[:-1]) + 1
+    grupos = np.split(orden, cortes) if len(orden) else []
+
+    resumen = {nombre: {'episodios': 0, 'crecidas': 0, 'detectadas': 0, 'perdidas': 0,
+                        'falsas_alarmas': 0, 'anticipacion_s': []} for nombre in alertas}
+    episodios = []
+    for indices in grupos:
+        t_n, nivel_n = t[indices], nivel[indices]
+        # Rachas separadas por menos de anticipacion_max son la misma crecida
+        # (el ruido alrededor del umbral no la parte en varias)
+        rachas = []
+        for i0, i1 in _rachas(nivel_n >= nivel_crecida):
+            if rachas and t_n[i0] - t_n[rachas[-1][1]] < anticipacion_max_s:
+                rachas[-1][1] = i1
+            else:
+                rachas.append([i0, i1])
+        crecidas = []
+        for i0, i1 in rachas:
+            pico = i0 + int(np.argmax(nivel_n[i0:i1 + 1]))
+            crecidas.append((t_n[i0] - anticipacion_max_s, t_n[i1], t_n[pico]))
+
+        for nombre, activo in alertas.items():
+            r = resumen[nombre]
+            propios = [(t_n[i0], t_n[i1]) for i0, i1 in _rachas(activo[indices])]
+            r['episodios'] += len(propios)
+            r['crecidas'] += len(crecidas)
+            for desde, hasta, pico in crecidas:
+                inicios = [max(inicio, desde) for inicio, fin in propios if inicio <= pico and fin >= desde]
+                if inicios:
+                    r['detectadas'] += 1
+                    r['anticipacion_s'].append(pico - min(inicios))
+                else:
+                    r['perdidas'] += 1
+            nodo = str(nodos[indices[0]])
+            for inicio, fin in propios:
+                verdadera = any(inicio <= hasta and fin >= desde for desde, hasta, _ in crecidas)
+                r['falsas_alarmas'] += not verdadera
+                episodios.append({'detector': nombre, 'node_id': nodo, 'inicio': inicio, 'fin': fin,
+                                  'falsa': not verdadera})
+
+    for r in resumen.values():
+        anticipacion = r.pop('anticipacion_s')
+        r['anticipacion_mediana_s'] = float(np.median(anticipacion)) if anticipacion else None
+        r['anticipacion_min_s'] = float(min(anticipacion)) if anticipacion else None
+    episodios.sort(key=lambda e: (e['inicio'], e['node_id'], e['detector']))
+    return resumen, episodios
+
+
+# ---------- Salida ----------
+
+def _iso(epoch: float) -> str:
+    return datetime.fromtimestamp(epoch, tz=timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def reproducir_linea_tiempo(episodios: list, velocidad: float):
+    """Imprime el inicio y fin de cada episodio; con velocidad > 0 respeta los tiempos a N× el real"""
+    eventos = sorted([(e['inicio'], 'inicio', e) for e in episodios] + [(e['fin'], 'fin', e) for e in episodios],
+                     key=lambda x: x[0])
+    if not eventos:
+        return
+    origen_virtual, origen_real = eventos[0][0], time.monotonic()
+    for ts, tipo, e in eventos:
+        if velocidad > 0:
+            espera = origen_real + (ts - origen_virtual) / velocidad - time.monotonic()
+            if espera > 0:
+                time.sleep(espera)
+        marca = " (falsa)" if e['falsa'] and tipo == 'inicio' else ""
+        print(f"{_iso(ts)}  {e['detector']:<8} {e['node_id']:<10} alerta {tipo}{marca}")
+
+
+def imprimir(resumen: dict, lecturas: int, tiempos: dict):
+    print(f"{lecturas} lecturas")
+    print(f"{'detector':<10}{'lect/s':>12}{'episodios':>11}{'crecidas':>10}{'detect.':>9}{'perdidas':>10}"
+          f"{'falsas':>8}{'antic. mediana':>16}{'antic. mín':>12}")
+    for nombre, r in resumen.items():
+        mediana = f"{r['anticipacion_mediana_s']:.0f} s" if r['anticipacion_mediana_s'] is not None else "-"
+        minima = f"{r['anticipacion_min_s']:.0f} s" if r['anticipacion_min_s'] is not None else "-"
+        print(f"{nombre:<10}{lecturas / tiempos[nombre]:>12.0f}{r['episodios']:>11}{r['crecidas']:>10}"
+              f"{r['detectadas']:>9}{r['perdidas']:>10}{r['falsas_alarmas']:>8}{mediana:>16}{minima:>12}")
+
+
+def main():
+    gw = detector.Umbrales()
+    parser = argparse.ArgumentParser(description="Replay de lecturas por los detectores del ETL y del gateway")
+    parser.add_argument("entrada", nargs='?', help="Export CSV/Parquet o captura .pcap")
+    parser.add_argument("--sintetico", action="store_true", help="Usa lecturas de carga.generar en vez de un archivo")
+    parser.add_argument("--escenario", default="crecida", help="Escenario de --sintetico (normal, crecida, rafaga)")
+    parser.add_argument("--nodos", type=int, default=100)
+    parser.add_argument("--lecturas", type=int, default=90, help="Lecturas por nodo de --sintetico")
+    parser.add_argument("--periodo", type=float, default=10.0, help="Segundos entre lecturas de --sintetico")
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--puerto", type=int, default=5005, help="Puerto UDP de destino a extraer del pcap (0 = todos)")
+    parser.add_argument("--velocidad", type=float, default=0,
+                        help="Reproduce la línea de tiempo a N× el tiempo real (0 = lo más rápido posible)")
+    parser.add_argument("--linea-tiempo", action="store_true", help="Imprime los episodios de alerta")
+    parser.add_argument("--salida", help="Guarda resumen y episodios en JSON")
+
+    criterio = parser.add_argument_group("evaluación")
+    criterio.add_argument("--nivel-crecida", type=float, default=0.55,
+                          help="Nivel (m) desde el que una racha de lecturas cuenta como crecida")
+    criterio.add_argument("--anticipacion-max", type=float, default=3600,
+                          help="Segundos antes de una crecida en que una alarma todavía cuenta como verdadera")
+
+    umbrales = parser.add_argument_group("reglas de alerta (reglas.py)")
+    umbrales.add_argument("--reglas", default=reglas.REGLAS_ALERTA,
+                          help="JSON con los conjuntos etl y gateway (por defecto REGLAS_ALERTA o los de reglas.py)")
+    umbrales.add_argument("--ajuste", action="append", default=[], metavar="CONJUNTO.REGLA.CLAVE=VALOR",
+                          help="Cambia un umbral, salida o peso; se puede repetir")
+    umbrales.add_argument("--persistencia-sobre", type=float, default=0.5,
+                          help="Nivel (m) desde el que una lectura suma a la persistencia del ETL")
+    umbrales.add_argument("--alfa", type=float, default=gw.alfa, help="Peso de la pendiente nueva en la EWMA del gateway")
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    if args.sintetico:
+        columnas = leer_sintetico(args.escenario, args.nodos, args.lecturas, args.periodo, args.semilla)
+    elif args.entrada and args.entrada.endswith(('.pcap', '.cap')):
+        columnas = leer_pcap(args.entrada, args.puerto)
+    elif args.entrada:
+        columnas = leer_export(args.entrada)
+    else:
+        parser.error("indicar un archivo de entrada o --sintetico")
+    lecturas = len(columnas['node_id'])
+    print(f"Entrada leída en {time.perf_counter() - inicio:.2f} s", file=sys.stderr)
+    if not lecturas:
+        raise SystemExit("La entrada no contiene lecturas")
+
+    config = reglas.cargar(args.reglas)
+    for ajuste in args.ajuste:
+        aplicar_ajuste(config, ajuste)
+    try:
+        motor_etl, motor_gateway = reglas.Motor(config['etl']), reglas.Motor(config['gateway'])
+    except ValueError as e:
+        raise SystemExit(f"Reglas inválidas: {e}")
+
+    tiempos, alertas = {}, {}
+    inicio = time.perf_counter()
+    alertas['etl'] = alertas_etl(columnas, motor_etl, args.persistencia_sobre)
+    tiempos['etl'] = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    alertas['gateway'] = alertas_gateway(columnas, detector.Umbrales(alfa=args.alfa), motor_gateway)
+    tiempos['gateway'] = time.perf_counter() - inicio
+
+    resumen, episodios = evaluar(columnas, alertas, args.nivel_crecida, args.anticipacion_max)
+    if args.linea_tiempo or args.velocidad > 0:
+        reproducir_linea_tiempo(episodios, args.velocidad)
+    imprimir(resumen, lecturas, tiempos)
+
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump({
+                'parametros': vars(args),
+                'lecturas': lecturas,
+                'resumen': resumen,
+                'episodios': [{**e, 'inicio': _iso(e['inicio']), 'fin': _iso(e['fin'])} for e in episodios],
+            }, f, indent=2, ensure_ascii=False)
+        print(f"Resultado guardado en {os.path.abspath(args.salida)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,13 @@
 # sensor_simulator.py
 import time, random, socket, json, os
 from datetime import datetime, timezone
+import trama
 
 HOST = os.getenv('HOST', '127.0.0.1')
 PORT = int(os.getenv('PORT', '5005'))
+FORMATO = os.getenv('FORMATO', 'json')  # json o binario (trama v1 del firmware)
+SEED = os.getenv('SEED')  # fija la serie de niveles y ruido para repetir una corrida
+NODES = ["N01","N02","N03","N04"]  # agregado nodo N04
 
 def make_payload(node_id, level_cm, lluvia_mm):
     return json.dumps({
@@ -13,30 +17,44 @@ def make_payload(node_id, level_cm, lluvia_mm):
         "lluvia_mm": round(lluvia_mm, 1)
     })
 
-def run_simulation():
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+def make_frame(node_id, level_cm, lluvia_mm, seq):
+    return trama.codificar(node_id, int(time.time()), level_cm/100, lluvia_mm, seq)
+
+def make_timeline(rng=random):
+    """Niveles en cm de una crecida: normal, subida, pico y caída (90 muestras)"""
     timeline = []
     # normal 30 samples (30 ±3 cm)
     for i in range(30):
-        timeline.append(30 + random.uniform(-3,3))
+        timeline.append(30 + rng.uniform(-3,3))
     # subida 30 samples (35 -> 105 cm)
     for i in range(30):
-        timeline.append(35 + i*(70/30) + random.uniform(-2,2))
+        timeline.append(35 + i*(70/30) + rng.uniform(-2,2))
     # peak 10 samples (100 ±2 cm)
     for i in range(10):
-        timeline.append(100 + random.uniform(-2,2))
+        timeline.append(100 + rng.uniform(-2,2))
     # caída 20 samples (100 -> 40 cm)
     for i in range(20):
-        timeline.append(100 - i*(60/20) + random.uniform(-2,2))
+        timeline.append(100 - i*(60/20) + rng.uniform(-2,2))
+    return timeline
 
-    nodes = ["N01","N02","N03","N04"]  # agregado nodo N04
-    for level in timeline:
-        lluvia = random.uniform(0, 5)  # lluvia simulada en mm
+def make_readings(rng=random, nodes=NODES):
+    """(seq, nodo, nivel_cm, lluvia_mm) en el orden en que se envían: cada muestra, a todos los nodos"""
+    for seq, level in enumerate(make_timeline(rng)):
+        lluvia = rng.uniform(0, 5)  # lluvia simulada en mm
         for n in nodes:
-            payload = make_payload(n, level + random.uniform(-1,1), lluvia)
-            sock.sendto(payload.encode(), (HOST, PORT))
-            time.sleep(2)  # esperar 2 segundos entre cada envío de mensaje
+            yield seq, n, level + rng.uniform(-1,1), lluvia
+
+def run_simulation():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    rng = random.Random(int(SEED)) if SEED else random
+    for seq, n, level, lluvia in make_readings(rng):
+        if FORMATO == "binario":
+            payload = make_frame(n, level, lluvia, seq)
+        else:
+            payload = make_payload(n, level, lluvia).encode()
+        sock.sendto(payload, (HOST, PORT))
+        time.sleep(2)  # esperar 2 segundos entre cada envío de mensaje
 
 if __name__ == "__main__":
-    print(f"Iniciando simulador (envía UDP a {HOST}:{PORT})...")
+    print(f"Iniciando simulador (envía UDP a {HOST}:{PORT}, formato {FORMATO})...")
     run_simulation()
@@ -0,0 +1,31 @@
+"""
+Los módulos que cada servicio lleva copiados en su contexto de Docker deben
+ser idénticos en todas sus copias. Fuera del repositorio completo (p. ej.
+dentro de la imagen del gateway) las demás copias no están y se omite.
+"""
+import os
+
+import pytest
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+
+COPIAS = {
+    'metricas.py': ('cola', 'back', 'simulacion'),
+    'reglas.py': ('back', 'simulacion'),
+    'registro.py': ('back', 'simulacion'),
+    'trama.py': ('microcontroladores', 'simulacion'),
+}
+
+
+@pytest.mark.parametrize('archivo', sorted(COPIAS))
+def test_copias_identicas(archivo):
+    rutas = [os.path.join(RAIZ, servicio, archivo) for servicio in COPIAS[archivo]]
+    faltantes = [ruta for ruta in rutas if not os.path.exists(ruta)]
+    if faltantes:
+        pytest.skip(f"Sin las demás copias de {archivo}: {', '.join(faltantes)}")
+    contenidos = {}
+    for servicio, ruta in zip(COPIAS[archivo], rutas):
+        with open(ruta, 'rb') as f:
+            contenidos[servicio] = f.read()
+    distintas = [servicio for servicio, contenido in contenidos.items() if contenido != contenidos['simulacion']]
+    assert not distintas, f"{archivo} difiere entre simulacion/ y {', '.join(distintas)}/"
@@ -0,0 +1,90 @@
+"""
+Spool del gateway: reenvío en orden, líneas ilegibles apartadas en lugar
+de detener el reenvío, y forward_worker que sobrevive a un error inesperado.
+"""
+import json
+import types
+
+import pytest
+
+import gateway
+
+
+@pytest.fixture
+def cola(monkeypatch, tmp_path):
+    """La cola recibe mientras `disponible`; guarda los lotes que le llegan"""
+    cola = types.SimpleNamespace(disponible=True, lotes=[])
+
+    def enviar(payloads):
+        if cola.disponible:
+            cola.lotes.append([p['i'] for p in payloads])
+        return cola.disponible
+
+    monkeypatch.setattr(gateway, 'SPOOL_PATH', str(tmp_path / 'gateway_spool.jsonl'))
+    monkeypatch.setattr(gateway, 'FORWARD_BATCH_MAX', 2)
+    monkeypatch.setattr(gateway, 'enviar_lote_a_cola', enviar)
+    return cola
+
+
+def _leer(ruta) -> list:
+    with open(ruta) as f:
+        return [json.loads(linea)['i'] for linea in f]
+
+
+def test_reenvio_en_orden_y_parcial(cola):
+    gateway.spool_append([{'i': i} for i in range(3)])
+    gateway.spool_append([{'i': 3}, {'i': 4}])
+
+    cola.disponible = False
+    assert not gateway.spool_replay()
+    assert _leer(gateway.SPOOL_PATH) == [0, 1, 2, 3, 4]
+
+    cola.disponible = True
+    assert gateway.spool_replay()
+    assert cola.lotes == [[0, 1], [2, 3], [4]]
+
+
+def test_lineas_ilegibles_se_apartan(cola):
+    with open(gateway.SPOOL_PATH, 'w') as f:
+        f.write('{"i": 0}\n{"i": 1, "node')  # el proceso murió a media línea
+    # Lo siguiente no queda pegado a la línea cortada
+    gateway.spool_append([{'i': 2}])
+
+    cola.disponible = False
+    assert not gateway.spool_replay()
+    # Ya sin la línea ilegible
+    assert _leer(gateway.SPOOL_PATH) == [0, 2]
+    with open(gateway.SPOOL_PATH + '.corrupto') as f:
+        assert f.read() == '{"i": 1, "node\n'
+
+    cola.disponible = True
+    assert gateway.spool_replay()
+    assert cola.lotes == [[0, 2]]
+
+
+class _Fin(BaseException):
+    """Sale del bucle infinito de forward_worker"""
+
+
+def test_forward_worker_sobrevive_a_un_error(cola, monkeypatch):
+    lotes = [[(0.0, {'i': 0})], [(0.0, {'i': 1})], [(0.0, {'i': 2})]]
+
+    def tomar():
+        if not lotes:
+            raise _Fin
+        return lotes.pop(0)
+
+    reales = gateway.forward_batch
+
+    def falla_el_segundo(lote, next_replay):
+        if lote[0][1]['i'] == 1:
+            raise OSError('sin espacio')
+        return reales(lote, next_replay)
+
+    monkeypatch.setattr(gateway, 'take_batch', tomar)
+    monkeypatch.setattr(gateway, 'forward_batch', falla_el_segundo)
+    errores = gateway.EVENTOS.valores().get(('errores_reenvio',), 0)
+    with pytest.raises(_Fin):
+        gateway.forward_worker()
+    assert cola.lotes == [[0], [2]]
+    assert gateway.EVENTOS.valores()[('errores_reenvio',)] == errores + 1
@@ -0,0 +1,163 @@
+"""
+Ingesta del gateway: duplicados, llegadas fuera de orden, huecos que vencen,
+vuelta de los seq de 16 bits y reinicio del sensor, con seq y sin seq (por ts).
+"""
+import collections
+
+import pytest
+
+from ingesta import Ingesta
+
+ESPERA = 0.5
+
+
+@pytest.fixture
+def eventos():
+    return collections.Counter()
+
+
+@pytest.fixture
+def ingesta(eventos):
+    return Ingesta(espera_s=ESPERA, max_retenidas=4, contar=lambda evento, n=1: eventos.update({evento: n}))
+
+
+def _lectura(epoch: float, seq=None, node_id: str = 'N1') -> dict:
+    return {'node_id': node_id, 'epoch': epoch, 'seq': seq}
+
+
+def _agregar(ingesta, lecturas, ahora: float = 0.0) -> list:
+    """Agrega en ese orden y retorna los epoch entregados"""
+    return [l['epoch'] for lectura in lecturas for l in ingesta.agregar(lectura, ahora)]
+
+
+# ---------- Con seq ----------
+
+def test_seq_duplicados(ingesta, eventos):
+    entregadas = _agregar(ingesta, [_lectura(10, 0), _lectura(20, 1), _lectura(20, 1), _lectura(10, 0)])
+    assert entregadas == [10, 20]
+    assert eventos['duplicados'] == 2
+
+
+def test_seq_fuera_de_orden(ingesta, eventos):
+    assert _agregar(ingesta, [_lectura(10, 0), _lectura(30, 2), _lectura(40, 3)]) == [10]
+    # Llega la que faltaba: sale con las retenidas, en orden
+    assert _agregar(ingesta, [_lectura(20, 1)]) == [20, 30, 40]
+    assert eventos['reordenados'] == 2 and eventos['perdidos'] == 0
+    # Un duplicado de una retenida tampoco pasa
+    assert _agregar(ingesta, [_lectura(60, 5), _lectura(60, 5)]) == []
+    assert eventos['duplicados'] == 1
+
+
+def test_seq_hueco_vencido(ingesta, eventos):
+    _agregar(ingesta, [_lectura(10, 0)])
+    assert _agregar(ingesta, [_lectura(30, 2)], ahora=1.0) == []
+    assert ingesta.vencidas(1.0 + ESPERA / 2) == []
+    assert [l['epoch'] for l in ingesta.vencidas(1.0 + ESPERA)] == [30]
+    assert eventos['perdidos'] == 1
+    # La que faltaba llega tarde: ya no se entrega
+    assert _agregar(ingesta, [_lectura(20, 1)], ahora=2.0) == []
+    assert eventos['atrasados'] == 1
+
+
+def test_seq_hueco_demasiado_grande(ingesta, eventos):
+    _agregar(ingesta, [_lectura(10, 0)])
+    # Más huecos que max_retenidas: no se espera
+    assert _agregar(ingesta, [_lectura(70, 6)]) == [70]
+    assert eventos['perdidos'] == 5
+
+
+def test_seq_hueco_lejano_libera_las_retenidas(ingesta, eventos):
+    _agregar(ingesta, [_lectura(10, 0)])
+    # Con el seq 1 pendiente caben 2..5; el 6 ya queda fuera de la ventana
+    assert _agregar(ingesta, [_lectura(10 * s, s) for s in (2, 3, 4, 5)]) == []
+    assert _agregar(ingesta, [_lectura(60, 6)]) == [20, 30, 40, 50, 60]
+    assert eventos['perdidos'] == 1
+    assert ingesta.vencidas(10.0) == []
+
+
+def test_seq_vuelta_de_16_bits(ingesta, eventos):
+    seqs = [65533, 65534, 65535, 0, 1]
+    assert _agregar(ingesta, [_lectura(i, s) for i, s in enumerate(seqs)]) == [0, 1, 2, 3, 4]
+    # También fuera de orden justo en la vuelta, y el duplicado de antes de la vuelta
+    assert _agregar(ingesta, [_lectura(6, 3), _lectura(5, 2), _lectura(2, 65535)]) == [5, 6]
+    assert eventos['duplicados'] == 1 and eventos['reinicios'] == 0
+    # seq mayor que 16 bits: se toma módulo 2**16, como en la trama
+    assert _agregar(ingesta, [_lectura(7, 65536 + 4)]) == [7]
+
+
+def test_seq_reinicio_del_sensor(ingesta, eventos):
+    _agregar(ingesta, [_lectura(s, s) for s in range(500, 505)])
+    # El seq vuelve a 0 con un ts posterior: no es un atrasado
+    assert _agregar(ingesta, [_lectura(1000, 0), _lectura(1001, 1)]) == [1000, 1001]
+    assert eventos['reinicios'] == 1 and eventos['atrasados'] == 0
+    # Un seq hacia atrás sin ts posterior no es otro reinicio: los dos ya se vieron
+    assert _agregar(ingesta, [_lectura(1001, 1), _lectura(1000, 0)]) == []
+    assert eventos['duplicados'] == 2 and eventos['reinicios'] == 1
+
+
+def test_seq_reinicio_libera_las_retenidas(ingesta, eventos):
+    _agregar(ingesta, [_lectura(10, 100)])
+    assert _agregar(ingesta, [_lectura(30, 102)]) == []
+    assert _agregar(ingesta, [_lectura(40, 0)]) == [30, 40]
+    assert eventos['reinicios'] == 1
+
+
+def test_nodos_independientes(ingesta, eventos):
+    lecturas = [_lectura(10, 0, 'A'), _lectura(10, 0, 'B'), _lectura(20, 1, 'B'), _lectura(20, 1, 'A')]
+    assert _agregar(ingesta, lecturas) == [10, 10, 20, 20]
+    assert sum(eventos.values()) == 0
+
+
+# ---------- Sin seq: por ts ----------
+
+def test_sin_seq_se_retienen_la_ventana(ingesta):
+    assert _agregar(ingesta, [_lectura(10), _lectura(20)], ahora=1.0) == []
+    assert ingesta.vencidas(1.0 + ESPERA / 2) == []
+    assert [l['epoch'] for l in ingesta.vencidas(1.0 + ESPERA)] == [10, 20]
+    assert ingesta.vencidas(10.0) == []
+
+
+def test_sin_seq_fuera_de_orden(ingesta, eventos):
+    _agregar(ingesta, [_lectura(30)], ahora=1.0)
+    _agregar(ingesta, [_lectura(10)], ahora=1.1)
+    _agregar(ingesta, [_lectura(20)], ahora=1.2)
+    # Vence la primera en llegar; las de ts anterior salen antes que ella
+    assert [l['epoch'] for l in ingesta.vencidas(1.0 + ESPERA)] == [10, 20, 30]
+    assert eventos['reordenados'] == 2 and eventos['atrasados'] == 0
+
+
+def test_sin_seq_vence_solo_hasta_la_vencida(ingesta):
+    _agregar(ingesta, [_lectura(10)], ahora=1.0)
+    _agregar(ingesta, [_lectura(20)], ahora=1.3)
+    assert [l['epoch'] for l in ingesta.vencidas(1.0 + ESPERA)] == [10]
+    assert [l['epoch'] for l in ingesta.vencidas(1.3 + ESPERA)] == [20]
+
+
+def test_sin_seq_duplicados(ingesta, eventos):
+    _agregar(ingesta, [_lectura(10), _lectura(20), _lectura(10)], ahora=1.0)
+    assert [l['epoch'] for l in ingesta.vencidas(1.0 + ESPERA)] == [10, 20]
+    # Repite la última entregada
+    assert _agregar(ingesta, [_lectura(20)], ahora=2.0) == []
+    assert eventos['duplicados'] == 2
+
+
+def test_sin_seq_atrasada_despues_de_la_ventana(ingesta, eventos):
+    _agregar(ingesta, [_lectura(20)], ahora=1.0)
+    ingesta.vencidas(1.0 + ESPERA)
+    assert _agregar(ingesta, [_lectura(10)], ahora=2.0) == []
+    assert eventos['atrasados'] == 1
+
+
+def test_sin_seq_mas_retenidas_que_el_maximo(ingesta, eventos):
+    # La quinta retenida fuerza la salida de la de menor ts
+    assert _agregar(ingesta, [_lectura(t) for t in (50, 40, 30, 20)]) == []
+    assert _agregar(ingesta, [_lectura(60)]) == [20]
+    # Anterior a una ya entregada: atrasada aunque quede lugar en la ventana
+    assert _agregar(ingesta, [_lectura(10)]) == []
+    assert [l['epoch'] for l in ingesta.vencidas(ESPERA)] == [30, 40, 50, 60]
+    assert eventos['atrasados'] == 1 and eventos['reordenados'] == 3
+
+
+def test_sin_seq_sin_ventana():
+    ingesta = Ingesta(espera_s=0)
+    assert _agregar(ingesta, [_lectura(20), _lectura(10), _lectura(30)]) == [20, 30]
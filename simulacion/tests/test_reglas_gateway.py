@@ -0,0 +1,105 @@
+"""
+El conjunto "gateway" de reglas.py por defecto decide igual que el detector
+anterior al motor, con la histéresis escrita en el código: por lectura
+(`evaluar` y `nivel`) y sobre series completas de EstimadorNodo.
+"""
+import itertools
+import math
+import random
+
+import pytest
+
+import detector
+import reglas
+
+NIVELES = (detector.NORMAL, detector.PRECAUCION, detector.ALERTA)
+
+# Umbrales de detector.Umbrales antes del motor de reglas
+PRECAUCION = 0.45
+ALERTA = 0.55
+PENDIENTE = 0.007
+HISTERESIS_M = 0.03
+
+
+def _decidir_anterior(ma: float, pendiente: float, estado: str) -> str:
+    """EstimadorNodo.agregar antes del motor de reglas"""
+    if ma >= ALERTA or pendiente >= PENDIENTE:
+        return detector.ALERTA
+    elif estado == detector.ALERTA and (ma >= ALERTA - HISTERESIS_M or pendiente >= PENDIENTE / 2):
+        return detector.ALERTA
+    elif ma >= PRECAUCION:
+        return detector.PRECAUCION
+    elif estado != detector.NORMAL and ma >= PRECAUCION - HISTERESIS_M:
+        return detector.PRECAUCION
+    return detector.NORMAL
+
+
+class _MotorAnterior:
+    """Lo que EstimadorNodo usa del motor, con la decisión anterior"""
+
+    def nivel(self, lectura: dict, previo: str) -> str:
+        return _decidir_anterior(lectura['promedio'], lectura['pendiente'], previo)
+
+
+@pytest.fixture(scope='module')
+def motor():
+    return reglas.Motor(reglas.CONFIG_DEFECTO['gateway'])
+
+
+def _comparar(motor, ma, pendiente, previo):
+    esperado = _decidir_anterior(ma, pendiente, previo)
+    lectura = {'promedio': ma, 'pendiente': pendiente}
+    assert motor.nivel(lectura, previo) == esperado, (ma, pendiente, previo)
+    assert motor.evaluar(lectura, previo).nivel == esperado, (ma, pendiente, previo)
+
+
+def test_iguales_en_los_umbrales(motor):
+    # Cada umbral de entrada y de salida calculado como lo calculaba el detector,
+    # y el flotante inmediatamente por debajo y por encima
+    promedios = [ALERTA, PRECAUCION, ALERTA - HISTERESIS_M, PRECAUCION - HISTERESIS_M, 0.42, 0.52]
+    pendientes = [PENDIENTE, PENDIENTE / 2, 0.0, -PENDIENTE]
+    cerca = lambda x: (math.nextafter(x, -math.inf), x, math.nextafter(x, math.inf))
+    for ma, pendiente, previo in itertools.product(
+            [v for x in promedios for v in cerca(x)], [v for x in pendientes for v in cerca(x)], NIVELES):
+        _comparar(motor, ma, pendiente, previo)
+
+
+def test_iguales_con_valores_aleatorios(motor):
+    rng = random.Random(0)
+    for _ in range(50000):
+        # Al centímetro y al décimo de mm/s, para caer seguido justo en los umbrales
+        ma = round(rng.uniform(0.35, 0.65), rng.choice([2, 6]))
+        pendiente = round(rng.uniform(-0.002, 0.01), rng.choice([4, 7]))
+        _comparar(motor, ma, pendiente, rng.choice(NIVELES))
+
+
+def test_iguales_sin_nivel_previo(motor):
+    for ma, pendiente in itertools.product([0.0, 0.42, 0.45, 0.52, 0.55, 1.0], [0.0, 0.0035, 0.007]):
+        esperado = _decidir_anterior(ma, pendiente, detector.NORMAL)
+        assert motor.nivel({'promedio': ma, 'pendiente': pendiente}) == esperado
+
+
+def test_campo_ausente_o_nan_no_cumple(motor):
+    assert motor.nivel({'pendiente': 0.0}, detector.ALERTA) == detector.NORMAL
+    assert motor.nivel({'promedio': None, 'pendiente': None}, detector.ALERTA) == detector.NORMAL
+    # NaN no cumple ninguna comparación, igual que en el detector anterior
+    assert motor.nivel({'promedio': math.nan, 'pendiente': math.nan}, detector.ALERTA) == \
+        _decidir_anterior(math.nan, math.nan, detector.ALERTA) == detector.NORMAL
+
+
+@pytest.mark.parametrize('semilla', range(5))
+def test_series_iguales_al_detector_anterior(motor, semilla):
+    """Crecidas con ruido que cruzan los umbrales varias veces: mismos estados lectura por lectura"""
+    rng = random.Random(semilla)
+    u = detector.Umbrales()
+    nuevo, anterior = detector.EstimadorNodo(u, motor), detector.EstimadorNodo(u, _MotorAnterior())
+    ts = 1_700_000_000.0
+    vistos = set()
+    for k in range(3000):
+        ts += rng.choice([1, 5, 10])
+        # Niveles al centímetro: el promedio de 5 cae seguido justo en 0.42, 0.45, 0.52 y 0.55
+        nivel = round(0.48 + 0.1 * math.sin(k / 40) + rng.uniform(-0.03, 0.03), 2)
+        estado = nuevo.agregar(ts, nivel)
+        assert estado == anterior.agregar(ts, nivel), k
+        vistos.add(estado)
+    assert vistos == set(NIVELES)
@@ -0,0 +1,105 @@
+"""
+Trama binaria compacta de los nodos sensores (LoRa) y decodificador con
+detección automática de formato (binario o JSON)
+
+Formato v1, little-endian, 20 bytes:
+
+    offset  tipo      campo
+    0       uint8     magic (0xA7, nunca coincide con '{' de un JSON)
+    1       uint8     versión (1)
+    2       char[4]   node_id ASCII, relleno con '\\0'
+    6       uint32    ts (epoch en segundos)
+    10      int32     nivel en mm
+    14      uint16    lluvia en décimas de mm
+    16      uint16    número de secuencia (da la vuelta en 65535)
+    18      uint16    CRC-16/CCITT-FALSE de los bytes 0..17
+
+Los decodificadores devuelven ts en ISO 8601 (lo que espera la cola) y
+también `epoch` en segundos, para no volver a parsear la fecha.
+
+Este archivo está duplicado en microcontroladores/ y simulacion/ porque el
+gateway se construye con su propio contexto de Docker;
+simulacion/tests/test_copias.py falla si las copias difieren.
+"""
+import json
+from binascii import crc_hqx
+from datetime import datetime, timezone
+from struct import Struct
+from typing import Dict
+
+TRAMA_MAGIC = 0xA7
+TRAMA_VERSION = 1
+
+_CUERPO = Struct('<BB4sIiHH')
+_CRC = Struct('<H')
+TAMANO_TRAMA = _CUERPO.size + _CRC.size
+
+
+def es_trama_binaria(payload: bytes) -> bool:
+    return len(payload) == TAMANO_TRAMA and payload[0] == TRAMA_MAGIC
+
+
+def codificar(node_id: str, ts: int, nivel_m: float, lluvia_mm: float, seq: int) -> bytes:
+    """Arma una trama binaria v1 (lo mismo que hace el firmware del ESP32)"""
+    cuerpo = _CUERPO.pack(
+        TRAMA_MAGIC, TRAMA_VERSION,
+        node_id.encode('ascii')[:4],
+        int(ts),
+        int(round(nivel_m * 1000)),
+        int(round(lluvia_mm * 10)),
+        seq & 0xFFFF
+    )
+    return cuerpo + _CRC.pack(crc_hqx(cuerpo, 0xFFFF))
+
+
+def decodificar_binaria(payload: bytes) -> Dict:
+    if len(payload) != TAMANO_TRAMA:
+        raise ValueError(f"Trama de {len(payload)} bytes, se esperaban {TAMANO_TRAMA}")
+
+    cuerpo = payload[:_CUERPO.size]
+    (crc,) = _CRC.unpack_from(payload, _CUERPO.size)
+    if crc_hqx(cuerpo, 0xFFFF) != crc:
+        raise ValueError("CRC inválido")
+
+    magic, version, node_id, ts, nivel_mm, lluvia_dmm, seq = _CUERPO.unpack(cuerpo)
+    if magic != TRAMA_MAGIC or version != TRAMA_VERSION:
+        raise ValueError(f"Trama no soportada (magic={magic:#x}, versión={version})")
+
+    return {
+        "node_id": node_id.rstrip(b'\0').decode('ascii'),
+        "ts": datetime.fromtimestamp(ts, tz=timezone.utc).isoformat().replace('+00:00', 'Z'),
+        "epoch": float(ts),
+        "nivel_m": nivel_mm / 1000,
+        "lluvia_mm": lluvia_dmm / 10,
+        "seq": seq,
+    }
+
+
+def decodificar_json(payload: bytes) -> Dict:
+    """
+    Formato JSON original: ts puede venir como epoch (firmware) o en ISO 8601.
+    Sin ts (sensores sin reloj) se usa la hora de recepción, como hacía el gateway
+    """
+    data = json.loads(payload)
+    ts = str(data.get('ts') or '')
+    if not ts:
+        fecha = datetime.now(timezone.utc)
+    elif ts.isdigit():
+        fecha = datetime.fromtimestamp(int(ts), tz=timezone.utc)
+    else:
+        fecha = datetime.fromisoformat(ts.replace('Z', '+00:00'))
+    data['ts'] = fecha.isoformat().replace('+00:00', 'Z')
+    data['epoch'] = fecha.timestamp()
+    data['nivel_m'] = float(data['nivel_m'])
+    data['lluvia_mm'] = float(data['lluvia_mm'])
+    return data
+
+
+def decodificar(payload: bytes) -> Dict:
+    """Decodifica un datagrama de sensor detectando el formato; lanza ValueError si es inválido"""
+    if es_trama_binaria(payload):
+        return decodificar_binaria(payload)
+    try:
+        return decodificar_json(payload)
+    except (KeyError, TypeError, UnicodeDecodeError) as e:
+        raise ValueError(f"Payload inválido: {e}")